@@ -0,0 +1,76 @@
+import asyncio
+import time
+from collections import defaultdict
+from collections.abc import Coroutine
+from contextvars import ContextVar
+from typing import Any, Awaitable, Callable, Self
+from dendrite.utils.file import IO_STATS, IOStats
+
+# stage the running task works for. tasks copy their context when created, so tool calls
+# fanned out by a pass are charged to that pass too
+CURRENT_STAGE: ContextVar[str | None] = ContextVar('bench_stage', default=None)
+
+class StageMeter:
+    """
+    Charges CPU time and storage I/O to the stage whose task is running. Stages run concurrently on
+    one event loop, so a stopwatch around a stage would also count whatever the other stages did while
+    it was waiting. Instead every step of every task is measured on its own, in CPU time of the event loop's
+    thread, so work done on other threads (e.g. the background writer) isn't charged to whichever step is running.
+    """
+    def __init__(self: Self):
+        self.cpu: dict[str, float] = defaultdict(float)
+        self.io: dict[str, IOStats] = defaultdict(IOStats)
+
+    def install(self: Self, loop: asyncio.AbstractEventLoop):
+        loop.set_task_factory(lambda loop, coro, **kwargs: asyncio.Task(_Metered(self, coro), loop=loop, **kwargs))
+
+    def charge(self: Self, stage: str | None, cpu: float, io: IOStats):
+        stage = stage or 'other'
+        self.cpu[stage] += cpu
+        total = self.io[stage]
+        self.io[stage] = IOStats(
+            reads=total.reads + io.reads,
+            read_bytes=total.read_bytes + io.read_bytes,
+            writes=total.writes + io.writes,
+            written_bytes=total.written_bytes + io.written_bytes,
+        )
+
+    def measure(self: Self, stage: str, run: Callable[[], Any]) -> Any:
+        """Charge a synchronous call made outside the event loop (e.g. loading the store)."""
+        cpu, io = time.thread_time(), IO_STATS.model_copy()
+        try:
+            return run()
+        finally:
+            self.charge(stage, time.thread_time() - cpu, IO_STATS.since(io))
+
+def staged(stage: str, run: Callable[[], Awaitable[Any]]) -> Callable[[], Awaitable[Any]]:
+    async def run_staged():
+        CURRENT_STAGE.set(stage)
+        return await run()
+    return run_staged
+
+class _Metered(Coroutine):
+    """Wraps a task's coroutine so each step (send/throw) is timed while it runs."""
+    def __init__(self, meter: StageMeter, coro: Coroutine):
+        self.meter = meter
+        self.coro = coro
+
+    def send(self, value: Any) -> Any:
+        return self._step(self.coro.send, value)
+
+    def throw(self, *args: Any) -> Any:
+        return self._step(self.coro.throw, *args)
+
+    def close(self):
+        self.coro.close()
+
+    def __await__(self):
+        return self.coro.__await__()
+
+    def _step(self, step: Callable[..., Any], *args: Any) -> Any:
+        cpu, io = time.thread_time(), IO_STATS.model_copy()
+        try:
+            return step(*args)
+        finally:
+            # read after the step: a stage sets its name on its first step
+            self.meter.charge(CURRENT_STAGE.get(), time.thread_time() - cpu, IO_STATS.since(io))
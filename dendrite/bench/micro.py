@@ -0,0 +1,289 @@
+"""
+Micro benchmarks of the hot paths every tool call and write pass goes through, on synthetic stores of a given
+number of notes. Results are compared against a stored baseline, and anything slower than it by more than the
+threshold is reported as a regression (and fails the run).
+
+    python -m dendrite.bench.micro                                  # 1k and 100k notes
+    python -m dendrite.bench.micro --sizes 1k,100k,1M --cross-references 1.5
+    python -m dendrite.bench.micro --save-baseline                  # the results become dendrite/bench/micro_baseline.json
+    python -m dendrite.bench.micro --baseline ci.json --threshold 0.25 --cases load,parse_path
+
+Stores are generated once per spec under --root and reused by later runs. Timings are wall time per operation,
+the best of --repeat runs of as many operations as fit in about --min-time, so they are comparable between
+runs on one machine, not between machines.
+"""
+import argparse
+import hashlib
+import json
+import os
+import platform
+import random
+import statistics
+import sys
+import tempfile
+import time
+from typing import Callable, Self
+from pydantic import BaseModel
+from dendrite.bench.synthetic import SyntheticSpec, SyntheticStore, generate_store
+from dendrite.db.io import Database, DatabaseType
+from dendrite.interface import components
+from dendrite.interface.types import Content, ContentStatus, GitStatus
+from dendrite.interface.utils.diff import apply_content_diff
+from dendrite.utils.constants import MAX_INTERFACE_LENGTH
+from dendrite.utils.file import WRITER
+from dendrite.utils.tracing import configure_logging
+
+SIZES = {'1k': 1_000, '10k': 10_000, '100k': 100_000, '1M': 1_000_000}
+# committed next to this module, so every checkout compares against the same one wherever it is run from
+BASELINE = os.getenv("DENDRITE_BENCH_BASELINE", os.path.join(os.path.dirname(os.path.abspath(__file__)), "micro_baseline.json"))
+
+class Fixture:
+    """A generated store, loaded, and what the cases pick their targets from."""
+    def __init__(self: Self, store: SyntheticStore, seed: int):
+        self.store = store
+        self.database = Database('bench', store.root)
+        self.database.dbs
+        self.rng = random.Random(seed)
+        self.note_paths = [path for paths in store.note_paths.values() for path in paths]
+
+    def notes(self: Self, count: int) -> list:
+        found = []
+        for path in self.rng.sample(self.note_paths, count):
+            node, id = components._parse_path(path, None, True, database=self.database)
+            found.extend(note for note in node.notes if note.id == id)
+        return found
+
+# cases build what they need from the fixture and return the operation to time, and how many it does per call
+
+def _load(fixture: Fixture) -> tuple[Callable[[], object], int]:
+    database = Database('bench', fixture.store.root)
+    def load():
+        database._dbs = None
+        database._load()
+    return load, 1
+
+def _parse_path(fixture: Fixture) -> tuple[Callable[[], object], int]:
+    paths = fixture.rng.sample(fixture.note_paths, 100)
+    def parse():
+        for path in paths:
+            components._parse_path(path, None, True, database=fixture.database)
+    return parse, len(paths)
+
+def _explorer_render(fixture: Fixture) -> tuple[Callable[[], object], int]:
+    explorer = components.Explorer(fixture.database, DatabaseType.CONCEPTUAL)
+    explorer.set_max_length(MAX_INTERFACE_LENGTH)
+    # opened somewhere deep, as a pass usually is
+    explorer.open_node(max(fixture.store.node_paths[DatabaseType.CONCEPTUAL.value], key=lambda path: path.count('/')))
+    return explorer.__str__, 1
+
+def _notes_render(fixture: Fixture) -> tuple[Callable[[], object], int]:
+    notes = components.Notes(fixture.database, fixture.notes(20))
+    notes.set_max_length(MAX_INTERFACE_LENGTH)
+    return notes.__str__, 1
+
+def _apply_content_diff(fixture: Fixture) -> tuple[Callable[[], object], int]:
+    note = fixture.notes(1)[0]
+    lines = note.to_storage_string().split('\n')
+    edited = "\n".join(lines[:len(lines) // 2] + ["an edited line in the middle"] + lines[len(lines) // 2 + 1:] + ["and one appended"])
+    return lambda: apply_content_diff(note.content, edited), 1
+
+def _save_session_changes(fixture: Fixture) -> tuple[Callable[[], object], int]:
+    database = fixture.database
+    notes = fixture.notes(10)
+    # the same edit every time, so the kept store doesn't grow from one run to the next
+    edited = {note.id: "\n".join(note.to_storage_string().split('\n')[:-1] + ["edited by the benchmark"]) for note in notes}
+    def save():
+        # a pass that edited ten notes, saved and on disk
+        for note in notes:
+            note.content = [Content(text=edited[note.id], status=ContentStatus.ADDED)]
+            note.status = GitStatus.MODIFIED
+        for type_ in DatabaseType:
+            database.save_session_changes(database.dbs[type_])
+        WRITER.flush_sync()
+    return save, 1
+
+def _rename_node(fixture: Fixture) -> tuple[Callable[[], object], int]:
+    database = fixture.database
+    # a node right below the root, with about a fanout-th of the database beneath it
+    path = fixture.store.node_paths[DatabaseType.CONCEPTUAL.value][0]
+    name = path.rsplit('/', 1)[1]
+    def rename():
+        database.rename_node(path, f"{name}_renamed")
+        database.rename_node(f"{path}_renamed", name)
+    return rename, 2
+
+def _move_node(fixture: Fixture) -> tuple[Callable[[], object], int]:
+    database = fixture.database
+    top = [path for path in fixture.store.node_paths[DatabaseType.CONCEPTUAL.value] if path.count('/') == 1]
+    path, name = top[0], top[0].rsplit('/', 1)[1]
+    # under a sibling without a child of the same name, and back
+    parent = next(other for other in top[1:] if all(child.name != name for child in database.node(other).children))
+    def move():
+        database.move_node(path, parent)
+        database.move_node(f"{parent}/{name}", DatabaseType.CONCEPTUAL.value)
+    return move, 2
+
+CASES: dict[str, Callable[[Fixture], tuple[Callable[[], object], int]]] = {
+    'load': _load,
+    'parse_path': _parse_path,
+    'explorer.render': _explorer_render,
+    'notes.render': _notes_render,
+    'apply_content_diff': _apply_content_diff,
+    'save_session_changes': _save_session_changes,
+    'rename_node': _rename_node,
+    'move_node': _move_node,
+}
+
+class CaseResult(BaseModel):
+    case: str
+    size: str
+    notes: int
+    best: float                         # seconds per operation
+    median: float
+    operations: int                     # per run
+
+    @property
+    def key(self) -> str:
+        return f"{self.case}@{self.size}"
+
+class Regression(BaseModel):
+    key: str
+    baseline: float
+    current: float
+
+    @property
+    def ratio(self) -> float:
+        return self.current / self.baseline
+
+class MicroReport(BaseModel):
+    machine: str
+    python: str
+    threshold: float
+    results: list[CaseResult]
+    baseline: dict[str, float] = {}
+    regressions: list[Regression] = []
+
+    def __str__(self) -> str:
+        lines = [
+            f"{self.machine}, python {self.python}",
+            f"{'case':<24}{'size':>6}{'notes':>10}{'best':>12}{'median':>12}{'baseline':>12}{'change':>9}",
+        ]
+        for result in self.results:
+            baseline = self.baseline.get(result.key)
+            change = f"{(result.best / baseline - 1) * 100:+.0f}%" if baseline else ""
+            lines.append(
+                f"{result.case:<24}{result.size:>6}{result.notes:>10,}{_duration(result.best):>12}{_duration(result.median):>12}"
+                f"{_duration(baseline) if baseline else '-':>12}{change:>9}"
+            )
+        if self.regressions:
+            lines.append(f"{len(self.regressions)} regressions over {self.threshold:.0%}:")
+            lines += [f"  {regression.key}: {_duration(regression.baseline)} -> {_duration(regression.current)} ({regression.ratio:.2f}x)" for regression in self.regressions]
+        elif self.baseline:
+            lines.append(f"no regressions over {self.threshold:.0%}")
+        return "\n".join(lines)
+
+def _duration(seconds: float) -> str:
+    if seconds >= 1:
+        return f"{seconds:.2f} s"
+    if seconds >= 1e-3:
+        return f"{seconds * 1e3:.2f} ms"
+    return f"{seconds * 1e6:.1f} us"
+
+def time_case(run: Callable[[], object], operations: int, repeat: int, min_time: float) -> tuple[float, float, int]:
+    """Best and median seconds per operation over repeat runs, each calling run as often as fits in min_time."""
+    calls, started = 0, time.perf_counter()
+    while calls == 0 or (time.perf_counter() - started < min_time and calls < 1_000_000):
+        run()
+        calls += 1
+    runs = []
+    for _ in range(repeat):
+        started = time.perf_counter()
+        for _ in range(calls):
+            run()
+        runs.append((time.perf_counter() - started) / (calls * operations))
+    return min(runs), statistics.median(runs), calls * operations
+
+def store_for(root: str, size: str, spec: SyntheticSpec) -> SyntheticStore:
+    """The store of that spec under root, generated unless an earlier run left it there."""
+    folder = os.path.join(root, f"{size}-{hashlib.sha256(spec.model_dump_json().encode('utf-8')).hexdigest()[:8]}")
+    spec_path = os.path.join(folder, 'bench_store.json')
+    if os.path.exists(spec_path):
+        with open(spec_path, 'r', encoding='utf-8') as file:
+            cached = json.load(file)
+        if cached['spec'] == json.loads(spec.model_dump_json()):
+            return SyntheticStore.model_validate(cached['store'])
+    print(f"generating a store of ~{SIZES[size]:,} notes in {folder}", file=sys.stderr)
+    store = generate_store(folder, spec)
+    with open(spec_path, 'w', encoding='utf-8') as file:
+        json.dump({'spec': json.loads(spec.model_dump_json()), 'store': store.model_dump()}, file)
+    return store
+
+def compare(results: list[CaseResult], baseline: dict[str, float], threshold: float) -> list[Regression]:
+    return [
+        Regression(key=result.key, baseline=baseline[result.key], current=result.best)
+        for result in results
+        if result.key in baseline and result.best > baseline[result.key] * (1 + threshold)
+    ]
+
+def run(sizes: list[str], cases: list[str], spec: dict, root: str, repeat: int, min_time: float) -> list[CaseResult]:
+    results = []
+    for size in sizes:
+        store = store_for(root, size, SyntheticSpec.for_notes(SIZES[size], **spec))
+        fixture = Fixture(store, seed=spec.get('seed', 0))
+        for case in cases:
+            operation, operations = CASES[case](fixture)
+            best, median, done = time_case(operation, operations, repeat, min_time)
+            results.append(CaseResult(case=case, size=size, notes=store.note_count, best=best, median=median, operations=done))
+            print(f"{case}@{size}: {_duration(best)}", file=sys.stderr)
+    return results
+
+def main():
+    parser = argparse.ArgumentParser(description="Micro benchmarks of the core hot paths on synthetic stores, compared against a baseline.")
+    parser.add_argument('--sizes', default='1k,100k', help=f"comma separated, of {', '.join(SIZES)}")
+    parser.add_argument('--cases', default=','.join(CASES), help=f"comma separated, of {', '.join(CASES)}")
+    parser.add_argument('--depth', type=int, default=SyntheticSpec().depth)
+    parser.add_argument('--notes-per-node', type=int, default=4)
+    parser.add_argument('--note-lines', type=int, default=SyntheticSpec().note_lines)
+    parser.add_argument('--cross-references', type=float, default=1.0, help="note references per note, on average")
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--root', default=os.path.join(tempfile.gettempdir(), 'dendrite-micro'), help="where stores are generated and kept")
+    parser.add_argument('--repeat', type=int, default=5)
+    parser.add_argument('--min-time', type=float, default=0.2, help="seconds of operations per run, at least one operation")
+    parser.add_argument('--baseline', default=BASELINE, help="baseline to compare against (DENDRITE_BENCH_BASELINE)")
+    parser.add_argument('--threshold', type=float, default=0.15, help="slowdown over the baseline reported as a regression")
+    parser.add_argument('--save-baseline', action='store_true', help="write the results to the baseline, keeping entries not measured")
+    parser.add_argument('--json', help="also write the report to this file")
+    parser.add_argument('--log-level', default='WARNING')
+    args = parser.parse_args()
+
+    configure_logging(args.log_level)
+    sizes, cases = args.sizes.split(','), args.cases.split(',')
+    for name, known in (('size', SIZES), ('case', CASES)):
+        if unknown := [value for value in (sizes if name == 'size' else cases) if value not in known]:
+            parser.error(f"unknown {name} {', '.join(unknown)}")
+    spec = dict(depth=args.depth, notes_per_node=args.notes_per_node, note_lines=args.note_lines, cross_references=args.cross_references, seed=args.seed)
+    results = run(sizes, cases, spec, args.root, args.repeat, args.min_time)
+
+    baseline: dict[str, float] = {}
+    if os.path.exists(args.baseline):
+        with open(args.baseline, 'r', encoding='utf-8') as file:
+            baseline = json.load(file)['results']
+    report = MicroReport(
+        machine=f"{platform.machine()} {platform.processor() or platform.system()}",
+        python=platform.python_version(),
+        threshold=args.threshold,
+        results=results,
+        baseline=baseline,
+        regressions=compare(results, baseline, args.threshold),
+    )
+    print(report)
+    if args.json:
+        with open(args.json, 'w', encoding='utf-8') as file:
+            file.write(report.model_dump_json(indent=4))
+    if args.save_baseline:
+        with open(args.baseline, 'w', encoding='utf-8') as file:
+            json.dump({'machine': report.machine, 'python': report.python, 'results': baseline | {result.key: result.best for result in results}}, file, indent=4)
+    sys.exit(1 if report.regressions else 0)
+
+if __name__ == '__main__':
+    main()
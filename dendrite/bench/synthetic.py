@@ -0,0 +1,224 @@
+"""
+Synthetic stores, conversations and scripted sessions for benchmarking the write pass offline.
+Everything is derived from a seed, so two runs with the same spec do exactly the same work.
+Nothing in here imports dendrite.db.io: the store has to exist before DB_ROOT is loaded.
+"""
+import itertools
+import json
+import os
+import random
+import shutil
+from datetime import date, timedelta
+from typing import Any, Iterator
+from pydantic import BaseModel
+from dendrite.mcp.conflicts import ToolCall
+from dendrite.models.recording import Recording, RecordedTurn
+
+WORDS = [
+    'family', 'work', 'health', 'travel', 'money', 'friends', 'habits', 'projects', 'music', 'food',
+    'sleep', 'goals', 'school', 'career', 'home', 'fitness', 'reading', 'cooking', 'coding', 'comedy',
+]
+
+class SyntheticSpec(BaseModel):
+    depth: int = 3                      # levels of nodes below each (non temporal) database root
+    fanout: int = 4                     # children per node
+    notes_per_node: int = 2
+    note_lines: int = 8                 # of ten words each
+    days: int = 30                      # days of temporal nodes, ending at `today`
+    today: date = date(2025, 1, 31)
+    multi_filed: float = 0.2            # share of notes filed under a second node of the same database
+    cross_references: float = 0.0       # note references per note, on average
+    seed: int = 0
+
+    @property
+    def node_count(self) -> int:
+        return sum(self.fanout ** level for level in range(1, self.depth + 1))
+
+    @classmethod
+    def for_notes(cls, notes: int, **spec: Any) -> 'SyntheticSpec':
+        """A spec of about that many notes, mostly in the conceptual and concrete trees, by choosing the fanout."""
+        depth, notes_per_node = spec.pop('depth', cls().depth), spec.pop('notes_per_node', 4)
+        fanout = max(2, round((notes / (2 * notes_per_node)) ** (1 / depth)))
+        return cls(depth=depth, fanout=fanout, notes_per_node=notes_per_node, **spec)
+
+class SyntheticStore(BaseModel):
+    root: str
+    # database type -> every node path below its root
+    node_paths: dict[str, list[str]]
+    # database type -> path of every note, ending with the note id
+    note_paths: dict[str, list[str]]
+
+    @property
+    def note_count(self) -> int:
+        return sum(len(paths) for paths in self.note_paths.values())
+
+def _sentence(rng: random.Random, words: int = 10) -> str:
+    return " ".join(rng.choice(WORDS) for _ in range(words))
+
+def _tree(rng: random.Random, depth: int, fanout: int) -> dict[str, Any]:
+    if depth == 0:
+        return {}
+    names = rng.sample(WORDS, fanout) if fanout <= len(WORDS) else [f"{rng.choice(WORDS)}_{i}" for i in range(fanout)]
+    return {name: _tree(rng, depth - 1, fanout) for name in names}
+
+def _temporal_tree(spec: SyntheticSpec) -> dict[str, Any]:
+    tree: dict[str, Any] = {}
+    for offset in range(spec.days):
+        day = spec.today - timedelta(days=offset)
+        tree.setdefault(str(day.year), {}).setdefault(f"{day.month:02d}", {})[f"{day.day:02d}"] = {}
+    return tree
+
+def _paths(tree: dict[str, Any], prefix: str) -> list[str]:
+    paths = []
+    for name, children in tree.items():
+        path = f"{prefix}/{name}"
+        paths.append(path)
+        paths.extend(_paths(children, path))
+    return paths
+
+def _numbered(tree: dict[str, Any], ids: Iterator[int]) -> dict[str, Any]:
+    """A tree of names as nodes.json stores it, with a node id each (see dendrite/db/nodes.py)."""
+    return {'id': next(ids), 'children': {name: _numbered(children, ids) for name, children in tree.items()}}
+
+def _node_ids(tree: dict[str, Any], path: str) -> Iterator[tuple[str, int]]:
+    yield path, tree['id']
+    for name, child in tree['children'].items():
+        yield from _node_ids(child, f"{path}/{name}")
+
+def generate_store(root: str, spec: SyntheticSpec) -> SyntheticStore:
+    """
+    Write a store in the on-disk layout dendrite.db.io loads: nodes.json, notes/notes.json and notes/content/<id>.md.
+    """
+    rng = random.Random(spec.seed)
+    trees = {
+        'conceptual': _tree(rng, spec.depth, spec.fanout),
+        'concrete': _tree(rng, spec.depth, spec.fanout),
+        'temporal': _temporal_tree(spec),
+    }
+    node_paths = {db: _paths(tree, db) for db, tree in trees.items()}
+    ids = itertools.count(1)
+    nodes = {db: _numbered(tree, ids) for db, tree in trees.items()}
+    node_ids = {path: id for db, tree in nodes.items() for path, id in _node_ids(tree, db)}
+
+    content_folder = os.path.join(root, 'notes', 'content')
+    os.makedirs(content_folder, exist_ok=True)
+    # indexes of a store generated here before are built again from the new one when first used
+    shutil.rmtree(os.path.join(root, 'index'), ignore_errors=True)
+    notes, note_paths, next_id = [], {db: [] for db in trees}, 1
+    for db, paths in node_paths.items():
+        for path in paths:
+            for _ in range(spec.notes_per_node):
+                # most notes are filed under one node, some under a second one from the same database
+                references = [path] if rng.random() > spec.multi_filed else [path, rng.choice(paths)]
+                notes.append({
+                    'id': next_id,
+                    'name': _sentence(rng, 3),
+                    'node_references': [node_ids[path] for path in dict.fromkeys(references)],
+                    'note_references': [],
+                    'read_only': False,
+                })
+                with open(os.path.join(content_folder, f'{next_id}.md'), 'w', encoding='utf-8') as file:
+                    file.write("\n".join(_sentence(rng) for _ in range(spec.note_lines)))
+                note_paths[db].append(f"{path}/{next_id}")
+                next_id += 1
+
+    if spec.cross_references:
+        # drawn from a generator of their own, so a store without them is the same as before they existed
+        cross_rng = random.Random(spec.seed + 1)
+        whole, fraction = int(spec.cross_references), spec.cross_references % 1
+        for note in notes:
+            count = whole + (cross_rng.random() < fraction)
+            note['note_references'] = list(dict.fromkeys(
+                str(id) for _ in range(count) if (id := cross_rng.randrange(1, next_id)) != note['id']
+            ))
+
+    with open(os.path.join(root, 'notes', 'notes.json'), 'w', encoding='utf-8') as file:
+        json.dump(notes, file, indent=4)
+    with open(os.path.join(root, 'nodes.json'), 'w', encoding='utf-8') as file:
+        json.dump(nodes, file, indent=4)
+    return SyntheticStore(root=root, node_paths=node_paths, note_paths=note_paths)
+
+def generate_conversation(rng: random.Random, turns: int = 12, sentences: int = 3) -> list[dict[str, str]]:
+    return [
+        {'role': 'user' if i % 2 == 0 else 'assistant', 'content': " ".join(_sentence(rng) + '.' for _ in range(sentences))}
+        for i in range(turns)
+    ]
+
+def generate_corpus(count: int, turns: int = 12, seed: int = 0) -> list[list[dict[str, str]]]:
+    rng = random.Random(seed)
+    return [generate_conversation(rng, turns) for _ in range(count)]
+
+class _Script:
+    """Builds the tool calls of a scripted session, with call ids that are unique across the session."""
+    def __init__(self, name: str):
+        self.name = name
+        self.turns: list[RecordedTurn] = []
+        self.calls = 0
+
+    def turn(self, *calls: tuple[str, dict[str, Any]], latency: float = 1.0):
+        tool_calls = []
+        for tool, arguments in calls:
+            self.calls += 1
+            tool_calls.append(ToolCall(call_id=f"{self.name}-{self.calls}", name=tool, arguments=arguments))
+        # synthesized turns have no recorded request to compare against
+        self.turns.append(RecordedTurn(request_hash='', request_tokens=0, latency=latency, tool_calls=tool_calls))
+
+    def recording(self) -> Recording:
+        # the model ends the pass with a turn without tool calls
+        self.turn()
+        return Recording(name=self.name, turns=self.turns)
+
+# how a pass issues the notes it writes: all in one turn, one per turn, or through the batch tools
+TOOL_CALLS = ['parallel', 'sequential', 'batch']
+
+def _interface_pass(rng: random.Random, store: SyntheticStore, db: str, session: int, tie: str | None, facts: int = 2, tool_calls: str = 'parallel') -> _Script:
+    script = _Script(f"session-{session}.{db}")
+    nodes, notes = store.node_paths[db], store.note_paths[db]
+    script.turn(('open_node', {'path_to_node': rng.choice(nodes)}), ('open_note', {'path_to_note': rng.choice(notes)}))
+    created = [
+        {'name': f"session {session} {_sentence(rng, 2)}", 'content': _sentence(rng, 20), 'references': [rng.choice(nodes)]}
+        for _ in range(facts)
+    ]
+    edits = [
+        {'path_to_note': path, 'content_update': {'content': _sentence(rng, 12), 'append': True}}
+        for path in rng.sample(notes, max(facts // 2, 1))
+    ]
+    if tool_calls == 'batch':
+        script.turn(('create_notes', {'notes': created}), ('edit_notes', {'edits': edits}))
+    elif tool_calls == 'sequential':
+        for note in created:
+            script.turn(('create_note', note))
+        for edit in edits:
+            script.turn(('edit_note', {'edit': edit}))
+    else:
+        script.turn(*(('create_note', note) for note in created))
+        script.turn(*(('edit_note', {'edit': edit}) for edit in edits))
+    script.turn(('generate_scaffolding', {'parent_path': rng.choice(nodes), 'scaffolding': {f"session_{session}": {}}}))
+    if tie:
+        script.turn(('create_cross_reference', {'ref1': rng.choice(notes), 'ref2': rng.choice(store.note_paths[tie])}))
+    return script
+
+def synthesize_session(store: SyntheticStore, session: int, today: date, seed: int = 0, facts: int = 2, tool_calls: str = 'parallel') -> dict[str, Recording]:
+    """
+    Scripted recordings for every step of a write pass (keyed like write_pass_clients), touching
+    notes and nodes that exist in the store so every call does real work. Each interface pass creates
+    facts notes and edits half as many, issued as tool_calls says (see TOOL_CALLS).
+    """
+    rng = random.Random(f"{seed}-{session}")
+    day_path = f"temporal/{today.year}/{today.month:02d}/{today.day:02d}"
+    tagger = _Script(f"session-{session}.temporal.tag")
+    tagger.turn(('open_node', {'path_to_node': day_path}))
+    tagger.turn(*(
+        ('create_cross_reference', {'ref1': day_path, 'ref2': rng.choice(store.note_paths['concrete'])})
+        for _ in range(2)
+    ))
+    summary = Recording(
+        name=f"session-{session}.temporal.summarize",
+        turns=[RecordedTurn(request_hash='', request_tokens=0, latency=2.0, text=f"Session {session}: {_sentence(rng, 40)}")]
+    )
+    return {
+        'conceptual': _interface_pass(rng, store, 'conceptual', session, None, facts, tool_calls).recording(),
+        'concrete': _interface_pass(rng, store, 'concrete', session, 'conceptual', facts, tool_calls).recording(),
+        'temporal.summarize': summary,
+        'temporal.tag': tagger.recording(),
+    }
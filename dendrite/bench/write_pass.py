@@ -0,0 +1,204 @@
+"""
+End-to-end write pass benchmark. Runs full write passes (every stage, storage included) over a
+synthetic store with replayed provider sessions, and reports per-stage wall time, CPU time, I/O and tokens.
+
+    python -m dendrite.bench.write_pass --depth 3 --fanout 6 --sessions 5 --latency none
+    python -m dendrite.bench.write_pass --recordings ./recordings --corpus ./conversations
+    python -m dendrite.bench.write_pass --facts 15 --tool-calls sequential      # then --tool-calls batch
+
+--recordings replays sessions recorded with DENDRITE_RECORD_DIR (one <conversation>.<step>.json per
+step, conversations taken from --corpus); without it scripted sessions are synthesized for generated conversations.
+"""
+import argparse
+import asyncio
+import importlib
+import json
+import os
+import tempfile
+import time
+from collections import defaultdict
+from datetime import date
+from pydantic import BaseModel
+from dendrite.bench.meter import StageMeter, staged
+from dendrite.bench.synthetic import TOOL_CALLS, SyntheticSpec, generate_store, generate_corpus, synthesize_session
+from dendrite.models.recording import Recording, SyntheticLatency
+from dendrite.utils.constants import DIARRHEA_ROOT
+from dendrite.utils.file import WRITER, IOStats, WriterStats
+from dendrite.utils.tracing import TRACER, TraceSummary, configure_logging
+
+STEPS = ['conceptual', 'concrete', 'temporal.summarize', 'temporal.tag', 'save']
+PROMPTS = {
+    'conceptual': os.path.join(DIARRHEA_ROOT, 'models', 'system_prompts', 'conceptual.txt'),
+    'concrete': os.path.join(DIARRHEA_ROOT, 'models', 'system_prompts', 'concrete.txt'),
+    'temporal.summarize': os.path.join(DIARRHEA_ROOT, 'models', 'system_prompts', 'temporal', 'summarizer.txt'),
+    'temporal.tag': os.path.join(DIARRHEA_ROOT, 'models', 'system_prompts', 'temporal', 'tagger.txt'),
+}
+
+class StageReport(BaseModel):
+    wall: float = 0.0
+    cpu: float = 0.0
+    io: IOStats = IOStats()
+    turns: int = 0
+    input_tokens: int = 0
+    output_tokens: int = 0
+    tool_errors: int = 0
+    divergences: int = 0
+
+class BenchReport(BaseModel):
+    spec: SyntheticSpec
+    nodes: int
+    notes: int
+    sessions: int
+    latency: SyntheticLatency
+    load: StageReport
+    stages: dict[str, StageReport]
+    trace: TraceSummary
+    # stage i/o counts writes when a stage hands them to the background writer, this is what it wrote
+    writer: WriterStats
+    wall_time: float
+
+    def __str__(self) -> str:
+        lines = [
+            f"{self.notes} notes, {self.nodes} nodes, {self.sessions} sessions, latency {self.latency.mode}",
+            f"{'stage':<20}{'wall s':>9}{'cpu s':>9}{'reads':>7}{'read KB':>10}{'writes':>7}{'write KB':>10}{'turns':>7}{'in tok':>9}{'out tok':>9}{'errors':>7}",
+        ]
+        for name, stage in [('load', self.load)] + list(self.stages.items()):
+            lines.append(
+                f"{name:<20}{stage.wall:>9.3f}{stage.cpu:>9.3f}{stage.io.reads:>7}{stage.io.read_bytes / 1024:>10.1f}"
+                f"{stage.io.writes:>7}{stage.io.written_bytes / 1024:>10.1f}{stage.turns:>7}{stage.input_tokens:>9}{stage.output_tokens:>9}{stage.tool_errors:>7}"
+            )
+        divergences = sum(stage.divergences for stage in self.stages.values())
+        lines.append(f"total wall time {self.wall_time:.3f}s" + (f", {divergences} turns diverged from their recording" if divergences else ""))
+        lines.append(f"writer: {self.writer}")
+        lines.append(str(self.trace))
+        return "\n".join(lines)
+
+def _load_sessions(args: argparse.Namespace, spec: SyntheticSpec, store) -> list[tuple[list[dict], dict[str, Recording]]]:
+    if args.recordings:
+        if not args.corpus:
+            raise ValueError("--recordings needs the --corpus the sessions were recorded from")
+        sessions = []
+        for file_name in sorted(os.listdir(args.corpus)):
+            name, extension = os.path.splitext(file_name)
+            if extension != '.json':
+                continue
+            with open(os.path.join(args.corpus, file_name), 'r', encoding='utf-8') as file:
+                conversation = json.load(file)
+            sessions.append((conversation, {step: Recording.load(args.recordings, f"{name}.{step}") for step in PROMPTS}))
+        return sessions
+
+    corpus = generate_corpus(args.sessions, turns=args.turns, seed=spec.seed)
+    return [
+        (conversation, synthesize_session(store, i, spec.today, seed=spec.seed, facts=args.facts, tool_calls=args.tool_calls))
+        for i, conversation in enumerate(corpus)
+    ]
+
+async def _run_sessions(sessions, latency: SyntheticLatency, today: date, meter: StageMeter) -> dict[str, StageReport]:
+    # dendrite.db.io reads DB_ROOT on import, so nothing that touches the store is imported before the store exists
+    from dendrite.db.io import DatabaseType
+    from dendrite.mcp.write.mcp import WriteMCP
+    from dendrite.models.base_client import ModelConfig
+    from dendrite.models.client_implementations.interface.replay import ReplayInterfaceClient
+    from dendrite.models.client_implementations.response.replay import ReplayResponseClient
+    from dendrite.stages.write.full_pass import schedule_write_pass, write_pass_clients
+    from dendrite.utils.config import TemporalPass
+    from datetime import datetime
+
+    meter.install(asyncio.get_running_loop())
+    stages: dict[str, StageReport] = defaultdict(StageReport)
+    for conversation, recordings in sessions:
+        conceptual_mcp = WriteMCP(DatabaseType.CONCEPTUAL, None)
+        concrete_mcp = WriteMCP(DatabaseType.CONCRETE, conceptual_mcp.interface)
+        temporal_mcp = WriteMCP(DatabaseType.TEMPORAL, concrete_mcp.interface)
+        write_clients = {
+            DatabaseType.CONCEPTUAL: ReplayInterfaceClient(conceptual_mcp, PROMPTS['conceptual'], recordings['conceptual'], latency),
+            DatabaseType.CONCRETE: ReplayInterfaceClient(concrete_mcp, PROMPTS['concrete'], recordings['concrete'], latency),
+            DatabaseType.TEMPORAL: TemporalPass(
+                summarizer=ReplayResponseClient(
+                    ModelConfig(model='replay', api_key='', system_prompt_path=PROMPTS['temporal.summarize']),
+                    recordings['temporal.summarize'],
+                    latency
+                ),
+                tagger=ReplayInterfaceClient(temporal_mcp, PROMPTS['temporal.tag'], recordings['temporal.tag'], latency),
+            ),
+        }
+
+        scheduler = schedule_write_pass(conversation, write_clients, now=datetime.combine(today, datetime.min.time()))
+        for name, step in scheduler.steps.items():
+            step.run = staged(name, step.run)
+        report = await scheduler.run()
+
+        for name, timing in report.timings.items():
+            stages[name].wall += timing.duration
+        for name, client in write_pass_clients(write_clients).items():
+            if isinstance(client, ReplayInterfaceClient):
+                stages[name].turns += client.timing.turns
+                stages[name].input_tokens += sum(usage.input_tokens for usage in client.usage)
+                stages[name].output_tokens += sum(usage.output_tokens for usage in client.usage)
+                stages[name].tool_errors += len(client.context.messages) + sum(client.context.compacted.values())
+                stages[name].divergences += len(client.divergences)
+            else:
+                stages[name].turns += len(client.replaying.turns)
+                stages[name].output_tokens += sum(len(turn.text or '') // 4 for turn in client.replaying.turns)
+    return stages
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark full write passes offline against replayed provider sessions.")
+    parser.add_argument('--depth', type=int, default=SyntheticSpec().depth)
+    parser.add_argument('--fanout', type=int, default=SyntheticSpec().fanout)
+    parser.add_argument('--notes-per-node', type=int, default=SyntheticSpec().notes_per_node)
+    parser.add_argument('--days', type=int, default=SyntheticSpec().days)
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--sessions', type=int, default=3, help="generated conversations to write (ignored with --recordings)")
+    parser.add_argument('--turns', type=int, default=12, help="messages per generated conversation")
+    parser.add_argument('--facts', type=int, default=2, help="notes each generated interface pass creates, it edits half as many")
+    parser.add_argument('--tool-calls', choices=TOOL_CALLS, default='parallel', help="how generated passes issue them: all in one turn, one per turn, or batched")
+    parser.add_argument('--corpus', help="directory of conversation json files")
+    parser.add_argument('--recordings', help="directory of recorded sessions to replay")
+    parser.add_argument('--latency', choices=['recorded', 'fixed', 'none'], default='none')
+    parser.add_argument('--latency-scale', type=float, default=1.0)
+    parser.add_argument('--fixed-latency', type=float, default=0.5)
+    parser.add_argument('--per-1k-tokens', type=float, default=0.0)
+    parser.add_argument('--root', help="where to generate the store (defaults to a temporary directory)")
+    parser.add_argument('--json', help="also write the report to this file")
+    parser.add_argument('--log-level', default='WARNING', help="log level of the pipeline's own output")
+    args = parser.parse_args()
+
+    spec = SyntheticSpec(depth=args.depth, fanout=args.fanout, notes_per_node=args.notes_per_node, days=args.days, seed=args.seed)
+    latency = SyntheticLatency(mode=args.latency, scale=args.latency_scale, fixed=args.fixed_latency, per_1k_tokens=args.per_1k_tokens)
+    root = args.root or tempfile.mkdtemp(prefix='dendrite-bench-')
+    store = generate_store(root, spec)
+    os.environ['DB_ROOT'] = root
+    sessions = _load_sessions(args, spec, store)
+
+    configure_logging(args.log_level)
+    meter = StageMeter()
+    started = time.perf_counter()
+    with TRACER.trace('bench') as trace:
+        load_started = time.perf_counter()
+        # databases load on first use, so load them here rather than in whichever stage touches them first
+        meter.measure('load', lambda: importlib.import_module('dendrite.db.io').current_database().dbs)
+        load_wall = time.perf_counter() - load_started
+        stages = asyncio.run(_run_sessions(sessions, latency, spec.today, meter))
+
+    for name, stage in stages.items():
+        stage.cpu, stage.io = meter.cpu[name], meter.io[name]
+    report = BenchReport(
+        spec=spec,
+        nodes=sum(len(paths) for paths in store.node_paths.values()),
+        notes=store.note_count,
+        sessions=len(sessions),
+        latency=latency,
+        load=StageReport(wall=load_wall, cpu=meter.cpu['load'], io=meter.io['load']),
+        stages={name: stages[name] for name in STEPS if name in stages},
+        trace=TraceSummary.of(list(trace.spans), trace.trace_id),
+        writer=WRITER.stats.model_copy(),
+        wall_time=time.perf_counter() - started,
+    )
+    print(report)
+    if args.json:
+        with open(args.json, 'w', encoding='utf-8') as file:
+            file.write(report.model_dump_json(indent=4))
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,150 @@
+"""
+Client of the daemon (see dendrite/daemon/server.py).
+
+    python -m dendrite.daemon.client ping
+    python -m dendrite.daemon.client submit conversation.json --wait
+    python -m dendrite.daemon.client tool read conceptual open_node '{"path_to_node": "conceptual"}'
+    python -m dendrite.daemon.client latency --requests 50 --cold-requests 5
+
+tool --cold does the same without a daemon, loading everything in process like a one-off run does.
+latency times the tool request both ways: against the daemon, and cold in a fresh process each time.
+"""
+import argparse
+import asyncio
+import itertools
+import json
+import subprocess
+import sys
+import time
+from typing import Any, Self
+from dendrite.daemon.protocol import SOCKET_PATH, DaemonError, connect, encode, read_message
+
+class DaemonClient:
+    def __init__(self: Self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+        self.reader = reader
+        self.writer = writer
+        self.ids = itertools.count(1)
+
+    @classmethod
+    async def connect(cls, socket_path: str = SOCKET_PATH, port: int | None = None) -> Self:
+        return cls(*await connect(socket_path, port))
+
+    async def request(self: Self, op: str, **fields: Any) -> Any:
+        id = next(self.ids)
+        self.writer.write(encode({'op': op, 'id': id, **fields}))
+        await self.writer.drain()
+        # one request at a time per client, so the next response is this one
+        response = await read_message(self.reader)
+        if response is None:
+            raise DaemonError("The daemon closed the connection")
+        if not response['ok']:
+            raise DaemonError(response['error'])
+        return response['result']
+
+    async def tool(self: Self, mode: str, db_type: str, name: str, arguments: dict[str, Any], tenant: str | None = None) -> dict[str, Any]:
+        """Open a session, call one tool and close it again."""
+        session = (await self.request('open', mode=mode, **({'tenant': tenant} if tenant else {})))['session']
+        try:
+            return await self.request('call', session=session, db_type=db_type, name=name, arguments=arguments)
+        finally:
+            await self.request('close', session=session)
+
+    async def close(self: Self):
+        self.writer.close()
+        await self.writer.wait_closed()
+
+async def cold_tool(mode: str, db_type: str, name: str, arguments: dict[str, Any], tenant: str | None = None) -> dict[str, Any]:
+    """The same request without a daemon: everything is loaded in this process first."""
+    from dendrite.daemon.server import Session
+    from dendrite.db.io import DEFAULT_TENANT, REGISTRY, DatabaseType
+    session = Session('cold', mode, REGISTRY.get(tenant or DEFAULT_TENANT))
+    error = await session.call(DatabaseType(db_type), name, arguments)
+    return {'error': error, 'interface': session.render(DatabaseType(db_type))}
+
+def _percentiles(durations: list[float]) -> str:
+    durations = sorted(durations)
+    p50 = durations[len(durations) // 2]
+    p95 = durations[min(len(durations) - 1, int(len(durations) * 0.95))]
+    return f"p50 {p50 * 1000:9.1f}ms  p95 {p95 * 1000:9.1f}ms  mean {sum(durations) / len(durations) * 1000:9.1f}ms"
+
+async def latency(args: argparse.Namespace) -> str:
+    tool = [args.mode, args.db_type, args.name, args.arguments, *(['--tenant', args.tenant] if args.tenant else [])]
+    client = await DaemonClient.connect(args.socket, args.port)
+    warm = []
+    try:
+        for _ in range(args.requests):
+            started = time.perf_counter()
+            await client.tool(args.mode, args.db_type, args.name, json.loads(args.arguments), args.tenant)
+            warm.append(time.perf_counter() - started)
+    finally:
+        await client.close()
+
+    cold = []
+    for _ in range(args.cold_requests):
+        started = time.perf_counter()
+        subprocess.run([sys.executable, '-m', 'dendrite.daemon.client', 'tool', '--cold', *tool], check=True, stdout=subprocess.DEVNULL)
+        cold.append(time.perf_counter() - started)
+
+    speedup = (sum(cold) / len(cold)) / (sum(warm) / len(warm))
+    return "\n".join([
+        f"{args.name} on {args.db_type} ({args.mode} session)",
+        f"  daemon {len(warm):>4} requests  {_percentiles(warm)}",
+        f"  cold   {len(cold):>4} requests  {_percentiles(cold)}",
+        f"  {speedup:.0f}x faster through the daemon",
+    ])
+
+async def run(args: argparse.Namespace) -> Any:
+    if args.command == 'tool' and args.cold:
+        return await cold_tool(args.mode, args.db_type, args.name, json.loads(args.arguments), args.tenant)
+    if args.command == 'latency':
+        return await latency(args)
+
+    client = await DaemonClient.connect(args.socket, args.port)
+    try:
+        if args.command == 'tool':
+            return await client.tool(args.mode, args.db_type, args.name, json.loads(args.arguments), args.tenant)
+        if args.command == 'submit':
+            job = (await client.request('submit', path=args.path, date=args.date, **({'tenant': args.tenant} if args.tenant else {})))['job']
+            return await client.request('job', job=job, wait=True) if args.wait else {'job': job}
+        if args.command == 'job':
+            return await client.request('job', job=args.job, wait=args.wait)
+        return await client.request(args.command)
+    finally:
+        await client.close()
+
+def main():
+    parser = argparse.ArgumentParser(description="Talk to a running dendrite daemon.")
+    parser.add_argument('--socket', default=SOCKET_PATH)
+    parser.add_argument('--port', type=int)
+    commands = parser.add_subparsers(dest='command', required=True)
+    commands.add_parser('ping')
+    commands.add_parser('stats')
+    commands.add_parser('shutdown')
+
+    submit = commands.add_parser('submit', help="run a write pass over a conversation file")
+    submit.add_argument('path', help="conversation file, as the daemon sees the filesystem")
+    submit.add_argument('--date', help="ISO date to file the session under instead of today")
+    submit.add_argument('--wait', action='store_true')
+    submit.add_argument('--tenant', help="whose database to write to, the daemon's DB_ROOT database if not given")
+
+    job = commands.add_parser('job')
+    job.add_argument('job')
+    job.add_argument('--wait', action='store_true')
+
+    for name in ('tool', 'latency'):
+        command = commands.add_parser(name)
+        command.add_argument('mode', nargs='?' if name == 'latency' else None, default='read', choices=['read', 'write'])
+        command.add_argument('db_type', nargs='?' if name == 'latency' else None, default='conceptual')
+        command.add_argument('name', nargs='?' if name == 'latency' else None, default='open_node')
+        command.add_argument('arguments', nargs='?', default='{"path_to_node": "conceptual"}')
+        command.add_argument('--tenant', help="whose database to use, the daemon's DB_ROOT database if not given")
+    commands.choices['tool'].add_argument('--cold', action='store_true', help="run in this process instead of through the daemon")
+    commands.choices['latency'].add_argument('--requests', type=int, default=50)
+    commands.choices['latency'].add_argument('--cold-requests', type=int, default=5)
+    args = parser.parse_args()
+
+    result = asyncio.run(run(args))
+    print(result if isinstance(result, str) else json.dumps(result, indent=4, default=str))
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,31 @@
+"""
+Wire format of the daemon (see dendrite/daemon/server.py): one json object per line in both directions.
+A request names its "op" and may carry an "id", which the response echoes so requests can be pipelined.
+Responses are {"id", "ok": true, "result"} or {"id", "ok": false, "error"}.
+
+Kept free of the rest of the package, so a client doesn't pay for loading the databases.
+"""
+import asyncio
+import json
+import os
+import tempfile
+from typing import Any
+
+SOCKET_PATH = os.getenv("DENDRITE_SOCKET", os.path.join(tempfile.gettempdir(), 'dendrite.sock'))
+# longest line either side accepts: rendered interfaces and submitted conversations can be large
+MAX_LINE = 64 * 1024 * 1024
+
+class DaemonError(Exception):
+    """The daemon answered a request with an error."""
+
+def encode(message: dict[str, Any]) -> bytes:
+    return (json.dumps(message, default=str) + '\n').encode('utf-8')
+
+async def read_message(reader: asyncio.StreamReader) -> dict[str, Any] | None:
+    line = await reader.readline()
+    return json.loads(line) if line else None
+
+async def connect(socket_path: str = SOCKET_PATH, port: int | None = None) -> tuple[asyncio.StreamReader, asyncio.StreamWriter]:
+    if port is not None:
+        return await asyncio.open_connection('127.0.0.1', port, limit=MAX_LINE)
+    return await asyncio.open_unix_connection(socket_path, limit=MAX_LINE)
@@ -0,0 +1,397 @@
+"""
+Long running daemon. Keeps the databases of the tenants it serves loaded (see dendrite/db/io.py
+DatabaseRegistry) along with the provider clients, serving interface sessions and write pass jobs to local
+clients (see dendrite/daemon/client.py).
+
+    python -m dendrite.daemon.server --workers 2            # unix socket at DENDRITE_SOCKET
+    python -m dendrite.daemon.server --port 7413            # tcp on localhost
+    python -m dendrite.daemon.server --stdio                # one client on stdin/stdout
+
+Requests (see dendrite/daemon/protocol.py for the framing):
+    ping, stats, shutdown
+    open {mode: read|write, tenant}                     -> {session, tools}, one interface per database type
+    call {session, db_type, name, arguments}            -> {error, interface}
+    render {session, db_type}                           -> {interface}
+    commit {session}                                    -> merge result, closes the session
+    close {session}
+    submit {conversation | path, date, tenant}          -> {job}, a full write pass merged when it finishes
+    job {job, wait}                                     -> the job
+
+tenant defaults to the DB_ROOT database. Sessions and jobs work on versions of their tenant's database of their
+own (see dendrite/db/io.py TreeVersion), taken in O(1) when they open, and keep it loaded until they are done.
+Write sessions and jobs are merged into the database when they commit or finish.
+"""
+import argparse
+import asyncio
+import logging
+import os
+import sys
+import time
+import uuid
+from collections import OrderedDict, defaultdict, deque
+from contextlib import contextmanager
+from enum import Enum
+from typing import Any, Awaitable, Callable, Iterator, Self
+from mcp.server.fastmcp import FastMCP
+from pydantic import BaseModel
+from dendrite.daemon.protocol import MAX_LINE, SOCKET_PATH, connect, encode, read_message
+from dendrite.db.io import DEFAULT_TENANT, REGISTRY, Database, DatabaseType, TreeVersion
+from dendrite.mcp.read.mcp import ReadMCP
+from dendrite.mcp.write.mcp import WriteMCP
+from dendrite.models.client_implementations.provider_utils.openai.utils import read_convo_from_file
+from dendrite.stages.write.bulk import Conversation, Merger, MergeResult
+from dendrite.models.response_client import ResponseClient
+from dendrite.stages.write.full_pass import schedule_write_pass, start_recording, save_recordings
+from dendrite.stages.write.rollup import Rollups, session_days
+from dendrite.utils.config import WritePass, build_rollup, build_write_pass, get_config
+from dendrite.utils.file import WRITER
+from dendrite.utils.tracing import TRACER, configure_logging
+
+logger = logging.getLogger(__name__)
+
+class Session:
+    """An interface per database type, built the way the write pass (or a reader) builds them."""
+    def __init__(self: Self, id: str, mode: str, database: Database):
+        if mode not in ('read', 'write'):
+            raise ValueError(f"Unknown session mode '{mode}', expected read or write")
+        self.id = id
+        self.mode = mode
+        self.database = database
+        # every session works on a version of its own, so reads see the databases as they were when it opened
+        self.view = TreeVersion(database)
+        self.mcps: dict[DatabaseType, FastMCP] = {}
+        with self.active():
+            tie = None
+            for type_ in DatabaseType:
+                if mode == 'write':
+                    self.mcps[type_] = WriteMCP(type_, tie, database)
+                    tie = self.mcps[type_].interface
+                else:
+                    self.mcps[type_] = ReadMCP(type_, database)
+
+    @contextmanager
+    def active(self: Self) -> Iterator[None]:
+        with self.view.active():
+            yield
+
+    def tools(self: Self) -> dict[str, list[dict[str, Any]]]:
+        return {
+            type_.value: [
+                {'name': tool.name, 'description': tool.description, 'parameters': tool.parameters}
+                for tool in mcp._tool_manager._tools.values()
+            ]
+            for type_, mcp in self.mcps.items()
+        }
+
+    async def call(self: Self, db_type: DatabaseType, name: str, arguments: dict[str, Any]) -> str | None:
+        with self.active():
+            try:
+                await self.mcps[db_type].call_tool(name, arguments)
+            except Exception as e:
+                return str(e)
+        return None
+
+    def render(self: Self, db_type: DatabaseType) -> str:
+        with self.active():
+            return str(self.mcps[db_type].interface)
+
+class JobStatus(str, Enum):
+    QUEUED = "queued"
+    RUNNING = "running"
+    DONE = "done"
+    FAILED = "failed"
+
+class Job(BaseModel):
+    id: str
+    tenant: str
+    status: JobStatus = JobStatus.QUEUED
+    messages: int
+    submitted: float                    # unix time
+    started: float | None = None
+    finished: float | None = None
+    error: str | None = None
+    result: MergeResult | None = None
+
+class Daemon:
+    def __init__(
+            self: Self,
+            workers: int = 2,
+            write_pass: Callable[[Conversation], WritePass] | None = None,
+            max_jobs: int = 1000,
+            rollup: ResponseClient | None = None
+        ):
+        self.workers = workers
+        # clients are built inside the job's view, so their interfaces are bound to it
+        self.write_pass = write_pass or (lambda conversation: build_write_pass(get_config()))
+        self.max_jobs = max_jobs
+        self.mergers: dict[str, Merger] = {}
+        # jobs bring the day, month and year summaries of their session up to date when a rollup model is given
+        self.rollup = rollup
+        self.rollups: dict[str, Rollups] = {}
+        self.sessions: dict[str, Session] = {}
+        self.jobs: OrderedDict[str, Job] = OrderedDict()
+        self.finished: dict[str, asyncio.Event] = {}
+        self.queue: asyncio.Queue[tuple[str, Conversation]] = asyncio.Queue()
+        self.started = time.time()
+        self.latencies: dict[str, deque[float]] = defaultdict(lambda: deque(maxlen=1000))
+        self.stopping = asyncio.Event()
+        self.connections: set[asyncio.StreamWriter] = set()
+        self.ops: dict[str, Callable[[dict[str, Any]], Awaitable[Any]]] = {
+            'ping': self.ping,
+            'stats': self.stats,
+            'shutdown': self.shutdown,
+            'open': self.open,
+            'call': self.call,
+            'render': self.render,
+            'commit': self.commit,
+            'close': self.close,
+            'submit': self.submit,
+            'job': self.job,
+        }
+
+    async def serve(self: Self, socket_path: str | None = SOCKET_PATH, port: int | None = None, stdio: bool = False):
+        job_workers = [asyncio.create_task(self._work()) for _ in range(self.workers)]
+        try:
+            if stdio:
+                await self._serve_stdio()
+            else:
+                server = await self._start_server(socket_path, port)
+                async with server:
+                    await self.stopping.wait()
+                    # the server only finishes closing once every connection has
+                    for writer in list(self.connections):
+                        writer.close()
+        finally:
+            for worker in job_workers:
+                worker.cancel()
+            await WRITER.flush()
+            if not stdio and port is None and os.path.exists(socket_path):
+                os.remove(socket_path)
+
+    async def _start_server(self: Self, socket_path: str, port: int | None) -> asyncio.Server:
+        if port is not None:
+            server = await asyncio.start_server(self.handle, '127.0.0.1', port, limit=MAX_LINE)
+            logger.info("Serving on 127.0.0.1:%d", port)
+            return server
+        if os.path.exists(socket_path):
+            try:
+                _, writer = await connect(socket_path)
+                writer.close()
+                raise RuntimeError(f"A daemon is already serving {socket_path}")
+            except (ConnectionRefusedError, FileNotFoundError):
+                # left behind by a daemon that didn't shut down cleanly
+                os.remove(socket_path)
+        server = await asyncio.start_unix_server(self.handle, socket_path, limit=MAX_LINE)
+        logger.info("Serving on %s", socket_path)
+        return server
+
+    async def _serve_stdio(self: Self):
+        loop = asyncio.get_running_loop()
+        reader = asyncio.StreamReader(limit=MAX_LINE)
+        await loop.connect_read_pipe(lambda: asyncio.StreamReaderProtocol(reader), sys.stdin)
+        transport, protocol = await loop.connect_write_pipe(asyncio.streams.FlowControlMixin, sys.stdout)
+        writer = asyncio.StreamWriter(transport, protocol, reader, loop)
+        # the client going away (stdin closing) ends the daemon too
+        await self.handle(reader, writer)
+
+    async def handle(self: Self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+        """
+        Serve one connection. Requests run concurrently, so waiting on a job doesn't hold up the ones behind it.
+        Sessions the connection opened and left open are closed when it goes away.
+        """
+        pending: set[asyncio.Task] = set()
+        sessions: set[str] = set()
+        self.connections.add(writer)
+        try:
+            while not self.stopping.is_set() and (request := await read_message(reader)) is not None:
+                task = asyncio.create_task(self._respond(request, writer, sessions))
+                pending.add(task)
+                task.add_done_callback(pending.discard)
+            if pending:
+                await asyncio.wait(pending)
+        except (ConnectionResetError, asyncio.IncompleteReadError):
+            pass
+        finally:
+            self.connections.discard(writer)
+            for id in sessions:
+                self._close(id)
+            sessions.clear()
+            writer.close()
+
+    async def _respond(self: Self, request: dict[str, Any], writer: asyncio.StreamWriter, sessions: set[str]):
+        op = request.get('op')
+        started = time.perf_counter()
+        with TRACER.span('daemon.request', op=op) as span:
+            try:
+                if op not in self.ops:
+                    raise ValueError(f"Unknown op '{op}'")
+                result = await self.ops[op](request)
+                if op == 'open':
+                    sessions.add(result['session'])
+                    # the connection went away while the session opened
+                    if writer not in self.connections:
+                        self._close(result['session'])
+                elif op in ('commit', 'close'):
+                    sessions.discard(request.get('session'))
+                response = {'id': request.get('id'), 'ok': True, 'result': result}
+            except Exception as e:
+                span['error'] = f"{type(e).__name__}: {e}"
+                response = {'id': request.get('id'), 'ok': False, 'error': f"{type(e).__name__}: {e}"}
+        self.latencies[op].append(time.perf_counter() - started)
+        writer.write(encode(response))
+        await writer.drain()
+
+    def _session(self: Self, request: dict[str, Any]) -> Session:
+        if (session := self.sessions.get(request.get('session'))) is None:
+            raise ValueError(f"No open session '{request.get('session')}'")
+        return session
+
+    async def ping(self: Self, request: dict[str, Any]) -> dict[str, Any]:
+        return {'pid': os.getpid(), 'uptime': time.time() - self.started}
+
+    async def stats(self: Self, request: dict[str, Any]) -> dict[str, Any]:
+        requests = {}
+        for op, latencies in self.latencies.items():
+            durations = sorted(latencies)
+            requests[op] = {
+                'recent': len(durations),
+                'p50_ms': durations[len(durations) // 2] * 1000,
+                'p95_ms': durations[min(len(durations) - 1, int(len(durations) * 0.95))] * 1000,
+            }
+        jobs = defaultdict(int)
+        for job in self.jobs.values():
+            jobs[job.status.value] += 1
+        return {
+            'uptime': time.time() - self.started,
+            'sessions': len(self.sessions),
+            'jobs': dict(jobs),
+            'queued': self.queue.qsize(),
+            'requests': requests,
+            'databases': REGISTRY.stats().model_dump(),
+            'writer': WRITER.stats.model_dump(),
+        }
+
+    async def shutdown(self: Self, request: dict[str, Any]) -> dict[str, Any]:
+        self.stopping.set()
+        return {}
+
+    async def open(self: Self, request: dict[str, Any]) -> dict[str, Any]:
+        database = REGISTRY.acquire(request.get('tenant', DEFAULT_TENANT))
+        try:
+            session = Session(uuid.uuid4().hex[:12], request.get('mode', 'read'), database)
+        except Exception:
+            REGISTRY.release(database)
+            raise
+        self.sessions[session.id] = session
+        return {'session': session.id, 'tools': session.tools()}
+
+    async def call(self: Self, request: dict[str, Any]) -> dict[str, Any]:
+        session = self._session(request)
+        db_type = DatabaseType(request['db_type'])
+        error = await session.call(db_type, request['name'], request.get('arguments', {}))
+        return {'error': error, 'interface': session.render(db_type)}
+
+    async def render(self: Self, request: dict[str, Any]) -> dict[str, Any]:
+        return {'interface': self._session(request).render(DatabaseType(request['db_type']))}
+
+    async def commit(self: Self, request: dict[str, Any]) -> dict[str, Any]:
+        session = self._session(request)
+        if session.mode != 'write':
+            raise ValueError("Read sessions have nothing to commit")
+        result = self._merger(session.database).merge(session.id, session.view)
+        self._close(session.id)
+        await WRITER.flush()
+        return result.model_dump()
+
+    async def close(self: Self, request: dict[str, Any]) -> dict[str, Any]:
+        self._close(request.get('session'))
+        return {}
+
+    def _close(self: Self, id: str | None):
+        if (session := self.sessions.pop(id, None)) is not None:
+            REGISTRY.release(session.database)
+
+    def _merger(self: Self, database: Database) -> Merger:
+        if database.tenant not in self.mergers:
+            self.mergers[database.tenant] = Merger(database)
+        return self.mergers[database.tenant]
+
+    def _rollups(self: Self, database: Database) -> Rollups:
+        if database.tenant not in self.rollups:
+            self.rollups[database.tenant] = Rollups(database, self.rollup)
+        return self.rollups[database.tenant]
+
+    async def submit(self: Self, request: dict[str, Any]) -> dict[str, Any]:
+        if 'conversation' in request:
+            messages = request['conversation']
+        else:
+            messages = [dict(message) for message in read_convo_from_file(request['path'])]
+        tenant = request.get('tenant', DEFAULT_TENANT)
+        # fails right away for a tenant without a database
+        REGISTRY.get(tenant)
+        conversation = Conversation(key=uuid.uuid4().hex[:12], messages=messages, date=request.get('date'))
+        self.jobs[conversation.key] = Job(id=conversation.key, tenant=tenant, messages=len(messages), submitted=time.time())
+        self.finished[conversation.key] = asyncio.Event()
+        self._forget_old_jobs()
+        await self.queue.put((tenant, conversation))
+        return {'job': conversation.key}
+
+    async def job(self: Self, request: dict[str, Any]) -> dict[str, Any]:
+        if (job := self.jobs.get(request.get('job'))) is None:
+            raise ValueError(f"No job '{request.get('job')}'")
+        if request.get('wait'):
+            await self.finished[job.id].wait()
+        return job.model_dump()
+
+    def _forget_old_jobs(self: Self):
+        for id in list(self.jobs):
+            if len(self.jobs) <= self.max_jobs:
+                break
+            if self.jobs[id].status in (JobStatus.DONE, JobStatus.FAILED):
+                del self.jobs[id]
+                del self.finished[id]
+
+    async def _work(self: Self):
+        while True:
+            tenant, conversation = await self.queue.get()
+            job = self.jobs[conversation.key]
+            job.status, job.started = JobStatus.RUNNING, time.time()
+            try:
+                with REGISTRY.use(tenant) as database:
+                    view = TreeVersion(database)
+                    with view.active():
+                        write_clients = self.write_pass(conversation)
+                        start_recording(write_clients, conversation.key)
+                        await schedule_write_pass(conversation.conversation, write_clients, now=conversation.date, save=False).run()
+                        save_recordings(write_clients)
+                    job.result = self._merger(database).merge(conversation.key, view)
+                    if self.rollup is not None:
+                        rollups = self._rollups(database)
+                        rollups.mark(session_days(view.notes.values()))
+                        await rollups.flush()
+                await WRITER.flush()
+                job.status = JobStatus.DONE
+            except Exception as e:
+                logger.warning("Job %s failed: %s", job.id, e)
+                job.status, job.error = JobStatus.FAILED, f"{type(e).__name__}: {e}"
+            job.finished = time.time()
+            self.finished[job.id].set()
+
+def main():
+    parser = argparse.ArgumentParser(description="Keep the databases loaded and serve interface sessions and write pass jobs.")
+    parser.add_argument('--socket', default=SOCKET_PATH, help="unix socket to listen on")
+    parser.add_argument('--port', type=int, help="listen on this localhost tcp port instead of a unix socket")
+    parser.add_argument('--stdio', action='store_true', help="serve a single client on stdin/stdout")
+    parser.add_argument('--workers', type=int, default=2, help="write pass jobs run at once")
+    parser.add_argument('--rollups', action='store_true', help="keep day, month and year summaries up to date, with the rollup model of the config")
+    parser.add_argument('--log-level', default='INFO')
+    args = parser.parse_args()
+
+    configure_logging(args.log_level)
+    try:
+        asyncio.run(Daemon(workers=args.workers, rollup=build_rollup(get_config()) if args.rollups else None).serve(args.socket, args.port, args.stdio))
+    except KeyboardInterrupt:
+        pass
+
+if __name__ == '__main__':
+    main()
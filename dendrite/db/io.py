@@ -1,27 +1,43 @@
 from __future__ import annotations
 import dendrite.interface.types as types
-from dendrite.utils.file import write_to_file, read_file
+from dendrite.db.nodes import NodeIndex
+from dendrite.db.similarity import DEDUPE, SimilarityIndex
+from dendrite.db.temporal import TemporalIndex
+from dendrite.utils.file import IO_STATS, WRITER, dump_json, write_behind, read_file
 
 
+import copy as py_copy
 import json
+import logging
 import os
-from typing import cast, List
+from collections import OrderedDict
+from contextlib import contextmanager
+from contextvars import ContextVar
+from typing import cast, Iterable, Iterator, List, Self
 from pydantic import BaseModel
 from enum import Enum
 
+logger = logging.getLogger(__name__)
 
 """
 Read utilities
 """
 
+# nodes.json from before node ids, every database a tree of names
 db_json = dict[str, 'db_json']
 
+class node_json(BaseModel):
+    id: int
+    children: dict[str, 'node_json']
+
 class note_json(BaseModel):
     id: int
     name: str
-    node_references: list[str]
+    # node ids. paths in notes.json from before node ids, and those left when it was rewritten that didn't resolve
+    node_references: list[int | str]
     note_references: list[str]
     read_only: bool = False
+    sources: list[str] = []
 
 class DatabaseType(Enum):
     CONCEPTUAL = "conceptual"
@@ -31,125 +47,760 @@ class DatabaseType(Enum):
 
 DatabaseSet = dict[DatabaseType, types.Node]
 
+# the database of a process that serves a single user
 ROOT = os.getenv("DB_ROOT")
-node_path = os.path.join(ROOT, 'nodes.json')
-note_path = os.path.join(ROOT, 'notes', 'notes.json')
-content_folder = os.path.join(ROOT, 'notes', 'content')
+# one directory per tenant, named by tenant id and laid out like DB_ROOT
+TENANTS_ROOT = os.getenv("DENDRITE_TENANTS_ROOT")
+# estimated bytes the loaded databases may take before idle ones are unloaded
+MEMORY_BUDGET = int(os.getenv("DENDRITE_DB_MEMORY_BUDGET", str(1024 ** 3)))
+DEFAULT_TENANT = "default"
 
-def load_db_into_memory() -> DatabaseSet:
+# rough memory of a loaded note or node on top of its text, for the memory budget
+NOTE_OVERHEAD = 1024
+NODE_OVERHEAD = 512
+
+def load_db_into_memory(root: str | None = ROOT, legacy: list[str] | None = None) -> DatabaseSet:
+    """
+    The databases of a store. Whatever is still stored the way it was before node ids (see dendrite/db/nodes.py),
+    a database's tree of names or notes filed by path, is numbered as it is read and named in legacy.
+    """
+    if root is None:
+        raise ValueError("No database root given and DB_ROOT isn't set")
+    node_path, note_path, content_folder = _paths(root)
+    aliases: dict[int, int] = {}
+    read_dbs = parse_nodes(read_file(node_path), aliases=aliases)
+    if not all(type_.value in read_dbs for type_ in DatabaseType):
+        raise ValueError(f"Database root at {root} is missing one of the required database types: {[type_.value for type_ in DatabaseType]}")
     dbs: DatabaseSet = {}
-    notes_by_path: dict[str, list[types.Note]] = {}
+    nodes_by_id: dict[int, types.Node] = {}
+    # trees with ids first, the nodes of those without are numbered after them
+    for type_ in sorted(DatabaseType, key=lambda type_: not _has_ids(read_dbs[type_.value])):
+        tree = read_dbs[type_.value]
+        if not _has_ids(tree):
+            tree = _number(tree, iter(range(max(nodes_by_id, default=0) + 1, 2 ** 63)))
+            if legacy is not None:
+                legacy.append(type_.value)
+        dbs[type_] = traverse_node(tree, type_.value, type_.value, nodes_by_id)
+
+    # paths of every node, only built if a note is still filed by path
+    paths: dict[str, int] | None = None
     notes = cast(List[note_json], json.loads(read_file(note_path)))
     for read_note in notes:
         content_path = os.path.join(content_folder, f'{read_note['id']}.md')
         content = read_file(content_path)
+        node_ids = []
+        for ref in read_note['node_references']:
+            if isinstance(ref, str):
+                if paths is None:
+                    paths = {path: id for id, path in _node_paths(dbs.values())}
+                    if legacy is not None:
+                        legacy.append('notes')
+                ref = paths.get(ref.strip().strip('/'))
+            else:
+                ref = aliases.get(ref, ref)
+            # a reference that doesn't resolve is left in notes.json, see dendrite/db/vacuum.py
+            if ref in nodes_by_id and ref not in node_ids:
+                node_ids.append(ref)
         read_note = types.Note(
             id=read_note['id'],
-            read_only=read_note['read_only'],
+            read_only=read_note.get('read_only', False),
             name=read_note['name'],
             content=[types.Content(text=content, status=types.ContentStatus.STAGED)],
-            node_references=read_note['node_references'],
+            node_ids=node_ids,
             note_references=read_note['note_references'],
+            sources=read_note.get('sources', []),
             status=types.GitStatus.STAGED
         )
-        for ref in read_note.node_references:
-            if ref not in notes_by_path:
-                notes_by_path[ref] = []
-            notes_by_path[ref].append(read_note)
-    read_dbs = cast(db_json, json.loads(read_file(node_path)))
-    if not all(type_.value in read_dbs for type_ in DatabaseType):
-        raise ValueError(f"Database root at {ROOT} is missing one of the required database types: {[type_.value for type_ in DatabaseType]}")
-    for type_ in DatabaseType:
-        db = traverse_node(read_dbs[type_.value], notes_by_path, type_.value)
-        if not len(db) == 1:
-            raise ValueError(f"Database of type {type_.value} does not have a single root node.")
-        dbs[type_] = db[0]
-    return dbs
-
-def traverse_node(db: db_json, notes_by_path: dict[str, list[types.Note]], current_path: str) -> list[types.Node]:
-    nodes = []
-    for name, child_json in db.items():
-        node = types.Node(
-            name=name,
-            notes=[
-                note for note in notes_by_path.get(os.path.join(current_path, name), [])
-            ],
-            children=[traverse_node(val, notes_by_path, os.path.join(current_path, name)) for val in child_json.values()],
-            status=types.GitStatus.STAGED
+        for id in node_ids:
+            nodes_by_id[id].notes.append(read_note)
+    return {type_: dbs[type_] for type_ in DatabaseType}
+
+def traverse_node(tree: node_json, name: str, db_type: str, nodes_by_id: dict[int, types.Node]) -> types.Node:
+    node = types.Node(
+        id=tree['id'],
+        db_type=db_type,
+        name=name,
+        notes=[],
+        children=[traverse_node(child_json, child_name, db_type, nodes_by_id) for child_name, child_json in tree['children'].items()],
+        status=types.GitStatus.STAGED
+    )
+    nodes_by_id[node.id] = node
+    return node
+
+def _has_ids(tree: node_json | db_json) -> bool:
+    # the children of a node in a tree of names are trees too, never ints
+    return isinstance(tree.get('id'), int)
+
+def _number(tree: db_json, ids: Iterator[int]) -> node_json:
+    """A tree of names as a tree of ids, numbered parents first."""
+    return {'id': next(ids), 'children': {name: _number(children, ids) for name, children in tree.items()}}
+
+def _node_paths(roots: Iterable[types.Node]) -> Iterator[tuple[int, str]]:
+    stack = [(root, root.name) for root in roots]
+    while stack:
+        node, path = stack.pop()
+        yield node.id, path
+        stack.extend((child, f"{path}/{child.name}") for child in node.children)
+
+def parse_nodes(data: str, duplicates: list[str] | None = None, aliases: dict[int, int] | None = None) -> dict[str, node_json | db_json]:
+    """
+    nodes.json, with sibling nodes of the same name merged into one: json.loads keeps only the last of them,
+    and the notes filed under it with it. The names merged are added to duplicates, and the ids of the nodes
+    merged away to aliases, mapped to the id of the node they were merged into.
+    """
+    return json.loads(data, object_pairs_hook=lambda pairs: _merge_trees({}, pairs, duplicates, aliases))
+
+def _merge_trees(tree: dict, pairs: Iterable[tuple[str, dict | int]], duplicates: list[str] | None, aliases: dict[int, int] | None) -> dict:
+    for name, value in pairs:
+        if name not in tree:
+            tree[name] = value
+        elif isinstance(value, dict) and isinstance(tree[name], dict):
+            # with ids, merging two nodes merges their children too, which is no duplicate of its own
+            if duplicates is not None and not (name == 'children' and _has_ids(tree)):
+                duplicates.append(name)
+            _merge_trees(tree[name], value.items(), duplicates, aliases)
+        elif aliases is not None:
+            aliases[value] = tree[name]
+    return tree
+
+def _paths(root: str) -> tuple[str, str, str]:
+    return os.path.join(root, 'nodes.json'), os.path.join(root, 'notes', 'notes.json'), os.path.join(root, 'notes', 'content')
+
+def _temporal_index_path(root: str) -> str:
+    return os.path.join(root, 'index', 'temporal')
+
+def _similarity_index_path(root: str) -> str:
+    return os.path.join(root, 'index', 'similarity')
+
+"""
+Databases
+"""
+
+class Database:
+    """
+    One tenant's databases, loaded the first time they are used. The handle outlives unloading (see
+    DatabaseRegistry): interfaces and passes hold on to it, and the databases are loaded again when next used.
+    """
+    def __init__(self: Self, tenant: str, root: str, registry: DatabaseRegistry | None = None):
+        self.tenant = tenant
+        self.root = root
+        self.node_path, self.note_path, self.content_folder = _paths(root)
+        self.registry = registry
+        self._dbs: DatabaseSet | None = None
+        self._nodes: NodeIndex | None = None
+        self.next_node_id = 1               # shared by every version, so nodes created side by side never share an id
+        # notes.json by note id, kept in memory once read so a tool call that adds a note doesn't parse and rewrite it
+        self._notes: dict[int, note_json] | None = None
+        self._temporal: TemporalIndex | None = None
+        self._similarity: SimilarityIndex | None = None
+        self.generation = 0                 # times loaded, so indexes over an earlier load can tell they are stale
+        self.size = 0                       # estimated bytes in memory while loaded
+        self.users = 0                      # sessions, passes and jobs working on it, it stays loaded while there are any
+
+    @property
+    def loaded(self: Self) -> bool:
+        return self._dbs is not None
+
+    @property
+    def dbs(self: Self) -> DatabaseSet:
+        if self._dbs is None:
+            self._load()
+        if self.registry is not None:
+            self.registry.touch(self)
+        return self._dbs
+
+    @property
+    def nodes(self: Self) -> NodeIndex:
+        """Where every node is, as the version the running task works on has them (see dendrite.db.nodes)."""
+        view = self.version()
+        if view is not None:
+            return view.nodes
+        if self._nodes is None:
+            self._load()
+        return self._nodes
+
+    @property
+    def temporal(self: Self) -> TemporalIndex:
+        """The date index of the temporal database, as saved (see dendrite.db.temporal)."""
+        if self._temporal is None:
+            self._temporal = TemporalIndex(_temporal_index_path(self.root))
+            if not self._temporal.exists():
+                self._temporal.rebuild(self.dbs[DatabaseType.TEMPORAL])
+        return self._temporal
+
+    @property
+    def similarity(self: Self) -> SimilarityIndex:
+        """The near duplicate index of every saved note (see dendrite.db.similarity)."""
+        if self._similarity is None:
+            self._similarity = SimilarityIndex(_similarity_index_path(self.root))
+            if not self._similarity.exists():
+                self._similarity.rebuild(self.dbs.values())
+        return self._similarity
+
+    def _load(self: Self):
+        before = IO_STATS.model_copy()
+        legacy: list[str] = []
+        self._dbs = load_db_into_memory(self.root, legacy)
+        self._nodes = NodeIndex.of(self._dbs.values())
+        self.next_node_id = self._nodes.max_id() + 1
+        if legacy:
+            self._migrate(legacy)
+        self.generation += 1
+        notes, nodes, stack = set(), 0, list(self._dbs.values())
+        while stack:
+            node = stack.pop()
+            nodes += 1
+            notes.update(note.id for note in node.notes)
+            stack.extend(node.children)
+        self.size = IO_STATS.since(before).read_bytes + len(notes) * NOTE_OVERHEAD + nodes * NODE_OVERHEAD
+        logger.info("Loaded the databases of %s from %s: %d notes, %d nodes, ~%.1f MB", self.tenant, self.root, len(notes), nodes, self.size / 1024 ** 2)
+        if self.registry is not None:
+            self.registry.loaded(self)
+
+    def unload(self: Self):
+        """Save whatever was changed in place, wait until it is on disk and drop the databases."""
+        if self._dbs is None:
+            return
+        if self.dirty():
+            for type_ in DatabaseType:
+                self.save_session_changes(self._dbs[type_])
+        WRITER.flush_sync()
+        self._dbs = None
+        self._nodes = None
+        self._notes = None
+        self._temporal = None
+        self._similarity = None
+        self.size = 0
+
+    def _migrate(self: Self, legacy: list[str]):
+        """Store the ids the nodes were numbered with when loaded, so they are the same from now on."""
+        nodes_json = {type_.value: _node_to_json(root) for type_, root in self._dbs.items()}
+        write_behind(self.node_path, lambda: dump_json(nodes_json))
+        if 'notes' in legacy:
+            paths = {path: id for id, path in _node_paths(self._dbs.values())}
+            for note in self._notes_json().values():
+                note['node_references'] = [paths.get(ref.strip().strip('/'), ref) if isinstance(ref, str) else ref for ref in note['node_references']]
+            self._write_notes_json()
+        logger.info("Stored the node ids of %s (%s) in %s", self.tenant, ", ".join(legacy), self.root)
+
+    def dirty(self: Self) -> bool:
+        """Changed in place and not saved yet, as a one off pass leaves it until its save step."""
+        stack = list(self._dbs.values()) if self._dbs is not None else []
+        while stack:
+            node = stack.pop()
+            if node.status != types.GitStatus.STAGED or any(note.status != types.GitStatus.STAGED for note in node.notes):
+                return True
+            stack.extend(node.children)
+        return False
+
+    @contextmanager
+    def active(self: Self) -> Iterator[Self]:
+        """Make this the database of the running task, for whatever isn't bound to a database of its own."""
+        token = CURRENT_DATABASE.set(self)
+        try:
+            yield self
+        finally:
+            CURRENT_DATABASE.reset(token)
+
+    def version(self: Self) -> TreeVersion | None:
+        """The version of this database the running task works on, if any."""
+        view = CURRENT_VIEW.get()
+        return view if view is not None and view.database is self else None
+
+    def roots(self: Self) -> DatabaseSet:
+        view = self.version()
+        return self.dbs if view is None else view.roots
+
+    # without a version of its own running, the databases are changed in place, as a one off pass does
+
+    def own_root(self: Self, type_: DatabaseType) -> types.Node:
+        view = self.version()
+        return self.dbs[type_] if view is None else view.root(type_)
+
+    def own_child(self: Self, parent: types.Node, child: types.Node) -> types.Node:
+        view = self.version()
+        return child if view is None else view.child(parent, child)
+
+    def own_note(self: Self, note: types.Note) -> types.Note:
+        view = self.version()
+        return note if view is None else view.note(note)
+
+    def adopt(self: Self, item: types.Node | types.Note) -> types.Node | types.Note:
+        view = self.version()
+        return item if view is None else view.adopt(item)
+
+    def latest(self: Self, item: types.Node | types.Note) -> types.Node | types.Note:
+        view = self.version()
+        return item if view is None else view.latest(item)
+
+    def has_note(self: Self, note_id: int) -> bool:
+        """Whether a note of that id was saved, or created in the version the running task works on."""
+        view = self.version()
+        while view is not None:
+            if note_id in view.notes:
+                return True
+            view = view.base
+        return note_id in self._notes_json()
+
+    @contextmanager
+    def all_or_none(self: Self) -> Iterator[TreeVersion]:
+        """
+        Changes made in the block are kept if it finishes and thrown away if it raises: they are made in a version
+        taken from the running one (or from the databases) and published only once the block is done.
+        """
+        version = TreeVersion(self, base=self.version())
+        with version.active():
+            yield version
+        publish(version)
+        if version.base is None:
+            # without a version of its own running, notes are written as they are created
+            for id in version.notes.keys() - version.originals.keys():
+                self.add_note(version.notes[id])
+
+    # nodes, by path. without a version of its own the databases are changed in place
+
+    def node(self: Self, path: str, writable: bool = False) -> types.Node | None:
+        view = self.version()
+        return _find(self.dbs, path) if view is None else view.node(path, writable)
+
+    def new_node(self: Self, parent: types.Node, name: str, id: int | None = None) -> types.Node:
+        """Add a node under a parent the running version owns. A new one gets an id of its own."""
+        if id is None:
+            id, self.next_node_id = self.next_node_id, self.next_node_id + 1
+        node = self.adopt(types.Node(id=id, db_type=parent.db_type, name=name, notes=[], children=[], status=types.GitStatus.ADDED))
+        parent.children.append(node)
+        self.nodes.set(id, parent.id, name)
+        return node
+
+    def rename_node(self: Self, path: str, name: str) -> types.Node:
+        """Rename a node. The notes beneath it are filed by id, so none of them change."""
+        node, parent = self._placed(path)
+        if not name or '/' in name:
+            raise ValueError(f"Invalid node name '{name}'")
+        if name != node.name and any(child.name == name for child in parent.children):
+            raise ValueError(f"'{self.nodes.path(parent.id)}' already has a child named '{name}'")
+        node.change_name(name)
+        self.nodes.set(node.id, parent.id, name)
+        return node
+
+    def move_node(self: Self, path: str, parent_path: str) -> types.Node:
+        """Move a node, and everything beneath it, under another node of the same database. The notes don't change."""
+        node, parent = self._placed(path)
+        path = self.nodes.path(node.id)
+        new_parent = self.node(parent_path, writable=True)
+        if new_parent is None:
+            raise ValueError(f"No node at '{parent_path}'")
+        new_parent_path = self.nodes.path(new_parent.id)
+        if new_parent.db_type != node.db_type:
+            raise ValueError(f"Cannot move '{path}' to another database")
+        if new_parent_path == path or new_parent_path.startswith(path + '/'):
+            raise ValueError(f"Cannot move '{path}' beneath itself")
+        if new_parent.id == parent.id:
+            return node
+        if any(child.name == node.name for child in new_parent.children):
+            raise ValueError(f"'{new_parent_path}' already has a child named '{node.name}'")
+        # both already the version's own, resolving the new parent copied neither of them
+        parent.children = [child for child in parent.children if child is not node]
+        new_parent.children.append(node)
+        if node.status == types.GitStatus.STAGED:
+            node.status = types.GitStatus.MODIFIED
+        self.nodes.set(node.id, new_parent.id, node.name)
+        return node
+
+    def _placed(self: Self, path: str) -> tuple[types.Node, types.Node]:
+        """A node other than a database root and its parent, both writable."""
+        node = self.node(path, writable=True)
+        if node is None:
+            raise ValueError(f"No node at '{path}'")
+        parent_id, _ = self.nodes.place(node.id)
+        if parent_id is None:
+            raise ValueError("Cannot rename or move a database root")
+        return node, self.node(self.nodes.path(parent_id), writable=True)
+
+    # write utilities
+
+    def add_note(self: Self, note: types.Note):
+        # notes created in a version are written when it is merged back into the databases
+        if self.version() is not None:
+            return
+        # replaces the note if it was already written earlier this session
+        self._notes_json()[note.id] = _note_to_json(note)
+        self._write_notes_json()
+        self.temporal.file(note, self.nodes.paths(note.node_ids))
+        if DEDUPE:
+            self.similarity.add(note)
+        # write actual content file
+        write_behind(
+            os.path.join(self.content_folder, f'{note.id}.md'),
+            note.to_storage_string()
         )
-        nodes.append(node)
-    return nodes
 
-DB_SET = load_db_into_memory()
+    def update_note_content(self: Self, note_id: int, content: str):
+        content_path = os.path.join(self.content_folder, f'{note_id}.md')
+        write_behind(content_path, content)
+
+    def save_session_changes(self: Self, root_node: types.Node):
+        self._save_all_notes(root_node)
+        self._save_nodes_structure(root_node)
+        _mark_saved(root_node)
+
+    def _save_all_notes(self: Self, node: types.Node, saved: set[int] | None = None):
+        # a note filed under several nodes only needs saving once
+        saved = set() if saved is None else saved
+        for note in node.notes:
+            if note.id in saved:
+                continue
+            saved.add(note.id)
+            if note.status in [types.GitStatus.ADDED, types.GitStatus.MODIFIED]:
+                if note.status == types.GitStatus.ADDED:
+                    self.add_note(note)
+                else:
+                    self.update_note_content(note.id, note.to_storage_string())
+                    if DEDUPE:
+                        self.similarity.add(note)
+                    if note.name != note.original_name or note.node_ids != note.og_node_ids or note.note_references != note.og_note_references:
+                        self._update_note_metadata(note)
+
+        for child in node.children:
+            self._save_all_notes(child, saved)
+
+    def _update_note_metadata(self: Self, note: types.Note):
+        notes = self._notes_json()
+        if note.id in notes:
+            notes[note.id] = _note_to_json(note)
+            self._write_notes_json()
+            self.temporal.file(note, self.nodes.paths(note.node_ids), self.nodes.paths(note.og_node_ids))
+
+    def _notes_json(self: Self) -> dict[int, note_json]:
+        if self._notes is None:
+            self._notes = {note['id']: note for note in cast(List[note_json], json.loads(read_file(self.note_path)))}
+        return self._notes
+
+    def _write_notes_json(self: Self):
+        # serialized on the writer thread, once for however many notes were added while the write waited
+        notes = list(self._notes_json().values())
+        write_behind(self.note_path, lambda: dump_json(notes))
+
+    def _save_nodes_structure(self: Self, root_node: types.Node):
+        """Save the node structure of one database to nodes.json, leaving the other databases as they are"""
+        nodes_json = parse_nodes(read_file(self.node_path))
+        nodes_json[root_node.db_type] = _node_to_json(root_node)
+        write_behind(self.node_path, lambda: dump_json(nodes_json))
+
+class RegistryStats(BaseModel):
+    budget: int
+    loaded: int = 0
+    size: int = 0                       # estimated bytes of the loaded databases
+    loads: int = 0
+    evictions: int = 0
+
+class DatabaseRegistry:
+    """
+    Databases by tenant, so one process can serve many users. Databases are loaded the first time they are
+    used; once the loaded ones are estimated to take more than the memory budget, the least recently used ones
+    that nothing is working on are saved and unloaded.
+    """
+    def __init__(self: Self, budget: int = MEMORY_BUDGET, tenants_root: str | None = TENANTS_ROOT):
+        self.budget = budget
+        self.tenants_root = tenants_root
+        self.databases: dict[str, Database] = {}
+        # the loaded ones, least recently used first
+        self.recent: OrderedDict[str, Database] = OrderedDict()
+        self.loads = 0
+        self.evictions = 0
+
+    def register(self: Self, tenant: str, root: str) -> Database:
+        if tenant in self.databases:
+            raise ValueError(f"Tenant '{tenant}' is already registered at {self.databases[tenant].root}")
+        self.databases[tenant] = Database(tenant, root, self)
+        return self.databases[tenant]
+
+    def get(self: Self, tenant: str) -> Database:
+        """The tenant's database handle, found under the tenants root if it wasn't registered. Doesn't load it."""
+        if tenant in self.databases:
+            return self.databases[tenant]
+        if self.tenants_root is None:
+            raise ValueError(f"Unknown tenant '{tenant}' and DENDRITE_TENANTS_ROOT isn't set")
+        if not tenant or tenant != os.path.basename(tenant) or tenant.startswith('.'):
+            raise ValueError(f"Invalid tenant id '{tenant}'")
+        root = os.path.join(self.tenants_root, tenant)
+        if not os.path.isdir(root):
+            raise ValueError(f"No database for tenant '{tenant}' at {root}")
+        return self.register(tenant, root)
+
+    def acquire(self: Self, tenant: str) -> Database:
+        """The tenant's database, kept loaded until released."""
+        database = self.get(tenant)
+        database.users += 1
+        return database
+
+    def release(self: Self, database: Database):
+        database.users -= 1
+        self._evict()
+
+    @contextmanager
+    def use(self: Self, tenant: str) -> Iterator[Database]:
+        """The tenant's database, kept loaded and made the running task's database while in use."""
+        database = self.acquire(tenant)
+        try:
+            with database.active():
+                yield database
+        finally:
+            self.release(database)
+
+    def touch(self: Self, database: Database):
+        if database.tenant in self.recent:
+            self.recent.move_to_end(database.tenant)
+
+    def loaded(self: Self, database: Database):
+        self.recent[database.tenant] = database
+        self.recent.move_to_end(database.tenant)
+        self.loads += 1
+        self._evict()
+
+    def _evict(self: Self):
+        size = sum(database.size for database in self.recent.values())
+        # never the most recently used one, it is about to be used
+        for database in list(self.recent.values())[:-1]:
+            if size <= self.budget:
+                break
+            if database.users:
+                continue
+            size -= database.size
+            logger.info("Unloading the databases of %s (~%.1f MB) to stay within the memory budget", database.tenant, database.size / 1024 ** 2)
+            database.unload()
+            del self.recent[database.tenant]
+            self.evictions += 1
+
+    def stats(self: Self) -> RegistryStats:
+        return RegistryStats(
+            budget=self.budget,
+            loaded=len(self.recent),
+            size=sum(database.size for database in self.recent.values()),
+            loads=self.loads,
+            evictions=self.evictions,
+        )
+
+REGISTRY = DatabaseRegistry()
+if ROOT is not None:
+    REGISTRY.register(DEFAULT_TENANT, ROOT)
+
+# the database of the running task, for interfaces and passes not bound to one of their own
+CURRENT_DATABASE: ContextVar[Database | None] = ContextVar('dendrite_database', default=None)
+
+def current_database() -> Database:
+    database = CURRENT_DATABASE.get()
+    if database is not None:
+        return database
+    if ROOT is None:
+        raise ValueError("No database to work on: set DB_ROOT, or use a tenant's database (see DatabaseRegistry)")
+    return REGISTRY.get(DEFAULT_TENANT)
 
 """
-Write utilities
+Versions
 """
 
+class TreeVersion:
+    """
+    A version of the databases that shares every node and note with the databases it was taken from until it
+    changes them. Changing a note copies the note and the nodes it is filed under, changing a node copies it and
+    the nodes above it; everything else stays shared. Taking a version is O(1) and it only takes memory for what
+    its edits touched. Whatever a version copied or created is its own and is changed in place from then on.
+
+    Nothing is ever changed in place in the databases a version was taken from (see publish), so any number of
+    versions can be taken from them and worked on side by side. Whoever takes one keeps the database in use
+    (see DatabaseRegistry.acquire) until the version is published or thrown away.
+
+    A version can also be taken from another (base) the same way, to make changes that are kept all together or
+    not at all: publishing it hands what it changed to its base rather than to the databases.
+    """
+    def __init__(self: Self, database: Database, base: 'TreeVersion | None' = None):
+        self.database = database
+        self.base = base
+        self.roots: DatabaseSet = dict(database.dbs if base is None else base.roots)
+        # nodes it creates, renames or moves, on top of where the databases (or its base) have them
+        self.nodes = NodeIndex(database._nodes if base is None else base.nodes)
+        # by id(), holding on to them keeps the ids from being reused
+        self.owned: dict[int, types.Node | types.Note] = {}
+        self.copies: dict[int, tuple[types.Node | types.Note, types.Node | types.Note]] = {}
+        # notes as they were when the version was taken, and the notes it copied or created, by note id
+        self.originals: dict[int, types.Note] = {}
+        self.notes: dict[int, types.Note] = {}
+
+    @contextmanager
+    def active(self: Self) -> Iterator[DatabaseSet]:
+        token = CURRENT_VIEW.set(self)
+        try:
+            yield self.roots
+        finally:
+            CURRENT_VIEW.reset(token)
+
+    def owns(self: Self, item: types.Node | types.Note) -> bool:
+        return id(item) in self.owned
+
+    def adopt(self: Self, item: types.Node | types.Note) -> types.Node | types.Note:
+        """Take a node or note created in this version as its own."""
+        self.owned[id(item)] = item
+        if isinstance(item, types.Note):
+            self.notes[item.id] = item
+        return item
+
+    def latest(self: Self, item: types.Node | types.Note) -> types.Node | types.Note:
+        """This version's copy of a node or note if it copied it, for references held from before it did."""
+        if self.base is not None:
+            item = self.base.latest(item)
+        # a copy taken over from a version published into this one may itself have been copied
+        while (copied := self.copies.get(id(item))) is not None:
+            item = copied[1]
+        return item
+
+    def root(self: Self, type_: DatabaseType) -> types.Node:
+        root = self.roots[type_]
+        if not self.owns(root):
+            root = self.roots[type_] = self._copy(root)
+        return root
+
+    def child(self: Self, parent: types.Node, child: types.Node) -> types.Node:
+        """The child of a node this version owns, copied if it doesn't own it yet."""
+        if self.owns(child):
+            return child
+        copy = self._copy(child)
+        parent.children[parent.children.index(child)] = copy
+        return copy
+
+    def node(self: Self, path: str, writable: bool = False) -> types.Node | None:
+        parts = path.strip().strip('/').split('/')
+        try:
+            type_ = DatabaseType(parts[0])
+        except ValueError:
+            return None
+        node = self.root(type_) if writable else self.roots[type_]
+        for name in parts[1:]:
+            child = next((child for child in node.children if child.name == name), None)
+            if child is None:
+                return None
+            node = self.child(node, child) if writable else child
+        return node
+
+    def node_by_id(self: Self, id: int, writable: bool = False) -> types.Node | None:
+        path = self.nodes.path(id)
+        return None if path is None else self.node(path, writable)
+
+    def note(self: Self, note: types.Note) -> types.Note:
+        """This version's own copy of a note, replacing it under every node it is filed under."""
+        note = self.latest(note)
+        if self.owns(note):
+            return note
+        copy = self._copy(note)
+        self.originals[note.id] = note
+        # a note whose references changed is still filed where it was until it is saved
+        for id in dict.fromkeys(note.og_node_ids + note.node_ids):
+            node = self.node_by_id(id)
+            if node is None or not any(other is note for other in node.notes):
+                continue
+            node = self.node_by_id(id, writable=True)
+            node.notes = [copy if other is note else other for other in node.notes]
+        return copy
+
+    def _copy(self: Self, item: types.Node | types.Note) -> types.Node | types.Note:
+        copy = py_copy.copy(item)
+        if isinstance(copy, types.Node):
+            copy.children = list(item.children)
+            copy.notes = list(item.notes)
+        else:
+            # contents are never changed in place, only replaced or appended to
+            copy.content = list(item.content)
+            copy.node_ids = list(item.node_ids)
+            copy.note_references = list(item.note_references)
+            copy.og_node_ids = list(item.og_node_ids)
+            copy.og_note_references = list(item.og_note_references)
+        self.copies[id(item)] = (item, copy)
+        return self.adopt(copy)
+
+    def absorb(self: Self, version: 'TreeVersion'):
+        """Take over what a version taken from this one changed, as if this one had made the changes."""
+        self.roots.update(version.roots)
+        for id, (parent, name) in version.nodes.places.items():
+            self.nodes.set(id, parent, name)
+        self.owned.update(version.owned)
+        self.copies.update(version.copies)
+        for note_id, note in version.originals.items():
+            self.originals.setdefault(note_id, note)
+        self.notes.update(version.notes)
+
+def publish(version: TreeVersion):
+    """Make a version its database's current one. Versions already taken from it keep the one they were taken from."""
+    if version.base is not None:
+        version.base.absorb(version)
+        return
+    version.database.dbs.update(version.roots)
+    if version.nodes.places:
+        version.database._nodes = version.nodes.compacted()
+
+# the version the running task works on instead of its database. tasks copy their context when created,
+# so every pass a worker fans out to works on the worker's version
+CURRENT_VIEW: ContextVar[TreeVersion | None] = ContextVar('dendrite_view', default=None)
+
+def db_set() -> DatabaseSet:
+    return current_database().roots()
+
+def node_index() -> NodeIndex:
+    """Where the nodes are for the running task: in the version it works on, or else in its database."""
+    view = CURRENT_VIEW.get()
+    return view.nodes if view is not None else current_database().nodes
+
+# the running task's database, for callers not bound to one
+
 def add_note(note: types.Note):
-    # read in current notes json
-    notes = cast(List[note_json], json.loads(read_file(note_path)))
-    # add note in memory
-    notes.append({
-        'id': note.id,
-        'name': note.name,
-        'references': note.node_references
-    })
-    # write updated notes json back to file
-    write_to_file(note_path, json.dumps(notes, indent=4))
-    # write actual content file
-    write_to_file(
-        os.path.join(content_folder, f'{note.id}.md'),
-        note.to_storage_string()
-    )
+    current_database().add_note(note)
 
 def update_note_content(note_id: int, content: str):
-    content_path = os.path.join(content_folder, f'{note_id}.md')
-    write_to_file(content_path, content)
+    current_database().update_note_content(note_id, content)
 
 def save_session_changes(root_node: types.Node):
-    _save_all_notes(root_node)
-    _save_nodes_structure(root_node)
+    current_database().save_session_changes(root_node)
 
-def _save_all_notes(node: types.Node):
+def _mark_saved(node: types.Node):
+    """Everything under the node is saved now, so it is staged again and a later save only writes what changes after this one"""
+    if node.status == types.GitStatus.STAGED and all(note.status == types.GitStatus.STAGED for note in node.notes):
+        # left alone, it may be shared with versions taken before the save
+        for child in node.children:
+            _mark_saved(child)
+        return
     for note in node.notes:
-        if note.status in [types.GitStatus.ADDED, types.GitStatus.MODIFIED]:
-            if note.status == types.GitStatus.ADDED:
-                add_note(note)
-            else:
-                update_note_content(note.id, note.to_storage_string())
-                if note.name != note.original_name or note.node_references != note.og_note_references:
-                    _update_note_metadata(note)
-    
+        if note.status == types.GitStatus.STAGED:
+            continue
+        note.content = [types.Content(text=note.to_storage_string(), status=types.ContentStatus.STAGED)]
+        note.status = types.GitStatus.STAGED
+        note.original_name = note.name
+        note.og_node_ids = list(note.node_ids)
+        note.og_note_references = list(note.note_references)
+    node.status = types.GitStatus.STAGED
+    node.original_name = node.name
     for child in node.children:
-        _save_all_notes(child)
+        _mark_saved(child)
 
-def _update_note_metadata(note: types.Note):
-    from dendrite.utils.file import write_to_file, read_file
-    notes = cast(List[note_json], json.loads(read_file(note_path)))
-    for i, note_data in enumerate(notes):
-        if note_data['id'] == note.id:
-            notes[i]['name'] = note.name
-            notes[i]['references'] = note.node_references
-            break
-
-    write_to_file(note_path, json.dumps(notes, indent=4))
-
-def _save_nodes_structure(root_node: types.Node):
-    """Save the node structure to nodes.json"""
-    nodes_json = _node_to_json(root_node)
-    write_to_file(
-        node_path,
-        json.dumps(nodes_json, indent=4)
-    )
+def _note_to_json(note: types.Note) -> note_json:
+    return {
+        'id': note.id,
+        'name': note.name,
+        # copies, the lists may be serialized on the writer thread while the note changes
+        'node_references': list(note.node_ids),
+        'note_references': list(note.note_references),
+        'read_only': note.read_only,
+        # only notes taken from documents have any, the others are stored as they always were
+        **({'sources': list(note.sources)} if note.sources else {})
+    }
 
-def _node_to_json(node: types.Node, include_root=False) -> db_json:
+def _node_to_json(node: types.Node) -> node_json:
     """Recursively convert Node tree back to JSON format"""
-    result = {}
-    children_to_process = node.children if include_root else node.children
-    
-    for child in children_to_process:
-        result[child.name] = {
-            "children": _node_to_json(child, include_root=True)
-        }
-    return result
\ No newline at end of file
+    return {'id': node.id, 'children': {child.name: _node_to_json(child) for child in node.children}}
+
+def _find(roots: DatabaseSet, path: str) -> types.Node | None:
+    parts = path.strip().strip('/').split('/')
+    node = next((root for root in roots.values() if root.name == parts[0]), None)
+    for name in parts[1:]:
+        if node is None:
+            return None
+        node = next((child for child in node.children if child.name == name), None)
+    return node
@@ -0,0 +1,100 @@
+"""
+Stable node ids. Every node has an integer id that never changes, and notes are filed by the ids of their nodes
+rather than by path, so renaming or moving a node doesn't touch the notes beneath it, however many there are.
+nodes.json keeps each database as a tree of ids, children by name:
+
+    {"conceptual": {"id": 1, "children": {"work": {"id": 4, "children": {}}}}, ...}
+
+and notes.json the ids of the nodes every note is filed under (node_references). Stores from before node ids
+(a tree of names, notes filed by path) are numbered and rewritten the first time they are loaded, see
+Database._load.
+
+Paths are resolved through a NodeIndex, the parent and name of every node by id, so a path is as many lookups as
+the node is deep and a rename or a move is a single entry.
+"""
+from typing import Iterable, Iterator, Self
+import dendrite.interface.types as types
+
+# parent id (None for a database root) and name
+Place = tuple[int | None, str]
+
+# indexes stacked on top of each other before they are flattened into one, see NodeIndex.compacted
+MAX_DEPTH = 16
+
+class NodeIndex:
+    """
+    Where every node is, by id. An index taken on top of another (a version's on top of its database's) only holds
+    what changed since, and what is in the base is never changed through it.
+    """
+    def __init__(self: Self, base: 'NodeIndex | None' = None, places: dict[int, Place] | None = None):
+        self.base = base
+        self.places: dict[int, Place] = places if places is not None else {}
+        # places in the base of the nodes this index placed elsewhere, and the nodes created on top of it
+        self.originals: dict[int, Place] = {}
+        self.created: set[int] = set()
+        self.depth = 0 if base is None else base.depth + 1
+
+    @classmethod
+    def of(cls, roots: Iterable[types.Node]) -> 'NodeIndex':
+        places: dict[int, Place] = {}
+        stack: list[tuple[types.Node, int | None]] = [(root, None) for root in roots]
+        while stack:
+            node, parent = stack.pop()
+            places[node.id] = (parent, node.name)
+            stack.extend((child, node.id) for child in node.children)
+        return cls(places=places)
+
+    def __iter__(self: Self) -> Iterator[int]:
+        seen: set[int] = set()
+        index = self
+        while index is not None:
+            for id in index.places:
+                if id not in seen:
+                    seen.add(id)
+                    yield id
+            index = index.base
+
+    def place(self: Self, id: int) -> Place | None:
+        index = self
+        while index is not None:
+            if (place := index.places.get(id)) is not None:
+                return place
+            index = index.base
+        return None
+
+    def path(self: Self, id: int) -> str | None:
+        """Path of the node, None if there is no node of that id."""
+        names = []
+        while id is not None:
+            if (place := self.place(id)) is None:
+                return None
+            id, name = place
+            names.append(name)
+        return "/".join(reversed(names))
+
+    def paths(self: Self, ids: Iterable[int]) -> list[str]:
+        """Paths of the nodes, leaving out ids of nodes that don't exist."""
+        return [path for id in ids if (path := self.path(id)) is not None]
+
+    def max_id(self: Self) -> int:
+        return max(self, default=0)
+
+    def set(self: Self, id: int, parent: int | None, name: str):
+        if id not in self.places and id not in self.created:
+            if self.base is not None and (original := self.base.place(id)) is not None:
+                self.originals[id] = original
+            else:
+                self.created.add(id)
+        self.places[id] = (parent, name)
+
+    def compacted(self: Self) -> 'NodeIndex':
+        """This index, or one flat index of the same places once too many are stacked up."""
+        if self.depth <= MAX_DEPTH:
+            return self
+        places: dict[int, Place] = {}
+        index = self
+        while index is not None:
+            for id, place in index.places.items():
+                places.setdefault(id, place)
+            index = index.base
+        return NodeIndex(places=places)
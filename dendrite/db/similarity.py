@@ -0,0 +1,328 @@
+"""
+Near duplicate notes. A write pass only sees the part of the database it opened, so it often creates a note that
+mostly repeats one it never saw. Every saved note gets a MinHash signature of its word shingles (runs of
+SHINGLE_WORDS words of its name and content), split into BANDS bands of ROWS values; notes that share a band are
+candidates, and candidates are compared by the Jaccard similarity of their shingles.
+
+With the defaults (10 bands of 3) notes that are 60% alike share a band about 9 times out of 10 and notes 30%
+alike about 1 in 4, so candidates are checked before anything is done with them (see Interface.create_note).
+
+The bands are stored by note id (index/similarity/NN.json under the database root, a partition per id % 64) and
+kept up to date as notes are saved (see Database.add_note), built from the loaded databases the first time a
+database without one is used.
+
+    python -m dendrite.db.similarity --tenant alice                   # clusters of notes at least 80% alike
+    python -m dendrite.db.similarity --tenant alice --threshold 0.6 --json dupes.json
+    python -m dendrite.db.similarity --tenant alice --rebuild
+"""
+import argparse
+import hashlib
+import json
+import logging
+import os
+import re
+import zlib
+from typing import Iterable, Self
+from pydantic import BaseModel
+import dendrite.interface.types as types
+from dendrite.db.nodes import NodeIndex
+from dendrite.utils.file import dump_json, read_file, write_behind
+
+logger = logging.getLogger(__name__)
+
+# 0 turns the index and the checks made with it off
+DEDUPE = os.getenv("DENDRITE_DEDUPE", "1") != "0"
+SHINGLE_WORDS = int(os.getenv("DENDRITE_SHINGLE_WORDS", "3"))
+BANDS = int(os.getenv("DENDRITE_MINHASH_BANDS", "10"))
+ROWS = int(os.getenv("DENDRITE_MINHASH_ROWS", "3"))
+# Jaccard similarity of a new note to an existing one to point the existing one out, and to merge into it instead
+DEDUPE_NOTIFY = float(os.getenv("DENDRITE_DEDUPE_NOTIFY", "0.6"))
+DEDUPE_MERGE = float(os.getenv("DENDRITE_DEDUPE_MERGE", "0.9"))
+# candidates compared per new note, those sharing the most bands
+MAX_CANDIDATES = 20
+PARTITIONS = 64
+
+_WORD = re.compile(r"\w+")
+# a shingle's crc picks its bin, and the crc times an odd constant is the value a bin keeps the least of
+_MIX = 0x9E3779B97F4A7C15
+_MASK = (1 << 64) - 1
+# gap between the values an empty bin borrows from further bins, over any value a bin can hold
+_BORROWED = 1 << 64
+
+def note_text(note: types.Note) -> str:
+    return f"{note.name}\n{note.to_storage_string()}"
+
+def shingles(text: str) -> set[int]:
+    """Hashes (crc32) of every run of SHINGLE_WORDS words, case and punctuation aside. Shorter texts are one shingle."""
+    words = _WORD.findall(text.lower())
+    if len(words) < SHINGLE_WORDS:
+        return {zlib.crc32(" ".join(words).encode('utf-8'))} if words else set()
+    return {zlib.crc32(run.encode('utf-8')) for run in map(" ".join, zip(*(words[i:] for i in range(SHINGLE_WORDS))))}
+
+def signature(hashes: set[int]) -> list[int]:
+    """
+    One permutation MinHash: each shingle hash falls in one of BANDS * ROWS bins, and a bin keeps the least. An empty
+    bin borrows from the next bin that isn't, marked by how far it went, so two notes only agree on it when they agree
+    on that one. Each hash is looked at once, instead of once per value of the signature.
+    """
+    if not hashes:
+        return []
+    size = BANDS * ROWS
+    bins: list[int | None] = [None] * size
+    for x in hashes:
+        at, value = x % size, (x * _MIX) & _MASK
+        if bins[at] is None or value < bins[at]:
+            bins[at] = value
+    if None in bins:
+        filled = [at for at, value in enumerate(bins) if value is not None]
+        for at in range(size):
+            if bins[at] is None:
+                source = next((other for other in filled if other > at), filled[0])
+                bins[at] = bins[source] + _BORROWED * ((source - at) % size)
+    return bins
+
+def bands(signature: list[int]) -> list[int]:
+    """One key per band; two signatures share a key only if the band's rows are all equal (and it is the same band)."""
+    if not signature:
+        return []
+    return [
+        int.from_bytes(hashlib.blake2b(repr((band, signature[band * ROWS:(band + 1) * ROWS])).encode('utf-8'), digest_size=8).digest(), 'big')
+        for band in range(BANDS)
+    ]
+
+def jaccard(a: set[int], b: set[int]) -> float:
+    return len(a & b) / len(a | b) if a or b else 0.0
+
+class SimilarityEntry(BaseModel):
+    note_id: int
+    nodes: list[int]                    # ids of the nodes the note is filed under
+    bands: list[int]
+
+    def path(self, nodes: NodeIndex, db_type: str | None = None) -> str | None:
+        """Path of the note under a node of that database (any, if none is given), None if it isn't filed in it."""
+        ref = next((ref for ref in nodes.paths(self.nodes) if db_type is None or ref.split('/')[0] == db_type), None)
+        return None if ref is None else f"{ref}/{self.note_id}"
+
+class SimilarityIndex:
+    """Band keys of notes, by note id, and the notes of every band key. Without a folder it is only kept in memory."""
+    def __init__(self: Self, folder: str | None = None):
+        self.folder = folder
+        # entries by note id, a dict per partition so a change only writes its own
+        self.partitions: list[dict[int, SimilarityEntry]] = [{} for _ in range(PARTITIONS)]
+        # most band keys are of a single note, kept as its id rather than a list of one
+        self.buckets: dict[int, int | list[int]] = {}
+        if folder is not None and self.exists():
+            self._read()
+
+    def exists(self: Self) -> bool:
+        if self.folder is None or not os.path.isdir(self.folder):
+            return False
+        # built with other bands or rows, the keys don't compare
+        meta = os.path.join(self.folder, 'meta.json')
+        return os.path.exists(meta) and json.loads(read_file(meta)) == _meta()
+
+    def rebuild(self: Self, roots: Iterable[types.Node]):
+        """Index every note of the trees, replacing whatever was indexed."""
+        for entries in self.partitions:
+            entries.clear()
+        self.buckets.clear()
+        for note in _notes(roots):
+            self._index(note)
+        if self.folder is not None:
+            os.makedirs(self.folder, exist_ok=True)
+            for partition in range(PARTITIONS):
+                self._write(partition)
+            write_behind(os.path.join(self.folder, 'meta.json'), dump_json(_meta()))
+        logger.info("Indexed the shingles of %d notes in %s", len(self), self.folder or "memory")
+
+    def __len__(self: Self) -> int:
+        return sum(len(entries) for entries in self.partitions)
+
+    def get(self: Self, note_id: int) -> SimilarityEntry | None:
+        return self.partitions[note_id % PARTITIONS].get(note_id)
+
+    def add(self: Self, note: types.Note):
+        """Index a note as saved, in place of what was indexed of it before."""
+        if note.read_only:
+            return
+        self._unindex(note.id)
+        self._index(note)
+        self._write(note.id % PARTITIONS)
+
+    def remove(self: Self, note_id: int):
+        if self.get(note_id) is not None:
+            self._unindex(note_id)
+            self._write(note_id % PARTITIONS)
+
+    def candidates(self: Self, hashes: set[int], exclude: int | None = None) -> list[SimilarityEntry]:
+        """Notes sharing a band with the shingles, those sharing the most bands first."""
+        shared: dict[int, int] = {}
+        for key in bands(signature(hashes)):
+            ids = self.buckets.get(key, ())
+            for id in (ids,) if isinstance(ids, int) else ids:
+                if id != exclude:
+                    shared[id] = shared.get(id, 0) + 1
+        return [self.get(id) for id in sorted(shared, key=lambda id: -shared[id])]
+
+    def _index(self: Self, note: types.Note):
+        keys = bands(signature(shingles(note_text(note))))
+        if not keys:
+            return
+        self.partitions[note.id % PARTITIONS][note.id] = SimilarityEntry(note_id=note.id, nodes=list(note.node_ids), bands=keys)
+        self._bucket(note.id, keys)
+
+    def _unindex(self: Self, note_id: int):
+        entry = self.partitions[note_id % PARTITIONS].pop(note_id, None)
+        for key in entry.bands if entry is not None else ():
+            ids = self.buckets[key]
+            if isinstance(ids, int):
+                del self.buckets[key]
+                continue
+            ids.remove(note_id)
+            if len(ids) == 1:
+                self.buckets[key] = ids[0]
+
+    def _bucket(self: Self, note_id: int, keys: list[int]):
+        for key in keys:
+            ids = self.buckets.get(key)
+            if ids is None:
+                self.buckets[key] = note_id
+            elif isinstance(ids, int):
+                self.buckets[key] = [ids, note_id]
+            else:
+                ids.append(note_id)
+
+    def _read(self: Self):
+        for partition in range(PARTITIONS):
+            if not os.path.exists(self._path(partition)):
+                continue
+            for entry in json.loads(read_file(self._path(partition))):
+                entry = SimilarityEntry.model_validate(entry)
+                self.partitions[partition][entry.note_id] = entry
+                self._bucket(entry.note_id, entry.bands)
+
+    def _write(self: Self, partition: int):
+        if self.folder is None:
+            return
+        os.makedirs(self.folder, exist_ok=True)
+        entries = list(self.partitions[partition].values())
+        write_behind(self._path(partition), lambda: dump_json([entry.model_dump() for entry in entries]))
+
+    def _path(self: Self, partition: int) -> str:
+        return os.path.join(self.folder, f"{partition:02d}.json")
+
+def _meta() -> dict[str, int]:
+    # entries from before node ids have paths instead, they are built again
+    return {'shingle_words': SHINGLE_WORDS, 'bands': BANDS, 'rows': ROWS, 'node_ids': 1}
+
+def _notes(roots: Iterable[types.Node]) -> Iterable[types.Note]:
+    """Every note of the trees once, read only ones (manifests, rollup summaries) aside."""
+    seen: set[int] = set()
+    stack = list(roots)
+    while stack:
+        node = stack.pop()
+        for note in node.notes:
+            if note.id not in seen and not note.read_only:
+                seen.add(note.id)
+                yield note
+        stack.extend(node.children)
+
+"""
+Dedupe report
+"""
+
+class DuplicateCluster(BaseModel):
+    # the notes, as a path each, by id
+    paths: list[str]
+    names: list[str]
+    similarity: float                   # least similar linked pair
+    bytes: int                          # of every note but the first, what merging them would save
+
+class DedupeReport(BaseModel):
+    notes: int
+    threshold: float
+    candidates: int = 0                 # pairs sharing a band
+    clusters: list[DuplicateCluster] = []
+
+    def __str__(self) -> str:
+        duplicates = sum(len(cluster.paths) - 1 for cluster in self.clusters)
+        lines = [
+            f"{self.notes} notes, {self.candidates} candidate pairs, {len(self.clusters)} clusters of notes at least "
+            f"{self.threshold:.0%} alike, {duplicates} notes ({sum(cluster.bytes for cluster in self.clusters) / 1024:.1f} KB) could be merged away"
+        ]
+        for cluster in sorted(self.clusters, key=lambda cluster: -cluster.bytes):
+            lines.append(f"  {len(cluster.paths)} notes, at least {cluster.similarity:.0%} alike:")
+            lines += [f"    {path}  {name}" for path, name in zip(cluster.paths, cluster.names)]
+        return "\n".join(lines)
+
+def dedupe_report(roots: Iterable[types.Node], nodes: NodeIndex, threshold: float = 0.8) -> DedupeReport:
+    """Notes at least threshold alike, linked into clusters (so a cluster can hold pairs that are less alike)."""
+    notes = {note.id: note for note in _notes(roots)}
+    report = DedupeReport(notes=len(notes), threshold=threshold)
+    index = SimilarityIndex()
+    texts = {id: shingles(note_text(note)) for id, note in notes.items()}
+    parents = {id: id for id in notes}
+    weakest: dict[int, float] = {}
+
+    def find(id: int) -> int:
+        while parents[id] != id:
+            parents[id] = parents[parents[id]]
+            id = parents[id]
+        return id
+
+    # each note against the ones before it, so a pair is compared once
+    for id, note in notes.items():
+        for entry in index.candidates(texts[id]):
+            report.candidates += 1
+            similarity = jaccard(texts[id], texts[entry.note_id])
+            if similarity < threshold:
+                continue
+            a, b = find(id), find(entry.note_id)
+            if a == b:
+                continue
+            weakest[min(a, b)] = min(weakest.get(a, 1.0), weakest.get(b, 1.0), similarity)
+            parents[max(a, b)] = min(a, b)
+        index._index(note)
+
+    members: dict[int, list[int]] = {}
+    for id in notes:
+        members.setdefault(find(id), []).append(id)
+    for root, ids in members.items():
+        if len(ids) < 2:
+            continue
+        ids.sort()
+        report.clusters.append(DuplicateCluster(
+            paths=[f"{nodes.path(notes[id].node_ids[0])}/{id}" for id in ids],
+            names=[notes[id].name for id in ids],
+            similarity=weakest[root],
+            bytes=sum(len(note_text(notes[id]).encode('utf-8')) for id in ids[1:]),
+        ))
+    return report
+
+def main():
+    from dendrite.db.io import DEFAULT_TENANT, REGISTRY
+    from dendrite.utils.file import WRITER
+    from dendrite.utils.tracing import configure_logging
+
+    parser = argparse.ArgumentParser(description="Report clusters of near duplicate notes, or rebuild the index they are found with.")
+    parser.add_argument('--tenant', default=DEFAULT_TENANT)
+    parser.add_argument('--threshold', type=float, default=0.8, help="Jaccard similarity of the shingles of two notes to report them")
+    parser.add_argument('--rebuild', action='store_true', help="index every note again from scratch")
+    parser.add_argument('--json', help="also write the report to this file")
+    parser.add_argument('--log-level', default='INFO')
+    args = parser.parse_args()
+
+    configure_logging(args.log_level)
+    with REGISTRY.use(args.tenant) as database:
+        if args.rebuild:
+            database.similarity.rebuild(database.dbs.values())
+            WRITER.flush_sync()
+            return
+        report = dedupe_report(database.dbs.values(), database.nodes, args.threshold)
+    print(report)
+    if args.json:
+        with open(args.json, 'w', encoding='utf-8') as file:
+            file.write(report.model_dump_json(indent=4))
+
+if __name__ == '__main__':
+    main()
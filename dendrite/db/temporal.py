@@ -0,0 +1,230 @@
+"""
+Date index of the temporal database. Sessions are filed under temporal/YYYY/MM/DD, so "everything from last
+March" or "the last 30 sessions" walked every day node in between. The index keeps one entry per note filed
+under a day node (rollup summaries aside), sorted by date, so both are binary searches.
+
+Entries are stored a month per file (index/temporal/YYYY-MM.json under the database root) and a month is only
+read once a query reaches it, so old months stay on disk. The index is kept up to date as notes are saved
+(see Database.add_note) and built from the temporal tree the first time a database without one is used.
+
+    python -m dendrite.db.temporal --tenant alice --rebuild
+    python -m dendrite.db.temporal --start 2025-03 --end 2025-03
+"""
+import argparse
+import bisect
+import calendar
+import json
+import logging
+import os
+import re
+from collections import OrderedDict
+from datetime import date
+from typing import Self
+from pydantic import BaseModel
+import dendrite.interface.types as types
+from dendrite.utils.file import dump_json, read_file, write_behind
+
+logger = logging.getLogger(__name__)
+
+TEMPORAL = "temporal"
+# months kept in memory per database, the least recently queried are dropped first
+MAX_PARTITIONS = int(os.getenv("DENDRITE_TEMPORAL_PARTITIONS", "24"))
+
+DAY_PATH = re.compile(rf"^{TEMPORAL}/(\d{{4}})/(\d{{2}})/(\d{{2}})$")
+
+# read only summaries of the day, month and year nodes they are filed under (see dendrite.stages.write.rollup)
+DAY_SUMMARY, MONTH_SUMMARY, YEAR_SUMMARY = "Day summary", "Month summary", "Year summary"
+
+def is_rollup(note: types.Note) -> bool:
+    return note.read_only and note.name in (DAY_SUMMARY, MONTH_SUMMARY, YEAR_SUMMARY)
+
+class TemporalEntry(BaseModel):
+    day: date
+    note_id: int
+    name: str
+
+    @property
+    def path(self) -> str:
+        return f"{day_path(self.day)}/{self.note_id}"
+
+def day_path(day: date) -> str:
+    return f"{TEMPORAL}/{day.year}/{day.month:02d}/{day.day:02d}"
+
+def parse_day_path(path: str) -> date | None:
+    """The day of a temporal/YYYY/MM/DD node path, None for any other path."""
+    if (match := DAY_PATH.match(path.strip().strip('/'))) is None:
+        return None
+    try:
+        return date(*(int(part) for part in match.groups()))
+    except ValueError:
+        return None
+
+def parse_bound(value: str, end: bool = False) -> date:
+    """YYYY, YYYY-MM or YYYY-MM-DD, as its first day (or its last one for the end of a range)."""
+    parts = [int(part) for part in value.strip().split('-')]
+    if not 1 <= len(parts) <= 3:
+        raise ValueError(f"Expected YYYY, YYYY-MM or YYYY-MM-DD, got '{value}'")
+    year, month, day = (parts + [None, None])[:3]
+    if month is None:
+        month = 12 if end else 1
+    if day is None:
+        day = calendar.monthrange(year, month)[1] if end else 1
+    return date(year, month, day)
+
+def _month(day: date) -> str:
+    return f"{day.year}-{day.month:02d}"
+
+class TemporalIndex:
+    """Notes filed under day nodes, by date. Entries of a day are ordered by note id."""
+    def __init__(self: Self, folder: str):
+        self.folder = folder
+        # every month with entries, sorted, whether it is loaded or not
+        self.months: list[str] = sorted(
+            os.path.splitext(file_name)[0] for file_name in os.listdir(folder) if file_name.endswith('.json')
+        ) if os.path.isdir(folder) else []
+        # loaded months, least recently used first. keys are (day, note id), kept alongside for bisect
+        self.partitions: OrderedDict[str, tuple[list[tuple[date, int]], list[TemporalEntry]]] = OrderedDict()
+
+    def exists(self: Self) -> bool:
+        return os.path.isdir(self.folder)
+
+    def rebuild(self: Self, temporal_root: types.Node):
+        """Index every note under the day nodes of the tree, replacing whatever was indexed."""
+        entries: dict[str, list[TemporalEntry]] = {}
+        for year in temporal_root.children:
+            for month in year.children:
+                for day_node in month.children:
+                    day = parse_day_path(f"{TEMPORAL}/{year.name}/{month.name}/{day_node.name}")
+                    if day is None:
+                        continue
+                    for note in day_node.notes:
+                        if is_rollup(note):
+                            continue
+                        entries.setdefault(_month(day), []).append(TemporalEntry(day=day, note_id=note.id, name=note.name))
+        os.makedirs(self.folder, exist_ok=True)
+        for month in set(self.months) - set(entries):
+            os.remove(self._path(month))
+        self.months = sorted(entries)
+        self.partitions.clear()
+        for month, month_entries in entries.items():
+            month_entries.sort(key=lambda entry: (entry.day, entry.note_id))
+            self.partitions[month] = ([(entry.day, entry.note_id) for entry in month_entries], month_entries)
+            self._write(month)
+        logger.info("Indexed %d notes over %d months in %s", sum(len(month) for month in entries.values()), len(entries), self.folder)
+        self._drop_cold()
+
+    def add(self: Self, note: types.Note, day: date):
+        keys, entries = self._partition(_month(day), create=True)
+        key = (day, note.id)
+        at = bisect.bisect_left(keys, key)
+        if at < len(keys) and keys[at] == key:
+            # saved again, e.g. renamed
+            entries[at] = TemporalEntry(day=day, note_id=note.id, name=note.name)
+        else:
+            keys.insert(at, key)
+            entries.insert(at, TemporalEntry(day=day, note_id=note.id, name=note.name))
+        self._write(_month(day))
+
+    def remove(self: Self, note_id: int, day: date):
+        if _month(day) not in self.months:
+            return
+        keys, entries = self._partition(_month(day))
+        at = bisect.bisect_left(keys, (day, note_id))
+        if at < len(keys) and keys[at] == (day, note_id):
+            del keys[at], entries[at]
+            self._write(_month(day))
+
+    def file(self: Self, note: types.Note, references: list[str], old_references: list[str] = ()):
+        """Index a saved note under the days of the node paths it is filed under, and drop it from days it no longer is."""
+        if is_rollup(note):
+            return
+        days = {day for ref in references if (day := parse_day_path(ref)) is not None}
+        for ref in old_references:
+            if (day := parse_day_path(ref)) is not None and day not in days:
+                self.remove(note.id, day)
+        for day in days:
+            self.add(note, day)
+
+    def range(self: Self, start: date | None = None, end: date | None = None) -> list[TemporalEntry]:
+        """Entries from start to end, both included, oldest first."""
+        first = bisect.bisect_left(self.months, _month(start)) if start else 0
+        last = bisect.bisect_right(self.months, _month(end)) if end else len(self.months)
+        found: list[TemporalEntry] = []
+        for month in self.months[first:last]:
+            keys, entries = self._partition(month)
+            low = bisect.bisect_left(keys, (start, -1)) if start else 0
+            high = bisect.bisect_right(keys, (end, float('inf'))) if end else len(keys)
+            found.extend(entries[low:high])
+        return found
+
+    def recent(self: Self, count: int, end: date | None = None) -> list[TemporalEntry]:
+        """The last count entries up to end (included), oldest first."""
+        last = bisect.bisect_right(self.months, _month(end)) if end else len(self.months)
+        found: list[TemporalEntry] = []
+        for month in reversed(self.months[:last]):
+            if len(found) >= count:
+                break
+            keys, entries = self._partition(month)
+            high = bisect.bisect_right(keys, (end, float('inf'))) if end else len(keys)
+            found = entries[max(0, high - (count - len(found))):high] + found
+        return found
+
+    def _partition(self: Self, month: str, create: bool = False) -> tuple[list[tuple[date, int]], list[TemporalEntry]]:
+        if month not in self.partitions:
+            if month in self.months:
+                entries = [TemporalEntry.model_validate(entry) for entry in json.loads(read_file(self._path(month)))]
+            elif create:
+                entries = []
+                bisect.insort(self.months, month)
+            else:
+                raise KeyError(month)
+            self.partitions[month] = ([(entry.day, entry.note_id) for entry in entries], entries)
+            self._drop_cold(keep=month)
+        self.partitions.move_to_end(month)
+        return self.partitions[month]
+
+    def _drop_cold(self: Self, keep: str | None = None):
+        # dropped months were written when they changed, they are read again when a query needs them
+        for month in list(self.partitions):
+            if len(self.partitions) <= MAX_PARTITIONS:
+                break
+            if month != keep:
+                del self.partitions[month]
+
+    def _write(self: Self, month: str):
+        os.makedirs(self.folder, exist_ok=True)
+        entries = list(self.partitions[month][1])
+        write_behind(self._path(month), lambda: dump_json([entry.model_dump(mode='json') for entry in entries]))
+
+    def _path(self: Self, month: str) -> str:
+        return os.path.join(self.folder, f"{month}.json")
+
+def main():
+    from dendrite.db.io import DEFAULT_TENANT, REGISTRY, DatabaseType
+    from dendrite.utils.file import WRITER
+    from dendrite.utils.tracing import configure_logging
+
+    parser = argparse.ArgumentParser(description="Query or rebuild the date index of the temporal database.")
+    parser.add_argument('--tenant', default=DEFAULT_TENANT)
+    parser.add_argument('--rebuild', action='store_true', help="index the temporal tree again from scratch")
+    parser.add_argument('--start', help="YYYY, YYYY-MM or YYYY-MM-DD")
+    parser.add_argument('--end', help="YYYY, YYYY-MM or YYYY-MM-DD, included")
+    parser.add_argument('--recent', type=int, help="only the most recent entries, up to --end")
+    parser.add_argument('--log-level', default='INFO')
+    args = parser.parse_args()
+
+    configure_logging(args.log_level)
+    with REGISTRY.use(args.tenant) as database:
+        if args.rebuild:
+            database.temporal.rebuild(database.dbs[DatabaseType.TEMPORAL])
+            WRITER.flush_sync()
+        end = parse_bound(args.end, end=True) if args.end else None
+        if args.recent is not None:
+            entries = database.temporal.recent(args.recent, end)
+        else:
+            entries = database.temporal.range(parse_bound(args.start) if args.start else None, end)
+    for entry in entries:
+        print(f"{entry.day.isoformat()}  {entry.path}  {entry.name}")
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,233 @@
+"""
+Storage maintenance. A store that has been written to for a while collects content files of notes that are
+gone, references to nodes that no longer exist (a note whose every node is gone never shows up once loaded),
+sibling nodes of the same name and the whitespace of indented json, all of it read again on every load. Stores
+from before node ids (see dendrite/db/nodes.py) filed notes by path, and lost them to every rename.
+
+    python -m dendrite.db.vacuum --tenant alice               # fix, compact and report
+    python -m dendrite.db.vacuum --tenant alice --dry-run     # only report what would change
+    python -m dendrite.db.vacuum --root ./store --indent 0    # without any whitespace, see DENDRITE_JSON_INDENT
+
+nodes.json and notes.json are read once and the content folder is only listed, never read. Then:
+- sibling nodes of the same name are merged into one, and notes filed under the one merged away are filed
+  under the one kept
+- node references that don't resolve are dropped; a note left without any is filed under the first path
+  it was filed under again, which is scaffolded for it
+- nodes and notes from before node ids are numbered and filed by id
+- note references to notes that don't exist are dropped, as are repeated references
+- notes whose content file is gone are dropped (the store fails to load with them), and so are content
+  files no note has
+- nodes.json and notes.json are rewritten (with node ids) and the derived indexes (the temporal and similarity indexes) are
+  built again
+
+The store must not be in use while this runs: a process that has it loaded would write its own version back.
+"""
+import argparse
+import json
+import logging
+import os
+import time
+from typing import Iterator, List, cast
+from pydantic import BaseModel
+from dendrite.db.io import (
+    DEFAULT_TENANT, REGISTRY, DatabaseType, _has_ids, _number, _paths, _similarity_index_path, _temporal_index_path,
+    load_db_into_memory, parse_nodes, node_json, note_json
+)
+from dendrite.db.similarity import DEDUPE, SimilarityIndex
+from dendrite.db.temporal import TemporalIndex
+from dendrite.utils.file import JSON_INDENT, WRITER, dump_json, read_file, write_to_file
+from dendrite.utils.tracing import configure_logging
+
+logger = logging.getLogger(__name__)
+
+class VacuumReport(BaseModel):
+    root: str
+    dry_run: bool
+    bytes_before: int = 0               # nodes.json, notes.json and the content files
+    bytes_after: int = 0
+    load_before: float | None = None    # seconds, None if the store didn't load
+    load_after: float | None = None
+    duplicate_nodes: int = 0            # merged into a sibling of the same name
+    duplicate_notes: int = 0            # listed more than once in notes.json, the last one is kept
+    dangling_node_references: int = 0
+    dangling_note_references: int = 0
+    repeated_references: int = 0
+    refiled_notes: int = 0              # every node reference was dangling, filed under the first one again
+    scaffolded_nodes: int = 0
+    unreachable_notes: int = 0          # no reference into any database, left as they are
+    missing_content: int = 0            # notes dropped
+    orphaned_content: int = 0           # content files removed
+
+    @property
+    def bytes_saved(self) -> int:
+        return self.bytes_before - self.bytes_after
+
+    def __str__(self) -> str:
+        lines = [
+            f"{self.root}{' (dry run, nothing changed)' if self.dry_run else ''}",
+            f"  {self.bytes_before:,} -> {self.bytes_after:,} bytes, {self.bytes_saved:,} saved",
+        ]
+        if self.load_before is not None and self.load_after is not None:
+            lines.append(f"  load {self.load_before * 1000:.1f} -> {self.load_after * 1000:.1f} ms, {(self.load_before - self.load_after) * 1000:.1f} ms saved")
+        elif self.load_before is not None:
+            lines.append(f"  load {self.load_before * 1000:.1f} ms")
+        else:
+            lines.append("  the store didn't load before")
+        lines += [
+            f"  {self.duplicate_nodes} duplicate nodes merged, {self.scaffolded_nodes} nodes scaffolded for {self.refiled_notes} refiled notes",
+            f"  {self.dangling_node_references} dangling node references, {self.dangling_note_references} dangling note references, {self.repeated_references} repeated references dropped",
+            f"  {self.duplicate_notes} duplicate notes, {self.missing_content} notes without content dropped, {self.orphaned_content} orphaned content files removed",
+        ]
+        if self.unreachable_notes:
+            lines.append(f"  {self.unreachable_notes} notes reference no database and are left as they are")
+        return "\n".join(lines)
+
+def vacuum(root: str, dry_run: bool = False, indent: int = JSON_INDENT, repeat: int = 3) -> VacuumReport:
+    node_path, note_path, content_folder = _paths(root)
+    report = VacuumReport(root=root, dry_run=dry_run)
+    report.load_before = _load_time(root, repeat)
+
+    node_data, note_data = read_file(node_path), read_file(note_path)
+    content_sizes = {
+        int(file_name[:-3]): os.path.getsize(os.path.join(content_folder, file_name))
+        for file_name in os.listdir(content_folder) if file_name.endswith('.md') and file_name[:-3].isdigit()
+    }
+    report.bytes_before = len(node_data.encode('utf-8')) + len(note_data.encode('utf-8')) + sum(content_sizes.values())
+
+    duplicates: list[str] = []
+    aliases: dict[int, int] = {}
+    nodes = parse_nodes(node_data, duplicates, aliases)
+    report.duplicate_nodes = len(duplicates)
+    ids = {id for tree in nodes.values() if _has_ids(tree) for id in _node_ids(tree)}
+    for name, tree in nodes.items():
+        if not _has_ids(tree):
+            nodes[name] = _number(tree, iter(range(max(ids, default=0) + 1, 2 ** 63)))
+            ids.update(_node_ids(nodes[name]))
+    paths = {path: id for name, tree in nodes.items() for path, id in _node_paths(tree, name)}
+    # for nodes scaffolded for notes that lost theirs
+    new_ids = iter(range(max(ids, default=0) + 1, 2 ** 63))
+
+    notes: dict[int, note_json] = {}
+    for note in cast(List[note_json], json.loads(note_data)):
+        if note['id'] in notes:
+            report.duplicate_notes += 1
+        notes[note['id']] = note
+    for id, note in list(notes.items()):
+        if id not in content_sizes:
+            logger.warning("Dropping note %d (%s): its content file is gone", id, note['name'])
+            del notes[id]
+            report.missing_content += 1
+            continue
+        _fix_node_references(note, nodes, paths, ids, new_ids, aliases, report)
+    for note in notes.values():
+        references = list(dict.fromkeys(note['note_references']))
+        report.repeated_references += len(note['note_references']) - len(references)
+        note['note_references'] = [reference for reference in references if reference.isdigit() and int(reference) in notes]
+        report.dangling_note_references += len(references) - len(note['note_references'])
+    orphans = sorted(set(content_sizes) - set(notes))
+    report.orphaned_content = len(orphans)
+
+    node_data, note_data = dump_json(nodes, indent), dump_json(list(notes.values()), indent)
+    report.bytes_after = len(node_data.encode('utf-8')) + len(note_data.encode('utf-8')) + sum(size for id, size in content_sizes.items() if id in notes)
+    if dry_run:
+        return report
+
+    write_to_file(node_path, node_data)
+    write_to_file(note_path, note_data)
+    for id in orphans:
+        os.remove(os.path.join(content_folder, f'{id}.md'))
+    dbs = load_db_into_memory(root)
+    TemporalIndex(_temporal_index_path(root)).rebuild(dbs[DatabaseType.TEMPORAL])
+    if DEDUPE:
+        SimilarityIndex(_similarity_index_path(root)).rebuild(dbs.values())
+    WRITER.flush_sync()
+    report.load_after = _load_time(root, repeat)
+    return report
+
+def _fix_node_references(
+        note: note_json,
+        nodes: dict[str, node_json],
+        paths: dict[str, int],
+        ids: set[int],
+        new_ids: Iterator[int],
+        aliases: dict[int, int],
+        report: VacuumReport
+    ):
+    # node ids, or paths from before node ids
+    references = list(dict.fromkeys(
+        reference.strip().strip('/') if isinstance(reference, str) else aliases.get(reference, reference)
+        for reference in note['node_references']
+    ))
+    report.repeated_references += len(note['node_references']) - len(references)
+    resolved = list(dict.fromkeys(
+        resolved for reference in references
+        if (resolved := paths.get(reference) if isinstance(reference, str) else reference if reference in ids else None) is not None
+    ))
+    report.dangling_node_references += len(references) - len(resolved)
+    if not resolved:
+        # an id says nothing about where the node was, a path does
+        placeable = [reference for reference in references if isinstance(reference, str) and reference.split('/')[0] in nodes]
+        if not placeable:
+            report.unreachable_notes += 1
+            return
+        # lost its every node, most likely to a rename before node ids. filed where it was rather than dropped
+        report.scaffolded_nodes += _scaffold(nodes, placeable[0], paths, ids, new_ids)
+        report.refiled_notes += 1
+        report.dangling_node_references -= 1
+        resolved = [paths[placeable[0]]]
+    note['node_references'] = resolved
+
+def _scaffold(nodes: dict[str, node_json], path: str, paths: dict[str, int], ids: set[int], new_ids: Iterator[int]) -> int:
+    parts, added = path.split('/'), 0
+    tree = nodes[parts[0]]
+    for depth, name in enumerate(parts[1:], start=2):
+        if name not in tree['children']:
+            tree['children'][name] = {'id': next(new_ids), 'children': {}}
+            paths["/".join(parts[:depth])] = tree['children'][name]['id']
+            ids.add(tree['children'][name]['id'])
+            added += 1
+        tree = tree['children'][name]
+    return added
+
+def _node_paths(tree: node_json, path: str) -> list[tuple[str, int]]:
+    found = [(path, tree['id'])]
+    for name, child in tree['children'].items():
+        found += _node_paths(child, f"{path}/{name}")
+    return found
+
+def _node_ids(tree: node_json) -> list[int]:
+    return [id for _, id in _node_paths(tree, "")]
+
+def _load_time(root: str, repeat: int) -> float | None:
+    """Best of repeat loads, so the page cache is warm for both measurements."""
+    times = []
+    for _ in range(repeat):
+        started = time.perf_counter()
+        try:
+            load_db_into_memory(root)
+        except (OSError, ValueError, KeyError) as e:
+            logger.warning("The store at %s doesn't load: %s", root, e)
+            return None
+        times.append(time.perf_counter() - started)
+    return min(times)
+
+def main():
+    parser = argparse.ArgumentParser(description="Fix dangling references, remove orphans, merge duplicate nodes and rewrite the store compactly.")
+    parser.add_argument('--tenant', default=DEFAULT_TENANT, help="whose store to vacuum, see DENDRITE_TENANTS_ROOT")
+    parser.add_argument('--root', help="vacuum the store at this path instead of a tenant's")
+    parser.add_argument('--dry-run', action='store_true', help="only report what would change")
+    parser.add_argument('--indent', type=int, default=JSON_INDENT, help="indent of the rewritten json, 0 for none")
+    parser.add_argument('--repeat', type=int, default=3, help="loads timed before and after, the best one counts")
+    parser.add_argument('--json', help="also write the report to this file")
+    parser.add_argument('--log-level', default='INFO')
+    args = parser.parse_args()
+
+    configure_logging(args.log_level)
+    report = vacuum(args.root or REGISTRY.get(args.tenant).root, args.dry_run, args.indent, args.repeat)
+    print(report)
+    if args.json:
+        with open(args.json, 'w', encoding='utf-8') as file:
+            file.write(report.model_dump_json(indent=4))
+
+if __name__ == '__main__':
+    main()
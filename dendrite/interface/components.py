@@ -1,22 +1,28 @@
 from __future__ import annotations
 from abc import ABC, abstractmethod
+from collections import deque
+import copy
 import dendrite.interface.types as types
-from dendrite.utils.constants import TAB
-from dendrite.db.io import DB_SET
+from dendrite.utils.constants import TAB, MAX_NOTIFICATIONS, PAGE_SIZE, MAX_PAGE_SIZE
 import dendrite.db.io as io
 from typing import Dict, Any, Tuple, Optional
 from pydantic import BaseModel
 
 Scaffolding = Dict[str, Any]
 
-def _parse_path(path: str, current_node: types.Node, last_node_is_note: bool = False) -> Tuple[types.Node, int]:
+def _parse_path(path: str, current_node: types.Node, last_node_is_note: bool = False, writable: bool = False, database: io.Database | None = None) -> Tuple[types.Node, int]:
     """
     Parse a path and return (target_node, note_id_or_empty).
     
     Returns:
         - For node paths: (target_node, "")
         - For note paths: (parent_node, note_id)
+
+    Absolute paths are resolved in database, or the running task's database.
+    writable resolves the nodes along the path to the running version's own copies (see io.TreeVersion),
+    so the target can be changed. Only absolute paths can be resolved writable.
     """
+    database = database or io.current_database()
     path = path.strip().strip('/')
     if not path:
         raise ValueError("Path cannot be empty")
@@ -25,14 +31,18 @@ def _parse_path(path: str, current_node: types.Node, last_node_is_note: bool = F
     
     path_parts = path.split('/')
     if path_parts[0] == '.':
+        if writable:
+            raise ValueError(f"Only absolute paths can be changed, got '{path}'")
         if path_parts[1] != current_node.name:
             raise ValueError(f"Relative path must still include the current node '{current_node.name}'")
         skip = 2
-        temp_node = current_node.model_copy()
+        temp_node = copy.copy(current_node)
     else:
-        if path_parts[0] not in [db.db_type for db in DB_SET.values()]:
-            raise ValueError(f"Absolute path must start with a valid database type: {[db.db_type for db in DB_SET.values()]}")
-        temp_node = DB_SET[types.DatabaseType(path_parts[0])]
+        dbs = database.roots()
+        if path_parts[0] not in [db.db_type for db in dbs.values()]:
+            raise ValueError(f"Absolute path must start with a valid database type: {[db.db_type for db in dbs.values()]}")
+        type_ = io.DatabaseType(path_parts[0])
+        temp_node = database.own_root(type_) if writable else dbs[type_]
     
     note_id = None
     if last_node_is_note:
@@ -45,7 +55,7 @@ def _parse_path(path: str, current_node: types.Node, last_node_is_note: bool = F
         found = False
         for child in temp_node.children:
             if child.name == dir_name:
-                temp_node = child
+                temp_node = database.own_child(temp_node, child) if writable else child
                 found = True
                 break
         if not found:
@@ -53,6 +63,15 @@ def _parse_path(path: str, current_node: types.Node, last_node_is_note: bool = F
     
     return temp_node, note_id
 
+def _window(offset: int, limit: int | None, prefix: str, sort: str) -> types.Window:
+    if offset < 0:
+        raise ValueError(f"Offset must not be negative, got {offset}")
+    if limit is not None and not 1 <= limit <= MAX_PAGE_SIZE:
+        raise ValueError(f"Limit must be between 1 and {MAX_PAGE_SIZE}, got {limit}")
+    if sort not in [s.value for s in types.Sort]:
+        raise ValueError(f"Sort must be one of {[s.value for s in types.Sort]}, got '{sort}'")
+    return types.Window(offset=offset, limit=limit or PAGE_SIZE, prefix=prefix or "", sort=types.Sort(sort))
+
 class Component(ABC):
     def __init__(self, base_indent: int = 0):
         self.base_indent = base_indent
@@ -66,13 +85,33 @@ class Component(ABC):
         raise NotImplementedError("Subclasses must implement __str__ method")
 
 class Explorer(Component):
-    def __init__(self, node: types.Node, base_indent: int = 0):
+    def __init__(self, database: io.Database, db_type: io.DatabaseType, base_indent: int = 0):
         super().__init__(base_indent)
-        self.node: types.Node = node
-        self.db = node
-        self.current_path: list[str] = [node.db_type]
+        self.database = database
+        self.db_type = db_type
+        self.current_path: list[str] = [db_type.value]
+        # pages of the current node's children and notes shown, back to the first ones on every open_node
+        self.children_window = types.Window()
+        self.notes_window = types.Window()
         self.SCHEMA_PRIORITY = 0.7
 
+    # both resolved on every use rather than held on to: the version being worked on replaces nodes as it changes them
+    @property
+    def db(self) -> types.Node:
+        return self.database.roots()[self.db_type]
+
+    @property
+    def node(self) -> types.Node:
+        return _parse_path("/".join(self.current_path), self.db, database=self.database)[0]
+
+    def _absolute(self, path: str) -> str:
+        path_parts = path.strip().strip('/').split('/')
+        if path_parts[0] != '.':
+            return path
+        if len(path_parts) < 2 or path_parts[1] != self.node.name:
+            raise ValueError(f"Relative path must still include the current node '{self.node.name}'")
+        return "/".join(self.current_path + path_parts[2:])
+
     def __str__(self):
         tab = TAB * self.base_indent
         path_str = "/".join(self.current_path) if hasattr(self, 'current_path') and self.current_path else "/root"
@@ -97,8 +136,14 @@ class Explorer(Component):
         
         # Current node detail section
         current_section = f'{tab}<current_node>\n'
-        current_content = self.node.to_current_node_string(tab + TAB)
-        
+        node, children_window, notes_window = self.node, self.children_window, self.notes_window
+        current_content = node.to_current_node_string(tab + TAB, children_window, notes_window)
+        # a page that doesn't fit is shown smaller rather than not at all
+        while len(current_content) > current_node_budget and (children_window.limit > 1 or notes_window.limit > 1):
+            children_window = children_window.model_copy(update={'limit': max(children_window.limit // 2, 1)})
+            notes_window = notes_window.model_copy(update={'limit': max(notes_window.limit // 2, 1)})
+            current_content = node.to_current_node_string(tab + TAB, children_window, notes_window)
+
         if len(current_content) > current_node_budget:
             current_section += f"{tab + TAB}<current_node truncated=\"true\">...</current_node>\n"
         else:
@@ -108,114 +153,144 @@ class Explorer(Component):
         return result + schema_section + current_section
     
     def open_node(self, node_path: str):
-        target_node, _ = _parse_path(node_path, self.node, False)
-        self.node = target_node
+        node_path = self._absolute(node_path)
+        _parse_path(node_path, self.node, False, database=self.database)
         self.current_path = [p for p in node_path.split('/') if p]
+        self.children_window = types.Window()
+        self.notes_window = types.Window()
+
+    def list_children(self, offset: int = 0, limit: int | None = None, prefix: str = "", sort: str = types.Sort.STORED.value):
+        self.children_window = _window(offset, limit, prefix, sort)
+
+    def list_notes(self, offset: int = 0, limit: int | None = None, prefix: str = "", sort: str = types.Sort.STORED.value):
+        self.notes_window = _window(offset, limit, prefix, sort)
 
     # only for use by write passers, not tiers
     def create_note(self, name: str, content: str, node_references: list[str], note_references: list[str]) -> types.Note:
         new_note = types.Note(
-            id=abs(hash(name + content)),
+            id=types.content_id(name, content),
+            read_only=False,
             name=name,
             content=[types.Content(text=content, status=types.ContentStatus.ADDED)],
-            node_references=node_references,
+            node_ids=[],
             note_references=note_references,
             status=types.GitStatus.ADDED
         )
-        return self.create_note_direct(new_note)
+        return self.create_note_direct(new_note, node_references)
     
     # only for use by tiers, not write passers
-    def create_note_direct(self, note: types.Note) -> types.Note:
-        og_node = self.node
-        for ref in note.node_references:
-            target_node, _ = _parse_path(ref, self.node, False)
-            if target_node.name == self.node.db_type:
+    def create_note_direct(self, note: types.Note, node_references: list[str]) -> types.Note:
+        """File a new note under the nodes at those paths and write it."""
+        self.database.adopt(note)
+        for ref in node_references:
+            target_node, _ = _parse_path(self._absolute(ref), self.node, False, writable=True, database=self.database)
+            if target_node.name == target_node.db_type:
                 raise ValueError("Cannot add note to root node")
             target_node.notes.append(note)
-        self.node = og_node
-        io.add_note(note)
-        return note        
+            note.node_ids.append(target_node.id)
+        note.og_node_ids = list(note.node_ids)
+        self.database.add_note(note)
+        return note
 
     def edit_note(self, path_to_note: str, content: str, append: bool = False):
-        og_node = self.node
-        
-        try:
-            target_node, note_id = _parse_path(path_to_note, self.node, True)
-            if target_node.name == target_node.db_type:
-                raise ValueError("Cannot edit note in root node")
-            if not note_id:
-                raise ValueError(f"Path '{path_to_note}' does not end with a note ID")
-            
-            found = False
-            for note in target_node.notes:
-                if note.id == note_id:
-                    if append:
-                        note.add_content(content)
-                    else:
-                        from dendrite.interface.utils.diff import apply_content_diff
-                        new_content, has_changes = apply_content_diff(note.content, content)
-                        
-                        if has_changes:
-                            note.content = new_content
-                            if note.status == types.GitStatus.STAGED:
-                                note.status = types.GitStatus.MODIFIED
-                    found = True
-                    break
-            
-            if not found:
-                raise ValueError(f"Note with ID {note_id} not found in target node")
-
-        finally:
-            self.node = og_node
+        target_node, note_id = _parse_path(path_to_note, self.node, True, database=self.database)
+        if target_node.name == target_node.db_type:
+            raise ValueError("Cannot edit note in root node")
+        if not note_id:
+            raise ValueError(f"Path '{path_to_note}' does not end with a note ID")
+
+        found = False
+        for note in target_node.notes:
+            if note.id == note_id:
+                note = self.database.own_note(note)
+                if append:
+                    note.add_content(content)
+                else:
+                    from dendrite.interface.utils.diff import apply_content_diff
+                    new_content, has_changes = apply_content_diff(note.content, content)
+
+                    if has_changes:
+                        note.content = new_content
+                        if note.status == types.GitStatus.STAGED:
+                            note.status = types.GitStatus.MODIFIED
+                found = True
+                break
+
+        if not found:
+            raise ValueError(f"Note with ID {note_id} not found in target node")
 
     def change_note_name(self, path_to_note: str, new_name: str):
-        og_node = self.node
-        
-        try:
-            target_node, note_id = _parse_path(path_to_note, self.node, True)
-            
-            for note in target_node.notes:
-                if note.id == note_id:
-                    note.change_name(new_name)
-                    break
-        finally:
-            self.node = og_node
+        target_node, note_id = _parse_path(path_to_note, self.node, True, database=self.database)
+
+        for note in target_node.notes:
+            if note.id == note_id:
+                self.database.own_note(note).change_name(new_name)
+                break
 
     def change_note_references(self, path_to_note: str, new_references: list[str]):
-        og_node = self.node
-        
-        try:
-            target_node, note_id = _parse_path(path_to_note, self.node, True)
-            
-            for note in target_node.notes:
-                if note.id == note_id:
-                    note.change_references(new_references)
-                    break
-        finally:
-            self.node = og_node
+        target_node, note_id = _parse_path(path_to_note, self.node, True, database=self.database)
+        node_ids = [_parse_path(self._absolute(ref), self.node, False, database=self.database)[0].id for ref in new_references]
+
+        for note in target_node.notes:
+            if note.id == note_id:
+                self.database.own_note(note).change_references(list(dict.fromkeys(node_ids)))
+                break
+
+    def file_note(self, path_to_note: str, references: list[str]):
+        """File a note under more nodes, as it would have been had it been created with those references too."""
+        target_node, note_id = _parse_path(path_to_note, self.node, True, database=self.database)
+        note = next((note for note in target_node.notes if note.id == note_id), None)
+        if note is None:
+            raise ValueError(f"Note with ID {note_id} not found in target node")
+        note = self.database.own_note(note)
+        node_ids = []
+        for ref in references:
+            node, _ = _parse_path(self._absolute(ref), self.node, False, writable=True, database=self.database)
+            if node.name == node.db_type:
+                raise ValueError("Cannot add note to root node")
+            if not any(other is note for other in node.notes):
+                node.notes.append(note)
+            node_ids.append(node.id)
+        note.change_references(list(dict.fromkeys(note.node_ids + node_ids)))
 
     def generate_scaffolding(self, parent_path: str, scaffolding: Scaffolding):
-        og_node = self.node
-        try:
-            target_node, _ = _parse_path(parent_path, self.node, False)
-            self._add_scaffolding(target_node, scaffolding)
-        finally:
-            self.node = og_node
+        target_node, _ = _parse_path(self._absolute(parent_path), self.node, False, writable=True, database=self.database)
+        self._add_scaffolding(target_node, scaffolding)
 
     def _add_scaffolding(self, node: types.Node, scaffolding: Scaffolding):
         for name, child in scaffolding.items():
-            new_node = types.Node(
-                name=name, 
-                notes=[], 
-                children=[],
-                status=types.GitStatus.ADDED
-            )
-            node.children.append(new_node)
-            self._add_scaffolding(new_node, child)
+            existing = next((existing for existing in node.children if existing.name == name), None)
+            if existing is not None:
+                # scaffolding a path again only adds what is missing below it
+                self._add_scaffolding(self.database.own_child(node, existing), child)
+                continue
+            self._add_scaffolding(self.database.new_node(node, name), child)
+
+    def rename_node(self, path_to_node: str, new_name: str) -> str:
+        """Rename a node, the explorer follows it if it is on or beneath it. Returns the node's new path."""
+        path = self._absolute(path_to_node).strip().strip('/')
+        node = self.database.rename_node(path, new_name)
+        new_path = self.database.nodes.path(node.id)
+        self._follow(path, new_path)
+        return new_path
+
+    def move_node(self, path_to_node: str, new_parent_path: str) -> str:
+        """Move a node and everything beneath it under another node. Returns the node's new path."""
+        path = self._absolute(path_to_node).strip().strip('/')
+        node = self.database.move_node(path, self._absolute(new_parent_path))
+        new_path = self.database.nodes.path(node.id)
+        self._follow(path, new_path)
+        return new_path
+
+    def _follow(self, old_path: str, new_path: str):
+        current = "/".join(self.current_path)
+        if current == old_path or current.startswith(old_path + '/'):
+            self.current_path = (new_path + current[len(old_path):]).split('/')
 
 class Notes(Component):
-    def __init__(self, open_notes: list[types.Note], base_indent: int = 0):
+    def __init__(self, database: io.Database, open_notes: list[types.Note], base_indent: int = 0):
         super().__init__(base_indent)
+        self.database = database
         self.open_notes = open_notes
 
     def __str__(self, tie_interface: bool = False):
@@ -226,6 +301,8 @@ class Notes(Component):
         lines = []
         
         for note in self.open_notes:
+            # opened before the running version copied it, maybe
+            note = self.database.latest(note)
             note_str = note.to_interface_string(tab, tie_interface=tie_interface)
             if len("\n".join(lines + [note_str])) > self.max_length:
                 lines.append(f"{tab}<note truncated=\"true\">...</note>")
@@ -234,27 +311,32 @@ class Notes(Component):
         
         return "\n".join(lines)
 
-    def open_note(self, note_path: str, current_node: types.Node) -> str:
-        target_node, note_id = _parse_path(note_path, current_node, True)
+    def open_note(self, note_path: str, current_node: types.Node):
+        target_node, note_id = _parse_path(note_path, current_node, True, database=self.database)
         if not note_id:
             raise ValueError(f"Path '{note_path}' does not end with a note ID")
 
+        # rendered with the rest of the interface once the turn's tool calls are done, not on every open
         if note_id in [note.id for note in self.open_notes]:
-            return str(self)
+            return
         
         for note in target_node.notes:
             if note.id == note_id:
                 self.open_notes.append(note)
-                return str(self)
+                return
 
         raise ValueError(f"Note with ID {note_id} not found in target node")
 
 class Notifications(Component):
-    def __init__(self, notifications: list[str] = [], base_indent: int = 0):
+    def __init__(self, notifications: list[str] = (), base_indent: int = 0, max_notifications: int = MAX_NOTIFICATIONS):
         super().__init__(base_indent)
-        self.notifications = notifications
+        # ring buffer, a long pass only ever shows the most recent notifications
+        self.notifications: deque[str] = deque(notifications, maxlen=max_notifications)
+        self.dropped = 0
 
     def add_notification(self, message: str) -> None:
+        if len(self.notifications) == self.notifications.maxlen:
+            self.dropped += 1
         self.notifications.append(message)
 
     def __str__(self):
@@ -263,6 +345,8 @@ class Notifications(Component):
             return ""
         
         notifications_content = ""
+        if self.dropped:
+            notifications_content += f'{TAB * self.base_indent}<notification dropped="{self.dropped}">{tab}</notification>'
         for note in self.notifications:
             if len(notifications_content) >= self.max_length:
                 notifications_content += f'{TAB * self.base_indent}<notification truncated="true">...</notification>'
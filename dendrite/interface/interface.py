@@ -1,9 +1,18 @@
 import dendrite.interface.components as components
-from dendrite.interface.types import Note, Node
+from dendrite.interface.types import Note, Node, content_id
+from dendrite.interface.utils.diff import apply_content_diff
 from dendrite.utils.constants import TAB, MAX_INTERFACE_LENGTH
-from dendrite.db.io import DB_SET, DatabaseType
+from dendrite.utils.tokens import estimate_tokens
+from dendrite.utils.profiling import PROFILER
+from dendrite.utils.tracing import TRACER
+from dendrite.db.io import Database, DatabaseType, current_database
+from dendrite.db.similarity import DEDUPE, DEDUPE_MERGE, DEDUPE_NOTIFY, MAX_CANDIDATES, SimilarityIndex, jaccard, note_text, shingles
+from dendrite.db.temporal import parse_bound
 from pydantic import BaseModel
-from typing import Optional
+from typing import Any, Callable, Optional
+import re
+
+_SENTENCE = re.compile(r"(?<=[.!?])\s+|\n")
 
 class ContentUpdate(BaseModel):
     content: str = None
@@ -15,21 +24,51 @@ class NoteEdit(BaseModel):
     updated_references: Optional[list[str]] = None
     updated_name: Optional[str] = None
 
+class NewNote(BaseModel):
+    name: str
+    content: str
+    references: list[str]
+
+def _raise_failures(done: str, errors: list[str | None]):
+    if failed := [(i, error) for i, error in enumerate(errors) if error is not None]:
+        lines = [f"None were {done}, {len(failed)} of {len(errors)} failed (counting from 0):"]
+        lines += [f"  {i}: {error}" for i, error in failed]
+        raise ValueError("\n".join(lines))
+
 class Interface:
-    def __init__(self, db_type: DatabaseType, base_indent: int = 0):
+    def __init__(self, db_type: DatabaseType, base_indent: int = 0, database: Database | None = None):
         self.db_type = db_type
         self.base_indent = base_indent
-        self.db = DB_SET[db_type]
-        self.explorer = components.Explorer(self.db, base_indent=base_indent + 2)
+        # bound to a tenant's database, the running task's if none is given
+        self.database = database or current_database()
+        self.explorer = components.Explorer(self.database, db_type, base_indent=base_indent + 2)
         # put in read only manifest at root of db if it exists
-        self.opened = components.Notes([self.db.notes[0]] if self.db.notes and self.db.notes[0].read_only else [], base_indent=base_indent + 2)
+        self.opened = components.Notes(self.database, [self.db.notes[0]] if self.db.notes and self.db.notes[0].read_only else [], base_indent=base_indent + 2)
         self.notifications = components.Notifications(base_indent=base_indent + 2)
-        self.current_node = self.db.model_copy()
         self.current_path = ""
+        # notes created through this interface, which the database's index only has once they are saved
+        self.created = SimilarityIndex()
+
+    # resolved on every use, see components.Explorer
+    @property
+    def db(self) -> Node:
+        return self.database.roots()[self.db_type]
+
+    @property
+    def current_node(self) -> Node:
+        return self.db
 
     def __str__(self, tie_interface: bool = False):
+        with TRACER.span('interface.render', db_type=self.db_type.value, tie=tie_interface) as span, PROFILER.profile('render', self.db_type.value):
+            rendered = self._render(tie_interface)
+            if TRACER.enabled:
+                span.update(bytes=len(rendered), tokens=estimate_tokens(rendered))
+        return rendered
+
+    def _render(self, tie_interface: bool) -> str:
         tab = TAB * self.base_indent
-        component_names = ["explorer", "opened", "notifications", "conversation_coverage"] if tie_interface else ["opened"]
+        # a tie interface only shows what the pass it belongs to worked on
+        component_names = ["opened"] if tie_interface else ["explorer", "opened", "notifications"]
 
         room_left = MAX_INTERFACE_LENGTH
 
@@ -38,7 +77,7 @@ class Interface:
             comp: components.Component = getattr(self, name)
             comp.set_max_length(room_left)
             if tie_interface and isinstance(comp, components.Notes):
-                comp_str = str(comp, show_diff=False)
+                comp_str = comp.__str__(tie_interface=True)
             else:
                 comp_str = str(comp)
             prefix += f'{tab}{TAB}<{name}>\n{comp_str + chr(10) if comp_str else ""}{tab}{TAB}</{name}>\n'
@@ -50,17 +89,163 @@ class Interface:
         # with git diff showing most edit history, we can just notify write model about paths its explored
         self.notifications.add_notification(f"Opened node: {node_path}")
 
+    def list_children(self, offset: int = 0, limit: int | None = None, prefix: str = "", sort: str = "stored"):
+        self.explorer.list_children(offset, limit, prefix, sort)
+
+    def list_notes(self, offset: int = 0, limit: int | None = None, prefix: str = "", sort: str = "stored"):
+        self.explorer.list_notes(offset, limit, prefix, sort)
+
     def open_note(self, note_path: str):
         self.opened.open_note(note_path, self.current_node)
+
+    def find_sessions(self, start: str | None = None, end: str | None = None, limit: int = 30):
+        # the index is of saved notes, notes created in the running version show up once it is merged
+        if start is None and end is None:
+            entries, total = self.database.temporal.recent(limit), None
+        else:
+            entries = self.database.temporal.range(parse_bound(start) if start else None, parse_bound(end, end=True) if end else None)
+            total, entries = len(entries), entries[-limit:]
+        lines = [f"{entry.day.isoformat()} {entry.path}: {entry.name}" for entry in entries]
+        header = f"Sessions from {start or 'the start'} to {end or 'now'}" if total is not None else f"Last {len(entries)} sessions"
+        if total is not None and total > len(entries):
+            header += f" (latest {len(entries)} of {total})"
+        self.notifications.add_notification("\n".join([header + ":"] + (lines or ["none found"])))
     
     def create_note(self, name: str, content: str, references: list[str]):
         if not references:
             raise ValueError("References cannot be empty")
+        duplicates = self._duplicates(name, content) if DEDUPE else []
+        if duplicates and duplicates[0][0] >= DEDUPE_MERGE:
+            similarity, path = duplicates[0]
+            self._merge_into(path, content, references)
+            self.notifications.add_notification(
+                f"Did not create note '{name}', it is {similarity:.0%} alike note {path}: "
+                f"what it had that note didn't was appended to it, and it is filed under the nodes given too"
+            )
+            return
         new_note = self.explorer.create_note(name, content, node_references=references, note_references=[])
+        if DEDUPE:
+            self.created.add(new_note)
         id = new_note.id
         ref = references[0]
         note_path = f"{ref}/{id}"
         self.opened.open_note(note_path, self.current_node)
+        if duplicates:
+            lines = [f"Created note {note_path}, which looks like notes that already exist:"]
+            lines += [f"  {path} ({similarity:.0%} alike)" for similarity, path in duplicates]
+            lines.append("If they are about the same thing, merge them into one with edit_note")
+            self.notifications.add_notification("\n".join(lines))
+
+    def _duplicates(self, name: str, content: str) -> list[tuple[float, str]]:
+        """Notes of this database at least DEDUPE_NOTIFY alike a note of that name and content, most alike first."""
+        hashes = shingles(f"{name}\n{content}")
+        candidates = self.database.similarity.candidates(hashes)[:MAX_CANDIDATES] + self.created.candidates(hashes)[:MAX_CANDIDATES]
+        found, seen = [], set()
+        for entry in candidates:
+            path = entry.path(self.database.nodes, self.db_type.value)
+            if path is None or entry.note_id in seen:
+                continue
+            seen.add(entry.note_id)
+            try:
+                note = self.database.latest(self.find_note(path))
+            except ValueError:
+                # moved or gone in the running version since it was saved
+                continue
+            similarity = jaccard(hashes, shingles(note_text(note)))
+            if similarity >= DEDUPE_NOTIFY:
+                found.append((similarity, path))
+        return sorted(found, reverse=True)
+
+    def _merge_into(self, note_path: str, content: str, references: list[str]):
+        note = self.database.latest(self.find_note(note_path))
+        # only the sentences the note doesn't have yet
+        known = {sentence.strip().lower() for sentence in _SENTENCE.split(note.to_storage_string())}
+        if new := [sentence.strip() for sentence in _SENTENCE.split(content) if sentence.strip() and sentence.strip().lower() not in known]:
+            self.explorer.edit_note(note_path, " ".join(new), append=True)
+        references = [self.explorer._absolute(ref).strip().strip('/') for ref in references]
+        if missing := [ref for ref in references if ref not in note.node_references]:
+            self.explorer.file_note(note_path, missing)
+        self.opened.open_note(note_path, self.current_node)
+
+    def create_notes(self, notes: list[NewNote]):
+        """
+        Create every note, or none of them if any can't be: each one is checked before the first is created, and
+        they are created in a version of their own which is only published once every one of them was.
+        """
+        ids: dict[int, int] = {}
+        errors = []
+        for i, note in enumerate(notes):
+            error = self._check_create(note)
+            id = content_id(note.name, note.content)
+            if error is None and id in ids:
+                error = f"same name and content as note {ids[id]}"
+            ids.setdefault(id, i)
+            errors.append(error)
+        _raise_failures("created", errors)
+        self._all_or_none("created", notes, lambda note: self.create_note(note.name, note.content, note.references))
+
+    def edit_notes(self, edits: list[NoteEdit]):
+        """Apply every edit, or none of them if any can't be, checked and applied as create_notes does."""
+        edited: dict[int, int] = {}
+        errors = []
+        for i, edit in enumerate(edits):
+            try:
+                note = self._check_edit(edit)
+                error = f"edits the same note as edit {edited[note.id]}, edit a note once per call" if note.id in edited else None
+                edited.setdefault(note.id, i)
+            except ValueError as e:
+                error = str(e)
+            errors.append(error)
+        _raise_failures("edited", errors)
+        self._all_or_none("edited", edits, self.edit_note)
+
+    def _all_or_none(self, done: str, items: list, apply: Callable[[Any], None]):
+        # what the interface shows is put back too if one fails, as if none were tried
+        opened, notifications, dropped = list(self.opened.open_notes), list(self.notifications.notifications), self.notifications.dropped
+        try:
+            with self.database.all_or_none() as version:
+                for i, item in enumerate(items):
+                    try:
+                        apply(item)
+                    except ValueError as e:
+                        _raise_failures(done, [str(e) if j == i else None for j in range(len(items))])
+        except Exception:
+            self.opened.open_notes = opened
+            self.notifications.notifications.clear()
+            self.notifications.notifications.extend(notifications)
+            self.notifications.dropped = dropped
+            # the notes it created, rather than copied
+            for id in version.notes.keys() - version.originals.keys():
+                self.created.remove(id)
+            raise
+
+    def _check_create(self, note: NewNote) -> str | None:
+        if not note.references:
+            return "References cannot be empty"
+        if self.database.has_note(content_id(note.name, note.content)):
+            return "a note of the same name and content already exists, edit that note instead"
+        for ref in note.references:
+            try:
+                node = self._resolve_node(ref)
+            except ValueError as e:
+                return str(e)
+            if node.name == node.db_type:
+                return "Cannot add note to root node"
+        return None
+
+    def _check_edit(self, edit: NoteEdit) -> Note:
+        node, _ = components._parse_path(edit.path_to_note, self.explorer.node, True, database=self.database)
+        if node.name == node.db_type:
+            raise ValueError("Cannot edit note in root node")
+        note = self.find_note(edit.path_to_note)
+        if edit.content_update and not edit.content_update.append:
+            apply_content_diff(self.database.latest(note).content, edit.content_update.content)
+        for ref in edit.updated_references or []:
+            self._resolve_node(ref)
+        return note
+
+    def _resolve_node(self, path: str) -> Node:
+        return components._parse_path(self.explorer._absolute(path), self.explorer.node, False, database=self.database)[0]
 
     def edit_note(self, note_edit: NoteEdit):
         if note_edit.content_update:
@@ -71,23 +256,31 @@ class Interface:
         if note_edit.updated_references:
             self.explorer.change_note_references(note_edit.path_to_note, note_edit.updated_references)
 
-    def add_cross_reference(self, tie_type: type[Note] | type[Node], note_id: str, tie_interface: 'Interface', tie_ref: str):
-        corresponding_primary_note = [note for note in self.opened.open_notes if note.id == note_id]
-        if len(corresponding_primary_note) != 1:
-            raise ValueError(f"Expected to find exactly one note with ID {note_id} in opened notes, found {len(corresponding_primary_note)} instead.")
-        corresponding_primary_note = corresponding_primary_note[0]
-        
+    def find_note(self, note_path: str) -> Note:
+        target_node, note_id = components._parse_path(note_path, self.explorer.node, True, database=self.database)
+        for note in target_node.notes:
+            if note.id == note_id:
+                return note
+        raise ValueError(f"Note with ID {note_id} not found at '{note_path}'")
+
+    def add_cross_reference(self, tie_type: type[Note] | type[Node], note_path: str, tie_interface: 'Interface', tie_ref: str):
+        primary_note = self.database.own_note(self.find_note(note_path))
+
         if tie_type == Note:
-            corresponding_tie_note = [note for note in tie_interface.opened.open_notes if note.id == tie_ref]
-            if len(corresponding_tie_note) != 1:
-                raise ValueError(f"Expected to find exactly one note with ID {tie_ref} in tie interface opened notes, found {len(corresponding_tie_note)} instead.")
-            corresponding_tie_note = corresponding_tie_note[0]
-            corresponding_primary_note.note_references.append(corresponding_tie_note)
-            corresponding_tie_note.note_references.append(corresponding_primary_note)
+            tie_note = tie_interface.database.own_note(tie_interface.find_note(tie_ref))
+            primary_note.change_note_references(primary_note.note_references + [str(tie_note.id)])
+            tie_note.change_note_references(tie_note.note_references + [str(primary_note.id)])
         elif tie_type == Node:
-            tie_interface.explorer.open_node(tie_ref)
-            corresponding_tie_node = tie_interface.explorer.node
-            corresponding_primary_note.node_references.append(corresponding_tie_node)
+            node, _ = components._parse_path(tie_ref, tie_interface.explorer.node, False, database=tie_interface.database)
+            primary_note.change_references(list(dict.fromkeys(primary_note.node_ids + [node.id])))
 
     def generate_scaffolding(self, parent_path: str, scaffolding: components.Scaffolding):
-        self.explorer.generate_scaffolding(parent_path, scaffolding)
\ No newline at end of file
+        self.explorer.generate_scaffolding(parent_path, scaffolding)
+
+    def rename_node(self, node_path: str, new_name: str):
+        new_path = self.explorer.rename_node(node_path, new_name)
+        self.notifications.add_notification(f"Renamed node {node_path} to {new_path}, the notes beneath it moved with it")
+
+    def move_node(self, node_path: str, new_parent_path: str):
+        new_path = self.explorer.move_node(node_path, new_parent_path)
+        self.notifications.add_notification(f"Moved node {node_path} to {new_path}, the notes beneath it moved with it")
\ No newline at end of file
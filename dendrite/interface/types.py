@@ -1,8 +1,9 @@
 from pydantic import BaseModel
-from typing import List
+from typing import List, TypeVar
 from enum import Enum
-from dendrite.db.io import DatabaseType
-from dendrite.utils.constants import TAB
+import hashlib
+import heapq
+from dendrite.utils.constants import TAB, PAGE_SIZE
 
 class GitStatus(str, Enum):
     STAGED = "staged"           # Loaded from DB (committed)
@@ -14,6 +15,47 @@ class ContentStatus(str, Enum):
     ADDED = "added"             # New content added this session
     DELETED = "deleted"         # Content removed this session
 
+class Sort(str, Enum):
+    STORED = "stored"           # in the order they were added
+    RECENT = "recent"           # last added first
+    ALPHA = "alpha"
+
+Named = TypeVar('Named', 'Node', 'Note')
+
+class Window(BaseModel):
+    """The page of a node's children or of its notes that is shown, so a node of any width renders at a bounded size."""
+    offset: int = 0
+    limit: int = PAGE_SIZE
+    prefix: str = ""            # of the name, case insensitive
+    sort: Sort = Sort.STORED
+
+    def page(self, entries: list[Named]) -> tuple[list[Named], int]:
+        """The entries shown, and how many match the prefix in all."""
+        if self.prefix:
+            prefix = self.prefix.lower()
+            entries = [entry for entry in entries if entry.name.lower().startswith(prefix)]
+        total = len(entries)
+        if self.sort == Sort.RECENT:
+            end = max(total - self.offset, 0)
+            return entries[max(end - self.limit, 0):end][::-1], total
+        if self.sort == Sort.ALPHA:
+            # only as many sorted as the page needs
+            entries = heapq.nsmallest(self.offset + self.limit, entries, key=lambda entry: entry.name.lower())
+        return entries[self.offset:self.offset + self.limit], total
+
+    def to_interface_string(self, kind: str, shown: int, total: int, indent: str = "") -> str | None:
+        """Where the page is, unless it is everything there is."""
+        if not self.offset and not self.prefix and shown == total:
+            return None
+        attributes = f'shown="{self.offset + 1 if shown else 0}-{self.offset + shown}" total="{total}"'
+        if self.offset + shown < total:
+            attributes += f' next_offset="{self.offset + shown}"'
+        if self.prefix:
+            attributes += f' prefix="{self.prefix}"'
+        if self.sort != Sort.STORED:
+            attributes += f' sort="{self.sort.value}"'
+        return f"{indent}<{kind} {attributes}/>"
+
 class Content(BaseModel):
     text: str
     status: ContentStatus = ContentStatus.STAGED
@@ -25,6 +67,14 @@ class Content(BaseModel):
             lines.append(f"{indent}{i + 1}: {prefix} {line}")
         return lines
 
+def content_id(*parts: str) -> int:
+    """
+    Note id derived from what the note was created with. Unlike hash() it is the same in every process,
+    so recorded sessions that reference a note by id replay against the same note.
+    """
+    digest = hashlib.sha256('\0'.join(parts).encode('utf-8')).hexdigest()
+    return int(digest[:15], 16)
+
 class Note:
     def __init__(
         self,
@@ -33,20 +83,33 @@ class Note:
         read_only: bool,
         name: str,
         content: List[Content],
-        node_references: List['Node'],
-        note_references: List['Note'],
+        node_ids: List[int],                # ids of the nodes this note is filed under, see dendrite/db/nodes.py
+        note_references: List[str],         # ids of notes this note is cross referenced with
         status: GitStatus = GitStatus.STAGED,
+        sources: List[str] | None = None,   # parts of documents the note was taken from, as document@start-end in bytes
     ):
         self.id = id
         self.read_only = read_only
         self.name = name
         self.content = content
-        self.node_references = node_references
+        self.node_ids = node_ids
         self.note_references = note_references
         self.status = status
+        self.sources = sources or []
         self.original_name = name
-        self.og_note_references = [node.name for node in self.node_references]
-        self.og_node_references = [note.name for note in self.note_references]
+        self.og_node_ids = list(self.node_ids)
+        self.og_note_references = list(self.note_references)
+
+    # paths as the running task's version or database has them, they change when a node is renamed or moved
+    @property
+    def node_references(self) -> List[str]:
+        from dendrite.db.io import node_index
+        return node_index().paths(self.node_ids)
+
+    @property
+    def og_node_references(self) -> List[str]:
+        from dendrite.db.io import node_index
+        return node_index().paths(self.og_node_ids)
 
     def add_content(self, text: str):
         if self.status == GitStatus.STAGED:
@@ -58,10 +121,15 @@ class Note:
             self.status = GitStatus.MODIFIED
         self.name = new_name
     
-    def change_references(self, new_references: List[str]):
+    def change_references(self, node_ids: List[int]):
+        if self.status == GitStatus.STAGED:
+            self.status = GitStatus.MODIFIED
+        self.node_ids = node_ids
+
+    def change_note_references(self, new_references: List[str]):
         if self.status == GitStatus.STAGED:
             self.status = GitStatus.MODIFIED
-        self.node_references = new_references
+        self.note_references = new_references
 
     def to_interface_string(self, indent: str = "", tie_interface: bool = False) -> str:
         status_prefix = {
@@ -76,7 +144,7 @@ class Note:
         suffix = f"{indent}{status_prefix} </note>"
 
 
-        content = [content.to_interface_lines(indent + TAB) for content in self.content]
+        content = [line for content in self.content for line in content.to_interface_lines(indent + TAB)]
         if not self.status == GitStatus.MODIFIED:
             return "\n".join(lines + content + [suffix])
 
@@ -86,9 +154,9 @@ class Note:
             lines.append(f"{indent}  {'+' if not tie_interface else ''} name: {self.name}")
 
 
-        lines.extend(self._ref_comparison_string(self.og_note_references, [node.name for node in self.node_references], indent))
+        lines.extend(self._ref_comparison_string(self.og_node_references, self.node_references, indent))
         if tie_interface:
-            lines.extend(self._ref_comparison_string(self.og_node_references, [note.name for note in self.note_references], indent))
+            lines.extend(self._ref_comparison_string(self.og_note_references, self.note_references, indent))
 
         lines.append(suffix)
         return "\n".join(lines)
@@ -110,15 +178,16 @@ class Note:
         from dendrite.interface.utils.diff import content_list_to_storage_string
         return content_list_to_storage_string(self.content)
 
-class Node(BaseModel):
-    
+class Node:
     def __init__(self,
+                 id: int,                   # stable across renames and moves, see dendrite/db/nodes.py
                  db_type: str,
                  name: str,
                  notes: List[Note],
                  children: List["Node"],
                  status: GitStatus = GitStatus.STAGED
         ):
+        self.id = id
         self.db_type = db_type
         self.name = name
         self.notes = notes
@@ -149,14 +218,16 @@ class Node(BaseModel):
             lines.append(f"{indent}{status_prefix} <node name=\"{self.name}\">")
         
         # Show child nodes recursively (for schema section)
-        for child in self.children:
+        for child in self.children[:PAGE_SIZE]:
             lines.append(child.to_interface_string(indent + "  ", show_notes_summary=False))
+        if len(self.children) > PAGE_SIZE:
+            lines.append(f"{indent}    <more children=\"{len(self.children) - PAGE_SIZE}\"/>")
         
         lines.append(f"{indent}{status_prefix} </node>")
         return "\n".join(lines)
     
-    def to_current_node_string(self, indent: str = "") -> str:
-        """Return detailed view of current node with notes and immediate children"""
+    def to_current_node_string(self, indent: str = "", children_window: Window = Window(), notes_window: Window = Window()) -> str:
+        """Return detailed view of current node with a page of its notes and immediate children"""
         status_prefix = {
             GitStatus.STAGED: " ",
             GitStatus.ADDED: "+", 
@@ -172,7 +243,10 @@ class Node(BaseModel):
             lines.append(f"{indent}{status_prefix} <node name=\"{self.name}\">")
         
         # Show immediate child nodes (collapsed)
-        for child in self.children:
+        children, total = children_window.page(self.children)
+        if (line := children_window.to_interface_string('children', len(children), total, indent + "    ")) is not None:
+            lines.append(line)
+        for child in children:
             child_prefix = {
                 GitStatus.STAGED: " ",
                 GitStatus.ADDED: "+",
@@ -184,8 +258,11 @@ class Node(BaseModel):
             else:
                 lines.append(f"{indent}  {child_prefix} <node name=\"{child.name}\"></node>")
         
-        # Show all notes in this node with full detail
-        for note in self.notes:
+        # Show notes in this node with full detail
+        notes, total = notes_window.page(self.notes)
+        if (line := notes_window.to_interface_string('notes', len(notes), total, indent + "    ")) is not None:
+            lines.append(line)
+        for note in notes:
             note_prefix = {
                 GitStatus.STAGED: " ",
                 GitStatus.ADDED: "+",
@@ -199,7 +276,7 @@ class Node(BaseModel):
                 modifications = []
                 if note.original_name != note.name:
                     modifications.append(f"name_changed=\"{note.original_name}\"")
-                if note.og_note_references != note.node_references:
+                if note.og_node_ids != note.node_ids:
                     modifications.append("refs_changed=\"true\"")
                 if modifications:
                     note_line += f" {' '.join(modifications)}"
@@ -16,10 +16,10 @@ def diff_note_content(original_content: List[types.Content], new_text: str) -> L
     lines_from_new_text = 0  # Track how many lines we've taken from new_text
     
     for operation, line in diff_result:
-        if operation == 'r':  # delete - line only in original, skip it
-            pass
+        if operation in ('r', 'o'):  # remove (or omitted context) - line only in original, skip it
+            continue
         lines_from_new_text += 1
-        if operation == 'e':  # equal - line exists in both
+        if operation in ('k', 'e'):  # keep - line exists in both
             result_content.append(types.Content(
                 text=line,
                 status=types.ContentStatus.STAGED
@@ -1,16 +1,45 @@
+import asyncio
 from mcp.server.fastmcp import FastMCP
-from typing import Optional
+from typing import Any, Optional
 
 from dendrite.interface.interface import Interface
-from dendrite.db.io import DatabaseType
+from dendrite.db.io import Database, DatabaseType
+from dendrite.mcp.conflicts import ToolCall, ToolDispatcher, ToolResult, plan_batches
+from dendrite.utils.profiling import PROFILER
+from dendrite.utils.tracing import TRACER
 
 class InterfaceMCP(FastMCP):
     """
     Dressed with both read and write tools. Read is needed for navigation.
     """
-    def __init__(self, name: str, db_type: DatabaseType, tie_interface: Optional[Interface]) -> None:
+    def __init__(self, name: str, db_type: DatabaseType, tie_interface: Optional[Interface], database: Optional[Database] = None) -> None:
         super().__init__(name)
-        self.interface = Interface(db_type)
-        if tie_interface:
-            tie_interface = tie_interface.copy()
-        self.tie_interface = tie_interface
\ No newline at end of file
+        self.interface = Interface(db_type, database=database)
+        # shared, not copied: the tied pass runs after the pass that owns this interface and works off what it opened
+        self.tie_interface = tie_interface
+
+    async def call_tool(self, name: str, arguments: dict[str, Any]) -> Any:
+        with TRACER.span('tool.call', tool=name, db_type=self.interface.db_type.value), PROFILER.profile('tool', name):
+            return await super().call_tool(name, arguments)
+
+    async def call_tools(self, calls: list[ToolCall]) -> list[ToolResult]:
+        """
+        Run every tool call from a single model turn. Conflicting calls run in the order they were issued and
+        results keep that order too. This only orders the calls: the tools are synchronous and change the
+        interface and the version it works on in place, so a batch's calls still run one after another.
+        """
+        results: dict[str, ToolResult] = {}
+
+        async def run(call: ToolCall):
+            try:
+                await self.call_tool(call.name, call.arguments)
+                results[call.call_id] = ToolResult(call=call)
+            except Exception as e:
+                results[call.call_id] = ToolResult(call=call, error=str(e))
+
+        for batch in plan_batches(calls):
+            await asyncio.gather(*(run(call) for call in batch))
+        return [results[call.call_id] for call in calls]
+
+    def dispatcher(self) -> ToolDispatcher:
+        return ToolDispatcher(self.call_tool)
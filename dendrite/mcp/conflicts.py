@@ -0,0 +1,170 @@
+import asyncio
+from typing import Any, Awaitable, Callable
+from pydantic import BaseModel
+
+# key touched by tools that move the explorer, and read by anything resolving a relative path
+CURSOR = "@cursor"
+# key for calls whose footprint can't be determined; conflicts with every other call
+EVERYTHING = "*"
+
+class ToolCall(BaseModel):
+    call_id: str
+    name: str
+    arguments: dict[str, Any]
+
+class ToolResult(BaseModel):
+    call: ToolCall
+    error: str | None = None
+
+class ToolAccess(BaseModel):
+    reads: set[str] = set()
+    writes: set[str] = set()
+
+    def conflicts_with(self, other: 'ToolAccess') -> bool:
+        """
+        Two calls conflict when either writes something the other reads or writes.
+        Reads never conflict with reads.
+        """
+        return (
+            _overlaps(self.writes, other.writes | other.reads) or
+            _overlaps(other.writes, self.reads)
+        )
+
+def _overlaps(keys: set[str], other_keys: set[str]) -> bool:
+    return any(_keys_overlap(a, b) for a in keys for b in other_keys)
+
+def _keys_overlap(a: str, b: str) -> bool:
+    if a == EVERYTHING or b == EVERYTHING:
+        return True
+    # a node path overlaps everything beneath it (child nodes and the notes inside them)
+    a_parts, b_parts = a.split('/'), b.split('/')
+    shortest = min(len(a_parts), len(b_parts))
+    return a_parts[:shortest] == b_parts[:shortest]
+
+def _path_keys(path: str, is_note: bool = False) -> set[str]:
+    path = path.strip().strip('/')
+    if not path:
+        return {EVERYTHING}
+    if path.startswith('.'):
+        # relative paths depend on where the explorer is when the call runs
+        return {CURSOR, EVERYTHING}
+    keys = {path}
+    if is_note:
+        # the same note can be reached through any node it references
+        keys.add(f"note:{path.split('/')[-1]}")
+    return keys
+
+def _note_keys(paths: list[str]) -> set[str]:
+    return set().union(*(_path_keys(path, is_note=True) for path in paths)) if paths else set()
+
+def _node_keys(paths: list[str]) -> set[str]:
+    return set().union(*(_path_keys(path) for path in paths)) if paths else set()
+
+def _open_node_access(args: dict[str, Any]) -> ToolAccess:
+    return ToolAccess(reads=_node_keys([args.get('path_to_node', '')]), writes={CURSOR})
+
+def _list_children_access(args: dict[str, Any]) -> ToolAccess:
+    # the page shown is the explorer's, so it goes with where the explorer is
+    return ToolAccess(writes={f"{CURSOR}/children"})
+
+def _list_notes_access(args: dict[str, Any]) -> ToolAccess:
+    return ToolAccess(writes={f"{CURSOR}/notes"})
+
+def _open_note_access(args: dict[str, Any]) -> ToolAccess:
+    return ToolAccess(reads=_note_keys([args.get('path_to_note', '')]))
+
+def _find_sessions_access(args: dict[str, Any]) -> ToolAccess:
+    return ToolAccess(reads={'temporal'})
+
+def _create_note_access(args: dict[str, Any]) -> ToolAccess:
+    return ToolAccess(writes=_node_keys(args.get('references') or ['']))
+
+def _edit_note_access(args: dict[str, Any]) -> ToolAccess:
+    edit = args.get('edit') or {}
+    return ToolAccess(writes=_note_keys([edit.get('path_to_note', '')]) | _node_keys(edit.get('updated_references') or []))
+
+def _create_notes_access(args: dict[str, Any]) -> ToolAccess:
+    return ToolAccess(writes=set().union(*(_create_note_access(note).writes for note in args.get('notes') or [{}])))
+
+def _edit_notes_access(args: dict[str, Any]) -> ToolAccess:
+    return ToolAccess(writes=set().union(*(_edit_note_access({'edit': edit}).writes for edit in args.get('edits') or [{}])))
+
+def _generate_scaffolding_access(args: dict[str, Any]) -> ToolAccess:
+    return ToolAccess(writes=_node_keys([args.get('parent_path', '')]))
+
+def _rename_node_access(args: dict[str, Any]) -> ToolAccess:
+    # every path through the node changes, and the explorer follows it if it is beneath it
+    path = args.get('node_path', '').strip().strip('/')
+    return ToolAccess(writes=_node_keys([path, f"{path.rsplit('/', 1)[0]}/{args.get('new_name', '')}"]) | {CURSOR})
+
+def _move_node_access(args: dict[str, Any]) -> ToolAccess:
+    return ToolAccess(writes=_node_keys([args.get('node_path', ''), args.get('new_parent_path', '')]) | {CURSOR})
+
+TOOL_ACCESS: dict[str, Callable[[dict[str, Any]], ToolAccess]] = {
+    'open_node': _open_node_access,
+    'open_note': _open_note_access,
+    'list_children': _list_children_access,
+    'list_notes': _list_notes_access,
+    'find_sessions': _find_sessions_access,
+    'create_note': _create_note_access,
+    'edit_note': _edit_note_access,
+    'create_notes': _create_notes_access,
+    'edit_notes': _edit_notes_access,
+    'generate_scaffolding': _generate_scaffolding_access,
+    'rename_node': _rename_node_access,
+    'move_node': _move_node_access,
+}
+
+def tool_access(call: ToolCall) -> ToolAccess:
+    if call.name not in TOOL_ACCESS:
+        # unknown tools (e.g. cross references spanning two interfaces) always run on their own
+        return ToolAccess(writes={EVERYTHING})
+    return TOOL_ACCESS[call.name](call.arguments)
+
+def plan_batches(calls: list[ToolCall]) -> list[list[ToolCall]]:
+    """
+    Group tool calls into batches whose calls don't conflict, so they could run in any order. A call is placed in
+    the batch right after the latest earlier call it conflicts with, so conflicting calls keep the order the model
+    issued them in and everything else runs as early as possible. The write and read tools are synchronous, so
+    this orders them rather than running them in parallel (see InterfaceMCP.call_tools).
+    """
+    accesses = [tool_access(call) for call in calls]
+    levels: list[int] = []
+    for i, access in enumerate(accesses):
+        level = 0
+        for j in range(i):
+            if access.conflicts_with(accesses[j]):
+                level = max(level, levels[j] + 1)
+        levels.append(level)
+
+    batches: list[list[ToolCall]] = [[] for _ in range(max(levels, default=-1) + 1)]
+    for call, level in zip(calls, levels):
+        batches[level].append(call)
+    return batches
+
+class ToolDispatcher:
+    """
+    Starts tool calls as they arrive (e.g. while a response is still streaming). A call only waits
+    for the earlier calls it conflicts with, which gives the same ordering guarantees as plan_batches.
+    What it overlaps is the calls with the rest of the stream, the calls themselves don't run in parallel.
+    """
+    def __init__(self, call_tool: Callable[[str, dict[str, Any]], Awaitable[Any]]):
+        self.call_tool = call_tool
+        self.pending: list[tuple[ToolAccess, asyncio.Task]] = []
+
+    def submit(self, call: ToolCall) -> None:
+        access = tool_access(call)
+        blockers = [task for other, task in self.pending if access.conflicts_with(other)]
+        self.pending.append((access, asyncio.create_task(self._run(call, blockers))))
+
+    async def _run(self, call: ToolCall, blockers: list[asyncio.Task]) -> ToolResult:
+        # blockers never raise, failures are carried on their results
+        await asyncio.gather(*blockers)
+        try:
+            await self.call_tool(call.name, call.arguments)
+            return ToolResult(call=call)
+        except Exception as e:
+            return ToolResult(call=call, error=str(e))
+
+    async def drain(self) -> list[ToolResult]:
+        return list(await asyncio.gather(*(task for _, task in self.pending)))
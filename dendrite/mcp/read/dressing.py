@@ -1,5 +1,6 @@
 from dendrite.mcp.base_mcp import InterfaceMCP
 from dendrite.interface.interface import Interface
+from dendrite.db.io import DatabaseType
 
 def dress_mcp_read(mcp: InterfaceMCP, interface: Interface):
     @mcp.tool()
@@ -23,4 +24,46 @@ def dress_mcp_read(mcp: InterfaceMCP, interface: Interface):
         Args:
             path_to_node (str): Absolute or relative path to the node to open.
         """
-        return interface.open_node(path_to_node)
\ No newline at end of file
+        return interface.open_node(path_to_node)
+
+    @mcp.tool()
+    def list_children(offset: int = 0, limit: int | None = None, prefix: str = "", sort: str = "stored"):
+        """
+        Page through the child nodes of the current node. A node with more children than fit shows only a page of them, with a <children shown="1-50" total="..." next_offset="50"/> line; after calling this tool, the "current_node" section shows the page asked for. Opening a node goes back to the first page.
+
+        Args:
+            offset (int): How many matching children to skip, e.g. the next_offset shown.
+            limit (int): Most children to show, up to 200; fewer are shown if they don't fit.
+            prefix (str): Only children whose name starts with this, ignoring case.
+            sort (str): "stored" (the order they were added), "recent" (last added first) or "alpha".
+        """
+        return interface.list_children(offset, limit, prefix, sort)
+
+    @mcp.tool()
+    def list_notes(offset: int = 0, limit: int | None = None, prefix: str = "", sort: str = "stored"):
+        """
+        Page through the notes of the current node. A node with more notes than fit shows only a page of them, with a <notes shown="1-50" total="..." next_offset="50"/> line; after calling this tool, the "current_node" section shows the page asked for. Opening a node goes back to the first page.
+
+        Args:
+            offset (int): How many matching notes to skip, e.g. the next_offset shown.
+            limit (int): Most notes to show, up to 200; fewer are shown if they don't fit.
+            prefix (str): Only notes whose name starts with this, ignoring case.
+            sort (str): "stored" (the order they were added), "recent" (last added first) or "alpha".
+        """
+        return interface.list_notes(offset, limit, prefix, sort)
+
+    if interface.db_type != DatabaseType.TEMPORAL:
+        return
+
+    @mcp.tool()
+    def find_sessions(start: str | None = None, end: str | None = None, limit: int = 30):
+        """
+        List the sessions filed by date, oldest first. The sessions found appear in the "notifications" section of the interface, with the path to open each one.
+        Without start or end, lists the most recent sessions.
+
+        Args:
+            start (str): First date to include, as YYYY, YYYY-MM or YYYY-MM-DD.
+            end (str): Last date to include, as YYYY, YYYY-MM or YYYY-MM-DD.
+            limit (int): Most sessions to list; the latest ones are kept.
+        """
+        return interface.find_sessions(start, end, limit)
@@ -1,10 +1,11 @@
 from mcp.server.fastmcp import FastMCP
 from dendrite.interface.interface import Interface
-from dendrite.databases.io import DatabaseType
+from typing import Optional
+from dendrite.db.io import Database, DatabaseType
 from .dressing import dress_mcp_read
 
 class ReadMCP(FastMCP):
-    def __init__(self, db_type: DatabaseType) -> None:
+    def __init__(self, db_type: DatabaseType, database: Optional[Database] = None) -> None:
         super().__init__('read')
-        self.interface = Interface(db_type)
+        self.interface = Interface(db_type, database=database)
         dress_mcp_read(self, self.interface)
\ No newline at end of file
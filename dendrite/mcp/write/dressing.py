@@ -1,5 +1,5 @@
 from typing import Optional, Union
-from dendrite.interface.interface import Interface, NoteEdit
+from dendrite.interface.interface import Interface, NewNote, NoteEdit
 from dendrite.interface.components import Scaffolding
 from dendrite.interface.types import Note, Node
 from dendrite.mcp.base_mcp import InterfaceMCP
@@ -36,6 +36,33 @@ def dress_mcp_write(mcp: InterfaceMCP, interface: Interface) -> None:
         """
         return interface.edit_note(edit)
 
+    @mcp.tool()
+    def create_notes(notes: list[NewNote]) -> None:
+        """
+        Create several new notes in one call, e.g. every fact taken from the conversation. Either every note is created or, if any of them can't be, none are and the error says which ones failed and why. The notes will be marked as ADDED in the interface.
+
+        Args:
+            notes (list[NewNote]): The notes to create, each with:
+                - name (str): The name of the new note
+                - content (str): The content of the new note
+                - references (list[str]): A list of node paths this note should be categorized under
+        """
+        return interface.create_notes(notes)
+
+    @mcp.tool()
+    def edit_notes(edits: list[NoteEdit]) -> None:
+        """
+        Modify several existing notes in one call, each edit as in edit_note. Either every edit is applied or, if any of them can't be, none are and the error says which ones failed and why. Edit each note at most once per call.
+
+        Args:
+            edits (list[NoteEdit]): Note modifications, each with:
+                - path_to_note (str): Full path to the note including note ID (e.g., /root/personality/risk_tolerance/123456)
+                - content_update (ContentUpdate, optional): New content to replace or append
+                - updated_references (list[str], optional): New list of node paths this note should appear in
+                - updated_name (str, optional): New name for the note
+        """
+        return interface.edit_notes(edits)
+
     @mcp.tool()
     def generate_scaffolding(parent_path: str, scaffolding: Scaffolding) -> None:
         """
@@ -57,6 +84,28 @@ def dress_mcp_write(mcp: InterfaceMCP, interface: Interface) -> None:
                 }
         """
         return interface.generate_scaffolding(parent_path, scaffolding)
+
+    @mcp.tool()
+    def rename_node(node_path: str, new_name: str) -> None:
+        """
+        Rename a node. The node keeps its notes and children, which are found under its new path from then on. The node will be marked as MODIFIED.
+
+        Args:
+            node_path (str): The path to the node to rename
+            new_name (str): The new name of the node, unique among its siblings
+        """
+        return interface.rename_node(node_path, new_name)
+
+    @mcp.tool()
+    def move_node(node_path: str, new_parent_path: str) -> None:
+        """
+        Move a node, with its notes and everything beneath it, under another node of the same database. The node will be marked as MODIFIED.
+
+        Args:
+            node_path (str): The path to the node to move
+            new_parent_path (str): The path to the node it should be moved under
+        """
+        return interface.move_node(node_path, new_parent_path)
     
 
 example_paths = {
@@ -80,37 +129,35 @@ def dress_mcp_write_tied(mcp: InterfaceMCP, interface: Interface, tie_interface:
         raise ValueError("Cannot tie an interface to another interface of the same type.")
     
     example_note_id = '123456'
-    note_condition = 'Note ID'
+    note_condition = 'Path to note, ending with the note ID'
     node_condition = 'Path to node'
     if permission1 == Note:
-        example_1 += example_note_id
+        example_1 = f"{example_paths[type1]}/{example_note_id}"
         condition_1 = note_condition
     else:
         example_1 = example_paths[type1]
         condition_1 = node_condition
     
     if permission2 == Note:
-        example_2 += example_note_id
+        example_2 = f"{example_paths[type2]}/{example_note_id}"
         condition_2 = note_condition
     else:
         example_2 = example_paths[type2]
         condition_2 = node_condition
 
 
-    @mcp.tool()
-    def create_cross_reference(ref1: str, ref2: str) -> None:
-        f"""
-        Create a cross-reference between a {permission1} from the {type1} database and a {permission2} from the {type2} database.
+    @mcp.tool(description=f"""
+        Create a cross-reference between a {permission1.__name__.lower()} from the {type1.value} database and a {permission2.__name__.lower()} from the {type2.value} database.
 
         Args:
             ref1 (str): {condition_1} (e.g., {example_1})
             ref2 (str): {condition_2} (e.g., {example_2})
-        """
-        if permission1 == Note:
-            interface.add_cross_reference(permission2, ref1, ref2)
-        if permission2 == Note:
-            if not ref2.endswith(example_note_id):
-                raise ValueError(f"Path to {permission2} must include note ID. Example: {example_2}")
-            interface.add_cross_reference(permission1, ref2.split('/')[-1], ref1)
-
-
+        """)
+    def create_cross_reference(ref1: str, ref2: str) -> None:
+        if permission1 == Note and permission2 == Note:
+            interface.add_cross_reference(Note, ref1, tie_interface, ref2)
+        elif permission1 == Node and permission2 == Note:
+            # node -> note: the tie note gets filed under the node from this database
+            tie_interface.add_cross_reference(Node, ref2, interface, ref1)
+        else:
+            raise ValueError(f"Unsupported cross reference between a {permission1.__name__} and a {permission2.__name__}.")
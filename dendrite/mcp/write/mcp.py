@@ -1,7 +1,7 @@
 from typing import Optional
 
 from dendrite.interface.interface import Interface
-from dendrite.db.io import DatabaseType
+from dendrite.db.io import Database, DatabaseType
 from ..base_mcp import InterfaceMCP
 from ..read.dressing import dress_mcp_read
 from .dressing import dress_mcp_write, dress_mcp_write_tied
@@ -10,10 +10,11 @@ class WriteMCP(InterfaceMCP):
     """
     Dressed with both read and write tools. Read is needed for navigation.
     """
-    def __init__(self, db_type: DatabaseType, tie_interface: Optional[Interface]) -> None:
-        super().__init__('write', db_type, tie_interface)
+    def __init__(self, db_type: DatabaseType, tie_interface: Optional[Interface], database: Optional[Database] = None) -> None:
+        super().__init__('write', db_type, tie_interface, database)
         dress_mcp_read(self, self.interface)
+        # the temporal tagger only links nodes to notes, it never edits notes itself
+        if db_type != DatabaseType.TEMPORAL:
+            dress_mcp_write(self, self.interface)
         if tie_interface:
-            dress_mcp_write_tied(self, self.interface, tie_interface)
-        else:
-            dress_mcp_write(self, self.interface)
\ No newline at end of file
+            dress_mcp_write_tied(self, self.interface, self.tie_interface)
\ No newline at end of file
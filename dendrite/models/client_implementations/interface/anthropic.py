@@ -1,58 +1,205 @@
-import anthropic
-from typing import Self
-import httpx
-from mcp.server.fastmcp import FastMCP
+from contextlib import aclosing
+from typing import Optional, Self
+import json
+import logging
+import time
 import mcp.server.fastmcp.tools as mcp_types
-import dendrite.models.client_implementations.provider_utils.anthropic as types
+import dendrite.models.client_implementations.provider_utils.anthropic.types as types
 import anthropic.types as anthropic_types
-import dendrite.utils as utils
+import dendrite.utils.config as config
 from dendrite.models.interface_client import InterfaceClient
+from dendrite.models.types import CallUsage, PassTiming
+from dendrite.models.context import ToolLoopContext
+from dendrite.models.request_scheduler import HeldStream, Priority, get_request_scheduler
+from dendrite.models.response_cache import ResponseCache, get_response_cache
+from dendrite.utils.tokens import estimate_tokens
+from dendrite.mcp.base_mcp import InterfaceMCP
+from dendrite.mcp.conflicts import ToolCall, ToolResult
+from dendrite.utils.constants import MAX_LOOP_TURNS
+
+logger = logging.getLogger(__name__)
+
+MODEL = 'claude-3-haiku-20240307'
 
 class AnthropicInterfaceClient(InterfaceClient):
-    def __init__(self: Self, mcp: FastMCP, system_prompt_path: str = './system.txt'):
-        super().__init__(system_prompt_path)
-        self.mcp_instance = mcp
-        self.conversation_history: list[types.AnthropicMessage] = []
-        self.cache = False
-        self.anthropic_client = anthropic.AsyncAnthropic(
-            api_key=utils.get_config().write,
-            http_client=httpx.AsyncClient(verify=False)
-        )
+    def __init__(self: Self, mcp: InterfaceMCP, system_prompt_path: str = './system.txt', priority: Priority = Priority.BACKGROUND, stream: bool = False, response_cache: Optional[ResponseCache] = None):
+        super().__init__(system_prompt_path, mcp_instance=mcp)
+        self.scheduler = get_request_scheduler()
+        self.anthropic_client = self.scheduler.anthropic_client(api_key=config.get_config().write.tagger.api_key)
+        self.priority = priority
+        self.response_cache = response_cache or get_response_cache()
+        # when streaming, tool calls are dispatched as soon as their input json is complete
+        self.stream = stream
+        self.tools = self._format_tools(mcp)
+        self.cache_key = self._cache_key([tool.model_dump() for tool in self.tools])
+        self.context = ToolLoopContext()
+        # times each request was made this pass, see _response_key
+        self.occurrences: dict[str, int] = {}
 
-    async def process_convo(self):
+    async def process_convo(self, conversation: list[types.AnthropicEasyInputMessageParam]):
         # optional query for write model. we just literally want one pass ideally, so no conversing, just tool calls.
-        response, err = await self._get_response()
-        if err is not None:
-            return None, err
-            
-        while not model_stop:
-            # move this to the top so we always process the last tool call.
-            model_stop = response.stop_reason == 'end_turn'
-            # tool results are always None, and tool calls will always be presented in the notifications section of the interface.
-            # therefore, simply call the tool and move on.
-            tool_calls: list[anthropic_types.ToolUseBlock] = [content for content in response.content if isinstance(content, anthropic_types.ToolUseBlock)]
-            if len(tool_calls) != len(response.content):
-                raise ValueError(f"Expected all content to be tool calls, got {len(tool_calls)} tool calls and {len(response.content) - len(tool_calls)} other content blocks.")
-    
-    async def _get_response(self) -> tuple[anthropic_types.Message, Exception | None]:
-        try:
-            response: anthropic_types.Message = await self.anthropic_client.messages.create(
-                model='claude-3-haiku-20240307',
-                system=self.system_prompt,
-                tools=self._format_tools,
-                tool_choice={'type': 'auto'}, # give model the option to run a tool. might need to change this later. 
-                messages=self.conversation_history,
-            )
-        except httpx.HTTPStatusError as e:
-            if e.response.status_code == 429:
-                raise Exception("Rate limit exceeded. Please try again later.")
-            else:
-                raise Exception(f"Error from Anthropic API: {e.response.status_code} - {e.response.text}")
-        if response.usage.cache_creation_input_tokens > 2000:
-            self.cache_on_next_message = True
-        return response, None
-    
+        self.timing = PassTiming()
+        self.context = ToolLoopContext()
+        self.occurrences = {}
+        started = time.perf_counter()
+        turn = self._streamed_turn if self.stream else self._turn
+        while await turn(conversation, started):
+            if self.timing.turns >= MAX_LOOP_TURNS:
+                logger.warning("%s pass stopped after %d turns", self.mcp_instance.interface.db_type.value, self.timing.turns)
+                break
+        self.timing.total = time.perf_counter() - started
+        logger.info("%s pass finished: %s", self.mcp_instance.interface.db_type.value, self.timing)
+
+    async def _turn(self, conversation: list[types.AnthropicEasyInputMessageParam], started: float) -> bool:
+        messages = self._build_messages(conversation)
+        usage_before, sent = len(self.usage), time.perf_counter()
+        key = self._response_key(messages)
+        if (response := await self._cached_response(key)) is not None:
+            return await self._apply_response(response, messages, time.perf_counter() - sent, usage_before, started, cached=True)
+        response = await self._get_response(messages, key)
+        return await self._apply_response(response, messages, time.perf_counter() - sent, usage_before, started)
+
+    async def _apply_response(self, response: anthropic_types.Message, messages: list[dict], latency: float, usage_before: int, started: float, cached: bool = False) -> bool:
+        self.timing.turns += 1
+        # tool results are always None, and tool calls will always be presented in the notifications section of the interface.
+        # therefore, simply call the tool and move on.
+        tool_calls: list[anthropic_types.ToolUseBlock] = [content for content in response.content if isinstance(content, anthropic_types.ToolUseBlock)]
+        if tool_calls and self.timing.time_to_first_tool is None:
+            self.timing.time_to_first_tool = time.perf_counter() - started
+        calls = [ToolCall(call_id=call.id, name=call.name, arguments=call.input) for call in tool_calls]
+        self._finish_turn(messages, latency, calls, usage_before, cached=cached)
+        results = await self.mcp_instance.call_tools(calls)
+        self._report_tool_errors(results)
+        return bool(tool_calls) and response.stop_reason != 'end_turn'
+
+    async def _streamed_turn(self, conversation: list[types.AnthropicEasyInputMessageParam], started: float) -> bool:
+        messages = self._build_messages(conversation)
+        usage_before, sent = len(self.usage), time.perf_counter()
+        # streamed responses aren't written to the response cache, but a response cached by a blocking call is still used
+        key = self._response_key(messages)
+        if (response := await self._cached_response(key)) is not None:
+            return await self._apply_response(response, messages, time.perf_counter() - sent, usage_before, started, cached=True)
+        dispatcher = self.mcp_instance.dispatcher()
+        # tool_use blocks by content index, with their input json as it streams in
+        blocks: dict[int, tuple[anthropic_types.ToolUseBlock, list[str]]] = {}
+        calls: list[ToolCall] = []
+        usage, stop_reason = None, None
+        # the stream holds its scheduler slot until it is drained, closing it gives the slot back if the turn fails
+        async with aclosing(await self._get_response(messages, key, stream=True)) as events:
+            async for event in events:
+                if event.type == 'message_start':
+                    usage = event.message.usage
+                elif event.type == 'content_block_start' and event.content_block.type == 'tool_use':
+                    blocks[event.index] = (event.content_block, [])
+                elif event.type == 'content_block_delta' and event.delta.type == 'input_json_delta' and event.index in blocks:
+                    blocks[event.index][1].append(event.delta.partial_json)
+                elif event.type == 'content_block_stop' and event.index in blocks:
+                    block, parts = blocks[event.index]
+                    try:
+                        arguments = json.loads(''.join(parts)) if parts else {}
+                    except json.JSONDecodeError as e:
+                        self.context.add_error(block.name, e)
+                        continue
+                    calls.append(ToolCall(call_id=block.id, name=block.name, arguments=arguments))
+                    dispatcher.submit(calls[-1])
+                    if self.timing.time_to_first_tool is None:
+                        self.timing.time_to_first_tool = time.perf_counter() - started
+                elif event.type == 'message_delta':
+                    stop_reason = event.delta.stop_reason
+                    if usage:
+                        usage.output_tokens = event.usage.output_tokens
+        self.timing.turns += 1
+        if usage:
+            self._record_usage(usage)
+        self._finish_turn(messages, time.perf_counter() - sent, calls, usage_before)
+
+        self._report_tool_errors(await dispatcher.drain())
+        return bool(blocks) and stop_reason != 'end_turn'
+
+    def _report_tool_errors(self, results: list[ToolResult]):
+        for result in results:
+            if result.error is not None:
+                logger.warning("Error calling tool %s: %s", result.call.name, result.error)
+                self.context.add_error(result.call.name, result.error)
+
+    def _build_messages(self, conversation: list[types.AnthropicEasyInputMessageParam]) -> list[dict]:
+        # cache layout: system prompt -> tool schemas -> conversation are stable across turns and each end in a
+        # breakpoint, the interface changes every turn so it is sent last and never cached.
+        messages = [message.to_param(cache=i == len(conversation) - 1) for i, message in enumerate(conversation)]
+        # tool errors from this pass, compacted so they can't grow the input without bound
+        messages.extend(types.AnthropicEasyInputMessageParam(role='user', content=content).to_param() for content in self.context.render())
+        if self.mcp_instance.tie_interface:
+            messages.append(types.AnthropicEasyInputMessageParam(
+                role='user',
+                content=f"Current {self.mcp_instance.tie_interface.db_type.value} Interface State:\n{self.mcp_instance.tie_interface.__str__(tie_interface=True)}"
+            ).to_param())
+        messages.append(types.AnthropicEasyInputMessageParam(
+            role='user',
+            content=f"Current Interface State:\n{self.mcp_instance.interface}"
+        ).to_param())
+        return messages
+
+    def _response_key(self, messages: list[dict]) -> str:
+        """Key of a request about to be made, counting the times it was made before this pass (see the openai client)."""
+        tools = [tool.model_dump() for tool in self.tools]
+        request = ResponseCache.key(MODEL, self.system_prompt, tools, messages)
+        occurrence = self.occurrences[request] = self.occurrences.get(request, -1) + 1
+        return ResponseCache.key(MODEL, self.system_prompt, tools, messages, occurrence) if occurrence else request
+
+    async def _cached_response(self, key: str) -> anthropic_types.Message | None:
+        if not self.response_cache or (cached := await self.response_cache.get(key)) is None:
+            return None
+        return anthropic_types.Message.model_validate_json(cached)
+
+    async def _get_response(self, messages: list[dict], key: str, stream: bool = False) -> anthropic_types.Message | HeldStream:
+        system = [{"type": "text", "text": self.system_prompt, "cache_control": types.CACHE_CONTROL}]
+        tools = [tool.to_param(cache=i == len(self.tools) - 1) for i, tool in enumerate(self.tools)]
+        # 429s and transient failures are retried by the shared scheduler
+        response: anthropic_types.Message = await self.scheduler.submit(
+            MODEL,
+            lambda: self.anthropic_client.messages.create(
+                model=MODEL,
+                max_tokens=4096,
+                system=system,
+                tools=tools,
+                tool_choice={'type': 'auto'}, # give model the option to run a tool. might need to change this later.
+                messages=messages,
+                stream=stream,
+            ),
+            priority=self.priority,
+            estimated_tokens=estimate_tokens([system, tools, messages]),
+            # streamed usage arrives with the events, input tokens when the message starts and output tokens at its end
+            used_tokens=_streamed_tokens if stream else lambda response: response.usage.input_tokens + response.usage.output_tokens,
+            stream=stream
+        )
+        if not stream:
+            self._record_usage(response.usage)
+            if self.response_cache:
+                await self.response_cache.put(key, MODEL, response.model_dump_json())
+        return response
+
+    def _record_usage(self, usage: anthropic_types.Usage):
+        cache_read = usage.cache_read_input_tokens or 0
+        cache_write = usage.cache_creation_input_tokens or 0
+        usage = CallUsage(
+            cache_key=self.cache_key,
+            # anthropic reports cached input separately from the uncached remainder
+            input_tokens=usage.input_tokens + cache_read + cache_write,
+            output_tokens=usage.output_tokens,
+            cached_tokens=cache_read,
+            cache_write_tokens=cache_write,
+        )
+        self.usage.append(usage)
+        logger.info("Prompt cache hit rate: %.0f%% this call, %.0f%% this pass", usage.cache_hit_rate * 100, self.cache_hit_rate * 100)
+
     # Formats tools into a list of ToolSchema objects.
-    def _format_tools(self: Self, mcp: FastMCP) -> list[types.AnthropicToolSchema]:
+    def _format_tools(self: Self, mcp: InterfaceMCP) -> list[types.AnthropicToolSchema]:
         tools: list[mcp_types.Tool] = list(mcp._tool_manager._tools.values())
-        return [types.AnthropicToolSchema.model_validate({ "name": tool.name, "description": tool.description, "input_schema": tool.parameters }) for tool in tools]
\ No newline at end of file
+        return [types.AnthropicToolSchema.model_validate({ "name": tool.name, "description": tool.description, "input_schema": tool.parameters }) for tool in tools]
+
+def _streamed_tokens(event: anthropic_types.RawMessageStreamEvent) -> int | None:
+    if event.type == 'message_start':
+        return event.message.usage.input_tokens
+    if event.type == 'message_delta':
+        return event.usage.output_tokens
+    return None
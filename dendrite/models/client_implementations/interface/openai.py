@@ -1,89 +1,266 @@
-import openai
-from typing import Self
+from contextlib import aclosing
+from typing import Optional, Self
+import time
 import openai.types.responses as api_types
 from openai.types.responses.response_input_param import EasyInputMessageParam
 from dendrite.models.client_implementations.provider_utils.openai.types import OpenAIToolSchema
 import dendrite.utils.config as config
 from dendrite.models.interface_client import InterfaceClient
+from dendrite.models.types import CallUsage, PassTiming
+from dendrite.models.context import ToolLoopContext
+from dendrite.models.request_scheduler import HeldStream, Priority, get_request_scheduler
+from dendrite.models.response_cache import ResponseCache, get_response_cache
+from dendrite.models.routing import get_router, invalid_calls
+from dendrite.utils.tokens import estimate_tokens
 from dendrite.mcp.write.mcp import WriteMCP
 from dendrite.mcp.base_mcp import InterfaceMCP
-from dendrite.db.io import save_session_changes
+from dendrite.mcp.conflicts import ToolCall
+from dendrite.utils.tracing import TRACER
+from dendrite.utils.constants import MAX_LOOP_TURNS
 
-from pprint import pprint
 import json
+import logging
+
+logger = logging.getLogger(__name__)
 
 class OpenAIInterfaceClient(InterfaceClient):
     def __init__(
             self: Self, 
             mcp: InterfaceMCP,
-            system_prompt_path: str
+            system_prompt_path: str,
+            priority: Priority = Priority.BACKGROUND,
+            stream: bool = False,
+            response_cache: Optional[ResponseCache] = None,
+            step: Optional[str] = None
         ):
         super().__init__(system_prompt_path, mcp_instance=mcp)
-        self.client = openai.AsyncOpenAI(
-            api_key=config.get_config().write
-        )
+        self.scheduler = get_request_scheduler()
+        # the step's route, cheapest tier first (see dendrite/models/routing.py)
+        self.step = step or mcp.interface.db_type.value
+        self.router = get_router()
+        fallback = config.get_config().write.tagger
+        self.tiers = self.router.tiers(self.step, fallback.model, fallback.api_key)
+        self.clients = [self.scheduler.openai_client(api_key=tier.api_key, base_url=tier.base_url) for _, tier in self.tiers]
+        # tier the pass's turns start at, only raised by streamed turns that failed validation
+        self.tier = 0
+        self.priority = priority
+        self.response_cache = response_cache or get_response_cache()
+        # when streaming, tool calls are dispatched as soon as their arguments are complete
+        self.stream = stream
         self.tools = self._format_tools(mcp)
+        self.cache_key = self._cache_key(self.tools)
+        self.context = ToolLoopContext()
+        # times each request was made this pass, see _response_key
+        self.occurrences: dict[str, int] = {}
 
     async def process_convo(self, conversation: list[EasyInputMessageParam]):
-        response = await self._get_response(conversation=conversation)
-        outputs = response.output
-
-        while (function_calls := [o for o in outputs if o.type == 'function_call']):
-            for fc in function_calls:
-                pprint(fc.model_dump())
-                print(f"Processing function call:")
-                print(fc)
-                if fc.type != 'function_call':
-                    continue
-                args = json.loads(fc.arguments)
-                try:
-                    await self.mcp_instance.call_tool(fc.name, args)
-                except Exception as e:
-                    print(f"Error calling tool {fc.name}: {e}")
-                    conversation.append(
-                        EasyInputMessageParam(
-                            role='developer',
-                            content=f'<error>{str(e)}</error>'
-                        )
-                    )
-            response = await self._get_response(conversation=conversation)
-            outputs = response.output
-            pprint(response.model_dump())
-
-    async def _get_response(self, conversation: list[EasyInputMessageParam]) -> api_types.Response:
+        self.timing = PassTiming()
+        self.context = ToolLoopContext()
+        self.tier = 0
+        self.occurrences = {}
+        started = time.perf_counter()
+        turn = self._streamed_turn if self.stream else self._turn
+        while await turn(conversation, started):
+            if self.timing.turns >= MAX_LOOP_TURNS:
+                logger.warning("%s pass stopped after %d turns", self.mcp_instance.interface.db_type.value, self.timing.turns)
+                break
+        self.timing.total = time.perf_counter() - started
+        logger.info("%s pass finished: %s", self.mcp_instance.interface.db_type.value, self.timing)
+
+    async def _turn(self, conversation: list[EasyInputMessageParam], started: float) -> bool:
+        messages = self._build_messages(conversation)
+        for tier in range(self.tier, len(self.tiers)):
+            usage_before, sent = len(self.usage), time.perf_counter()
+            key = self._response_key(messages, tier)
+            cached = (response := await self._cached_response(key)) is not None
+            if response is None:
+                response = await self._get_response(messages, tier, key)
+            # nothing of the response has run yet, so one that doesn't validate can be asked of the next tier instead
+            if tier < len(self.tiers) - 1 and (invalid := self._invalid_calls(response.output)):
+                self._escalate(tier, invalid, time.perf_counter() - sent, usage_before, cached)
+                continue
+            return await self._apply_response(response, messages, time.perf_counter() - sent, usage_before, started, tier, cached)
+
+    async def _apply_response(self, response: api_types.Response, messages: list[EasyInputMessageParam], latency: float, usage_before: int, started: float, tier: int, cached: bool = False) -> bool:
+        self.timing.turns += 1
+        logger.debug("Response: %s", response)
+        function_calls = [o for o in response.output if o.type == 'function_call']
+        calls = [call for fc in function_calls if (call := self._parse_call(fc))]
+        if calls and self.timing.time_to_first_tool is None:
+            self.timing.time_to_first_tool = time.perf_counter() - started
+        self._finish_turn(messages, latency, calls, usage_before, cached=cached, **self._record(tier, latency, usage_before, cached))
+
+        # every call from this turn is applied before the single follow-up request
+        for result in await self.mcp_instance.call_tools(calls):
+            if result.error is not None:
+                self._report_tool_error(result.call.name, result.error)
+        return bool(function_calls)
+
+    async def _streamed_turn(self, conversation: list[EasyInputMessageParam], started: float) -> bool:
+        messages = self._build_messages(conversation)
+        usage_before, sent, tier = len(self.usage), time.perf_counter(), self.tier
+        key = self._response_key(messages, tier)
+        if (response := await self._cached_response(key)) is not None:
+            # nothing to stream, the whole response is already on disk
+            return await self._apply_response(response, messages, time.perf_counter() - sent, usage_before, started, tier, cached=True)
+        dispatcher = self.mcp_instance.dispatcher()
+        calls: list[ToolCall] = []
+        function_calls: list[api_types.ResponseFunctionToolCall] = []
+        saw_function_call = False
+        # the stream holds its scheduler slot until it is drained, closing it gives the slot back if the turn fails
+        async with aclosing(await self._get_response(messages, tier, key, stream=True)) as events:
+            async for event in events:
+                if event.type == 'response.output_item.done' and event.item.type == 'function_call':
+                    saw_function_call = True
+                    function_calls.append(event.item)
+                    if call := self._parse_call(event.item):
+                        calls.append(call)
+                        dispatcher.submit(call)
+                        if self.timing.time_to_first_tool is None:
+                            self.timing.time_to_first_tool = time.perf_counter() - started
+                elif event.type == 'response.completed':
+                    self._record_usage(event.response)
+                    if self.response_cache:
+                        await self.response_cache.put(key, self.tiers[tier][1].model, event.response.model_dump_json())
+        self.timing.turns += 1
+        latency = time.perf_counter() - sent
+        self._finish_turn(messages, latency, calls, usage_before, **self._record(tier, latency, usage_before))
+        # the calls were dispatched as they arrived, so only the turns after this one can go to the next tier
+        if tier < len(self.tiers) - 1 and (invalid := self._invalid_calls(function_calls)):
+            self.router.escalate(self.tiers[tier][0], self.step, invalid, self.tiers[tier + 1][0])
+            self.tier += 1
+
+        # conflicting calls were chained on dispatch, this only waits for the stragglers
+        for result in await dispatcher.drain():
+            if result.error is not None:
+                self._report_tool_error(result.call.name, result.error)
+        return saw_function_call
+
+    def _parse_call(self, fc: api_types.ResponseFunctionToolCall) -> ToolCall | None:
+        try:
+            return ToolCall(call_id=fc.call_id, name=fc.name, arguments=json.loads(fc.arguments))
+        except json.JSONDecodeError as e:
+            self._report_tool_error(fc.name, e)
+            return None
+
+    def _invalid_calls(self, output: list[api_types.ResponseOutputItem]) -> list[tuple[ToolCall, str]]:
+        """Function calls of the output that would fail before their tool runs, arguments that aren't json included."""
+        calls, invalid = [], []
+        for fc in output:
+            if fc.type != 'function_call':
+                continue
+            try:
+                calls.append(ToolCall(call_id=fc.call_id, name=fc.name, arguments=json.loads(fc.arguments)))
+            except json.JSONDecodeError as e:
+                invalid.append((ToolCall(call_id=fc.call_id, name=fc.name, arguments={}), str(e)))
+        return invalid + invalid_calls(self.mcp_instance, calls)
+
+    def _record(self, tier: int, latency: float, usage_before: int, cached: bool = False) -> dict[str, str | float]:
+        """Record the request with the router, and return what the trace should know of it."""
+        name, model_tier = self.tiers[tier]
+        usage = self.usage[-1] if len(self.usage) > usage_before else None
+        cost = self.router.record(name, model_tier, latency, usage, cached)
+        return {'step': self.step, 'tier': name, 'model': model_tier.model, 'cost': cost}
+
+    def _escalate(self, tier: int, invalid: list[tuple[ToolCall, str]], latency: float, usage_before: int, cached: bool):
+        # traced like any other request but never recorded: a replay of the pass only sees the responses it applied
+        attributes = self._record(tier, latency, usage_before, cached)
+        usage = self.usage[-1] if len(self.usage) > usage_before else None
+        TRACER.emit(
+            'llm.request',
+            latency,
+            client=type(self).__name__,
+            db_type=self.mcp_instance.interface.db_type.value,
+            tool_calls=0,
+            response_cached=cached,
+            escalated=True,
+            **attributes,
+            **(usage.model_dump(exclude={'cache_key'}) if usage else {})
+        )
+        self.router.escalate(self.tiers[tier][0], self.step, invalid, self.tiers[tier + 1][0])
+
+    def _report_tool_error(self, tool_name: str, error: Exception | str):
+        logger.warning("Error calling tool %s: %s", tool_name, error)
+        self.context.add_error(tool_name, error)
+
+    def _build_messages(self, conversation: list[EasyInputMessageParam]) -> list[EasyInputMessageParam]:
         interface_state = str(self.mcp_instance.interface)
-        pprint(f"Interface state:\n{interface_state}")
-        
-        messages = [
-            EasyInputMessageParam(
-                role='user',
-                content=f"Current Interface State:\n{interface_state}"
-            )
-        ]
+        logger.debug("Interface state:\n%s", interface_state)
+
+        # instructions and tools go first (the api places them ahead of the input), then the conversation and
+        # the loop messages, which only change at the end. the interface changes every turn so it goes last to keep the prefix cacheable.
+        messages = list(conversation)
+        # tool errors from this pass, compacted so they can't grow the input without bound
+        messages.extend(EasyInputMessageParam(role='developer', content=content) for content in self.context.render())
         if isinstance(self.mcp_instance, WriteMCP) and self.mcp_instance.tie_interface:
             messages.append(
                 EasyInputMessageParam(
                     role='user',
-                    content=f"Current {self.mcp_instance.tie_interface.db_type.value} Interface State:\n{self.mcp_instance.tie_interface}"
+                    content=f"Current {self.mcp_instance.tie_interface.db_type.value} Interface State:\n{self.mcp_instance.tie_interface.__str__(tie_interface=True)}"
                 )
             )
-        messages.extend(conversation)
-
-        print(f"Total messages being sent: {len(messages)}")
-        print("Last few messages:")
-        for i, msg in enumerate(messages):
-            print(f"  {i}: {msg['role']} - {msg['content']}...")
-    
-        response = await self.client.responses.create(
-            model="gpt-5",
-            instructions=self.system_prompt,
-            tools=self.tools,
-            parallel_tool_calls=False,
-            tool_choice='auto',
-            input=messages,
+        messages.append(
+            EasyInputMessageParam(
+                role='user',
+                content=f"Current Interface State:\n{interface_state}"
+            )
         )
+
+        logger.debug("Sending %d messages (%s)", len(messages), ", ".join(message['role'] for message in messages))
+        return messages
+
+    def _response_key(self, messages: list[EasyInputMessageParam], tier: int) -> str:
+        """
+        Key of a request about to be made. A turn that leaves the input as it was makes the same request again, so
+        the key also counts how often it was made before this pass: every repeat gets, and replays, a response of its own.
+        """
+        model = self.tiers[tier][1].model
+        request = ResponseCache.key(model, self.system_prompt, self.tools, messages)
+        occurrence = self.occurrences[request] = self.occurrences.get(request, -1) + 1
+        return ResponseCache.key(model, self.system_prompt, self.tools, messages, occurrence) if occurrence else request
+
+    async def _cached_response(self, key: str) -> api_types.Response | None:
+        if not self.response_cache or (cached := await self.response_cache.get(key)) is None:
+            return None
+        return api_types.Response.model_validate_json(cached)
+
+    async def _get_response(self, messages: list[EasyInputMessageParam], tier: int, key: str, stream: bool = False) -> api_types.Response | HeldStream:
+        model = self.tiers[tier][1].model
+        response = await self.scheduler.submit(
+            model,
+            lambda: self.clients[tier].responses.create(
+                model=model,
+                instructions=self.system_prompt,
+                tools=self.tools,
+                parallel_tool_calls=True,
+                tool_choice='auto',
+                input=messages,
+                extra_body={'prompt_cache_key': self.cache_key},
+                stream=stream,
+            ),
+            priority=self.priority,
+            estimated_tokens=estimate_tokens([self.system_prompt, self.tools, messages]),
+            # streamed usage only arrives with the last event
+            used_tokens=_streamed_tokens if stream else lambda response: response.usage.total_tokens if response.usage else 0,
+            stream=stream
+        )
+        if not stream:
+            self._record_usage(response)
+            if self.response_cache:
+                await self.response_cache.put(key, model, response.model_dump_json())
         return response
 
+    def _record_usage(self, response: api_types.Response):
+        if not response.usage:
+            return
+        usage = CallUsage(
+            cache_key=self.cache_key,
+            input_tokens=response.usage.input_tokens,
+            output_tokens=response.usage.output_tokens,
+            cached_tokens=response.usage.input_tokens_details.cached_tokens,
+        )
+        self.usage.append(usage)
+        logger.info("Prompt cache hit rate: %.0f%% this call, %.0f%% this pass", usage.cache_hit_rate * 100, self.cache_hit_rate * 100)
 
     def _format_tools(self: Self, mcp: InterfaceMCP) -> list[api_types.FunctionToolParam]:
         tools: list[OpenAIToolSchema] = list(mcp._tool_manager._tools.values())
@@ -95,4 +272,7 @@ class OpenAIInterfaceClient(InterfaceClient):
                 parameters=tool.parameters,
                 strict=False,
             ) for tool in tools
-        ]
\ No newline at end of file
+        ]
+
+def _streamed_tokens(event: api_types.ResponseStreamEvent) -> int | None:
+    return event.response.usage.total_tokens if event.type == 'response.completed' and event.response.usage else None
@@ -0,0 +1,93 @@
+from typing import Self
+import asyncio
+import time
+import openai.types.responses as api_types
+from openai.types.responses.response_input_param import EasyInputMessageParam
+from dendrite.models.interface_client import InterfaceClient
+from dendrite.models.types import CallUsage, PassTiming
+from dendrite.models.context import ToolLoopContext
+from dendrite.models.recording import Recording, ReplayDivergence, SyntheticLatency, request_hash
+from dendrite.utils.tokens import estimate_tokens
+from dendrite.mcp.base_mcp import InterfaceMCP
+
+class ReplayInterfaceClient(InterfaceClient):
+    """
+    Offline stand-in for a provider. Every turn still renders the interface and builds the full
+    request (that cost is part of what gets benchmarked), then waits out the synthetic latency and
+    applies the tool calls that were recorded for that turn instead of asking a model.
+    """
+    def __init__(
+            self: Self,
+            mcp: InterfaceMCP,
+            system_prompt_path: str,
+            recording: Recording,
+            latency: SyntheticLatency = SyntheticLatency()
+        ):
+        super().__init__(system_prompt_path, mcp_instance=mcp)
+        self.replaying = recording
+        self.latency = latency
+        self.tools = self._format_tools(mcp)
+        self.cache_key = self._cache_key(self.tools)
+        self.context = ToolLoopContext()
+        # turns where the request built now differs from the recorded one, i.e. the pipeline no longer behaves as recorded
+        self.divergences: list[ReplayDivergence] = []
+
+    async def process_convo(self, conversation: list[EasyInputMessageParam]):
+        self.timing = PassTiming()
+        self.context = ToolLoopContext()
+        self.divergences = []
+        started = time.perf_counter()
+        for i, turn in enumerate(self.replaying.turns):
+            messages = self._build_messages(conversation)
+            replayed_hash = request_hash(messages)
+            # synthesized sessions have no recorded request to compare against
+            if turn.request_hash and replayed_hash != turn.request_hash:
+                self.divergences.append(ReplayDivergence(turn=i, recorded_hash=turn.request_hash, replayed_hash=replayed_hash))
+
+            usage_before, sent = len(self.usage), time.perf_counter()
+            request_tokens = estimate_tokens([self.system_prompt, self.tools, messages])
+            await asyncio.sleep(self.latency.seconds(turn, request_tokens))
+            self.usage.append(turn.usage or CallUsage(
+                cache_key=self.cache_key,
+                input_tokens=request_tokens,
+                output_tokens=estimate_tokens([call.model_dump() for call in turn.tool_calls]),
+            ))
+            self.timing.turns += 1
+            if turn.tool_calls and self.timing.time_to_first_tool is None:
+                self.timing.time_to_first_tool = time.perf_counter() - started
+            self._finish_turn(messages, time.perf_counter() - sent, turn.tool_calls, usage_before)
+
+            for result in await self.mcp_instance.call_tools(turn.tool_calls):
+                if result.error is not None:
+                    self.context.add_error(result.call.name, result.error)
+        self.timing.total = time.perf_counter() - started
+
+    def _build_messages(self, conversation: list[EasyInputMessageParam]) -> list[EasyInputMessageParam]:
+        # same layout as the openai client, so replays of its recordings build identical requests
+        messages = list(conversation)
+        messages.extend(EasyInputMessageParam(role='developer', content=content) for content in self.context.render())
+        if self.mcp_instance.tie_interface:
+            messages.append(
+                EasyInputMessageParam(
+                    role='user',
+                    content=f"Current {self.mcp_instance.tie_interface.db_type.value} Interface State:\n{self.mcp_instance.tie_interface.__str__(tie_interface=True)}"
+                )
+            )
+        messages.append(
+            EasyInputMessageParam(
+                role='user',
+                content=f"Current Interface State:\n{self.mcp_instance.interface}"
+            )
+        )
+        return messages
+
+    def _format_tools(self: Self, mcp: InterfaceMCP) -> list[api_types.FunctionToolParam]:
+        return [
+            api_types.FunctionToolParam(
+                type='function',
+                name=tool.name,
+                description=tool.description,
+                parameters=tool.parameters,
+                strict=False,
+            ) for tool in mcp._tool_manager._tools.values()
+        ]
@@ -1,11 +1,25 @@
 from pydantic import BaseModel, Field
 from typing import Any
 
+CACHE_CONTROL = {"type": "ephemeral"}
+
 class AnthropicToolSchema(BaseModel):
     name: str
     description: str
     input_schema: dict[str, Any] = Field(default_factory = dict)
 
+    def to_param(self, cache: bool = False) -> dict[str, Any]:
+        param = self.model_dump()
+        if cache:
+            param["cache_control"] = CACHE_CONTROL
+        return param
+
 class AnthropicEasyInputMessageParam(BaseModel):
     role: str
-    content: str
\ No newline at end of file
+    content: str
+
+    def to_param(self, cache: bool = False) -> dict[str, Any]:
+        block = {"type": "text", "text": self.content}
+        if cache:
+            block["cache_control"] = CACHE_CONTROL
+        return {"role": self.role, "content": [block]}
@@ -1,35 +1,69 @@
-import openai
-from typing import Self
+from typing import Optional, Self
+import time
 import openai.types.responses as api_types
 from openai.types.responses.response_input_param import EasyInputMessageParam
-from dendrite.models.client_implementations.provider_utils.openai.types import OpenAIToolSchema
 from dendrite.models.response_client import ResponseClient
 from dendrite.models.base_client import ModelConfig
-from dendrite.utils.config import get_config
-
-from pprint import pprint
-import json
+from dendrite.models.types import CallUsage
+from dendrite.models.request_scheduler import Priority, get_request_scheduler
+from dendrite.models.response_cache import ResponseCache, get_response_cache
+from dendrite.models.routing import get_router
+from dendrite.utils.tokens import estimate_tokens
+from dendrite.utils.tracing import TRACER
 
 class OpenAIResponseClient(ResponseClient):
     def __init__(
             self: Self, 
-            model_config: ModelConfig
+            model_config: ModelConfig,
+            priority: Priority = Priority.BACKGROUND,
+            response_cache: Optional[ResponseCache] = None,
+            step: Optional[str] = None
         ):
         super().__init__(model_config)
         self.conversation_history: list[EasyInputMessageParam] = []
-        self.client = openai.AsyncOpenAI(
-            api_key=get_config().write
-        )
+        self.scheduler = get_request_scheduler()
+        # nothing to validate a response against, so only the first tier of the step's route is used
+        self.step = step
+        self.router = get_router()
+        (self.tier_name, self.tier), *_ = self.router.tiers(step or '', model_config.model, model_config.api_key)
+        self.client = self.scheduler.openai_client(api_key=self.tier.api_key, base_url=self.tier.base_url)
+        self.priority = priority
+        self.response_cache = response_cache or get_response_cache()
 
-    async def process_convo(self: Self, conversation: list[EasyInputMessageParam]) -> str:
+    async def get_response(self: Self, conversation: list[EasyInputMessageParam]) -> str:
+        sent = time.perf_counter()
+        model = self.tier.model
+        key = ResponseCache.key(model, self.system_prompt, None, conversation) if self.response_cache else None
+        if key and (cached := await self.response_cache.get(key)) is not None:
+            latency = time.perf_counter() - sent
+            self.router.record(self.tier_name, self.tier, latency, None, cached=True)
+            TRACER.emit('llm.request', latency, client=type(self).__name__, step=self.step, tier=self.tier_name, model=model, response_cached=True)
+            if self.recording is not None:
+                self.recording.add_turn(conversation, time.perf_counter() - sent, text=cached)
+            return cached
 
-        response = await self.client.responses.create(
-            model="gpt-5",
-            instructions=self.system_prompt,
-            input=conversation,
+        response: api_types.Response = await self.scheduler.submit(
+            model,
+            lambda: self.client.responses.create(
+                model=model,
+                instructions=self.system_prompt,
+                input=conversation,
+            ),
+            priority=self.priority,
+            estimated_tokens=estimate_tokens([self.system_prompt, conversation]),
+            used_tokens=lambda response: response.usage.total_tokens if response.usage else 0
         )
-        outputs = response.output
-        pprint(response.model_dump())
-        
-
-        return response
\ No newline at end of file
+        latency = time.perf_counter() - sent
+        usage = CallUsage(
+            cache_key=model,
+            input_tokens=response.usage.input_tokens,
+            output_tokens=response.usage.output_tokens,
+            cached_tokens=response.usage.input_tokens_details.cached_tokens,
+        ) if response.usage else None
+        cost = self.router.record(self.tier_name, self.tier, latency, usage)
+        TRACER.emit('llm.request', latency, client=type(self).__name__, step=self.step, tier=self.tier_name, model=model, cost=cost, **(usage.model_dump(exclude={'cache_key'}) if usage else {}))
+        if self.recording is not None:
+            self.recording.add_turn(conversation, latency, text=response.output_text, usage=usage)
+        if key:
+            await self.response_cache.put(key, model, response.output_text)
+        return response.output_text
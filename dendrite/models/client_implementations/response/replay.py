@@ -0,0 +1,38 @@
+from typing import Self
+import asyncio
+import time
+from openai.types.responses.response_input_param import EasyInputMessageParam
+from dendrite.models.response_client import ResponseClient
+from dendrite.models.base_client import ModelConfig
+from dendrite.models.recording import Recording, SyntheticLatency
+from dendrite.utils.tokens import estimate_tokens
+from dendrite.utils.tracing import TRACER
+
+class ReplayResponseClient(ResponseClient):
+    """
+    Answers with the recorded responses in order, after the synthetic latency.
+    """
+    def __init__(
+            self: Self,
+            model_config: ModelConfig,
+            recording: Recording,
+            latency: SyntheticLatency = SyntheticLatency()
+        ):
+        super().__init__(model_config)
+        self.replaying = recording
+        self.latency = latency
+        self.position = 0
+
+    async def get_response(self: Self, conversation: list[EasyInputMessageParam]) -> str:
+        if self.position >= len(self.replaying.turns):
+            raise ValueError(f"Recording '{self.replaying.name}' only has {len(self.replaying.turns)} responses")
+        turn = self.replaying.turns[self.position]
+        self.position += 1
+
+        sent = time.perf_counter()
+        await asyncio.sleep(self.latency.seconds(turn, estimate_tokens([self.system_prompt, conversation])))
+        latency = time.perf_counter() - sent
+        TRACER.emit('llm.request', latency, client=type(self).__name__, model=self.model_config.model, **(turn.usage.model_dump(exclude={'cache_key'}) if turn.usage else {}))
+        if self.recording is not None:
+            self.recording.add_turn(conversation, latency, text=turn.text, usage=turn.usage)
+        return turn.text or ""
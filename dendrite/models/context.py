@@ -0,0 +1,47 @@
+from collections import Counter
+from typing import Self
+from pydantic import BaseModel
+from dendrite.utils.constants import MAX_LOOP_TOKENS, KEEP_RECENT_LOOP_MESSAGES, MAX_LOOP_MESSAGE_LENGTH
+from dendrite.utils.tokens import estimate_tokens
+
+class LoopMessage(BaseModel):
+    tool: str
+    content: str
+
+class ToolLoopContext:
+    """
+    Holds the messages a tool loop adds on top of the conversation it is processing (tool errors for now).
+    The conversation itself is always sent verbatim, the loop messages are kept under a token budget:
+    the most recent ones stay verbatim and older ones are folded into a single summary line, so the
+    input size of a turn stays bounded no matter how long the pass runs.
+    """
+    def __init__(self: Self, max_tokens: int = MAX_LOOP_TOKENS, keep_recent: int = KEEP_RECENT_LOOP_MESSAGES):
+        self.max_tokens = max_tokens
+        self.keep_recent = keep_recent
+        self.messages: list[LoopMessage] = []
+        self.compacted: Counter[str] = Counter()
+
+    def add_error(self: Self, tool: str, error: Exception | str):
+        content = str(error)
+        if len(content) > MAX_LOOP_MESSAGE_LENGTH:
+            content = content[:MAX_LOOP_MESSAGE_LENGTH] + '...'
+        self.messages.append(LoopMessage(tool=tool, content=f'<error tool="{tool}">{content}</error>'))
+        self._compact()
+
+    def render(self: Self) -> list[str]:
+        rendered = [message.content for message in self.messages]
+        if self.compacted:
+            counts = ", ".join(f"{count} from {tool}" for tool, count in self.compacted.most_common())
+            rendered.insert(0, f'<compacted>{sum(self.compacted.values())} earlier tool errors omitted ({counts}). They have already been handled.</compacted>')
+        return rendered
+
+    def tokens(self: Self) -> int:
+        return sum(estimate_tokens(content) for content in self.render())
+
+    def _compact(self: Self):
+        if self.tokens() <= self.max_tokens:
+            return
+        # compact in one go down to the recent window, so the rendered prefix changes rarely
+        while len(self.messages) > self.keep_recent or (len(self.messages) > 1 and self.tokens() > self.max_tokens):
+            dropped = self.messages.pop(0)
+            self.compacted[dropped.tool] += 1
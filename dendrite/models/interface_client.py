@@ -1,7 +1,13 @@
-from typing import Self
+from typing import Any, Self
 from abc import ABC, abstractmethod
+import hashlib
+import json
 from dendrite.utils.file import read_file
 from dendrite.mcp.base_mcp import InterfaceMCP
+from dendrite.models.types import CallUsage, PassTiming
+from dendrite.models.recording import Recording
+from dendrite.mcp.conflicts import ToolCall
+from dendrite.utils.tracing import TRACER
 
 # client class specifically for both read and write models.
 # They should not need any interaction, just tool calls.
@@ -10,6 +16,10 @@ class InterfaceClient(ABC):
     def __init__(self: Self, system_prompt_path: str, mcp_instance: InterfaceMCP):
         self.system_prompt = read_file(system_prompt_path)
         self.mcp_instance = mcp_instance
+        self.usage: list[CallUsage] = []
+        self.timing = PassTiming()
+        # set to record every turn of this client's passes (see dendrite/models/recording.py)
+        self.recording: Recording | None = None
 
     @abstractmethod
     async def process_convo(self, conversation: any) -> str:
@@ -17,10 +27,44 @@ class InterfaceClient(ABC):
         Handles the state of the interface, caching, context configuration, and other things that need to be done before getting a response.
         """
         pass
-    
+
     @abstractmethod
     def _format_tools(self: Self, mcp: InterfaceMCP) -> any:
         """
         Format tools given to use by the mcp instance into a list of that the client API expects.
         """
-        pass
\ No newline at end of file
+        pass
+
+    def _cache_key(self: Self, tools: any) -> str:
+        """
+        Stable per pass: only changes when the system prompt or the tool schemas do, so every turn of every
+        run of the same pass lands on the same provider cache entry.
+        """
+        prefix = json.dumps([self.system_prompt, tools], sort_keys=True, default=str)
+        digest = hashlib.sha256(prefix.encode('utf-8')).hexdigest()[:16]
+        return f"dendrite-{self.mcp_instance.name}-{self.mcp_instance.interface.db_type.value}-{digest}"
+
+    @property
+    def cache_hit_rate(self: Self) -> float:
+        input_tokens = sum(usage.input_tokens for usage in self.usage)
+        return sum(usage.cached_tokens for usage in self.usage) / input_tokens if input_tokens else 0.0
+
+    def _finish_turn(self: Self, request: any, latency: float, tool_calls: list[ToolCall], usage_before: int, cached: bool = False, **attributes: Any):
+        """
+        Trace the turn's request and record it if this client is recording. usage_before is len(self.usage) from
+        before the request went out, so a turn without usage reported by the provider doesn't pick up the previous turn's.
+        attributes are added to the trace, e.g. the model tier that answered (see dendrite/models/routing.py).
+        """
+        usage = self.usage[-1] if len(self.usage) > usage_before else None
+        TRACER.emit(
+            'llm.request',
+            latency,
+            client=type(self).__name__,
+            db_type=self.mcp_instance.interface.db_type.value,
+            tool_calls=len(tool_calls),
+            response_cached=cached,
+            **attributes,
+            **(usage.model_dump(exclude={'cache_key'}) if usage else {})
+        )
+        if self.recording is not None:
+            self.recording.add_turn(request, latency, tool_calls=tool_calls, usage=usage)
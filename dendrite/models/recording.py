@@ -0,0 +1,83 @@
+import hashlib
+import json
+import os
+from typing import Any, Literal, Self
+from pydantic import BaseModel
+from dendrite.mcp.conflicts import ToolCall
+from dendrite.models.types import CallUsage
+from dendrite.utils.tokens import estimate_tokens
+
+# when set, live write passes save every client's session here so it can be replayed offline
+RECORD_DIR = os.getenv("DENDRITE_RECORD_DIR")
+
+def request_hash(request: Any) -> str:
+    """
+    Fingerprint of everything sent for a turn. Replays compare it against the recording
+    to tell whether the pipeline still builds the same requests it did when recorded.
+    """
+    return hashlib.sha256(json.dumps(request, sort_keys=True, default=str).encode('utf-8')).hexdigest()[:16]
+
+class RecordedTurn(BaseModel):
+    request_hash: str
+    request_tokens: int                 # estimated size of the request, for latency models that scale with input
+    latency: float                      # seconds the provider took to answer (for streams, until the last event)
+    tool_calls: list[ToolCall] = []
+    text: str | None = None             # response clients answer with text instead of tool calls
+    usage: CallUsage | None = None
+
+class Recording(BaseModel):
+    name: str
+    turns: list[RecordedTurn] = []
+
+    @classmethod
+    def path(cls, directory: str, name: str) -> str:
+        return os.path.join(directory, f'{name}.json')
+
+    @classmethod
+    def load(cls, directory: str, name: str) -> Self:
+        with open(cls.path(directory, name), 'r', encoding='utf-8') as file:
+            return cls.model_validate_json(file.read())
+
+    def save(self: Self, directory: str) -> str:
+        os.makedirs(directory, exist_ok=True)
+        path = self.path(directory, self.name)
+        with open(path, 'w', encoding='utf-8') as file:
+            file.write(self.model_dump_json(indent=4))
+        return path
+
+    def add_turn(
+            self: Self,
+            request: Any,
+            latency: float,
+            tool_calls: list[ToolCall] = [],
+            text: str | None = None,
+            usage: CallUsage | None = None
+        ):
+        self.turns.append(RecordedTurn(
+            request_hash=request_hash(request),
+            request_tokens=estimate_tokens(request),
+            latency=latency,
+            tool_calls=tool_calls,
+            text=text,
+            usage=usage,
+        ))
+
+class SyntheticLatency(BaseModel):
+    """
+    How long a replayed request takes. 'recorded' sleeps what the provider took when the session
+    was recorded, 'fixed' the same time for every request and 'none' answers immediately, which
+    leaves only the pipeline's own overhead. per_1k_tokens adds time proportional to the request size.
+    """
+    mode: Literal['recorded', 'fixed', 'none'] = 'recorded'
+    scale: float = 1.0
+    fixed: float = 0.0
+    per_1k_tokens: float = 0.0
+
+    def seconds(self: Self, turn: RecordedTurn, request_tokens: int) -> float:
+        base = {'recorded': turn.latency, 'fixed': self.fixed, 'none': 0.0}[self.mode]
+        return base * self.scale + self.per_1k_tokens * request_tokens / 1000
+
+class ReplayDivergence(BaseModel):
+    turn: int
+    recorded_hash: str
+    replayed_hash: str
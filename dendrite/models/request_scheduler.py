@@ -0,0 +1,285 @@
+import asyncio
+import heapq
+import itertools
+import logging
+import random
+import time
+from enum import IntEnum
+from functools import cache
+from typing import Any, Awaitable, Callable, Optional, Self, TypeVar
+
+import anthropic
+import httpx
+import openai
+from pydantic import BaseModel
+from dendrite.utils.tracing import TRACER
+
+T = TypeVar('T')
+
+logger = logging.getLogger(__name__)
+
+RETRYABLE_STATUS = {408, 409, 429, 500, 502, 503, 504, 529}
+RETRYABLE_ERRORS = (httpx.TransportError, openai.APIConnectionError, anthropic.APIConnectionError)
+
+class Priority(IntEnum):
+    INTERACTIVE = 0     # read model, the user is waiting on it
+    BACKGROUND = 1      # write passes
+
+class ModelLimits(BaseModel):
+    requests_per_minute: int = 500
+    tokens_per_minute: int = 500_000
+    max_concurrency: int = 16
+
+class SchedulerConfig(BaseModel):
+    max_connections: int = 64
+    max_keepalive_connections: int = 32
+    max_retries: int = 6
+    base_backoff: float = 0.5       # seconds
+    max_backoff: float = 60.0
+    default_limits: ModelLimits = ModelLimits()
+    models: dict[str, ModelLimits] = {}
+
+class TokenBucket:
+    """
+    Continuously refilling bucket. The level is allowed to go negative when a request turns out to have
+    used more than was reserved for it, which delays whoever comes next instead of failing anyone.
+    """
+    def __init__(self: Self, per_minute: int):
+        self.capacity = float(per_minute)
+        self.rate = per_minute / 60.0
+        self.max_rate = self.rate
+        self.level = self.capacity
+        self.updated = time.monotonic()
+
+    def _refill(self: Self):
+        now = time.monotonic()
+        self.level = min(self.capacity, self.level + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def wait_time(self: Self, amount: float) -> float:
+        self._refill()
+        # never ask for more than the bucket can ever hold, otherwise huge requests would wait forever
+        amount = min(amount, self.capacity)
+        return 0.0 if self.level >= amount else (amount - self.level) / self.rate
+
+    def take(self: Self, amount: float):
+        self._refill()
+        self.level = min(self.capacity, self.level - amount)
+
+    def throttle(self: Self, factor: float = 0.5):
+        self.rate = max(self.max_rate * 0.05, self.rate * factor)
+
+    def recover(self: Self, step: float = 0.05):
+        self.rate = min(self.max_rate, self.rate + self.max_rate * step)
+
+class _ModelState:
+    def __init__(self: Self, limits: ModelLimits):
+        self.limits = limits
+        self.requests = TokenBucket(limits.requests_per_minute)
+        self.tokens = TokenBucket(limits.tokens_per_minute)
+        self.in_flight = 0
+        self.waiting: list[tuple[int, int]] = []
+        self.condition = asyncio.Condition()
+
+    def wait_time(self: Self, tokens: int) -> float:
+        return max(self.requests.wait_time(1), self.tokens.wait_time(tokens))
+
+class HeldStream:
+    """
+    A stream of events from a provider that holds its request's slot in the scheduler, so streamed generations
+    count against max_concurrency for as long as they run. The slot is given back once the stream is drained,
+    fails or is closed, and the token bucket is corrected for the usage the events reported.
+    """
+    def __init__(self: Self, scheduler: 'RequestScheduler', state: _ModelState, stream: Any, estimated_tokens: int, used_tokens: Optional[Callable[[Any], Optional[int]]]):
+        self.scheduler = scheduler
+        self.state = state
+        self.stream = stream
+        self.events = stream.__aiter__()
+        self.estimated_tokens = estimated_tokens
+        self.used_tokens = used_tokens
+        self.used = 0
+        self.released = False
+
+    def __aiter__(self: Self) -> Self:
+        return self
+
+    async def __anext__(self: Self) -> Any:
+        if self.released:
+            raise StopAsyncIteration
+        try:
+            event = await self.events.__anext__()
+        except StopAsyncIteration:
+            if self.used_tokens:
+                self.state.tokens.take(self.used - self.estimated_tokens)
+            await self.aclose()
+            raise
+        except BaseException:
+            await self.aclose()
+            raise
+        if self.used_tokens:
+            self.used += self.used_tokens(event) or 0
+        return event
+
+    async def aclose(self: Self):
+        if self.released:
+            return
+        self.released = True
+        try:
+            if (close := getattr(self.stream, 'close', None)) is not None:
+                await close()
+        finally:
+            await self.scheduler._release(self.state)
+
+class RequestScheduler:
+    """
+    Process-wide gate in front of every provider request. All sdk clients share one pooled http client,
+    each model has request and token buckets, waiting requests are admitted by priority, and rate limits
+    or transient failures are retried with jittered exponential backoff while the model's rate adapts down.
+    """
+    def __init__(self: Self, config: SchedulerConfig = SchedulerConfig()):
+        self.config = config
+        self.http_client = httpx.AsyncClient(
+            limits=httpx.Limits(
+                max_connections=config.max_connections,
+                max_keepalive_connections=config.max_keepalive_connections
+            ),
+            timeout=httpx.Timeout(600.0, connect=10.0)
+        )
+        self.models: dict[str, _ModelState] = {}
+        self.counter = itertools.count()
+        self.openai_clients: dict[tuple[str, Optional[str]], openai.AsyncOpenAI] = {}
+        self.anthropic_clients: dict[tuple[str, Optional[str]], anthropic.AsyncAnthropic] = {}
+
+    def openai_client(self: Self, api_key: str, base_url: Optional[str] = None) -> openai.AsyncOpenAI:
+        if (api_key, base_url) not in self.openai_clients:
+            # retries are owned by the scheduler so they respect the shared limits
+            self.openai_clients[(api_key, base_url)] = openai.AsyncOpenAI(
+                api_key=api_key, base_url=base_url, http_client=self.http_client, max_retries=0
+            )
+        return self.openai_clients[(api_key, base_url)]
+
+    def anthropic_client(self: Self, api_key: str, base_url: Optional[str] = None) -> anthropic.AsyncAnthropic:
+        if (api_key, base_url) not in self.anthropic_clients:
+            self.anthropic_clients[(api_key, base_url)] = anthropic.AsyncAnthropic(
+                api_key=api_key, base_url=base_url, http_client=self.http_client, max_retries=0
+            )
+        return self.anthropic_clients[(api_key, base_url)]
+
+    def _state(self: Self, model: str) -> _ModelState:
+        if model not in self.models:
+            self.models[model] = _ModelState(self.config.models.get(model, self.config.default_limits))
+        return self.models[model]
+
+    async def submit(
+            self: Self,
+            model: str,
+            request: Callable[[], Awaitable[T]],
+            priority: Priority = Priority.BACKGROUND,
+            estimated_tokens: int = 0,
+            used_tokens: Optional[Callable[[Any], Optional[int]]] = None,
+            stream: bool = False
+        ) -> T:
+        """
+        Run `request` once the model has capacity for it. `used_tokens` reads the real usage off the
+        response so the token bucket can be corrected for the estimate.
+
+        With stream, `request` opens a stream of events and what is returned is that stream, holding on to the
+        request's slot until it is drained or closed (see HeldStream, iterate it inside contextlib.aclosing). `used_tokens` is
+        then called with every event and what the events report is summed up.
+        """
+        state = self._state(model)
+        for attempt in itertools.count():
+            # time spent waiting for capacity, separate from the request's own latency
+            with TRACER.span('llm.queue', model=model, priority=priority.name, attempt=attempt):
+                await self._admit(state, priority, estimated_tokens)
+            held = False
+            try:
+                response = await request()
+                state.requests.recover()
+                state.tokens.recover()
+                if stream:
+                    held = True
+                    return HeldStream(self, state, response, estimated_tokens, used_tokens)
+                if used_tokens:
+                    state.tokens.take(used_tokens(response) - estimated_tokens)
+                return response
+            except Exception as e:
+                status = _status_code(e)
+                if attempt >= self.config.max_retries or not (status in RETRYABLE_STATUS or isinstance(e, RETRYABLE_ERRORS)):
+                    raise
+                if status == 429:
+                    state.requests.throttle()
+                    state.tokens.throttle()
+                backoff = self._backoff(attempt, e)
+                logger.warning("%s request failed (%s), retry %d in %.1fs", model, status or type(e).__name__, attempt + 1, backoff)
+            finally:
+                # cancelled or failed, the slot is given back either way
+                if not held:
+                    await self._release(state)
+            await asyncio.sleep(backoff)
+
+    async def _admit(self: Self, state: _ModelState, priority: Priority, tokens: int):
+        ticket = (int(priority), next(self.counter))
+        async with state.condition:
+            heapq.heappush(state.waiting, ticket)
+            try:
+                while True:
+                    if state.waiting[0] == ticket and state.in_flight < state.limits.max_concurrency:
+                        if (delay := state.wait_time(tokens)) <= 0:
+                            break
+                    else:
+                        delay = None
+                    try:
+                        await asyncio.wait_for(state.condition.wait(), timeout=delay)
+                    except TimeoutError:
+                        pass
+                heapq.heappop(state.waiting)
+                state.requests.take(1)
+                state.tokens.take(tokens)
+                state.in_flight += 1
+            except BaseException:
+                # a cancelled waiter must not block the queue
+                if ticket in state.waiting:
+                    state.waiting.remove(ticket)
+                    heapq.heapify(state.waiting)
+                raise
+            finally:
+                state.condition.notify_all()
+
+    async def _release(self: Self, state: _ModelState):
+        # counted at once and waiters woken even if the releasing task is cancelled while it waits for the lock
+        state.in_flight -= 1
+        await asyncio.shield(self._wake(state))
+
+    async def _wake(self: Self, state: _ModelState):
+        async with state.condition:
+            state.condition.notify_all()
+
+    def _backoff(self: Self, attempt: int, error: Exception) -> float:
+        if (retry_after := _retry_after(error)) is not None:
+            return retry_after + random.uniform(0, self.config.base_backoff)
+        # full jitter
+        return random.uniform(0, min(self.config.max_backoff, self.config.base_backoff * 2 ** attempt))
+
+def _status_code(error: Exception) -> Optional[int]:
+    if (status := getattr(error, 'status_code', None)) is not None:
+        return status
+    response = getattr(error, 'response', None)
+    return getattr(response, 'status_code', None)
+
+def _retry_after(error: Exception) -> Optional[float]:
+    response = getattr(error, 'response', None)
+    headers = getattr(response, 'headers', None) or {}
+    try:
+        if (ms := headers.get('retry-after-ms')) is not None:
+            return float(ms) / 1000
+        if (seconds := headers.get('retry-after')) is not None:
+            return float(seconds)
+    except ValueError:
+        pass
+    return None
+
+@cache
+def get_request_scheduler() -> RequestScheduler:
+    from dendrite.utils.config import get_config
+    return RequestScheduler(get_config().scheduler)
@@ -0,0 +1,148 @@
+import asyncio
+import hashlib
+import json
+import logging
+import os
+import sqlite3
+import threading
+import time
+from functools import cache
+from typing import Any, Optional, Self
+from pydantic import BaseModel
+from dendrite.utils.tracing import TRACER
+
+logger = logging.getLogger(__name__)
+
+class ResponseCacheConfig(BaseModel):
+    # sqlite file; no path means no cache
+    path: Optional[str] = os.getenv("DENDRITE_CACHE_PATH")
+    ttl: float = 7 * 24 * 60 * 60          # seconds an entry stays valid after it was written
+    max_bytes: int = 512 * 1024 * 1024     # least recently used entries are evicted past this
+
+class CacheStats(BaseModel):
+    hits: int = 0
+    misses: int = 0
+    writes: int = 0
+    expired: int = 0
+    evicted: int = 0
+
+    @property
+    def hit_rate(self) -> float:
+        lookups = self.hits + self.misses
+        return self.hits / lookups if lookups else 0.0
+
+    def __str__(self) -> str:
+        return f"{self.hits} hits, {self.misses} misses ({self.hit_rate:.0%}), {self.writes} writes, {self.expired} expired, {self.evicted} evicted"
+
+class ResponseCache:
+    """
+    Content addressed cache of provider responses. An entry is keyed by everything that determines the
+    response (model, instructions, tools and input), so re-running an unchanged pass, e.g. after a crash
+    or a prompt tweak to another pass, is answered from disk without an API call.
+    """
+    def __init__(self: Self, path: str, ttl: float = ResponseCacheConfig().ttl, max_bytes: int = ResponseCacheConfig().max_bytes):
+        self.path = path
+        self.ttl = ttl
+        self.max_bytes = max_bytes
+        self.stats = CacheStats()
+        self.lock = threading.Lock()
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        self.db = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+        self.db.execute("PRAGMA journal_mode=WAL")
+        self.db.execute("PRAGMA synchronous=NORMAL")
+        self.db.execute("""
+            CREATE TABLE IF NOT EXISTS responses (
+                key TEXT PRIMARY KEY,
+                model TEXT NOT NULL,
+                value TEXT NOT NULL,
+                size INTEGER NOT NULL,
+                created REAL NOT NULL,
+                accessed REAL NOT NULL
+            )
+        """)
+        self.db.execute("CREATE INDEX IF NOT EXISTS responses_accessed ON responses (accessed)")
+        self.size = self.db.execute("SELECT COALESCE(SUM(size), 0) FROM responses").fetchone()[0]
+
+    @staticmethod
+    def key(model: str, instructions: Any, tools: Any, input: Any, occurrence: int = 0) -> str:
+        """occurrence counts the same request made before it in a pass, so a repeated turn has a response of its own."""
+        payload = json.dumps([model, instructions, tools, input] + ([occurrence] if occurrence else []), sort_keys=True, default=str)
+        return hashlib.sha256(payload.encode('utf-8')).hexdigest()
+
+    async def get(self: Self, key: str) -> str | None:
+        # sqlite blocks, so lookups and writes run in a worker thread and never hold up the event loop
+        return await asyncio.to_thread(self._get, key)
+
+    async def put(self: Self, key: str, model: str, value: str):
+        await asyncio.to_thread(self._put, key, model, value)
+
+    def _get(self: Self, key: str) -> str | None:
+        with TRACER.span('llm.cache', hit=False) as span, self.lock:
+            row = self.db.execute("SELECT value, size, created FROM responses WHERE key = ?", (key,)).fetchone()
+            now = time.time()
+            if row is not None and now - row[2] > self.ttl:
+                self._delete(key, row[1])
+                self.stats.expired += 1
+                row = None
+            if row is None:
+                self.stats.misses += 1
+                return None
+            self.db.execute("UPDATE responses SET accessed = ? WHERE key = ?", (now, key))
+            self.stats.hits += 1
+            span['hit'] = True
+            return row[0]
+
+    def _put(self: Self, key: str, model: str, value: str):
+        size = len(value.encode('utf-8'))
+        if size > self.max_bytes:
+            return
+        with self.lock:
+            now = time.time()
+            # an entry is never replaced, what was replayed once is replayed the same every time
+            if self.db.execute("SELECT 1 FROM responses WHERE key = ?", (key,)).fetchone() is not None:
+                return
+            self.db.execute(
+                "INSERT INTO responses (key, model, value, size, created, accessed) VALUES (?, ?, ?, ?, ?, ?)",
+                (key, model, value, size, now, now)
+            )
+            self.size += size
+            self.stats.writes += 1
+            if self.size > self.max_bytes:
+                self._evict(now)
+
+    def _evict(self: Self, now: float):
+        # expired entries go first, then least recently used until the cache is back under budget
+        expired = self.db.execute("SELECT COUNT(*), COALESCE(SUM(size), 0) FROM responses WHERE created < ?", (now - self.ttl,)).fetchone()
+        self.db.execute("DELETE FROM responses WHERE created < ?", (now - self.ttl,))
+        self.stats.expired += expired[0]
+        self.size -= expired[1]
+
+        while self.size > self.max_bytes:
+            rows = self.db.execute("SELECT key, size FROM responses ORDER BY accessed LIMIT 64").fetchall()
+            if not rows:
+                break
+            for key, size in rows:
+                if self.size <= self.max_bytes:
+                    break
+                self._delete(key, size)
+                self.stats.evicted += 1
+
+    def _delete(self: Self, key: str, size: int):
+        self.db.execute("DELETE FROM responses WHERE key = ?", (key,))
+        self.size -= size
+
+    def clear(self: Self):
+        with self.lock:
+            self.db.execute("DELETE FROM responses")
+            self.size = 0
+
+    def close(self: Self):
+        logger.info("Response cache %s: %s", self.path, self.stats)
+        with self.lock:
+            self.db.close()
+
+@cache
+def get_response_cache() -> ResponseCache | None:
+    from dendrite.utils.config import get_config
+    config = get_config().cache
+    return ResponseCache(config.path, config.ttl, config.max_bytes) if config.path else None
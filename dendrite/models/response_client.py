@@ -2,10 +2,13 @@ from typing import Self
 from abc import abstractmethod
 from .base_client import ModelConfig, BaseClient
 from dendrite.utils.file import read_file
+from dendrite.models.recording import Recording
 
 class ResponseClient(BaseClient):
     def __init__(self: Self, model_config: ModelConfig):
         super().__init__(model_config)
+        # set to record every response (see dendrite/models/recording.py)
+        self.recording: Recording | None = None
 
     @abstractmethod
     async def get_response(self, conversation: any) -> str:
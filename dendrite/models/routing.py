@@ -0,0 +1,141 @@
+"""
+Model routing. Every pass and step of a pipeline (conceptual, concrete, temporal.tag, temporal.summarize, rollup,
+read, the names write_pass_clients uses) is routed to a list of model tiers from the config:
+
+    "routing": {
+        "tiers": {
+            "fast": {"model": "gpt-5-mini", "api_key": "...", "input_cost": 0.25, "cached_input_cost": 0.025, "output_cost": 2.0},
+            "full": {"model": "gpt-5", "api_key": "...", "input_cost": 1.25, "cached_input_cost": 0.125, "output_cost": 10.0}
+        },
+        "routes": {"temporal.summarize": ["fast"], "conceptual": ["fast", "full"], "concrete": ["fast", "full"]},
+        "default": ["full"]
+    }
+
+An interface pass with more than one tier cascades: each turn goes to the first tier, and when a tool call of its
+response doesn't validate (a tool that doesn't exist, arguments that don't parse or don't match the tool's schema)
+the response is dropped before any of its calls run and the turn is asked of the next tier. The last tier's
+response is applied whatever it is, its errors go back to the model as before. Streamed turns dispatch their calls
+as they arrive, so there is nothing to drop: a streamed turn that fails validation moves the rest of its pass to the
+next tier instead. Response clients (summaries) have no tools to validate and only use the first tier.
+
+A step without a route (and no default) uses the model of the ModelConfig it was built with. Latency, tokens, cost
+and escalations are recorded per tier for the whole process, see Router.report.
+"""
+import logging
+from functools import cache
+from typing import Self
+from pydantic import BaseModel, ValidationError
+from dendrite.mcp.base_mcp import InterfaceMCP
+from dendrite.mcp.conflicts import ToolCall
+from dendrite.models.types import CallUsage
+from dendrite.utils.profiling import Histogram
+
+logger = logging.getLogger(__name__)
+
+class ModelTier(BaseModel):
+    model: str
+    api_key: str
+    base_url: str | None = None
+    # dollars per million tokens, only used to record what each tier costs
+    input_cost: float = 0.0
+    cached_input_cost: float = 0.0
+    output_cost: float = 0.0
+
+    def cost(self: Self, usage: CallUsage) -> float:
+        uncached = usage.input_tokens - usage.cached_tokens
+        return (uncached * self.input_cost + usage.cached_tokens * self.cached_input_cost + usage.output_tokens * self.output_cost) / 1_000_000
+
+class RoutingConfig(BaseModel):
+    tiers: dict[str, ModelTier] = {}
+    # step name -> tier names, cheapest first
+    routes: dict[str, list[str]] = {}
+    default: list[str] = []
+
+class TierStats(BaseModel):
+    requests: int = 0
+    cached: int = 0                     # answered by the response cache
+    escalated: int = 0                  # responses dropped for the next tier
+    invalid_calls: int = 0
+    input_tokens: int = 0
+    cached_tokens: int = 0
+    output_tokens: int = 0
+    cost: float = 0.0                   # dollars
+    latency: Histogram = Histogram()
+
+    @property
+    def escalation_rate(self) -> float:
+        return self.escalated / self.requests if self.requests else 0.0
+
+    def __str__(self) -> str:
+        return (
+            f"{self.requests} requests ({self.cached} cached), latency p50 {self.latency.quantile(0.5):.2f}s p95 {self.latency.quantile(0.95):.2f}s, "
+            f"{self.input_tokens:,} input tokens ({self.cached_tokens:,} cached), {self.output_tokens:,} output tokens, ${self.cost:.4f}, "
+            f"{self.escalated} escalated ({self.escalation_rate:.0%}), {self.invalid_calls} invalid calls"
+        )
+
+class RoutingReport(BaseModel):
+    tiers: dict[str, TierStats] = {}
+
+    @property
+    def cost(self) -> float:
+        return sum(stats.cost for stats in self.tiers.values())
+
+    def __str__(self) -> str:
+        return "\n".join(f"  {name}: {stats}" for name, stats in self.tiers.items()) or "  no model requests"
+
+class Router:
+    def __init__(self: Self, config: RoutingConfig = RoutingConfig()):
+        for route, names in {**config.routes, 'default': config.default}.items():
+            if unknown := [name for name in names if name not in config.tiers]:
+                raise ValueError(f"Route {route} names tiers that aren't configured: {', '.join(unknown)}")
+        self.config = config
+        self.stats: dict[str, TierStats] = {}
+
+    def tiers(self: Self, step: str, model: str, api_key: str) -> list[tuple[str, ModelTier]]:
+        """Tiers of the step by name, cheapest first, or the model it was configured with if it has no route."""
+        names = self.config.routes.get(step) or self.config.default
+        if not names:
+            return [(model, ModelTier(model=model, api_key=api_key))]
+        return [(name, self.config.tiers[name]) for name in names]
+
+    def record(self: Self, name: str, tier: ModelTier, latency: float, usage: CallUsage | None, cached: bool = False) -> float:
+        """Record a request to the tier and return what it cost."""
+        stats = self.stats.setdefault(name, TierStats())
+        stats.requests += 1
+        stats.cached += cached
+        stats.latency.add(latency)
+        if usage is None or cached:
+            return 0.0
+        cost = tier.cost(usage)
+        stats.input_tokens += usage.input_tokens
+        stats.cached_tokens += usage.cached_tokens
+        stats.output_tokens += usage.output_tokens
+        stats.cost += cost
+        return cost
+
+    def escalate(self: Self, name: str, step: str, invalid: list[tuple[ToolCall, str]], to: str):
+        stats = self.stats.setdefault(name, TierStats())
+        stats.escalated += 1
+        stats.invalid_calls += len(invalid)
+        logger.info("%s: %d invalid tool calls from %s (%s), escalating to %s", step, len(invalid), name, ", ".join(call.name for call, _ in invalid), to)
+
+    def report(self: Self) -> RoutingReport:
+        return RoutingReport(tiers={name: stats.model_copy(deep=True) for name, stats in self.stats.items()})
+
+def invalid_calls(mcp: InterfaceMCP, calls: list[ToolCall]) -> list[tuple[ToolCall, str]]:
+    """Calls that would fail before their tool runs: unknown tools and arguments that don't match the tool's schema."""
+    invalid = []
+    for call in calls:
+        if (tool := mcp._tool_manager._tools.get(call.name)) is None:
+            invalid.append((call, f"Unknown tool: {call.name}"))
+            continue
+        try:
+            tool.fn_metadata.arg_model.model_validate(call.arguments)
+        except ValidationError as e:
+            invalid.append((call, str(e)))
+    return invalid
+
+@cache
+def get_router() -> Router:
+    from dendrite.utils.config import get_config
+    return Router(get_config().routing)
@@ -25,4 +25,25 @@ class EasyInputMessageParam(BaseModel):
 class ToolSchema(BaseModel):
     name: str
     description: str
-    input_schema: dict[str, Any]
\ No newline at end of file
+    input_schema: dict[str, Any]
+
+class CallUsage(BaseModel):
+    cache_key: str
+    input_tokens: int
+    output_tokens: int
+    cached_tokens: int = 0          # input tokens read from the provider's prompt cache
+    cache_write_tokens: int = 0     # input tokens written to the prompt cache (anthropic only)
+
+    @property
+    def cache_hit_rate(self) -> float:
+        return self.cached_tokens / self.input_tokens if self.input_tokens else 0.0
+
+
+class PassTiming(BaseModel):
+    turns: int = 0
+    time_to_first_tool: float | None = None     # seconds from the start of the pass until the first tool was dispatched
+    total: float = 0.0
+
+    def __str__(self) -> str:
+        first_tool = f"{self.time_to_first_tool:.2f}s" if self.time_to_first_tool is not None else "n/a"
+        return f"{self.turns} turns in {self.total:.2f}s, first tool after {first_tool}"
@@ -0,0 +1,493 @@
+"""
+Bulk ingestion. Streams a directory of conversation files (or a JSONL file, one conversation per line)
+through full write passes with a bounded number of concurrent workers.
+
+    python -m dendrite.stages.write.bulk ./conversations --workers 8 --checkpoint ./ingest.json
+
+A conversation is a list of messages, or an object with "messages" and optionally "id" and "date"
+(ISO date the session gets filed under instead of today).
+
+Every worker runs its passes on a view of its own, a version of the tenant's database taken when its
+conversation starts (see dendrite/db/io.py TreeVersion), so passes of different conversations never see each
+other's half finished work. Finished views are merged back into the database in input order and saved. Notes are merged
+three-way against what the view was taken with: when an earlier merge changed a note the view also changed,
+appends are rebased and whatever can't be merged is left as the earlier merge had it and reported as a conflict.
+With a rollup model configured, the day, month and year summaries of every day ingested are brought up to date
+once the last conversation is merged (see dendrite/stages/write/rollup.py), a call per year rather than per session.
+
+The checkpoint lists every merged conversation and is written after each merge, so an interrupted run
+picks up where it stopped. A crash between a merge and its checkpoint ingests that conversation again.
+"""
+import argparse
+import asyncio
+import json
+import logging
+import os
+import resource
+import time
+from datetime import datetime
+from typing import Callable, Iterable, Iterator, Self, TypeVar
+from openai.types.responses.response_input_param import EasyInputMessageParam
+from pydantic import BaseModel
+from dendrite.db.io import DEFAULT_TENANT, REGISTRY, Database, DatabaseSet, DatabaseType, TreeVersion, publish
+from dendrite.interface.types import Content, ContentStatus, GitStatus, Node, Note
+from dendrite.models.interface_client import InterfaceClient
+from dendrite.models.response_client import ResponseClient
+from dendrite.models.routing import RoutingReport, get_router
+from dendrite.stages.write.full_pass import schedule_write_pass, start_recording, save_recordings, write_pass_clients
+from dendrite.stages.write.rollup import Rollups, RollupReport, session_days
+from dendrite.utils.config import WritePass, build_rollup, build_write_pass, get_config
+from dendrite.utils.file import WRITER, read_file, write_behind
+from dendrite.utils.tracing import configure_logging
+
+logger = logging.getLogger(__name__)
+
+# node ids or note ids
+Ref = TypeVar('Ref', int, str)
+
+class DocumentSource(BaseModel):
+    """The part of a document a conversation was made from, see dendrite/stages/write/documents.py."""
+    document: str
+    start: int                          # bytes
+    end: int
+
+    def __str__(self) -> str:
+        return f"{self.document}@{self.start}-{self.end}"
+
+class Conversation(BaseModel):
+    key: str                            # identifies the conversation in its source and in the checkpoint
+    messages: list[dict]
+    date: datetime | None = None
+    # made from a document rather than held: not filed as a session, and the notes it adds record where they came from
+    source: DocumentSource | None = None
+
+    @property
+    def conversation(self) -> list[EasyInputMessageParam]:
+        return [EasyInputMessageParam(**message) for message in self.messages]
+
+def read_conversations(source: str) -> Iterator[Conversation]:
+    """Conversations in source order, read one at a time."""
+    if os.path.isdir(source):
+        for file_name in sorted(os.listdir(source)):
+            name, extension = os.path.splitext(file_name)
+            if extension == '.json':
+                yield _conversation(name, json.loads(read_file(os.path.join(source, file_name))))
+        return
+
+    prefix = os.path.splitext(os.path.basename(source))[0]
+    with open(source, 'r', encoding='utf-8') as file:
+        for line_number, line in enumerate(file, start=1):
+            if line.strip():
+                yield _conversation(f"{prefix}:{line_number}", json.loads(line))
+
+def _conversation(key: str, data: list[dict] | dict) -> Conversation:
+    if isinstance(data, list):
+        return Conversation(key=key, messages=data)
+    return Conversation(key=str(data.get('id', key)), messages=data['messages'], date=data.get('date'))
+
+def _notes(dbs: DatabaseSet) -> dict[int, Note]:
+    """Every note in the databases once, no matter how many nodes it is filed under."""
+    notes: dict[int, Note] = {}
+    stack: list[Node] = list(dbs.values())
+    while stack:
+        node = stack.pop()
+        for note in node.notes:
+            notes.setdefault(note.id, note)
+        stack.extend(node.children)
+    return notes
+
+class NoteConflict(BaseModel):
+    conversation: str
+    note_id: int
+    field: str                          # name or content
+    kept: str                           # what the earlier merge left, which is what the database keeps
+    dropped: str                        # what the conversation changed it to
+
+class MergeResult(BaseModel):
+    notes_added: int = 0
+    notes_modified: int = 0
+    nodes_added: int = 0
+    duplicates: int = 0                 # notes created with the same name and content as an existing note
+    conflicts: list[NoteConflict] = []
+
+class Merger:
+    """Merges views into the databases they were taken from, saves the result and publishes it as the databases' new version."""
+    def __init__(self: Self, database: Database):
+        self.database = database
+        self.notes: dict[int, Note] = {}
+        # load of the database the note index is of, it is built again once the database was unloaded and loaded
+        self.generation = 0
+
+    def merge(self: Self, key: str, view: TreeVersion) -> MergeResult:
+        result = MergeResult()
+        dbs = self.database.dbs
+        if self.generation != self.database.generation:
+            self.notes, self.generation = _notes(dbs), self.database.generation
+        # merged into a version of its own, so views taken earlier and still working keep what they were taken from
+        merged = TreeVersion(self.database)
+        # nodes first, so every note reference resolves
+        remap = self._merge_nodes(key, view, merged, result)
+        for note in list(view.notes.values()):
+            if remap:
+                # the view is thrown away after the merge, so its notes can be filed under the nodes theirs became
+                note.node_ids = list(dict.fromkeys(remap.get(id, id) for id in note.node_ids))
+            if note.status == GitStatus.STAGED:
+                continue
+            if note.status == GitStatus.ADDED and note.id not in self.notes:
+                self._add_note(merged, note)
+                result.notes_added += 1
+                continue
+            if note.status == GitStatus.ADDED:
+                result.duplicates += 1
+            if self._merge_note(key, note, view, merged, result):
+                result.notes_modified += 1
+
+        for conflict in result.conflicts:
+            logger.warning("Conversation %s conflicts with an earlier one on the %s of note %d, keeping the earlier %s", key, conflict.field, conflict.note_id, conflict.field)
+        # published first, so what is saved is filed under the paths the databases have now
+        publish(merged)
+        for type_ in DatabaseType:
+            if merged.owns(merged.roots[type_]):
+                self.database.save_session_changes(merged.roots[type_])
+        self.notes.update(merged.notes)
+        return result
+
+    def _merge_nodes(self: Self, key: str, view: TreeVersion, merged: TreeVersion, result: MergeResult) -> dict[int, int]:
+        """
+        Create, rename and move the nodes the view did, by id. A node the view created where an earlier merge
+        created one of the same name becomes that one: those are returned, mapped to the id of the node they became.
+        A node an earlier merge renamed or moved is left where that merge put it.
+        """
+        remap: dict[int, int] = {}
+        places = view.nodes.places
+        with merged.active():
+            # parents before their children
+            for id in sorted(view.nodes.created, key=lambda id: view.nodes.path(id).count('/')):
+                parent_id, name = places[id]
+                parent = merged.node_by_id(remap.get(parent_id, parent_id), writable=True)
+                if (existing := next((child for child in parent.children if child.name == name), None)) is not None:
+                    remap[id] = existing.id
+                    continue
+                self.database.new_node(parent, name, id)
+                result.nodes_added += 1
+            for id, original in view.nodes.originals.items():
+                parent_id, name = places[id]
+                parent_id = remap.get(parent_id, parent_id)
+                if merged.nodes.place(id) != original:
+                    logger.warning("Conversation %s moved or renamed node %s, which an earlier one did too, keeping the earlier", key, merged.nodes.path(id))
+                    continue
+                try:
+                    if parent_id != original[0]:
+                        self.database.move_node(merged.nodes.path(id), merged.nodes.path(parent_id))
+                    if name != original[1]:
+                        self.database.rename_node(merged.nodes.path(id), name)
+                except ValueError as e:
+                    logger.warning("Conversation %s: %s, leaving node %s where it is", key, e, merged.nodes.path(id))
+        return remap
+
+    def _add_note(self: Self, merged: TreeVersion, note: Note):
+        # the view is thrown away after the merge, so its note object can move over as is
+        merged.adopt(note)
+        for id in note.node_ids:
+            if (node := merged.node_by_id(id, writable=True)) is not None:
+                node.notes.append(note)
+
+    def _merge_note(self: Self, key: str, note: Note, view: TreeVersion, merged: TreeVersion, result: MergeResult) -> bool:
+        base = self.notes[note.id]
+        changed = False
+
+        if (original_note := view.originals.get(note.id)) is not None:
+            original, edited, current = original_note.to_storage_string(), note.to_storage_string(), base.to_storage_string()
+            if edited != original:
+                if current == original:
+                    base = merged.note(base)
+                    base.content = list(note.content)
+                    changed = True
+                elif edited.startswith(original):
+                    # an append on top of what the view was taken with applies just as well on top of the earlier merge
+                    base = merged.note(base)
+                    base.content = base.content + [Content(text=edited[len(original):].lstrip('\n'), status=ContentStatus.ADDED)]
+                    changed = True
+                else:
+                    result.conflicts.append(NoteConflict(conversation=key, note_id=note.id, field='content', kept=current, dropped=edited))
+
+        if note.name != note.original_name and base.name != note.name:
+            if base.name == note.original_name:
+                base = merged.note(base)
+                base.change_name(note.name)
+                changed = True
+            else:
+                result.conflicts.append(NoteConflict(conversation=key, note_id=note.id, field='name', kept=base.name, dropped=note.name))
+
+        # a note created again in the view starts out with none of its references
+        new = note.status == GitStatus.ADDED
+        node_ids = _merge_references(base.node_ids, [] if new else note.og_node_ids, note.node_ids)
+        if node_ids != base.node_ids:
+            base = merged.note(base)
+            self._move(merged, base, node_ids)
+            changed = True
+        note_references = _merge_references(base.note_references, [] if new else note.og_note_references, note.note_references)
+        if note_references != base.note_references:
+            base = merged.note(base)
+            base.change_note_references(note_references)
+            changed = True
+
+        if changed and base.status == GitStatus.STAGED:
+            base.status = GitStatus.MODIFIED
+        return changed
+
+    def _move(self: Self, merged: TreeVersion, note: Note, node_ids: list[int]):
+        for id in note.node_ids:
+            if id not in node_ids and (node := merged.node_by_id(id, writable=True)) is not None:
+                node.notes = [other for other in node.notes if other is not note]
+        for id in node_ids:
+            if id not in note.node_ids and (node := merged.node_by_id(id, writable=True)) is not None:
+                node.notes.append(note)
+        note.change_references(node_ids)
+
+def _merge_references(current: list[Ref], original: list[Ref], edited: list[Ref]) -> list[Ref]:
+    """Whatever the view added is added and whatever it removed is removed, the rest is left as the earlier merges have it."""
+    removed = set(original) - set(edited)
+    merged = [ref for ref in current if ref not in removed]
+    return merged + [ref for ref in edited if ref not in original and ref not in merged]
+
+class Checkpoint(BaseModel):
+    source: str
+    done: list[str] = []                # merged conversations, in merge order
+    failed: dict[str, str] = {}         # conversations whose passes raised, retried on resume
+    # bytes of each document merged. documents are merged in order, so that is all of it up to there
+    documents: dict[str, int] = {}
+    conflicts: list[NoteConflict] = []
+
+    @classmethod
+    def load(cls, path: str, source: str) -> Self:
+        if not os.path.exists(path):
+            return cls(source=source)
+        checkpoint = cls.model_validate_json(read_file(path))
+        if os.path.abspath(checkpoint.source) != os.path.abspath(source):
+            raise ValueError(f"Checkpoint {path} belongs to {checkpoint.source}, not {source}")
+        return checkpoint
+
+    def save(self: Self, path: str):
+        # queued behind the writes of the merge it records, so it never reaches the disk before them
+        write_behind(path, self.model_dump_json(indent=4))
+
+class IngestReport(BaseModel):
+    source: str
+    workers: int
+    ingested: int = 0
+    resumed: int = 0                    # skipped, already merged by an earlier run
+    failed: int = 0
+    messages: int = 0
+    document_bytes: int = 0
+    notes_added: int = 0
+    notes_modified: int = 0
+    nodes_added: int = 0
+    duplicates: int = 0
+    conflicts: int = 0
+    input_tokens: int = 0
+    output_tokens: int = 0
+    pass_time: float = 0.0              # summed over conversations
+    pass_p50: float = 0.0
+    pass_p95: float = 0.0
+    merge_time: float = 0.0
+    wall_time: float = 0.0
+    peak_rss: int = 0                   # bytes, of the whole process
+    rollups: RollupReport | None = None
+    # per model tier, for the whole process (see dendrite.models.routing)
+    routing: RoutingReport | None = None
+
+    @property
+    def conversations_per_second(self) -> float:
+        return self.ingested / self.wall_time if self.wall_time else 0.0
+
+    @property
+    def messages_per_second(self) -> float:
+        return self.messages / self.wall_time if self.wall_time else 0.0
+
+    @property
+    def concurrency(self) -> float:
+        """Passes running at once on average, at most the number of workers."""
+        return self.pass_time / self.wall_time if self.wall_time else 0.0
+
+    def __str__(self) -> str:
+        return "\n".join([
+            f"{self.source}: {self.ingested} conversations ingested, {self.resumed} already done, {self.failed} failed ({self.workers} workers)",
+            f"  {self.conversations_per_second:.2f} conversations/s, {self.messages_per_second:.1f} messages/s, {self.wall_time:.1f}s wall, average concurrency {self.concurrency:.1f}",
+        ] + ([f"  {self.document_bytes / 2**20:.1f} MB of documents, {self.document_bytes / 2**20 / self.wall_time if self.wall_time else 0:.2f} MB/s"] if self.document_bytes else []) + [
+            f"  peak rss {self.peak_rss / 2**20:.0f} MB",
+            f"  passes: p50 {self.pass_p50:.2f}s, p95 {self.pass_p95:.2f}s, merging and saving {self.merge_time:.2f}s total",
+            f"  {self.notes_added} notes added, {self.notes_modified} modified, {self.nodes_added} nodes added, {self.duplicates} duplicates, {self.conflicts} conflicts",
+            f"  {self.input_tokens:,} input tokens, {self.output_tokens:,} output tokens",
+        ] + ([f"  {self.rollups}"] if self.rollups else []) + ([f"  model tiers, ${self.routing.cost:.2f} total:\n{self.routing}"] if self.routing else []))
+
+class Outcome(BaseModel):
+    conversation: Conversation
+    view: TreeVersion | None = None
+    error: str | None = None
+
+    class Config:
+        arbitrary_types_allowed = True
+
+class BulkIngestion:
+    """
+    Producer, workers and merger of one ingestion run. Everything runs on one event loop and merging is
+    synchronous, so a view is always taken from, and merged into, a consistent database.
+    """
+    def __init__(
+            self: Self,
+            source: str,
+            workers: int = 4,
+            checkpoint_path: str | None = None,
+            write_pass: Callable[[Conversation], WritePass] | None = None,
+            max_pending: int | None = None,
+            tenant: str = DEFAULT_TENANT,
+            rollup: ResponseClient | None = None,
+            conversations: Iterable[Conversation] | None = None
+        ):
+        self.source = source
+        # read lazily, as the workers make room for them
+        self.conversations = read_conversations(source) if conversations is None else conversations
+        self.workers = workers
+        self.checkpoint_path = checkpoint_path
+        self.checkpoint = Checkpoint.load(checkpoint_path, source) if checkpoint_path else Checkpoint(source=source)
+        # clients are built inside the worker's view, so their interfaces are bound to it
+        self.write_pass = write_pass or (lambda conversation: build_write_pass(get_config()))
+        self.tenant = tenant
+        self.merger = Merger(REGISTRY.get(tenant))
+        # summaries of the days ingested, written once every conversation is merged
+        self.rollups = Rollups(self.merger.database, rollup) if rollup else None
+        self.report = IngestReport(source=source, workers=workers)
+        self.queue: asyncio.Queue[tuple[int, Conversation] | None] = asyncio.Queue(maxsize=workers)
+        # conversations in flight or done but waiting for an earlier one to be merged
+        self.window = asyncio.Semaphore(max_pending or workers * 2)
+        self.finished: dict[int, Outcome] = {}
+        self.next_merge = 0
+        self.pass_times: list[float] = []
+
+    async def run(self: Self) -> IngestReport:
+        started = time.perf_counter()
+        # workers build their clients over the tenant's database, and it stays loaded until the run is done
+        with REGISTRY.use(self.tenant):
+            await asyncio.gather(self._produce(), *(self._work() for _ in range(self.workers)))
+            if self.rollups:
+                self.report.rollups = await self.rollups.flush()
+        await WRITER.flush()
+        self.report.wall_time = time.perf_counter() - started
+        self.report.peak_rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
+        if self.pass_times:
+            durations = sorted(self.pass_times)
+            self.report.pass_p50 = durations[len(durations) // 2]
+            self.report.pass_p95 = durations[min(len(durations) - 1, int(len(durations) * 0.95))]
+        return self.report
+
+    async def _produce(self: Self):
+        done = set(self.checkpoint.done)
+        index = 0
+        for conversation in self.conversations:
+            if conversation.key in done or (self._merged(conversation.source) and conversation.key not in self.checkpoint.failed):
+                self.report.resumed += 1
+                continue
+            await self.window.acquire()
+            await self.queue.put((index, conversation))
+            index += 1
+        for _ in range(self.workers):
+            await self.queue.put(None)
+
+    def _merged(self: Self, source: DocumentSource | None) -> bool:
+        return source is not None and source.end <= self.checkpoint.documents.get(source.document, 0)
+
+    async def _work(self: Self):
+        while (item := await self.queue.get()) is not None:
+            index, conversation = item
+            started = time.perf_counter()
+            view = TreeVersion(self.merger.database)
+            try:
+                with view.active():
+                    write_clients = self.write_pass(conversation)
+                    start_recording(write_clients, conversation.key)
+                    await schedule_write_pass(conversation.conversation, write_clients, now=conversation.date, save=False, session=conversation.source is None).run()
+                    save_recordings(write_clients)
+                if conversation.source is not None:
+                    # the view's own copies, merged as they are
+                    for note in view.notes.values():
+                        if note.status == GitStatus.ADDED:
+                            note.sources = note.sources + [str(conversation.source)]
+                outcome = Outcome(conversation=conversation, view=view)
+            except Exception as e:
+                logger.warning("Write pass of conversation %s failed: %s", conversation.key, e)
+                outcome = Outcome(conversation=conversation, error=f"{type(e).__name__}: {e}")
+            else:
+                for client in write_pass_clients(write_clients).values():
+                    if isinstance(client, InterfaceClient):
+                        self.report.input_tokens += sum(usage.input_tokens for usage in client.usage)
+                        self.report.output_tokens += sum(usage.output_tokens for usage in client.usage)
+            self.pass_times.append(time.perf_counter() - started)
+            self.report.pass_time += self.pass_times[-1]
+            self.finished[index] = outcome
+            self._merge_ready()
+
+    def _merge_ready(self: Self):
+        """Merge every finished conversation whose predecessors are all merged."""
+        while (outcome := self.finished.pop(self.next_merge, None)) is not None:
+            key = outcome.conversation.key
+            if outcome.view is None:
+                self.checkpoint.failed[key] = outcome.error
+                self.report.failed += 1
+            else:
+                started = time.perf_counter()
+                result = self.merger.merge(key, outcome.view)
+                self.report.merge_time += time.perf_counter() - started
+                if self.rollups:
+                    self.rollups.mark(session_days(outcome.view.notes.values()))
+                if outcome.conversation.source is None:
+                    self.checkpoint.done.append(key)
+                else:
+                    # a key per part of a document would make every checkpoint write as long as the documents so far
+                    source = outcome.conversation.source
+                    self.checkpoint.documents[source.document] = max(source.end, self.checkpoint.documents.get(source.document, 0))
+                    self.report.document_bytes += source.end - source.start
+                self.checkpoint.failed.pop(key, None)
+                self.checkpoint.conflicts.extend(result.conflicts)
+                self.report.ingested += 1
+                self.report.messages += len(outcome.conversation.messages)
+                self.report.notes_added += result.notes_added
+                self.report.notes_modified += result.notes_modified
+                self.report.nodes_added += result.nodes_added
+                self.report.duplicates += result.duplicates
+                self.report.conflicts += len(result.conflicts)
+            if self.checkpoint_path:
+                self.checkpoint.save(self.checkpoint_path)
+            self.next_merge += 1
+            self.window.release()
+
+async def ingest(
+        source: str,
+        workers: int = 4,
+        checkpoint_path: str | None = None,
+        write_pass: Callable[[Conversation], WritePass] | None = None,
+        tenant: str = DEFAULT_TENANT,
+        rollup: ResponseClient | None = None
+    ) -> IngestReport:
+    return await BulkIngestion(source, workers, checkpoint_path, write_pass, tenant=tenant, rollup=rollup).run()
+
+def main():
+    parser = argparse.ArgumentParser(description="Run write passes over many conversations concurrently and merge them into the database in order.")
+    parser.add_argument('source', help="directory of conversation json files, or a jsonl file with one conversation per line")
+    parser.add_argument('--workers', type=int, default=4, help="conversations processed at once")
+    parser.add_argument('--tenant', default=DEFAULT_TENANT, help="whose database to ingest into, see DENDRITE_TENANTS_ROOT")
+    parser.add_argument('--checkpoint', help="progress file; an interrupted run resumes from it")
+    parser.add_argument('--json', help="also write the report to this file")
+    parser.add_argument('--log-level', default='INFO')
+    args = parser.parse_args()
+
+    configure_logging(args.log_level)
+    report = asyncio.run(ingest(args.source, args.workers, args.checkpoint, tenant=args.tenant, rollup=build_rollup(get_config())))
+    report.routing = get_router().report()
+    print(report)
+    if args.json:
+        with open(args.json, 'w', encoding='utf-8') as file:
+            file.write(report.model_dump_json(indent=4))
+
+if __name__ == '__main__':
+    main()
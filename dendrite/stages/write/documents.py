@@ -0,0 +1,184 @@
+"""
+Document ingestion. Streams documents (markdown, plain text or JSONL) through a chunker and the parts it cuts
+through write passes, the way dendrite/stages/write/bulk.py does conversations: a bounded number of workers, each
+on a view of its own, merged back in document order.
+
+    python -m dendrite.stages.write.documents ./docs --workers 8 --checkpoint ./docs.json
+    python -m dendrite.stages.write.documents ./export.jsonl --chunk-bytes 16000
+
+A directory is read recursively, every .md, .markdown, .txt and .jsonl file in path order. Documents are read a
+line at a time (a line longer than a chunk in pieces) and never held whole: at most a chunk per worker, and as
+many again waiting to be merged, is in memory at once, and reading waits for the workers to make room.
+
+A chunk is cut at most --chunk-bytes long and, once it is half that, before a paragraph, a markdown heading or a
+JSONL record. Chunks of markdown carry the headings they fall under. Each chunk is written like a conversation
+made of a single message, except that it isn't summarized or filed under a day, and the notes it adds record
+the part of the document they were taken from (Note.sources, document@start-end in bytes).
+
+The checkpoint keeps how far into each document has been merged, so an interrupted run picks up there, as long as
+it cuts the same chunks (the same --chunk-bytes).
+"""
+import argparse
+import asyncio
+import os
+from typing import BinaryIO, Callable, Iterator
+from pydantic import BaseModel
+from dendrite.db.io import DEFAULT_TENANT
+from dendrite.models.routing import get_router
+from dendrite.stages.write.bulk import BulkIngestion, Conversation, DocumentSource, IngestReport
+from dendrite.utils.config import WritePass
+from dendrite.utils.tracing import configure_logging
+
+CHUNK_BYTES = int(os.getenv("DENDRITE_CHUNK_BYTES", "8000"))
+FORMATS = {'.md': 'markdown', '.markdown': 'markdown', '.txt': 'text', '.jsonl': 'jsonl'}
+
+class DocumentChunk(BaseModel):
+    document: str
+    start: int                          # bytes
+    end: int
+    first_line: int
+    last_line: int
+    headings: list[str] = []            # markdown headings the chunk starts under, outermost first
+    text: str
+
+    @property
+    def source(self) -> DocumentSource:
+        return DocumentSource(document=self.document, start=self.start, end=self.end)
+
+    def to_conversation(self) -> Conversation:
+        section = f'\n<section>{" > ".join(self.headings)}</section>' if self.headings else ""
+        message = (
+            f'<document source="{self.document}" lines="{self.first_line}-{self.last_line}">{section}\n'
+            f'{self.text.strip()}\n'
+            f'</document>'
+        )
+        return Conversation(key=str(self.source), messages=[{'role': 'user', 'content': message}], source=self.source)
+
+def document_format(path: str) -> str | None:
+    return FORMATS.get(os.path.splitext(path)[1].lower())
+
+def find_documents(source: str) -> list[str]:
+    if not os.path.isdir(source):
+        return [source]
+    found = []
+    for folder, folders, file_names in os.walk(source):
+        folders.sort()
+        found += [os.path.join(folder, name) for name in sorted(file_names) if document_format(name)]
+    return found
+
+def chunk_document(path: str, name: str | None = None, chunk_bytes: int = CHUNK_BYTES) -> Iterator[DocumentChunk]:
+    """The chunks of a document in order, read as they are needed."""
+    format = document_format(path) or 'text'
+    name = name or os.path.basename(path)
+    lines: list[bytes] = []
+    size, start, line_number, first_line = 0, 0, 1, 1
+    headings: list[str] = []
+    chunk_headings: list[str] = []
+    fenced = False
+
+    def chunk() -> DocumentChunk:
+        # a chunk ending in the middle of a long line ends on that line
+        last_line = line_number - 1 if lines[-1].endswith(b'\n') else line_number
+        text = b"".join(lines).decode('utf-8', errors='replace')
+        return DocumentChunk(document=name, start=start, end=start + size, first_line=first_line, last_line=last_line, headings=chunk_headings, text=text)
+
+    with open(path, 'rb') as file:
+        for line in _lines(file, chunk_bytes):
+            starts_line = not lines or lines[-1].endswith(b'\n')
+            heading = None
+            if format == 'markdown' and starts_line:
+                if line.lstrip().startswith((b'```', b'~~~')):
+                    fenced = not fenced
+                elif not fenced:
+                    heading = _heading(line)
+            if lines and (size + len(line) > chunk_bytes or (size >= chunk_bytes // 2 and starts_line and (heading or _boundary(line, format)))):
+                yield chunk()
+                lines, start, size, first_line = [], start + size, 0, line_number
+                chunk_headings = list(headings)
+            lines.append(line)
+            size += len(line)
+            if heading:
+                level, title = heading
+                headings = headings[:level - 1] + [title]
+            if line.endswith(b'\n'):
+                line_number += 1
+        if lines:
+            yield chunk()
+
+def read_documents(source: str, chunk_bytes: int = CHUNK_BYTES) -> Iterator[Conversation]:
+    """Every chunk of every document under source as a conversation, named by its path under source."""
+    root = source if os.path.isdir(source) else os.path.dirname(source)
+    for path in find_documents(source):
+        for chunk in chunk_document(path, os.path.relpath(path, root), chunk_bytes):
+            yield chunk.to_conversation()
+
+def _lines(file: BinaryIO, limit: int) -> Iterator[bytes]:
+    """Lines of a file, those longer than limit in pieces of about limit bytes that don't split a character."""
+    carry = b''
+    while True:
+        read = file.readline(limit)
+        piece = carry + read
+        if not piece:
+            return
+        carry = b''
+        if read and not piece.endswith(b'\n'):
+            cut = _complete(piece)
+            piece, carry = piece[:cut], piece[cut:]
+        if piece:
+            yield piece
+
+def _complete(piece: bytes) -> int:
+    """Length of piece without the character its end cuts in half, if it does."""
+    for back in range(1, min(4, len(piece)) + 1):
+        byte = piece[-back]
+        if byte & 0xC0 == 0x80:
+            # continuation byte, the character started further back
+            continue
+        needed = 1 if byte < 0x80 else 2 if byte < 0xE0 else 3 if byte < 0xF0 else 4
+        return len(piece) - back if needed > back else len(piece)
+    return len(piece)
+
+def _heading(line: bytes) -> tuple[int, str] | None:
+    if not line.startswith(b'#'):
+        return None
+    marks = len(line) - len(line.lstrip(b'#'))
+    if marks > 6 or line[marks:marks + 1] not in (b' ', b'\t'):
+        return None
+    return marks, line[marks:].strip().decode('utf-8', errors='replace')
+
+def _boundary(line: bytes, format: str) -> bool:
+    """Whether a chunk can end before this line: before a paragraph, or before any record of JSONL."""
+    return format == 'jsonl' or not line.strip()
+
+async def ingest_documents(
+        source: str,
+        workers: int = 4,
+        checkpoint_path: str | None = None,
+        write_pass: Callable[[Conversation], WritePass] | None = None,
+        tenant: str = DEFAULT_TENANT,
+        chunk_bytes: int = CHUNK_BYTES
+    ) -> IngestReport:
+    ingestion = BulkIngestion(source, workers, checkpoint_path, write_pass, tenant=tenant, conversations=read_documents(source, chunk_bytes))
+    return await ingestion.run()
+
+def main():
+    parser = argparse.ArgumentParser(description="Run write passes over the chunks of large documents concurrently and merge them into the database in order.")
+    parser.add_argument('source', help="a document (.md, .markdown, .txt or .jsonl) or a directory of them")
+    parser.add_argument('--workers', type=int, default=4, help="chunks processed at once")
+    parser.add_argument('--chunk-bytes', type=int, default=CHUNK_BYTES, help="longest chunk, see DENDRITE_CHUNK_BYTES")
+    parser.add_argument('--tenant', default=DEFAULT_TENANT, help="whose database to ingest into, see DENDRITE_TENANTS_ROOT")
+    parser.add_argument('--checkpoint', help="progress file; an interrupted run resumes from it")
+    parser.add_argument('--json', help="also write the report to this file")
+    parser.add_argument('--log-level', default='INFO')
+    args = parser.parse_args()
+
+    configure_logging(args.log_level)
+    report = asyncio.run(ingest_documents(args.source, args.workers, args.checkpoint, tenant=args.tenant, chunk_bytes=args.chunk_bytes))
+    report.routing = get_router().report()
+    print(report)
+    if args.json:
+        with open(args.json, 'w', encoding='utf-8') as file:
+            file.write(report.model_dump_json(indent=4))
+
+if __name__ == '__main__':
+    main()
@@ -1,52 +1,133 @@
-from dendrite.utils.config import get_config, get_client_set, TemporalPass
-from dendrite.db.io import DatabaseType
-from dendrite.interface.types import Note, Content, ContentStatus
+from dendrite.utils.config import build_rollup, get_config, get_client_set, TemporalPass, WritePass
+from dendrite.db.io import Database, DatabaseType, current_database
+from dendrite.interface.types import Note, Content, ContentStatus, GitStatus, content_id
 from dendrite.models.client_implementations.interface.openai import OpenAIInterfaceClient
 from dendrite.models.client_implementations.response.openai import OpenAIResponseClient
 from dendrite.models.client_implementations.provider_utils.openai.utils import read_convo_from_file
 from dendrite.models.interface_client import InterfaceClient
 from dendrite.models.response_client import ResponseClient
+from dendrite.models.recording import Recording, RECORD_DIR
+from dendrite.models.routing import get_router
+from dendrite.interface.interface import Interface
+from dendrite.stages.write.rollup import Rollups, session_days
+from dendrite.stages.write.scheduler import PassScheduler, ScheduleReport
+from dendrite.utils.file import WRITER
+from dendrite.utils.tracing import TRACER, TraceSummary
 
 from openai.types.responses.response_input_param import EasyInputMessageParam
 from pydantic import BaseModel
 from datetime import datetime
+import logging
+import os
 
-class TemporalPass(BaseModel):
-    summarizer: ResponseClient
-    tagger: InterfaceClient
+logger = logging.getLogger(__name__)
 
-# No need for WritePass class, just use the dict
+async def summarize_session(conversation: list[EasyInputMessageParam], temporal: TemporalPass) -> str:
+    return await temporal.summarizer.get_response(conversation=conversation)
 
-async def run_temporal_pass(conversation: list[EasyInputMessageParam], temporal: TemporalPass, previous_notes: list[Note]):
+async def run_temporal_pass(conversation: list[EasyInputMessageParam], temporal: TemporalPass, previous_notes: list[Note], summary: str | None = None, now: datetime | None = None) -> Note:
     summarizer, tagger = temporal.summarizer, temporal.tagger
     interface = tagger.mcp_instance.interface
 
-    summary = await summarizer.get_response(conversation=conversation)
+    if summary is None:
+        summary = await summarize_session(conversation, temporal)
 
-    now = datetime.now()
-    year = str(now.year)
-    month = f"{now.month:02d}"
-    day = f"{now.day:02d}"
-    temporal_path = f"{DatabaseType.TEMPORAL.value}/{year}/{month}/{day}"
+    now = now or datetime.now()
+    date_parts = [str(now.year), f"{now.month:02d}", f"{now.day:02d}"]
+    _ensure_nodes(interface, date_parts)
+    temporal_path = "/".join([DatabaseType.TEMPORAL.value] + date_parts)
     interface.open_node(temporal_path)
-    temporal_node = interface.explorer.node
 
     session_note = Note(
-        db_type=DatabaseType.TEMPORAL,
-        id=hash(summary),
+        id=content_id(summary),
         read_only=True,
         name=f"Session",
         content=[
             Content(text=summary, status=ContentStatus.ADDED)
         ],
-        node_references=[temporal_node],
-        note_references=previous_notes,
-        status=ContentStatus.STAGED
+        node_ids=[],
+        note_references=[str(note.id) for note in previous_notes],
+        status=GitStatus.ADDED
     )
-    tagger.mcp_instance.interface.explorer.create_note_direct(session_note)
-    tagger.process_convo(conversation=conversation)
+    tagger.mcp_instance.interface.explorer.create_note_direct(session_note, [temporal_path])
+    await tagger.process_convo(conversation=conversation)
+    return session_note
 
-async def run_write_pass(conversation_path: str):
+def _ensure_nodes(interface: Interface, names: list[str]):
+    """Scaffold whatever part of the path below the database root doesn't exist yet (e.g. the first session of a day)."""
+    node, path = interface.db, [interface.db_type.value]
+    for i, name in enumerate(names):
+        child = next((child for child in node.children if child.name == name), None)
+        if child is None:
+            scaffolding = {}
+            for missing in reversed(names[i:]):
+                scaffolding = {missing: scaffolding}
+            interface.generate_scaffolding("/".join(path), scaffolding)
+            return
+        node = child
+        path.append(name)
+
+def _tie_reads(client: InterfaceClient, pass_names: dict[DatabaseType, str]) -> list[str]:
+    tie_interface = client.mcp_instance.tie_interface
+    return [pass_names[tie_interface.db_type]] if tie_interface and tie_interface.db_type in pass_names else []
+
+def schedule_write_pass(conversation: list[EasyInputMessageParam], write_clients: WritePass, now: datetime | None = None, save: bool = True, session: bool = True) -> PassScheduler:
+    temporal = write_clients.get(DatabaseType.TEMPORAL)
+    if session and not isinstance(temporal, TemporalPass):
+        raise ValueError("The temporal pass needs both a summarizer and a tagger.")
+    conceptual, concrete = write_clients[DatabaseType.CONCEPTUAL], write_clients[DatabaseType.CONCRETE]
+    pass_names = {DatabaseType.CONCEPTUAL: 'conceptual', DatabaseType.CONCRETE: 'concrete', DatabaseType.TEMPORAL: 'temporal.tag'}
+
+    scheduler = PassScheduler()
+    scheduler.add('conceptual', lambda: conceptual.process_convo(conversation=conversation), tie_reads=_tie_reads(conceptual, pass_names))
+    scheduler.add('concrete', lambda: concrete.process_convo(conversation=conversation), tie_reads=_tie_reads(concrete, pass_names))
+    passes = ['conceptual', 'concrete']
+    # what isn't a session (e.g. part of a document) isn't summarized or filed under a day
+    if session:
+        # the summarizer only needs the conversation, so it runs alongside the interface passes
+        scheduler.add('temporal.summarize', lambda: summarize_session(conversation, temporal))
+        scheduler.add(
+            'temporal.tag',
+            lambda: run_temporal_pass(
+                conversation=conversation,
+                temporal=temporal,
+                previous_notes=concrete.mcp_instance.interface.opened.open_notes,
+                summary=scheduler.result('temporal.summarize'),
+                now=now
+            ),
+            # session note links to the concrete notes opened during the concrete pass
+            depends_on=['temporal.summarize', 'concrete'],
+            tie_reads=_tie_reads(temporal.tagger, pass_names)
+        )
+        passes.append('temporal.tag')
+    # notes are written as they are created, edits and new nodes only once every pass is done.
+    # without the save step the changes stay in memory, e.g. for a bulk ingestion worker to merge them
+    if save:
+        database = conceptual.mcp_instance.interface.database
+        scheduler.add('save', lambda: save_write_pass(database), depends_on=passes)
+    return scheduler
+
+async def save_write_pass(database: Database):
+    dbs = database.roots()
+    for type_ in DatabaseType:
+        database.save_session_changes(dbs[type_])
+    # the pass is saved once its writes are on disk, not when they are queued
+    await WRITER.flush()
+
+def write_pass_clients(write_clients: WritePass) -> dict[str, InterfaceClient | ResponseClient]:
+    """Every client of a write pass, by the name of the step that uses it."""
+    temporal = write_clients.get(DatabaseType.TEMPORAL)
+    clients = {
+        'conceptual': write_clients[DatabaseType.CONCEPTUAL],
+        'concrete': write_clients[DatabaseType.CONCRETE],
+    }
+    # passes over what isn't a session can do without one
+    if isinstance(temporal, TemporalPass):
+        clients['temporal.summarize'] = temporal.summarizer
+        clients['temporal.tag'] = temporal.tagger
+    return clients
+
+async def run_write_pass(conversation_path: str) -> ScheduleReport:
     write_clients = get_client_set().write_pass
     if get_config().id != 'openai_write':
         raise ValueError("run_write_pass only works with OpenAI write configuration.")
@@ -55,13 +136,31 @@ async def run_write_pass(conversation_path: str):
     if not isinstance((temporal := write_clients[DatabaseType.TEMPORAL]), TemporalPass) or not isinstance(temporal.summarizer, OpenAIResponseClient) or not isinstance(temporal.tagger, OpenAIInterfaceClient) or not isinstance(write_clients[DatabaseType.CONCEPTUAL], OpenAIInterfaceClient) or not isinstance(write_clients[DatabaseType.CONCRETE], OpenAIInterfaceClient):
         raise ValueError("run_write_pass requires specific client types for Temporal, Concrete, and Conceptual passes.")
 
+    session = os.path.splitext(os.path.basename(conversation_path))[0]
+    start_recording(write_clients, session)
+    with TRACER.trace() as trace:
+        scheduler = schedule_write_pass(conversation, write_clients)
+        report = await scheduler.run()
+        # the session is saved by now, so its day, month and year summaries can be brought up to date
+        if (rollup := build_rollup(get_config())) is not None:
+            rollups = Rollups(current_database(), rollup)
+            rollups.mark(session_days([scheduler.result('temporal.tag')]))
+            await rollups.flush()
+            await WRITER.flush()
+    logger.info("Write pass finished:\n%s\n%s\nModel tiers so far:\n%s", report, TraceSummary.of(list(trace.spans), trace.trace_id), get_router().report())
+    save_recordings(write_clients)
+    return report
+
+def start_recording(write_clients: WritePass, session: str):
+    """Record every client of the pass as <session>.<step> when DENDRITE_RECORD_DIR is set."""
+    if not RECORD_DIR:
+        return
+    for name, client in write_pass_clients(write_clients).items():
+        client.recording = Recording(name=f"{session}.{name}")
 
-    for db_type in [DatabaseType.CONCRETE, DatabaseType.CONCEPTUAL, DatabaseType.TEMPORAL]:
-        client = write_clients[db_type]
-        print(f'Running {db_type.name} pass ...')
-        if db_type == DatabaseType.CONCEPTUAL:
-            await client.process_convo(conversation=conversation)
-        elif db_type == DatabaseType.CONCRETE:
-            await client.process_convo(conversation=conversation)
-        elif db_type == DatabaseType.TEMPORAL:
-            await run_temporal_pass(conversation=conversation, temporal=temporal, previous_notes=write_clients[DatabaseType.CONCRETE].mcp_instance.interface.opened.open_notes)
+def save_recordings(write_clients: WritePass):
+    if not RECORD_DIR:
+        return
+    for client in write_pass_clients(write_clients).values():
+        if client.recording is not None:
+            logger.info("Recorded session to %s", client.recording.save(RECORD_DIR))
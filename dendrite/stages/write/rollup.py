@@ -0,0 +1,226 @@
+"""
+Day, month and year summaries of the temporal database. Each write pass files a session summary under its day
+node, so anything about a month or a year meant opening every session in it. Rollups keep a read only summary
+note under every month and year node, and under every day with more than one session, up to date as sessions
+land; a day with a single session is summarized by that session.
+
+Only the summaries above the days that changed are written again, and everything one year needs is asked for in
+a single summarizer call: the sessions of each changed day, the summaries of the other days of its month and
+those of the other months of the year. Days marked while a call runs are summarized by the next one.
+
+    python -m dendrite.stages.write.rollup --tenant alice --start 2025-01 --end 2025-03
+"""
+import argparse
+import asyncio
+import logging
+import re
+from datetime import date
+from itertools import groupby
+from typing import Iterable, Self
+from pydantic import BaseModel
+from dendrite.db.io import DEFAULT_TENANT, REGISTRY, Database, DatabaseType, TreeVersion, publish
+from dendrite.db.temporal import DAY_SUMMARY, MONTH_SUMMARY, YEAR_SUMMARY, TEMPORAL, day_path, is_rollup, parse_bound, parse_day_path
+from dendrite.interface.components import _parse_path
+from dendrite.interface.types import Content, ContentStatus, GitStatus, Node, Note, content_id
+from dendrite.models.response_client import ResponseClient
+from dendrite.utils.config import build_rollup, get_config
+from dendrite.utils.file import WRITER
+from dendrite.utils.tracing import TRACER, configure_logging
+
+logger = logging.getLogger(__name__)
+
+SUMMARY = re.compile(r'<summary path="([^"]+)">\s*(.*?)\s*</summary>', re.DOTALL)
+
+def session_days(notes: Iterable[Note]) -> set[date]:
+    """Days the notes are filed under, rollups aside, e.g. of the notes a version created or changed."""
+    return {
+        day
+        for note in notes if not is_rollup(note)
+        for ref in note.node_references if (day := parse_day_path(ref)) is not None
+    }
+
+class RollupReport(BaseModel):
+    calls: int = 0
+    days: int = 0                       # day summaries written
+    months: int = 0
+    years: int = 0
+    missing: int = 0                    # summaries asked for but not in the answer, left as they were
+    failed: int = 0                     # years whose call failed, left as they were
+
+    def __str__(self) -> str:
+        return f"{self.calls} rollup calls: {self.days} days, {self.months} months, {self.years} years summarized, {self.missing} missing, {self.failed} failed"
+
+class Rollups:
+    """Rollups of one database. mark() the days that changed once they are in the database, then flush()."""
+    def __init__(self: Self, database: Database, summarizer: ResponseClient):
+        self.database = database
+        self.summarizer = summarizer
+        self.pending: set[date] = set()
+        self.lock = asyncio.Lock()
+        self.report = RollupReport()
+
+    def mark(self: Self, days: Iterable[date]):
+        self.pending.update(days)
+
+    async def flush(self: Self) -> RollupReport:
+        # a flush that has to wait for the running one usually finds its days summarized already
+        async with self.lock:
+            while self.pending:
+                days, self.pending = self.pending, set()
+                for year in sorted({day.year for day in days}):
+                    await self._update_year(year, sorted(day for day in days if day.year == year))
+        return self.report
+
+    async def _update_year(self: Self, year: int, days: list[date]):
+        year_node = _child(self.database.dbs[DatabaseType.TEMPORAL], str(year))
+        if year_node is None:
+            return
+        year_path = f"{TEMPORAL}/{year}"
+        # paths to summarize, by the name of their summary note, in the order they are written
+        asked: dict[str, str] = {}
+        blocks: list[str] = []
+        for month, month_days in groupby(days, key=lambda day: f"{day.month:02d}"):
+            if (month_node := _child(year_node, month)) is None:
+                continue
+            for day in month_days:
+                day_node = _child(month_node, f"{day.day:02d}")
+                if day_node is None or len(sessions := _sessions(day_node)) < 2:
+                    continue
+                asked[day_path(day)] = DAY_SUMMARY
+                blocks.append(_block('day', day_path(day), [_block('session', str(note.id), text=note.to_storage_string()) for note in sessions]))
+            month_path = f"{year_path}/{month}"
+            asked[month_path] = MONTH_SUMMARY
+            month_blocks = []
+            for day_node in sorted(month_node.children, key=lambda node: node.name):
+                path = f"{month_path}/{day_node.name}"
+                month_blocks.append(_block('day', path, updated=True) if path in asked else _block('day', path, text=_day_text(day_node)))
+            blocks.append(_block('month', month_path, month_blocks))
+        asked[year_path] = YEAR_SUMMARY
+        year_blocks = []
+        for month_node in sorted(year_node.children, key=lambda node: node.name):
+            path = f"{year_path}/{month_node.name}"
+            if path in asked:
+                year_blocks.append(_block('month', path, updated=True))
+            elif (note := _rollup(month_node, MONTH_SUMMARY)) is not None:
+                year_blocks.append(_block('month', path, text=note.to_storage_string()))
+        blocks.append(_block('year', year_path, year_blocks))
+
+        with TRACER.span('temporal.rollup', year=year, days=len(days), summaries=len(asked)):
+            try:
+                answer = await self.summarizer.get_response(conversation=[{'role': 'user', 'content': _block('rollup', year_path, blocks)}])
+            except Exception as e:
+                logger.warning("Rollup of %d failed, its summaries are left as they were: %s", year, e)
+                self.report.failed += 1
+                return
+        self.report.calls += 1
+        summaries = dict(SUMMARY.findall(answer))
+        if missing := [path for path in asked if path not in summaries]:
+            logger.warning("Rollup of %d left out %s, keeping what they had", year, ", ".join(missing))
+            self.report.missing += len(missing)
+        # applied on what the database is now, not what it was when the call was made
+        self._apply({path: (name, summaries[path]) for path, name in asked.items() if path in summaries})
+
+    def _apply(self: Self, summaries: dict[str, tuple[str, str]]):
+        version = TreeVersion(self.database)
+        with version.active():
+            for path, (name, text) in summaries.items():
+                try:
+                    node, _ = _parse_path(path, version.roots[DatabaseType.TEMPORAL], writable=True, database=self.database)
+                except ValueError:
+                    # e.g. a day node renamed while the call ran
+                    continue
+                self._write(node, path, name, text, _references(node, name))
+                if name == DAY_SUMMARY:
+                    self.report.days += 1
+                elif name == MONTH_SUMMARY:
+                    self.report.months += 1
+                else:
+                    self.report.years += 1
+        # published first, so what is saved is filed under the paths the databases have now
+        publish(version)
+        root = version.roots[DatabaseType.TEMPORAL]
+        if version.owns(root):
+            self.database.save_session_changes(root)
+
+    def _write(self: Self, node: Node, path: str, name: str, text: str, references: list[str]):
+        if (note := _rollup(node, name)) is None:
+            node.notes.append(self.database.adopt(Note(
+                id=content_id(name, path),
+                read_only=True,
+                name=name,
+                content=[Content(text=text, status=ContentStatus.ADDED)],
+                node_ids=[node.id],
+                note_references=references,
+                status=GitStatus.ADDED
+            )))
+            return
+        note = self.database.own_note(note)
+        note.content = [Content(text=text, status=ContentStatus.ADDED)]
+        note.note_references = references
+        if note.status == GitStatus.STAGED:
+            note.status = GitStatus.MODIFIED
+
+def _child(node: Node, name: str) -> Node | None:
+    return next((child for child in node.children if child.name == name), None)
+
+def _rollup(node: Node, name: str) -> Note | None:
+    return next((note for note in node.notes if note.read_only and note.name == name), None)
+
+def _sessions(day_node: Node) -> list[Note]:
+    return [note for note in day_node.notes if not is_rollup(note)]
+
+def _day_text(day_node: Node) -> str:
+    if (note := _rollup(day_node, DAY_SUMMARY)) is not None:
+        return note.to_storage_string()
+    return "\n\n".join(note.to_storage_string() for note in _sessions(day_node))
+
+def _references(node: Node, name: str) -> list[str]:
+    """A day summary references its sessions, a month or year summary the summaries of its days or months."""
+    if name == DAY_SUMMARY:
+        return [str(note.id) for note in _sessions(node)]
+    child_summary = DAY_SUMMARY if name == MONTH_SUMMARY else MONTH_SUMMARY
+    references = []
+    for child in sorted(node.children, key=lambda child: child.name):
+        if (note := _rollup(child, child_summary)) is not None:
+            references.append(str(note.id))
+        elif name == MONTH_SUMMARY and len(sessions := _sessions(child)) == 1:
+            references.append(str(sessions[0].id))
+    return references
+
+def _block(tag: str, path: str, children: list[str] = (), text: str | None = None, updated: bool = False) -> str:
+    attribute = 'id' if tag == 'session' else 'path'
+    if updated:
+        return f'<{tag} {attribute}="{path}" updated="true"/>'
+    body = "\n".join(children) if text is None else text
+    return f'<{tag} {attribute}="{path}">\n{body}\n</{tag}>'
+
+async def rollup(tenant: str, start: date | None = None, end: date | None = None) -> RollupReport:
+    """Summarize every day with sessions from start to end again, a month at a time to keep the calls small."""
+    if (summarizer := build_rollup(get_config())) is None:
+        raise ValueError("No rollup model configured, see TemporalPassConfig.rollup")
+    with REGISTRY.use(tenant) as database:
+        rollups = Rollups(database, summarizer)
+        entries = database.temporal.range(start, end)
+        for _, month_entries in groupby(entries, key=lambda entry: (entry.day.year, entry.day.month)):
+            rollups.mark(entry.day for entry in month_entries)
+            await rollups.flush()
+        await WRITER.flush()
+    return rollups.report
+
+def main():
+    parser = argparse.ArgumentParser(description="Write the day, month and year summaries of the temporal database again.")
+    parser.add_argument('--tenant', default=DEFAULT_TENANT)
+    parser.add_argument('--start', help="YYYY, YYYY-MM or YYYY-MM-DD")
+    parser.add_argument('--end', help="YYYY, YYYY-MM or YYYY-MM-DD, included")
+    parser.add_argument('--log-level', default='INFO')
+    args = parser.parse_args()
+
+    configure_logging(args.log_level)
+    print(asyncio.run(rollup(
+        args.tenant,
+        parse_bound(args.start) if args.start else None,
+        parse_bound(args.end, end=True) if args.end else None
+    )))
+
+if __name__ == '__main__':
+    main()
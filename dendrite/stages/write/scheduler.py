@@ -0,0 +1,130 @@
+import asyncio
+import time
+from typing import Any, Awaitable, Callable, Self
+from pydantic import BaseModel
+from dendrite.utils.tracing import TRACER
+
+StepRunner = Callable[[], Awaitable[Any]]
+
+class PassStep(BaseModel):
+    name: str
+    run: StepRunner
+    # steps whose results this step consumes
+    depends_on: list[str] = []
+    # steps whose interface this step reads through its tie interface
+    tie_reads: list[str] = []
+
+    class Config:
+        arbitrary_types_allowed = True
+
+    @property
+    def dependencies(self) -> list[str]:
+        return self.depends_on + [name for name in self.tie_reads if name not in self.depends_on]
+
+class StepTiming(BaseModel):
+    name: str
+    start: float
+    end: float
+
+    @property
+    def duration(self) -> float:
+        return self.end - self.start
+
+class ScheduleReport(BaseModel):
+    timings: dict[str, StepTiming]
+    critical_path: list[str]
+    wall_time: float
+
+    @property
+    def critical_path_time(self) -> float:
+        return sum(self.timings[name].duration for name in self.critical_path)
+
+    def __str__(self) -> str:
+        lines = [f"wall time: {self.wall_time:.2f}s, critical path: {self.critical_path_time:.2f}s ({' -> '.join(self.critical_path)})"]
+        for timing in sorted(self.timings.values(), key=lambda t: t.start):
+            marker = "*" if timing.name in self.critical_path else " "
+            lines.append(f"  {marker} {timing.name}: {timing.duration:.2f}s")
+        return "\n".join(lines)
+
+class PassScheduler:
+    """
+    Runs write pass steps as a DAG. Every step starts as soon as all of its dependencies
+    (including the passes whose interface it reads as a tie) have finished, so independent
+    passes and LLM calls overlap and the end-to-end latency is bounded by the longest chain.
+    """
+    def __init__(self: Self):
+        self.steps: dict[str, PassStep] = {}
+        self.results: dict[str, Any] = {}
+        self.timings: dict[str, StepTiming] = {}
+
+    def add(self: Self, name: str, run: StepRunner, depends_on: list[str] = [], tie_reads: list[str] = []) -> Self:
+        if name in self.steps:
+            raise ValueError(f"Step '{name}' is already scheduled.")
+        self.steps[name] = PassStep(name=name, run=run, depends_on=list(depends_on), tie_reads=list(tie_reads))
+        return self
+
+    def result(self: Self, name: str) -> Any:
+        if name not in self.results:
+            raise ValueError(f"Step '{name}' has not finished yet.")
+        return self.results[name]
+
+    async def run(self: Self) -> ScheduleReport:
+        order = self._topological_order()
+        tasks: dict[str, asyncio.Task] = {}
+        started = time.perf_counter()
+
+        async def run_step(step: PassStep):
+            await asyncio.gather(*(tasks[dep] for dep in step.dependencies))
+            start = time.perf_counter()
+            self.results[step.name] = await step.run()
+            self.timings[step.name] = StepTiming(name=step.name, start=start - started, end=time.perf_counter() - started)
+            TRACER.emit('pass.step', self.timings[step.name].duration, step=step.name)
+
+        # dependencies always come first in the order so their tasks exist when awaited
+        for name in order:
+            tasks[name] = asyncio.create_task(run_step(self.steps[name]), name=name)
+
+        try:
+            await asyncio.gather(*tasks.values())
+        except BaseException:
+            for task in tasks.values():
+                task.cancel()
+            raise
+
+        return ScheduleReport(
+            timings=dict(self.timings),
+            critical_path=self._critical_path(),
+            wall_time=time.perf_counter() - started
+        )
+
+    def _topological_order(self: Self) -> list[str]:
+        order: list[str] = []
+        visiting: set[str] = set()
+
+        def visit(name: str, chain: list[str]):
+            if name in order:
+                return
+            if name in visiting:
+                raise ValueError(f"Dependency cycle between write pass steps: {' -> '.join(chain + [name])}")
+            if name not in self.steps:
+                raise ValueError(f"Step '{chain[-1]}' depends on unknown step '{name}'.")
+            visiting.add(name)
+            for dep in self.steps[name].dependencies:
+                visit(dep, chain + [name])
+            visiting.discard(name)
+            order.append(name)
+
+        for name in self.steps:
+            visit(name, [])
+        return order
+
+    def _critical_path(self: Self) -> list[str]:
+        if not self.timings:
+            return []
+        # walk back from the step that finished last through whichever dependency released it
+        current = max(self.timings.values(), key=lambda t: t.end).name
+        path = [current]
+        while deps := self.steps[current].dependencies:
+            current = max(deps, key=lambda dep: self.timings[dep].end)
+            path.append(current)
+        return path[::-1]
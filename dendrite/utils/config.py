@@ -1,6 +1,6 @@
 import os
 from .constants import DIARRHEA_ROOT
-from ..databases.io import DatabaseType
+from dendrite.db.io import Database, DatabaseType
 from dendrite.interface.types import Note
 import json
 from pydantic import BaseModel
@@ -8,35 +8,55 @@ from typing import cast
 from dendrite.models.interface_client import InterfaceClient
 from dendrite.models.response_client import ResponseClient
 from dendrite.models.base_client import ModelConfig
+from dendrite.models.request_scheduler import SchedulerConfig, Priority
+from dendrite.models.response_cache import ResponseCacheConfig
+from dendrite.models.routing import RoutingConfig
+from dendrite.utils.profiling import PROFILER, ProfileConfig
 from functools import cache
-from dendrite.stages.write.full_pass import TemporalPass
 
 config_path = os.getenv("CONFIG_PATH", os.path.join(DIARRHEA_ROOT, 'config.json'))
 set_config = os.getenv("CONFIG", "")
-if not os.path.exists(config_path):
-    raise FileNotFoundError(f"Configuration file not found at {config_path}")
-if not set_config:
-    raise ValueError("CONFIG needs to be set.")
 
 class TemporalPassConfig(BaseModel):
     summarizer: ModelConfig
     tagger: ModelConfig
+    # day, month and year summaries are only kept up to date when set (see dendrite.stages.write.rollup)
+    rollup: ModelConfig | None = None
 
 class Config(BaseModel):
     id: str
     write: TemporalPassConfig
     read: ModelConfig | None
     converse: ModelConfig | None
+    scheduler: SchedulerConfig = SchedulerConfig()
+    cache: ResponseCacheConfig = ResponseCacheConfig()
+    # model tiers of every pass and step, see dendrite.models.routing
+    routing: RoutingConfig = RoutingConfig()
+    # profiles tool calls and renders when set, as DENDRITE_PROFILE_DIR does (see dendrite.utils.profiling)
+    profile: ProfileConfig | None = None
 
 @cache
 def get_config() -> Config:
+    if not os.path.exists(config_path):
+        raise FileNotFoundError(f"Configuration file not found at {config_path}")
+    if not set_config:
+        raise ValueError("CONFIG needs to be set.")
     with open(config_path, 'r') as file:
         config_data = cast(list[dict], json.load(file))
     configs = [config for item in config_data if (config := Config.model_validate(item)) and config.id == set_config]
     if not len(configs) == 1:
         raise ValueError(f"Expected exactly one configuration, found {len(configs)}")
+    if configs[0].profile is not None:
+        PROFILER.start(configs[0].profile)
     return configs[0]
 
+class TemporalPass(BaseModel):
+    summarizer: ResponseClient
+    tagger: InterfaceClient
+
+    class Config:
+        arbitrary_types_allowed = True
+
 WritePass = dict[DatabaseType, InterfaceClient | TemporalPass]
 class ClientSet(BaseModel):
     write_pass: WritePass
@@ -46,45 +66,64 @@ class ClientSet(BaseModel):
     class Config:
         arbitrary_types_allowed = True
 
-def get_client_set() -> ClientSet:
+def build_write_pass(config: Config, database: Database | None = None) -> WritePass:
+    """
+    A fresh set of write pass clients, their interfaces bound to database (the running task's if not given).
+    They work on whatever version of it the task that runs them works on (see dendrite.db.io.TreeVersion).
+    """
     from dendrite.mcp.write.mcp import WriteMCP
+    from dendrite.models.client_implementations.interface.openai import OpenAIInterfaceClient
+    from dendrite.models.client_implementations.response.openai import OpenAIResponseClient
+
+    write_pass: dict[DatabaseType, InterfaceClient] = {}
+    for type_ in DatabaseType:
+        if type_ == DatabaseType.CONCEPTUAL:
+            tie = None
+        elif type_ == DatabaseType.CONCRETE:
+            if DatabaseType.CONCEPTUAL not in write_pass:
+                raise ValueError("Conceptual interface not instantiated before concrete.")
+            tie = write_pass[DatabaseType.CONCEPTUAL].mcp_instance.interface
+        elif type_ == DatabaseType.TEMPORAL:
+            if DatabaseType.CONCRETE not in write_pass:
+                raise ValueError("Concrete interface not instantiated before temporal.")
+            tie = write_pass[DatabaseType.CONCRETE].mcp_instance.interface
+        else:
+            raise ValueError(f"Unexpected database type: {type_}")
+        prompt = ['temporal', 'tagger.txt'] if type_ == DatabaseType.TEMPORAL else [f'{type_.value}.txt']
+        client = OpenAIInterfaceClient(
+            mcp=WriteMCP(
+                type_,
+                tie,
+                database
+            ),
+            system_prompt_path=os.path.join(DIARRHEA_ROOT, 'models', 'system_prompts', *prompt),
+            step='temporal.tag' if type_ == DatabaseType.TEMPORAL else type_.value
+        )
+        if type_ == DatabaseType.TEMPORAL:
+            write_pass[type_] = TemporalPass(
+                summarizer=OpenAIResponseClient(config.write.summarizer, step='temporal.summarize'),
+                tagger=client
+            )
+        else:
+            write_pass[type_] = client
+    return write_pass
+
+def build_rollup(config: Config) -> ResponseClient | None:
+    from dendrite.models.client_implementations.response.openai import OpenAIResponseClient
+
+    return OpenAIResponseClient(config.write.rollup, step='rollup') if config.write.rollup else None
+
+def get_client_set() -> ClientSet:
     from dendrite.mcp.read.mcp import ReadMCP
     from dendrite.models.client_implementations.interface.openai import OpenAIInterfaceClient
     
     if (config := get_config()).id == 'openai_write':
-        # Create the actual OpenAI client with WriteMCP
-        write_pass: dict[DatabaseType, InterfaceClient] = {}
-        for type_ in DatabaseType:
-            if type_ == DatabaseType.CONCEPTUAL:
-                tie = None
-            elif type_ == DatabaseType.CONCRETE:
-                if DatabaseType.CONCEPTUAL not in write_pass:
-                    raise ValueError("Conceptual interface not instantiated before concrete.")
-                tie = write_pass[DatabaseType.CONCEPTUAL].mcp_instance.interface
-            elif type_ == DatabaseType.TEMPORAL:
-                if DatabaseType.CONCRETE not in write_pass:
-                    raise ValueError("Concrete interface not instantiated before temporal.")
-                tie = write_pass[DatabaseType.CONCRETE].mcp_instance.interface
-            else:
-                raise ValueError(f"Unexpected database type: {type_}")
-            client = OpenAIInterfaceClient(
-                mcp=WriteMCP(
-                    type_,
-                    tie
-                ),
-                system_prompt_path=f'C:\\Users\\Main\\Dendrite\\dendrite\\models\\system_prompts\\{type_.value}.txt'
-            )
-            if type_ == DatabaseType.TEMPORAL:
-                write_pass[type_] = TemporalPass(
-                    summarizer=ResponseClient(),
-                    consolidator=client
-                )
-            else:
-                write_pass[type_] = client
         return ClientSet(
-            write_pass=write_pass,
+            write_pass=build_write_pass(config),
             read_client=OpenAIInterfaceClient(
                 mcp=ReadMCP(),
+                priority=Priority.INTERACTIVE,
+                step='read',
                 system_prompt_path='C:\\Users\\Main\\Dendrite\\dendrite\\models\\stage_implementations\\read\\system.txt'
             )
         )
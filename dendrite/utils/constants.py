@@ -4,3 +4,15 @@ MAX_INTERFACE_LENGTH = 20_000
 DIARRHEA_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
 
 TAB = "    "
+
+# tool loop compaction (see dendrite/models/context.py)
+MAX_LOOP_TOKENS = 2_000
+KEEP_RECENT_LOOP_MESSAGES = 6
+MAX_LOOP_MESSAGE_LENGTH = 1_000
+MAX_NOTIFICATIONS = 50
+# turns a pass can take before it is stopped, whatever the model keeps asking for
+MAX_LOOP_TURNS = 50
+
+# children or notes of a node shown at once (see dendrite/interface/types.py Window)
+PAGE_SIZE = 50
+MAX_PAGE_SIZE = 200
@@ -1,8 +1,186 @@
+import asyncio
+import atexit
+import json
+import logging
+import os
+import threading
+import time
+from collections import OrderedDict
+from typing import Callable, Self
+from pydantic import BaseModel
+from dendrite.utils.tracing import TRACER
+
+logger = logging.getLogger(__name__)
+
+# "0" writes the store synchronously on the calling thread instead of through WRITER
+WRITE_BEHIND = os.getenv("DENDRITE_WRITE_BEHIND", "1") != "0"
+# indent of the store's json files, "0" writes them without any whitespace
+JSON_INDENT = int(os.getenv("DENDRITE_JSON_INDENT", "4"))
+
+class IOStats(BaseModel):
+    reads: int = 0
+    read_bytes: int = 0
+    writes: int = 0
+    written_bytes: int = 0
+
+    def since(self, earlier: 'IOStats') -> 'IOStats':
+        return IOStats(
+            reads=self.reads - earlier.reads,
+            read_bytes=self.read_bytes - earlier.read_bytes,
+            writes=self.writes - earlier.writes,
+            written_bytes=self.written_bytes - earlier.written_bytes,
+        )
+
+# process wide counters for everything read and written through this module (the whole store goes through it).
+# writes handed to WRITER count when they are handed over, their bytes only if they aren't rendered later;
+# what the writer thread actually wrote is in WRITER.stats
+IO_STATS = IOStats()
+
+def dump_json(value: object, indent: int = JSON_INDENT) -> str:
+    return json.dumps(value, indent=indent) if indent else json.dumps(value, separators=(',', ':'))
+
 def read_file(file_path: str) -> str:
-    with open(file_path, 'r', encoding='utf-8') as file:
-        return file.read()
-    
+    # a write that is still queued is newer than what is on disk
+    data = WRITER.pending(file_path)
+    if data is None:
+        with open(file_path, 'r', encoding='utf-8') as file:
+            data = file.read()
+    IO_STATS.reads += 1
+    IO_STATS.read_bytes += len(data)
+    return data
+
 def write_to_file(file_path: str, data: str):
-    print(f"!!!!!!!!!!!!!!!!!!Writing to file: {file_path}")
-    with open(file_path, 'w', encoding='utf-8') as file:
-        file.write(data)
\ No newline at end of file
+    logger.debug("Writing %d characters to %s", len(data), file_path)
+    with TRACER.span('storage.write', path=file_path, bytes=len(data)):
+        with open(file_path, 'w', encoding='utf-8') as file:
+            file.write(data)
+    IO_STATS.writes += 1
+    IO_STATS.written_bytes += len(data)
+
+def write_behind(file_path: str, data: str | Callable[[], str]):
+    """
+    Write the file from WRITER's thread and return right away. data can be a function that renders the
+    contents, which then runs on the writer thread too, and only for the last write to the file if several are queued.
+    """
+    IO_STATS.writes += 1
+    if not WRITE_BEHIND:
+        data = data() if callable(data) else data
+        _replace_file(file_path, data)
+        IO_STATS.written_bytes += len(data)
+        return
+    if not callable(data):
+        IO_STATS.written_bytes += len(data)
+    WRITER.write(file_path, data)
+
+def _replace_file(file_path: str, data: str):
+    # written next to the file and swapped in, so a reader (or a crash) never sees half a file
+    with TRACER.span('storage.write', path=file_path, bytes=len(data)):
+        with open(f"{file_path}.tmp", 'w', encoding='utf-8') as file:
+            file.write(data)
+        os.replace(f"{file_path}.tmp", file_path)
+
+class WriterStats(BaseModel):
+    submitted: int = 0
+    coalesced: int = 0                  # writes replaced by a later write to the same file before they ran
+    written: int = 0
+    written_bytes: int = 0
+    busy: float = 0.0                   # seconds spent rendering and writing
+    max_pending: int = 0                # most files waiting at once
+
+    def __str__(self) -> str:
+        return (
+            f"{self.submitted} writes submitted, {self.coalesced} coalesced, {self.written} written "
+            f"({self.written_bytes / 1024:.1f} KB, {self.busy:.3f}s busy), at most {self.max_pending} files pending"
+        )
+
+class _Job:
+    def __init__(self, sequence: int, data: str | Callable[[], str]):
+        self.sequence = sequence
+        self.data = data
+
+    def render(self) -> str:
+        if callable(self.data):
+            self.data = self.data()
+        return self.data
+
+class BackgroundWriter:
+    """
+    Writes files on a background thread so storage never blocks the event loop.
+
+    Only the last write to a file is kept while it waits, and files are written in the order of their
+    last write, so a flush, or a later write to another file, never lands before the writes submitted
+    ahead of it. Everything queued is written before the interpreter exits.
+    """
+    def __init__(self: Self):
+        self.condition = threading.Condition()
+        self.queue: OrderedDict[str, _Job] = OrderedDict()
+        self.in_flight: tuple[str, _Job] | None = None
+        self.submitted = 0                  # sequence of the last submitted write
+        self.done = 0                       # every write up to this sequence is on disk
+        self.error: Exception | None = None
+        self.stats = WriterStats()
+        self.thread: threading.Thread | None = None
+
+    def write(self: Self, file_path: str, data: str | Callable[[], str]):
+        with self.condition:
+            self.submitted += 1
+            self.stats.submitted += 1
+            if file_path in self.queue:
+                del self.queue[file_path]
+                self.stats.coalesced += 1
+            self.queue[file_path] = _Job(self.submitted, data)
+            self.stats.max_pending = max(self.stats.max_pending, len(self.queue))
+            if self.thread is None:
+                self.thread = threading.Thread(target=self._run, name='dendrite-writer', daemon=True)
+                self.thread.start()
+            self.condition.notify_all()
+
+    def pending(self: Self, file_path: str) -> str | None:
+        """Contents of the newest write to the file that isn't on disk yet."""
+        with self.condition:
+            job = self.queue.get(file_path)
+            if job is None and self.in_flight is not None and self.in_flight[0] == file_path:
+                job = self.in_flight[1]
+        return job.render() if job is not None else None
+
+    def flush_sync(self: Self, timeout: float | None = None):
+        """Block until everything submitted so far is on disk. Raises the first write that failed since the last flush."""
+        with self.condition:
+            target = self.submitted
+            if not self.condition.wait_for(lambda: self.done >= target, timeout):
+                raise TimeoutError(f"{len(self.queue)} files still waiting to be written after {timeout}s")
+            error, self.error = self.error, None
+        if error is not None:
+            raise error
+
+    async def flush(self: Self):
+        await asyncio.to_thread(self.flush_sync)
+
+    def _run(self: Self):
+        while True:
+            with self.condition:
+                self.condition.wait_for(lambda: self.queue)
+                file_path, job = self.queue.popitem(last=False)
+                self.in_flight = (file_path, job)
+            started = time.perf_counter()
+            written: int | None = None
+            try:
+                data = job.render()
+                _replace_file(file_path, data)
+                written = len(data)
+            except Exception as e:
+                logger.error("Writing %s failed: %s", file_path, e)
+                with self.condition:
+                    self.error = self.error or e
+            finally:
+                with self.condition:
+                    if written is not None:
+                        self.stats.written += 1
+                        self.stats.written_bytes += written
+                    self.stats.busy += time.perf_counter() - started
+                    self.in_flight = None
+                    self.done = job.sequence
+                    self.condition.notify_all()
+
+WRITER = BackgroundWriter()
+atexit.register(WRITER.flush_sync)
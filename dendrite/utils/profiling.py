@@ -0,0 +1,262 @@
+"""
+Opt-in CPU and memory profiling of tool calls and interface renders, for when a write pass is slow and the trace
+(see tracing.py) only says that a tool call took long, not where the time went.
+
+Set DENDRITE_PROFILE_DIR (or "profile" in the config, see ProfileConfig) and every InterfaceMCP.call_tool and
+Interface.__str__ is timed into a latency histogram per tool and per database rendered, and a sample of them
+(DENDRITE_PROFILE_SAMPLE) runs under cProfile, one profile accumulated per tool and per render. With
+DENDRITE_PROFILE_MEMORY=1, tracemalloc also records what each call allocated and snapshots the heap when
+profiling starts and when it is dumped. Everything is written to a folder of its own per process under the
+profile dir when the process exits (or on PROFILER.dump()):
+
+    <dir>/<pid>-<started>/tool.open_node.prof, render.conceptual.prof, ...    pstats files
+    <dir>/<pid>-<started>/latency.json                                          histograms and allocations
+    <dir>/<pid>-<started>/memory-start.snapshot, memory-end.snapshot            tracemalloc snapshots
+
+    python -m dendrite.utils.profiling ./profiles --top 30      # hotspots across every run under ./profiles
+
+Only one cProfile can run at a time, so a call made while another one is profiled (a render inside a tool
+call, or a concurrent tool call) is charged to that one rather than profiled on its own.
+"""
+import argparse
+import atexit
+import cProfile
+import json
+import logging
+import os
+import pstats
+import random
+import time
+import tracemalloc
+from collections import defaultdict
+from contextlib import contextmanager
+from typing import Iterator, Self
+from pydantic import BaseModel
+
+logger = logging.getLogger(__name__)
+
+PROFILE_DIR = os.getenv("DENDRITE_PROFILE_DIR")
+# share of calls run under cProfile, the rest are only timed
+PROFILE_SAMPLE = float(os.getenv("DENDRITE_PROFILE_SAMPLE", "1.0"))
+PROFILE_MEMORY = os.getenv("DENDRITE_PROFILE_MEMORY", "0") != "0"
+
+# upper bounds of the latency buckets, in milliseconds
+BUCKETS = [0.1, 0.25, 0.5, 1, 2.5, 5, 10, 25, 50, 100, 250, 500, 1000, 2500, 5000, 10000]
+
+# where the time of a profile went, by the functions that are entered for it
+AREAS = {
+    'path resolution': ['_parse_path'],
+    'rendering': ['to_interface_string', 'to_current_node_string', '_render'],
+    'diffing': ['apply_content_diff'],
+    'storage': ['read_file', 'write_to_file', 'write_behind', 'save_session_changes', 'add_note'],
+    'json': ['dumps', 'loads'],
+}
+
+class ProfileConfig(BaseModel):
+    dir: str
+    sample: float = PROFILE_SAMPLE
+    memory: bool = PROFILE_MEMORY
+
+class Histogram(BaseModel):
+    counts: list[int] = [0] * (len(BUCKETS) + 1)        # the last one is everything over BUCKETS[-1]
+    count: int = 0
+    total: float = 0.0                                  # seconds
+    max: float = 0.0
+    profiled: int = 0
+    allocated: int = 0                                  # bytes still allocated after the calls, summed
+    peak: int = 0                                       # most bytes allocated at once during a call
+
+    def add(self: Self, duration: float):
+        milliseconds = duration * 1000
+        self.counts[next((i for i, bound in enumerate(BUCKETS) if milliseconds <= bound), len(BUCKETS))] += 1
+        self.count += 1
+        self.total += duration
+        self.max = max(self.max, duration)
+
+    def merge(self: Self, other: 'Histogram'):
+        self.counts = [a + b for a, b in zip(self.counts, other.counts)]
+        self.count += other.count
+        self.total += other.total
+        self.max = max(self.max, other.max)
+        self.profiled += other.profiled
+        self.allocated += other.allocated
+        self.peak = max(self.peak, other.peak)
+
+    def quantile(self: Self, q: float) -> float:
+        """Upper bound of the bucket the quantile falls in, in seconds."""
+        seen = 0
+        for i, count in enumerate(self.counts):
+            seen += count
+            if seen >= q * self.count:
+                return (BUCKETS[i] if i < len(BUCKETS) else self.max * 1000) / 1000
+        return self.max
+
+class Profiler:
+    def __init__(self: Self):
+        self.config: ProfileConfig | None = None
+        self.profiles: dict[str, cProfile.Profile] = {}
+        self.histograms: dict[str, Histogram] = defaultdict(Histogram)
+        self.active = False
+        self.folder = ""
+        self.start_snapshot: tracemalloc.Snapshot | None = None
+
+    @property
+    def enabled(self: Self) -> bool:
+        return self.config is not None
+
+    def start(self: Self, config: ProfileConfig):
+        if self.enabled:
+            return
+        self.config = config
+        self.folder = os.path.join(config.dir, f"{os.getpid()}-{int(time.time())}")
+        if config.memory:
+            tracemalloc.start(25)
+            self.start_snapshot = tracemalloc.take_snapshot()
+        atexit.register(self.dump)
+        logger.info("Profiling tool calls and renders into %s", self.folder)
+
+    @contextmanager
+    def profile(self: Self, kind: str, name: str) -> Iterator[None]:
+        if self.config is None:
+            yield
+            return
+        key = f"{kind}.{name}"
+        histogram = self.histograms[key]
+        profile = None
+        if not self.active and random.random() < self.config.sample:
+            profile = self.profiles.setdefault(key, cProfile.Profile())
+            self.active = True
+            histogram.profiled += 1
+        if self.config.memory:
+            before = tracemalloc.get_traced_memory()[0]
+            tracemalloc.reset_peak()
+        started = time.perf_counter()
+        if profile is not None:
+            profile.enable()
+        try:
+            yield
+        finally:
+            if profile is not None:
+                profile.disable()
+                self.active = False
+            histogram.add(time.perf_counter() - started)
+            if self.config.memory:
+                current, peak = tracemalloc.get_traced_memory()
+                histogram.allocated += current - before
+                histogram.peak = max(histogram.peak, peak - before)
+
+    def dump(self: Self):
+        if self.config is None or not self.histograms:
+            return
+        os.makedirs(self.folder, exist_ok=True)
+        for key, profile in self.profiles.items():
+            profile.dump_stats(os.path.join(self.folder, f"{key}.prof"))
+        with open(os.path.join(self.folder, 'latency.json'), 'w', encoding='utf-8') as file:
+            json.dump({key: histogram.model_dump() for key, histogram in self.histograms.items()}, file, indent=4)
+        if self.start_snapshot is not None:
+            self.start_snapshot.dump(os.path.join(self.folder, 'memory-start.snapshot'))
+            tracemalloc.take_snapshot().dump(os.path.join(self.folder, 'memory-end.snapshot'))
+        logger.info("Profiles of %d calls written to %s", sum(histogram.count for histogram in self.histograms.values()), self.folder)
+
+PROFILER = Profiler()
+if PROFILE_DIR:
+    PROFILER.start(ProfileConfig(dir=PROFILE_DIR))
+
+"""
+Reading profiles
+"""
+
+def _runs(folder: str) -> list[str]:
+    """Every run folder under folder, or folder itself if it is one."""
+    if os.path.exists(os.path.join(folder, 'latency.json')):
+        return [folder]
+    if not os.path.isdir(folder):
+        return []
+    return sorted(os.path.join(folder, name) for name in os.listdir(folder) if os.path.exists(os.path.join(folder, name, 'latency.json')))
+
+def _function(key: tuple[str, int, str]) -> str:
+    file, line, name = key
+    return name if file == '~' else f"{name} ({os.path.relpath(file) if os.path.isabs(file) else file}:{line})"
+
+def report(folder: str, top: int = 25, sort: str = 'tottime', kind: str | None = None) -> str:
+    runs = _runs(folder)
+    if not runs:
+        raise ValueError(f"No profiles under {folder}, see DENDRITE_PROFILE_DIR")
+    histograms: dict[str, Histogram] = defaultdict(Histogram)
+    profiles: list[str] = []
+    for run in runs:
+        with open(os.path.join(run, 'latency.json'), 'r', encoding='utf-8') as file:
+            for key, histogram in json.load(file).items():
+                histograms[key].merge(Histogram.model_validate(histogram))
+        for file_name in os.listdir(run):
+            key, extension = os.path.splitext(file_name)
+            if extension != '.prof' or (kind and not key.startswith(f"{kind}.")):
+                continue
+            profiles.append(os.path.join(run, file_name))
+
+    lines = [f"{len(runs)} runs under {folder}", "", f"{'call':<36}{'count':>8}{'profiled':>9}{'total s':>10}{'p50':>10}{'p95':>10}{'max':>10}{'alloc KB':>10}"]
+    for key, histogram in sorted(histograms.items(), key=lambda item: -item[1].total):
+        if kind and not key.startswith(f"{kind}."):
+            continue
+        lines.append(
+            f"{key:<36}{histogram.count:>8}{histogram.profiled:>9}{histogram.total:>10.3f}"
+            f"{'<' + _ms(histogram.quantile(0.5)):>10}{'<' + _ms(histogram.quantile(0.95)):>10}{_ms(histogram.max):>10}{histogram.allocated / 1024:>10.1f}"
+        )
+    if not profiles:
+        return "\n".join(lines)
+
+    # per function: (primitive calls, calls, own time, cumulative time, callers)
+    functions = pstats.Stats(*profiles).stats
+    profiled = sum(own for _, _, own, _, _ in functions.values())
+    lines += ["", f"where the profiled {profiled:.3f}s went (cumulative, areas can overlap):"]
+    for area, names in AREAS.items():
+        cumulative = _area_time(functions, names)
+        lines.append(f"  {area:<18}{cumulative:>9.3f}s {cumulative / profiled * 100 if profiled else 0:>5.1f}%")
+
+    column = 2 if sort == 'tottime' else 3
+    lines += ["", f"top {top} functions by {sort}:", f"  {'own s':>9}{'cum s':>9}{'calls':>10}  function"]
+    for key, values in sorted(functions.items(), key=lambda item: -item[1][column])[:top]:
+        _, calls, own, cumulative, _ = values
+        lines.append(f"  {own:>9.3f}{cumulative:>9.3f}{calls:>10}  {_function(key)}")
+    return "\n".join(lines + _memory(runs, top))
+
+def _area_time(functions: dict, names: list[str]) -> float:
+    """Cumulative time of the functions, as entered from outside of them so nested and recursive calls count once."""
+    return sum(
+        cumulative
+        for (_, _, name), (_, _, _, _, callers) in functions.items() if name in names
+        for (_, _, caller), (_, _, _, cumulative) in callers.items() if caller not in names
+    )
+
+def _memory(runs: list[str], top: int) -> list[str]:
+    growth: dict[str, int] = defaultdict(int)
+    for run in runs:
+        start, end = os.path.join(run, 'memory-start.snapshot'), os.path.join(run, 'memory-end.snapshot')
+        if not (os.path.exists(start) and os.path.exists(end)):
+            continue
+        for difference in tracemalloc.Snapshot.load(end).compare_to(tracemalloc.Snapshot.load(start), 'lineno'):
+            frame = difference.traceback[0]
+            growth[f"{frame.filename}:{frame.lineno}"] += difference.size_diff
+    if not growth:
+        return []
+    lines = ["", f"top {top} allocation sites by growth over the run:"]
+    for site, size in sorted(growth.items(), key=lambda item: -item[1])[:top]:
+        lines.append(f"  {size / 1024:>10.1f} KB  {site}")
+    return lines
+
+def _ms(seconds: float) -> str:
+    return f"{seconds * 1000:.1f}ms"
+
+def main():
+    parser = argparse.ArgumentParser(description="Show the hotspots of the tool calls and renders profiled under DENDRITE_PROFILE_DIR.")
+    parser.add_argument('folder', nargs='?', default=PROFILE_DIR, help="profile dir (every run under it) or a single run's folder")
+    parser.add_argument('--top', type=int, default=25)
+    parser.add_argument('--sort', choices=['tottime', 'cumulative'], default='tottime')
+    parser.add_argument('--kind', choices=['tool', 'render'], help="only tool calls or only renders")
+    args = parser.parse_args()
+    if not args.folder:
+        parser.error("give the profile dir, or set DENDRITE_PROFILE_DIR")
+    print(report(args.folder, args.top, args.sort, args.kind))
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,9 @@
+import json
+from typing import Any
+
+# rough provider-agnostic estimate, good enough for budgeting without pulling in a tokenizer
+CHARS_PER_TOKEN = 4
+
+def estimate_tokens(value: Any) -> int:
+    text = value if isinstance(value, str) else json.dumps(value, default=str)
+    return len(text) // CHARS_PER_TOKEN + 1
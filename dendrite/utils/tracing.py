@@ -0,0 +1,161 @@
+import logging
+import logging.handlers
+import os
+import time
+import uuid
+from abc import ABC, abstractmethod
+from collections import deque
+from contextlib import contextmanager
+from contextvars import ContextVar
+from typing import Any, Iterator, Self
+from pydantic import BaseModel
+
+# spans go to this file (rotated at TRACE_MAX_BYTES, TRACE_BACKUPS files kept) when set
+TRACE_FILE = os.getenv("DENDRITE_TRACE_FILE")
+TRACE_MAX_BYTES = int(os.getenv("DENDRITE_TRACE_MAX_BYTES", 50_000_000))
+TRACE_BACKUPS = int(os.getenv("DENDRITE_TRACE_BACKUPS", 5))
+LOG_LEVEL = os.getenv("DENDRITE_LOG_LEVEL", "WARNING")
+
+# trace (e.g. one write pass) the running task belongs to. tasks copy their context when created,
+# so everything a pass fans out to ends up in the same trace
+CURRENT_TRACE: ContextVar[str | None] = ContextVar('dendrite_trace', default=None)
+
+class Span(BaseModel):
+    name: str                           # llm.request, tool.call, interface.render, storage.write, ...
+    trace_id: str | None
+    start: float                        # unix time
+    duration: float                     # seconds
+    attributes: dict[str, Any] = {}
+
+class SpanSink(ABC):
+    @abstractmethod
+    def emit(self: Self, span: Span) -> None:
+        pass
+
+class MemorySink(SpanSink):
+    """Keeps the most recent spans, optionally only the ones of a single trace."""
+    def __init__(self: Self, trace_id: str | None = None, max_spans: int = 100_000):
+        self.trace_id = trace_id
+        self.spans: deque[Span] = deque(maxlen=max_spans)
+
+    def emit(self: Self, span: Span) -> None:
+        if self.trace_id is None or span.trace_id == self.trace_id:
+            self.spans.append(span)
+
+class JsonlSink(SpanSink):
+    """One json object per line, rotated like a log file so long running processes can't fill the disk."""
+    def __init__(self: Self, path: str, max_bytes: int = TRACE_MAX_BYTES, backups: int = TRACE_BACKUPS):
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        self.handler = logging.handlers.RotatingFileHandler(path, maxBytes=max_bytes, backupCount=backups, encoding='utf-8')
+        self.handler.setFormatter(logging.Formatter('%(message)s'))
+
+    def emit(self: Self, span: Span) -> None:
+        self.handler.handle(logging.makeLogRecord({'msg': span.model_dump_json(), 'levelno': logging.INFO}))
+
+    def close(self: Self):
+        self.handler.close()
+
+class Tracer:
+    def __init__(self: Self):
+        self.sinks: list[SpanSink] = []
+
+    @property
+    def enabled(self: Self) -> bool:
+        return bool(self.sinks)
+
+    def add_sink(self: Self, sink: SpanSink) -> SpanSink:
+        self.sinks.append(sink)
+        return sink
+
+    def remove_sink(self: Self, sink: SpanSink):
+        self.sinks.remove(sink)
+
+    def emit(self: Self, name: str, duration: float, **attributes: Any):
+        """Emit a span that was timed elsewhere (e.g. a request whose latency a client already measured)."""
+        if not self.sinks:
+            return
+        span = Span(name=name, trace_id=CURRENT_TRACE.get(), start=time.time() - duration, duration=duration, attributes=attributes)
+        for sink in self.sinks:
+            sink.emit(span)
+
+    @contextmanager
+    def span(self: Self, name: str, **attributes: Any) -> Iterator[dict[str, Any]]:
+        """Time the block. The yielded attributes can be filled in while it runs, a raised error is recorded on the span."""
+        if not self.sinks:
+            yield attributes
+            return
+        started = time.perf_counter()
+        try:
+            yield attributes
+        except BaseException as e:
+            attributes['error'] = f"{type(e).__name__}: {e}"
+            raise
+        finally:
+            self.emit(name, time.perf_counter() - started, **attributes)
+
+    @contextmanager
+    def trace(self: Self, trace_id: str | None = None) -> Iterator[MemorySink]:
+        """Run the block as its own trace and collect its spans in memory, e.g. to summarize a write pass."""
+        trace_id = trace_id or uuid.uuid4().hex[:12]
+        token = CURRENT_TRACE.set(trace_id)
+        sink = self.add_sink(MemorySink(trace_id))
+        try:
+            yield sink
+        finally:
+            self.remove_sink(sink)
+            CURRENT_TRACE.reset(token)
+
+TRACER = Tracer()
+if TRACE_FILE:
+    TRACER.add_sink(JsonlSink(TRACE_FILE))
+
+def configure_logging(level: str = LOG_LEVEL):
+    """For entry points; the library itself only ever logs through module loggers."""
+    logging.basicConfig(level=level.upper(), format='%(asctime)s %(levelname)s %(name)s: %(message)s')
+
+class SpanStats(BaseModel):
+    count: int = 0
+    errors: int = 0
+    total: float = 0.0                          # seconds
+    p50: float = 0.0
+    p95: float = 0.0
+    totals: dict[str, float] = {}               # numeric attributes summed over the spans (tokens, bytes, ...)
+
+class TraceSummary(BaseModel):
+    trace_id: str | None
+    spans: dict[str, SpanStats]
+
+    @classmethod
+    def of(cls, spans: list[Span], trace_id: str | None = None) -> Self:
+        by_name: dict[str, list[Span]] = {}
+        for span in spans:
+            by_name.setdefault(span.name, []).append(span)
+
+        stats = {}
+        for name, named in sorted(by_name.items()):
+            durations = sorted(span.duration for span in named)
+            totals: dict[str, float] = {}
+            for span in named:
+                for key, value in span.attributes.items():
+                    if isinstance(value, (int, float)) and not isinstance(value, bool):
+                        totals[key] = totals.get(key, 0) + value
+            stats[name] = SpanStats(
+                count=len(named),
+                errors=sum('error' in span.attributes for span in named),
+                total=sum(durations),
+                p50=durations[len(durations) // 2],
+                p95=durations[min(len(durations) - 1, int(len(durations) * 0.95))],
+                totals=totals,
+            )
+        return cls(trace_id=trace_id, spans=stats)
+
+    def __str__(self) -> str:
+        lines = [f"trace {self.trace_id}:" if self.trace_id else "trace:"]
+        for name, stats in self.spans.items():
+            totals = ", ".join(f"{key}={value:,.0f}" for key, value in sorted(stats.totals.items()))
+            errors = f", {stats.errors} errors" if stats.errors else ""
+            lines.append(
+                f"  {name}: {stats.count} spans{errors}, {stats.total * 1000:.1f}ms total, "
+                f"p50 {stats.p50 * 1000:.2f}ms, p95 {stats.p95 * 1000:.2f}ms" + (f" ({totals})" if totals else "")
+            )
+        return "\n".join(lines)
@@ -21,6 +21,6 @@ setuptools.setup(
         'myers==1.0.1'
     ],
     packages=setuptools.find_packages(include=["*"]),
-    package_data={},
+    package_data={'dendrite.bench': ['micro_baseline.json']},
     zip_safe=False
 )
\ No newline at end of file
@@ -0,0 +1,109 @@
+"""
+What the tests share: throwaway stores and configs, and stand-ins for a provider's sdk client.
+"""
+import json
+import os
+import shutil
+import tempfile
+import unittest
+from typing import Any, Callable, Self
+import openai.types.responses as api_types
+from dendrite.bench.synthetic import SyntheticSpec, SyntheticStore, generate_store
+from dendrite.db.io import Database
+from dendrite.stages.write.bulk import Conversation
+from dendrite.stages.write.full_pass import write_pass_clients
+from dendrite.utils.config import WritePass, build_write_pass, get_config
+from dendrite.utils.file import WRITER
+
+def temporary_folder(case: unittest.TestCase) -> str:
+    folder = tempfile.mkdtemp(prefix='dendrite-test-')
+    case.addCleanup(shutil.rmtree, folder, True)
+    # cleanups run last first, so whatever was written behind is on disk before the folder goes
+    case.addCleanup(WRITER.flush_sync)
+    return folder
+
+def synthetic_database(case: unittest.TestCase, **spec: Any) -> tuple[Database, SyntheticStore]:
+    """A small generated store (see dendrite.bench.synthetic) and a database over it."""
+    root = os.path.join(temporary_folder(case), 'store')
+    store = generate_store(root, SyntheticSpec(**{'depth': 2, 'fanout': 3, 'notes_per_node': 1, 'days': 3, **spec}))
+    return Database('test', root), store
+
+def use_config(case: unittest.TestCase, **config: Any):
+    """Make get_config (and everything built from it) use a config of its own for the rest of the test."""
+    import dendrite.models.request_scheduler as request_scheduler
+    import dendrite.models.response_cache as response_cache
+    import dendrite.models.routing as routing
+    import dendrite.utils.config as config_module
+
+    folder = temporary_folder(case)
+    prompt = os.path.join(folder, 'prompt.txt')
+    with open(prompt, 'w', encoding='utf-8') as file:
+        file.write("test prompt")
+    model = {'model': 'test-model', 'api_key': 'test', 'system_prompt_path': prompt}
+    path = os.path.join(folder, 'config.json')
+    with open(path, 'w', encoding='utf-8') as file:
+        json.dump([{'id': 'test', 'write': {'summarizer': model, 'tagger': model}, 'read': None, 'converse': None, **config}], file)
+
+    cached = [config_module.get_config, routing.get_router, request_scheduler.get_request_scheduler, response_cache.get_response_cache]
+    def reset():
+        for function in cached:
+            function.cache_clear()
+    previous = config_module.config_path, config_module.set_config
+    config_module.config_path, config_module.set_config = path, 'test'
+    reset()
+    def restore():
+        config_module.config_path, config_module.set_config = previous
+        reset()
+    case.addCleanup(restore)
+
+def response(id: str, calls: list[tuple[str, dict[str, Any] | str]] = (), text: str | None = None, input_tokens: int = 1000, output_tokens: int = 100) -> api_types.Response:
+    """A responses api response making these tool calls (arguments as json, or as a string to send them malformed), or answering with text."""
+    output = [
+        {'type': 'function_call', 'id': f'{id}-{i}', 'call_id': f'{id}-{i}', 'name': name, 'status': 'completed', 'arguments': arguments if isinstance(arguments, str) else json.dumps(arguments)}
+        for i, (name, arguments) in enumerate(calls)
+    ]
+    if text is not None:
+        output.append({'type': 'message', 'id': f'{id}-text', 'role': 'assistant', 'status': 'completed', 'content': [{'type': 'output_text', 'text': text, 'annotations': []}]})
+    return api_types.Response.model_validate({
+        'id': id, 'object': 'response', 'created_at': 0, 'model': 'test-model', 'status': 'completed',
+        'parallel_tool_calls': True, 'tool_choice': 'auto', 'tools': [], 'output': output,
+        'usage': {'input_tokens': input_tokens, 'output_tokens': output_tokens, 'total_tokens': input_tokens + output_tokens, 'input_tokens_details': {'cached_tokens': 0}, 'output_tokens_details': {'reasoning_tokens': 0}},
+    })
+
+class FakeOpenAI:
+    """Stands in for an AsyncOpenAI client: every responses.create is answered by respond(request), and recorded."""
+    def __init__(self: Self, respond: Callable[[dict[str, Any]], api_types.Response]):
+        self.respond = respond
+        self.requests: list[dict[str, Any]] = []
+        self.responses = self
+
+    async def create(self: Self, **request: Any) -> api_types.Response:
+        self.requests.append(request)
+        return self.respond(request)
+
+# the turns of a pass, each the tool calls it makes
+Turns = list[list[tuple[str, dict[str, Any]]]]
+
+def scripted_write_pass(script: dict[str, dict[str, Turns] | Exception]) -> Callable[[Conversation], WritePass]:
+    """
+    Write passes (see BulkIngestion and Daemon) whose provider is a script: by conversation key, the turns of each
+    of its passes (conceptual, concrete, temporal.tag), or an error its passes fail with. A pass without turns left
+    makes no more calls, and every session is summarized as "session <key>".
+    """
+    def write_pass(conversation: Conversation) -> WritePass:
+        clients = build_write_pass(get_config())
+        steps = script.get(conversation.key, {})
+        def respond(step: str) -> Callable[[dict[str, Any]], api_types.Response]:
+            turns = iter([] if isinstance(steps, Exception) else steps.get(step, []))
+            def answer(request: dict[str, Any]) -> api_types.Response:
+                if isinstance(steps, Exception):
+                    raise steps
+                return response(f"{conversation.key}-{step}", next(turns, []))
+            return answer
+        for step, client in write_pass_clients(clients).items():
+            if step == 'temporal.summarize':
+                client.client = FakeOpenAI(lambda request: response('summary', text=f"session {conversation.key}"))
+            else:
+                client.clients = [FakeOpenAI(respond(step)) for _ in client.clients]
+        return clients
+    return write_pass
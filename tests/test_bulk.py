@@ -0,0 +1,147 @@
+"""
+Merging write passes into the database (Merger), and bulk ingestion resuming from its checkpoint.
+
+    python -m unittest discover -s tests
+"""
+import os
+import unittest
+import uuid
+from typing import Callable, Self
+from dendrite.db.io import REGISTRY, Database, DatabaseType, TreeVersion
+from dendrite.interface.interface import ContentUpdate, Interface, NoteEdit
+from dendrite.interface.types import Note
+from dendrite.stages.write.bulk import BulkIngestion, Checkpoint, Conversation, Merger, _notes
+from dendrite.utils.file import WRITER
+from support import scripted_write_pass, synthetic_database, temporary_folder, use_config
+
+class MergerTest(unittest.TestCase):
+    def setUp(self: Self):
+        self.database, self.store = synthetic_database(self)
+        context = self.database.active()
+        context.__enter__()
+        self.addCleanup(context.__exit__, None, None, None)
+        self.merger = Merger(self.database)
+        self.note_path = self.store.note_paths['conceptual'][0]
+        self.node_path, note_id = self.note_path.rsplit('/', 1)
+        self.note_id = int(note_id)
+
+    def _pass(self: Self, write: Callable[[Interface], None]) -> TreeVersion:
+        """A write pass without a model: whatever write does to an interface over a view of its own."""
+        view = TreeVersion(self.database)
+        with view.active():
+            write(Interface(DatabaseType.CONCEPTUAL, database=self.database))
+        return view
+
+    def _note(self: Self, database: Database | None = None) -> Note:
+        return _notes((database or self.database).dbs)[self.note_id]
+
+    def _reloaded(self: Self) -> Database:
+        WRITER.flush_sync()
+        return Database('reloaded', self.database.root)
+
+    def test_the_earlier_merge_wins(self):
+        def edit(by: str) -> Callable[[Interface], None]:
+            return lambda interface: interface.edit_note(NoteEdit(path_to_note=self.note_path, content_update=ContentUpdate(content=f"rewritten by {by}"), updated_name=f"named by {by}"))
+        first, second = self._pass(edit('first')), self._pass(edit('second'))
+
+        result = self.merger.merge('first', first)
+        self.assertEqual((result.notes_modified, result.conflicts), (1, []))
+        result = self.merger.merge('second', second)
+        self.assertEqual(result.notes_modified, 0)
+        self.assertEqual({(conflict.conversation, conflict.field) for conflict in result.conflicts}, {('second', 'content'), ('second', 'name')})
+        conflict = next(conflict for conflict in result.conflicts if conflict.field == 'name')
+        self.assertEqual((conflict.kept, conflict.dropped), ("named by first", "named by second"))
+
+        for database in (self.database, self._reloaded()):
+            note = self._note(database)
+            self.assertEqual(note.name, "named by first")
+            self.assertIn("rewritten by first", note.to_storage_string())
+            self.assertNotIn("second", note.to_storage_string())
+
+    def test_appends_to_the_same_note_are_rebased(self):
+        original = self._note().to_storage_string()
+        append = lambda text: lambda interface: interface.edit_note(NoteEdit(path_to_note=self.note_path, content_update=ContentUpdate(content=text, append=True)))
+        first, second = self._pass(append("appended first")), self._pass(append("appended second"))
+        self.assertEqual(self.merger.merge('first', first).notes_modified, 1)
+        result = self.merger.merge('second', second)
+        self.assertEqual((result.notes_modified, result.conflicts), (1, []))
+
+        stored = self._note(self._reloaded()).to_storage_string()
+        self.assertTrue(stored.startswith(original))
+        self.assertLess(stored.index("appended first"), stored.index("appended second"))
+
+    def test_a_node_created_twice_becomes_one(self):
+        def create(by: str) -> Callable[[Interface], None]:
+            def write(interface: Interface):
+                interface.generate_scaffolding(self.node_path, {'shared': {}})
+                interface.create_note(f"note of {by}", f"written by the {by} pass", [f"{self.node_path}/shared"])
+            return write
+        first, second = self._pass(create('first')), self._pass(create('second'))
+        results = [self.merger.merge('first', first), self.merger.merge('second', second)]
+        self.assertEqual([(result.nodes_added, result.notes_added) for result in results], [(1, 1), (0, 1)])
+
+        for database in (self.database, self._reloaded()):
+            parent = database.node(self.node_path)
+            shared = [child for child in parent.children if child.name == 'shared']
+            self.assertEqual(len(shared), 1)
+            self.assertEqual(sorted(note.name for note in shared[0].notes), ["note of first", "note of second"])
+            self.assertTrue(all(note.node_ids == [shared[0].id] for note in shared[0].notes))
+
+    def test_views_taken_before_a_merge_keep_what_they_were_taken_with(self):
+        before = self._note().to_storage_string()
+        later = TreeVersion(self.database)
+        self.merger.merge('first', self._pass(lambda interface: interface.edit_note(NoteEdit(path_to_note=self.note_path, content_update=ContentUpdate(content="more", append=True)))))
+        with later.active():
+            self.assertEqual(Interface(DatabaseType.CONCEPTUAL, database=self.database).find_note(self.note_path).to_storage_string(), before)
+        self.assertIn("more", self._note().to_storage_string())
+
+class BulkIngestionTest(unittest.IsolatedAsyncioTestCase):
+    async def asyncSetUp(self: Self):
+        use_config(self)
+        database, self.store = synthetic_database(self)
+        self.tenant = f"test-{uuid.uuid4().hex[:8]}"
+        self.database = REGISTRY.register(self.tenant, database.root)
+        self.addCleanup(REGISTRY.databases.pop, self.tenant, None)
+        self.checkpoint = os.path.join(temporary_folder(self), 'checkpoint.json')
+        self.node = self.store.node_paths['conceptual'][0]
+
+    def _ingestion(self: Self, failing: set[str] = frozenset()) -> BulkIngestion:
+        conversations = [Conversation(key=key, messages=[{'role': 'user', 'content': f"conversation {key}"}], date='2025-02-01') for key in 'abc']
+        script = {
+            key: RuntimeError("provider is down") if key in failing else {'conceptual': [[('create_note', {'name': f"from {key}", 'content': f"learned in {key}", 'references': [self.node]})]]}
+            for key in 'abc'
+        }
+        return BulkIngestion('conversations', workers=2, checkpoint_path=self.checkpoint, write_pass=scripted_write_pass(script), tenant=self.tenant, conversations=conversations)
+
+    def _names(self: Self) -> list[str]:
+        return sorted(note.name for note in self.database.node(self.node).notes if note.name.startswith("from "))
+
+    async def test_an_interrupted_run_resumes_from_its_checkpoint(self):
+        report = await self._ingestion(failing={'b'}).run()
+        self.assertEqual((report.ingested, report.failed, report.resumed), (2, 1, 0))
+        checkpoint = Checkpoint.load(self.checkpoint, 'conversations')
+        self.assertEqual(checkpoint.done, ['a', 'c'])
+        self.assertEqual(list(checkpoint.failed), ['b'])
+        self.assertEqual(self._names(), ["from a", "from c"])
+
+        report = await self._ingestion().run()
+        self.assertEqual((report.ingested, report.failed, report.resumed), (1, 0, 2))
+        checkpoint = Checkpoint.load(self.checkpoint, 'conversations')
+        self.assertEqual((checkpoint.done, checkpoint.failed), (['a', 'c', 'b'], {}))
+        self.assertEqual(self._names(), ["from a", "from b", "from c"])
+        # every session was filed under its day
+        self.assertEqual(len(self.database.node('temporal/2025/02/01').notes), 3)
+
+        # and a third run has nothing left to do
+        report = await self._ingestion().run()
+        self.assertEqual((report.ingested, report.resumed), (0, 3))
+
+    def test_a_checkpoint_belongs_to_its_source(self):
+        Checkpoint(source='conversations', done=['a']).save(self.checkpoint)
+        WRITER.flush_sync()
+        self.assertEqual(Checkpoint.load(self.checkpoint, 'conversations').done, ['a'])
+        with self.assertRaises(ValueError):
+            Checkpoint.load(self.checkpoint, 'elsewhere')
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,119 @@
+"""
+Which tool calls of a turn conflict, and the order InterfaceMCP.call_tools and ToolDispatcher run them in.
+
+    python -m unittest discover -s tests
+"""
+import asyncio
+import itertools
+import unittest
+from typing import Any, Self
+from dendrite.db.io import DatabaseType
+from dendrite.mcp.conflicts import ToolCall, ToolDispatcher, plan_batches, tool_access
+from dendrite.mcp.write.mcp import WriteMCP
+from support import synthetic_database
+
+_ids = itertools.count(1)
+
+def call(tool: str, /, **arguments: Any) -> ToolCall:
+    return ToolCall(call_id=f"{tool}-{next(_ids)}", name=tool, arguments=arguments)
+
+def conflict(a: ToolCall, b: ToolCall) -> bool:
+    return tool_access(a).conflicts_with(tool_access(b))
+
+def names(batches: list[list[ToolCall]]) -> list[list[str]]:
+    return [[call.call_id for call in batch] for batch in batches]
+
+class ConflictTest(unittest.TestCase):
+    def test_reads_and_writes_of_the_same_note(self):
+        # note 7 is filed under both nodes, so either path reaches it
+        read = call('open_note', path_to_note='conceptual/school/7')
+        edit = call('edit_note', edit={'path_to_note': 'conceptual/work/7', 'content_update': {'content': 'more', 'append': True}})
+        self.assertTrue(conflict(read, edit))
+        self.assertTrue(conflict(edit, read))
+        self.assertFalse(conflict(read, call('open_note', path_to_note='conceptual/work/7')))
+        self.assertFalse(conflict(edit, call('open_note', path_to_note='conceptual/work/8')))
+        # a note is beneath the node it is read through
+        self.assertTrue(conflict(call('create_note', name='n', content='c', references=['conceptual/school']), read))
+
+    def test_pages_of_the_explorer_go_with_the_cursor(self):
+        children, notes = call('list_children'), call('list_notes')
+        for mover in (call('rename_node', node_path='conceptual/school', new_name='academy'), call('move_node', node_path='conceptual/school', new_parent_path='conceptual/work'), call('open_node', path_to_node='conceptual/work')):
+            self.assertTrue(conflict(children, mover), mover.name)
+            self.assertTrue(conflict(mover, notes), mover.name)
+        self.assertFalse(conflict(children, notes))
+        self.assertFalse(conflict(children, call('open_note', path_to_note='conceptual/school/7')))
+
+    def test_batch_tools_touch_every_item(self):
+        create = call('create_notes', notes=[{'name': 'a', 'content': 'a', 'references': ['conceptual/school']}, {'name': 'b', 'content': 'b', 'references': ['concrete/money']}])
+        self.assertTrue(conflict(create, call('open_note', path_to_note='concrete/money/3')))
+        self.assertTrue(conflict(create, call('rename_node', node_path='conceptual/school', new_name='academy')))
+        self.assertFalse(conflict(create, call('open_note', path_to_note='conceptual/work/3')))
+
+        edits = call('edit_notes', edits=[{'path_to_note': 'conceptual/school/7'}, {'path_to_note': 'conceptual/work/8', 'updated_references': ['concrete/money']}])
+        self.assertTrue(conflict(edits, call('open_note', path_to_note='concrete/travel/7')))
+        self.assertFalse(conflict(edits, call('list_notes')))
+        self.assertTrue(conflict(call('open_node', path_to_node='concrete/money'), edits))
+        self.assertFalse(conflict(edits, call('open_note', path_to_note='conceptual/work/9')))
+        # relative paths depend on the cursor, so they conflict with everything
+        self.assertTrue(conflict(call('edit_notes', edits=[{'path_to_note': './7'}]), call('open_note', path_to_note='temporal/2025/1')))
+
+    def test_conflicting_calls_keep_their_order(self):
+        read_a = call('open_note', path_to_note='conceptual/school/1')
+        edit_a = call('edit_note', edit={'path_to_note': 'conceptual/school/1'})
+        read_b = call('open_note', path_to_note='conceptual/work/2')
+        rename = call('rename_node', node_path='conceptual/work', new_name='job')
+        listing = call('list_children')
+        self.assertEqual(
+            names(plan_batches([read_a, edit_a, read_b, rename, listing])),
+            names([[read_a, read_b], [edit_a, rename], [listing]])
+        )
+        self.assertEqual(plan_batches([]), [])
+
+class CallToolsTest(unittest.IsolatedAsyncioTestCase):
+    async def test_calls_run_in_batches_and_results_keep_their_order(self):
+        database, store = synthetic_database(self)
+        with database.active():
+            mcp = WriteMCP(DatabaseType.CONCEPTUAL, None, database)
+        ran: list[str] = []
+        call_tool = mcp.call_tool
+        async def record(name: str, arguments: dict[str, Any]):
+            ran.append(name)
+            return await call_tool(name, arguments)
+        mcp.call_tool = record
+
+        node = store.node_paths['conceptual'][0]
+        calls = [
+            call('list_notes'),
+            call('create_notes', notes=[{'name': 'new', 'content': 'something new', 'references': [node]}]),
+            call('no_such_tool'),
+            call('rename_node', node_path=node, new_name='renamed'),
+            call('open_node', path_to_node=node),
+        ]
+        with database.active():
+            results = await mcp.call_tools(calls)
+        self.assertEqual([result.call.call_id for result in results], [c.call_id for c in calls])
+        # the unknown tool runs on its own, after everything before it and before everything after it
+        self.assertEqual(ran, ['list_notes', 'create_notes', 'no_such_tool', 'rename_node', 'open_node'])
+        self.assertEqual([result.error is not None for result in results], [False, False, True, False, True])
+        self.assertIn('renamed', str(mcp.interface))
+
+    async def test_the_dispatcher_only_waits_for_conflicting_calls(self):
+        started: list[str] = []
+        release = asyncio.Event()
+        async def call_tool(name: str, arguments: dict[str, Any]):
+            started.append(arguments['path_to_note'] if 'path_to_note' in arguments else name)
+            if name == 'edit_note':
+                await release.wait()
+        dispatcher = ToolDispatcher(call_tool)
+        dispatcher.submit(call('edit_note', edit={'path_to_note': 'conceptual/school/1'}))
+        dispatcher.submit(call('open_note', path_to_note='conceptual/work/1'))
+        dispatcher.submit(call('open_note', path_to_note='conceptual/work/2'))
+        await asyncio.sleep(0.01)
+        self.assertEqual(started, ['edit_note', 'conceptual/work/2'])
+        release.set()
+        results = await dispatcher.drain()
+        self.assertEqual(started, ['edit_note', 'conceptual/work/2', 'conceptual/work/1'])
+        self.assertTrue(all(result.error is None for result in results))
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,70 @@
+"""
+The daemon over its unix socket, with a client of its own (see dendrite/daemon/client.py).
+
+    python -m unittest discover -s tests
+"""
+import asyncio
+import os
+import unittest
+import uuid
+from typing import Self
+from dendrite.daemon.client import DaemonClient
+from dendrite.daemon.server import Daemon
+from dendrite.db.io import REGISTRY
+from support import synthetic_database, temporary_folder
+
+class DaemonTest(unittest.IsolatedAsyncioTestCase):
+    async def asyncSetUp(self: Self):
+        database, _ = synthetic_database(self)
+        self.tenant = f"test-{uuid.uuid4().hex[:8]}"
+        self.database = REGISTRY.register(self.tenant, database.root)
+        self.addCleanup(REGISTRY.databases.pop, self.tenant, None)
+        self.socket = os.path.join(temporary_folder(self), 'daemon.sock')
+        self.daemon = Daemon(workers=0)
+        self.serving = asyncio.create_task(self.daemon.serve(self.socket))
+        while not os.path.exists(self.socket):
+            await asyncio.sleep(0.01)
+
+    async def asyncTearDown(self: Self):
+        self.daemon.stopping.set()
+        await asyncio.wait_for(self.serving, timeout=5)
+
+    async def _closed(self: Self):
+        """Wait for the daemon to notice the connection went away."""
+        for _ in range(100):
+            if not self.daemon.connections:
+                return
+            await asyncio.sleep(0.01)
+
+    async def test_sessions_left_open_are_closed_with_their_connection(self):
+        client = await DaemonClient.connect(self.socket)
+        sessions = [(await client.request('open', mode=mode, tenant=self.tenant))['session'] for mode in ('read', 'write', 'read')]
+        await client.request('close', session=sessions[0])
+        self.assertEqual(set(self.daemon.sessions), set(sessions[1:]))
+        self.assertEqual(self.database.users, 2)
+
+        await client.close()
+        await self._closed()
+        self.assertEqual(self.daemon.sessions, {})
+        self.assertEqual(self.database.users, 0)
+
+    async def test_other_connections_keep_their_sessions(self):
+        staying, leaving = await DaemonClient.connect(self.socket), await DaemonClient.connect(self.socket)
+        kept = (await staying.request('open', mode='read', tenant=self.tenant))['session']
+        await leaving.request('open', mode='read', tenant=self.tenant)
+        await leaving.close()
+        for _ in range(100):
+            if len(self.daemon.connections) == 1:
+                break
+            await asyncio.sleep(0.01)
+        self.assertEqual(list(self.daemon.sessions), [kept])
+        self.assertEqual(self.database.users, 1)
+        # and can still use them
+        rendered = await staying.request('render', session=kept, db_type='conceptual')
+        self.assertIn('<interface>', rendered['interface'])
+        await staying.close()
+        await self._closed()
+        self.assertEqual(self.database.users, 0)
+
+if __name__ == '__main__':
+    unittest.main()
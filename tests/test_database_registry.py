@@ -0,0 +1,71 @@
+"""
+DatabaseRegistry: databases loaded on first use and unloaded, least recently used first, past the memory budget.
+
+    python -m unittest discover -s tests
+"""
+import unittest
+from typing import Self
+from dendrite.db.io import Database, DatabaseRegistry, DatabaseType
+from dendrite.interface.interface import ContentUpdate, Interface, NoteEdit
+from support import synthetic_database
+
+class DatabaseRegistryTest(unittest.TestCase):
+    def setUp(self: Self):
+        stores = [synthetic_database(self, seed=seed)[1] for seed in range(3)]
+        self.note_path = stores[0].note_paths['conceptual'][0]
+        # the stores are the same size, so the budget holds two of them
+        probe = Database('probe', stores[0].root)
+        probe.dbs
+        self.registry = DatabaseRegistry(budget=int(probe.size * 2.5))
+        for name, store in zip('abc', stores):
+            self.registry.register(name, store.root)
+
+    def _load(self: Self, tenant: str):
+        with self.registry.use(tenant) as database:
+            database.dbs
+
+    def _loaded(self: Self) -> list[str]:
+        return list(self.registry.recent)
+
+    def test_the_least_recently_used_is_unloaded_past_the_budget(self):
+        self._load('a')
+        self._load('b')
+        self.assertEqual(self._loaded(), ['a', 'b'])
+        self._load('c')
+        self.assertEqual(self._loaded(), ['b', 'c'])
+        self.assertIsNone(self.registry.databases['a']._dbs)
+
+        # using b again makes c the least recently used
+        self._load('b')
+        self._load('a')
+        self.assertEqual(self._loaded(), ['b', 'a'])
+        stats = self.registry.stats()
+        self.assertEqual((stats.loaded, stats.loads, stats.evictions), (2, 4, 2))
+        self.assertLessEqual(stats.size, stats.budget)
+
+    def test_databases_in_use_are_never_unloaded(self):
+        pinned = self.registry.acquire('a')
+        pinned.dbs
+        self._load('b')
+        self._load('c')
+        # a is the least recently used, but in use: b goes instead
+        self.assertEqual(self._loaded(), ['a', 'c'])
+        self.assertIsNotNone(pinned._dbs)
+
+        self.registry.release(pinned)
+        self._load('b')
+        self.assertEqual(self._loaded(), ['c', 'b'])
+
+    def test_changes_made_in_place_are_saved_when_unloaded(self):
+        with self.registry.use('a') as database:
+            Interface(DatabaseType.CONCEPTUAL, database=database).edit_note(NoteEdit(path_to_note=self.note_path, content_update=ContentUpdate(content="kept through an unload", append=True)))
+            self.assertTrue(database.dirty())
+        self._load('b')
+        self._load('c')
+        self.assertNotIn('a', self._loaded())
+        with self.registry.use('a') as database:
+            note = Interface(DatabaseType.CONCEPTUAL, database=database).find_note(self.note_path)
+            self.assertIn("kept through an unload", note.to_storage_string())
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,110 @@
+"""
+The batch tools of Interface: a batch is applied all together or not at all, whether the databases are changed in
+place or the interface works on a version of them.
+
+    python -m unittest discover -s tests
+"""
+import unittest
+from typing import Iterable, Self
+from dendrite.db.io import DatabaseType, TreeVersion, publish
+from dendrite.interface.interface import ContentUpdate, Interface, NewNote, NoteEdit
+from dendrite.interface.types import GitStatus, Node
+from support import synthetic_database
+
+def note_ids(roots: Iterable[Node]) -> set[int]:
+    ids, stack = set(), list(roots)
+    while stack:
+        node = stack.pop()
+        ids.update(note.id for note in node.notes)
+        stack.extend(node.children)
+    return ids
+
+def fail_on_call(n: int, function):
+    """The function, except that its nth call raises."""
+    calls = 0
+    def wrapper(*args, **kwargs):
+        nonlocal calls
+        calls += 1
+        if calls == n:
+            raise ValueError("failed on purpose")
+        return function(*args, **kwargs)
+    return wrapper
+
+class BatchTest(unittest.TestCase):
+    def setUp(self: Self):
+        self.database, self.store = synthetic_database(self)
+        context = self.database.active()
+        context.__enter__()
+        self.addCleanup(context.__exit__, None, None, None)
+        self.interface = Interface(DatabaseType.CONCEPTUAL, database=self.database)
+
+    def _new_notes(self: Self, count: int) -> list[NewNote]:
+        return [NewNote(name=f"new note {i}", content=f"something new number {i}", references=['conceptual/school']) for i in range(count)]
+
+    def _shown(self: Self) -> tuple[list[int], list[str]]:
+        return [note.id for note in self.interface.opened.open_notes], list(self.interface.notifications.notifications)
+
+    def test_a_failure_partway_through_creates_none(self):
+        self.interface.notifications.add_notification("before")
+        shown, before = self._shown(), note_ids(self.database.roots().values())
+        self.interface.explorer.create_note = fail_on_call(2, self.interface.explorer.create_note)
+        with self.assertRaisesRegex(ValueError, "None were created, 1 of 3 failed.*\n  1: failed on purpose"):
+            self.interface.create_notes(self._new_notes(3))
+        self.assertEqual(note_ids(self.database.roots().values()), before)
+        self.assertEqual(self._shown(), shown)
+        # none were written either
+        self.assertEqual(len(self.database._notes_json()), self.store.note_count)
+
+    def test_a_batch_that_succeeds_is_created_and_written(self):
+        before = note_ids(self.database.roots().values())
+        self.interface.create_notes(self._new_notes(3))
+        created = note_ids(self.database.roots().values()) - before
+        self.assertEqual(len(created), 3)
+        self.assertTrue(all(self.database.has_note(id) for id in created))
+        self.assertEqual(len(self.interface.opened.open_notes), 3)
+
+    def test_a_note_that_exists_is_not_created_again(self):
+        note = self._new_notes(1)
+        self.interface.create_notes(note)
+        with self.assertRaisesRegex(ValueError, "0: a note of the same name and content already exists"):
+            self.interface.create_notes(note + self._new_notes(2)[1:])
+
+    def test_a_failure_partway_through_edits_none(self):
+        paths = self.store.note_paths['conceptual'][:2]
+        notes = [self.interface.find_note(path) for path in paths]
+        content = [note.to_storage_string() for note in notes]
+        self.interface.explorer.change_note_name = fail_on_call(1, self.interface.explorer.change_note_name)
+        edits = [
+            NoteEdit(path_to_note=paths[0], content_update=ContentUpdate(content="appended", append=True)),
+            NoteEdit(path_to_note=paths[1], content_update=ContentUpdate(content="appended", append=True), updated_name="renamed"),
+        ]
+        with self.assertRaisesRegex(ValueError, "None were edited, 1 of 2 failed.*\n  1: failed on purpose"):
+            self.interface.edit_notes(edits)
+        notes = [self.interface.find_note(path) for path in paths]
+        self.assertEqual([note.to_storage_string() for note in notes], content)
+        self.assertTrue(all(note.status == GitStatus.STAGED for note in notes))
+
+    def test_batches_in_a_version_only_reach_it(self):
+        version = TreeVersion(self.database)
+        before = note_ids(self.database.dbs.values())
+        with version.active():
+            self.interface.explorer.create_note = fail_on_call(2, self.interface.explorer.create_note)
+            with self.assertRaises(ValueError):
+                self.interface.create_notes(self._new_notes(2))
+            self.assertEqual(note_ids(version.roots.values()), before)
+            self.interface.create_notes(self._new_notes(2))
+            created = note_ids(version.roots.values()) - before
+            self.assertEqual(len(created), 2)
+            self.assertTrue(all(self.database.has_note(id) for id in created))
+            path = f"conceptual/school/{min(created)}"
+            self.interface.edit_notes([NoteEdit(path_to_note=path, content_update=ContentUpdate(content="more", append=True))])
+            self.assertIn("more", self.interface.find_note(path).to_storage_string())
+        # the databases are left alone until the version is published
+        self.assertEqual(note_ids(self.database.dbs.values()), before)
+        self.assertFalse(self.database.has_note(min(created)))
+        publish(version)
+        self.assertEqual(note_ids(self.database.dbs.values()), before | created)
+        self.assertIn("more", self.interface.find_note(path).to_storage_string())
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,169 @@
+"""
+Stable node ids: renames and moves leave the notes filed where they were, stores from before node ids are
+numbered and rewritten once, and the NodeIndex a version stacks on its database's.
+
+    python -m unittest discover -s tests
+"""
+import json
+import os
+import unittest
+from typing import Self
+from dendrite.db.io import Database, DatabaseType, TreeVersion, publish
+from dendrite.db.nodes import MAX_DEPTH, NodeIndex
+from dendrite.interface.interface import Interface
+from dendrite.utils.file import WRITER
+from support import synthetic_database, temporary_folder
+
+def write_legacy_store(root: str):
+    """A store from before node ids: trees of names, notes filed by path."""
+    os.makedirs(os.path.join(root, 'notes', 'content'))
+    nodes = {
+        'conceptual': {'work': {'coding': {}, 'goals': {}}, 'school': {}},
+        'concrete': {'people': {}},
+        'temporal': {'2025': {'01': {}}},
+    }
+    notes = [
+        {'id': 11, 'name': 'python', 'read_only': False, 'node_references': ['conceptual/work/coding', '/concrete/people/'], 'note_references': []},
+        {'id': 12, 'name': 'exams', 'read_only': False, 'node_references': ['conceptual/school'], 'note_references': ['11']},
+        {'id': 13, 'name': 'lost', 'read_only': False, 'node_references': ['conceptual/nowhere'], 'note_references': []},
+    ]
+    with open(os.path.join(root, 'nodes.json'), 'w', encoding='utf-8') as file:
+        json.dump(nodes, file)
+    with open(os.path.join(root, 'notes', 'notes.json'), 'w', encoding='utf-8') as file:
+        json.dump(notes, file)
+    for note in notes:
+        with open(os.path.join(root, 'notes', 'content', f"{note['id']}.md"), 'w', encoding='utf-8') as file:
+            file.write(f"all about {note['name']}")
+
+def read_text(path: str) -> str:
+    with open(path, 'r', encoding='utf-8') as file:
+        return file.read()
+
+def read_json(path: str):
+    return json.loads(read_text(path))
+
+class RenameTest(unittest.TestCase):
+    def setUp(self: Self):
+        self.database, self.store = synthetic_database(self)
+        context = self.database.active()
+        context.__enter__()
+        self.addCleanup(context.__exit__, None, None, None)
+        # a node with children, and notes beneath it and beneath them
+        self.node_path = self.store.node_paths['conceptual'][0]
+        self.note_paths = [path for path in self.store.note_paths['conceptual'] if path.startswith(self.node_path + '/')]
+        self.assertTrue(any(path.count('/') > self.node_path.count('/') + 1 for path in self.note_paths))
+
+    def _renamed(self: Self, path: str) -> str:
+        return path.replace(self.node_path, f"{self.node_path.rsplit('/', 1)[0]}/renamed", 1)
+
+    def test_a_rename_keeps_the_notes_beneath_it(self):
+        interface = Interface(DatabaseType.CONCEPTUAL, database=self.database)
+        notes = {path: interface.find_note(path) for path in self.note_paths}
+        node_ids = {path: list(note.node_ids) for path, note in notes.items()}
+        version = TreeVersion(self.database)
+        with version.active():
+            interface.rename_node(self.node_path, 'renamed')
+            for path, note in notes.items():
+                found = interface.find_note(self._renamed(path))
+                self.assertEqual((found.id, found.node_ids), (note.id, node_ids[path]))
+                with self.assertRaises(ValueError):
+                    interface.find_note(path)
+        # the notes weren't copied: renaming changed nothing about them
+        self.assertEqual(version.notes, {})
+
+        publish(version)
+        self.database.save_session_changes(self.database.dbs[DatabaseType.CONCEPTUAL])
+        WRITER.flush_sync()
+        reloaded = Database('reloaded', self.database.root)
+        with reloaded.active():
+            interface = Interface(DatabaseType.CONCEPTUAL, database=reloaded)
+            for path, note in notes.items():
+                self.assertEqual(interface.find_note(self._renamed(path)).node_ids, node_ids[path])
+        stored = {note['id']: note['node_references'] for note in read_json(os.path.join(self.database.root, 'notes', 'notes.json'))}
+        self.assertTrue(all(stored[note.id] == node_ids[path] for path, note in notes.items()))
+
+    def test_a_move_keeps_the_notes_beneath_it(self):
+        interface = Interface(DatabaseType.CONCEPTUAL, database=self.database)
+        name = self.node_path.rsplit('/', 1)[1]
+        target = next(
+            path for path in self.store.node_paths['conceptual']
+            if path.count('/') == 1 and path != self.node_path and all(child.name != name for child in self.database.node(path).children)
+        )
+        note_ids = {path: interface.find_note(path).id for path in self.note_paths}
+        interface.move_node(self.node_path, target)
+        moved = f"{target}/{name}"
+        for path, id in note_ids.items():
+            self.assertEqual(interface.find_note(path.replace(self.node_path, moved, 1)).id, id)
+        with self.assertRaisesRegex(ValueError, "beneath itself"):
+            interface.move_node(target, moved)
+
+class LegacyStoreTest(unittest.TestCase):
+    def setUp(self: Self):
+        self.root = os.path.join(temporary_folder(self), 'store')
+        write_legacy_store(self.root)
+
+    def _filed(self: Self, database: Database) -> dict[str, list[int]]:
+        """Paths of every node with notes, and the ids of its notes."""
+        with database.active():
+            paths = {}
+            stack = list(database.dbs.values())
+            while stack:
+                node = stack.pop()
+                if node.notes:
+                    paths[database.nodes.path(node.id)] = sorted(note.id for note in node.notes)
+                stack.extend(node.children)
+            return paths
+
+    def test_is_numbered_and_rewritten_with_ids(self):
+        database = Database('legacy', self.root)
+        filed = self._filed(database)
+        self.assertEqual(filed, {'conceptual/work/coding': [11], 'concrete/people': [11], 'conceptual/school': [12]})
+        WRITER.flush_sync()
+
+        nodes = read_json(os.path.join(self.root, 'nodes.json'))
+        self.assertTrue(all(isinstance(tree['id'], int) for tree in nodes.values()))
+        ids = {database.nodes.path(id): id for id in database.nodes}
+        notes = {note['id']: note['node_references'] for note in read_json(os.path.join(self.root, 'notes', 'notes.json'))}
+        self.assertEqual(notes[11], [ids['conceptual/work/coding'], ids['concrete/people']])
+        self.assertEqual(notes[12], [ids['conceptual/school']])
+        # what didn't resolve is left as it was, for vacuum to report
+        self.assertEqual(notes[13], ['conceptual/nowhere'])
+
+        # and loads again as it was, with the same ids and nothing left to migrate
+        stored = read_text(os.path.join(self.root, 'nodes.json'))
+        again = Database('legacy', self.root)
+        self.assertEqual(self._filed(again), filed)
+        self.assertEqual({id: again.nodes.path(id) for id in again.nodes}, {id: database.nodes.path(id) for id in database.nodes})
+        WRITER.flush_sync()
+        self.assertEqual(read_text(os.path.join(self.root, 'nodes.json')), stored)
+
+class NodeIndexTest(unittest.TestCase):
+    def test_set_keeps_track_of_what_it_changed(self):
+        base = NodeIndex(places={1: (None, 'conceptual'), 2: (1, 'work'), 3: (2, 'coding')})
+        index = NodeIndex(base)
+        index.set(3, 1, 'programming')
+        index.set(4, 3, 'python')
+        index.set(3, 1, 'code')
+        self.assertEqual(index.originals, {3: (2, 'coding')})
+        self.assertEqual(index.created, {4})
+        self.assertEqual(index.path(4), 'conceptual/code/python')
+        # the base is left as it was
+        self.assertEqual(base.path(3), 'conceptual/work/coding')
+        self.assertIsNone(base.path(4))
+        self.assertEqual(index.max_id(), 4)
+
+    def test_stacked_indexes_are_compacted_past_max_depth(self):
+        index = NodeIndex(places={1: (None, 'conceptual')})
+        for id in range(2, MAX_DEPTH + 3):
+            index = NodeIndex(index)
+            index.set(id, id - 1, f"level{id}")
+            if index.depth <= MAX_DEPTH:
+                self.assertIs(index.compacted(), index)
+        self.assertGreater(index.depth, MAX_DEPTH)
+        compacted = index.compacted()
+        self.assertEqual(compacted.depth, 0)
+        self.assertEqual(set(compacted), set(index))
+        self.assertEqual([compacted.path(id) for id in index], [index.path(id) for id in index])
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,203 @@
+"""
+RequestScheduler against a fake provider: a local http server that answers the OpenAI responses endpoint from a
+script, so retries, priorities and concurrency limits are exercised through the real sdk and http client.
+
+    python -m unittest discover -s tests
+"""
+import asyncio
+import json
+import time
+import unittest
+from contextlib import aclosing
+from typing import Any, Self
+from dendrite.models.request_scheduler import ModelLimits, Priority, RequestScheduler, SchedulerConfig
+
+MODEL = 'fake-model'
+
+def _response(text: str) -> dict[str, Any]:
+    return {
+        'id': 'resp', 'object': 'response', 'created_at': 0, 'model': MODEL, 'status': 'completed',
+        'parallel_tool_calls': True, 'tool_choice': 'auto', 'tools': [],
+        'output': [{'type': 'message', 'id': 'msg', 'role': 'assistant', 'status': 'completed', 'content': [{'type': 'output_text', 'text': text, 'annotations': []}]}],
+        'usage': {'input_tokens': 10, 'output_tokens': 5, 'total_tokens': 15, 'input_tokens_details': {'cached_tokens': 0}, 'output_tokens_details': {'reasoning_tokens': 0}},
+    }
+
+class FakeProvider:
+    """
+    Answers every request with the next scripted (status, headers) or 200 once the script runs out, after delay
+    seconds. Keeps the inputs in the order they arrived and the most requests it was answering at once.
+    """
+    def __init__(self: Self, delay: float = 0.0, script: list[tuple[int, dict[str, str]]] | None = None):
+        self.delay = delay
+        self.script = list(script or [])
+        self.received: list[str] = []
+        self.active = 0
+        self.max_active = 0
+        self.server: asyncio.Server | None = None
+        self.connections: set[asyncio.StreamWriter] = set()
+
+    async def __aenter__(self: Self) -> Self:
+        self.server = await asyncio.start_server(self._handle, '127.0.0.1', 0)
+        return self
+
+    async def __aexit__(self: Self, *exc: Any):
+        self.server.close()
+        # the sdk keeps its connections alive, and the server only finishes closing once they are gone
+        for writer in self.connections:
+            writer.close()
+        await self.server.wait_closed()
+
+    @property
+    def base_url(self: Self) -> str:
+        host, port = self.server.sockets[0].getsockname()[:2]
+        return f"http://{host}:{port}/v1"
+
+    async def _handle(self: Self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+        self.connections.add(writer)
+        try:
+            while request_line := await reader.readline():
+                if not request_line.strip():
+                    continue
+                headers = {}
+                while (line := await reader.readline()) not in (b'\r\n', b'\n', b''):
+                    name, _, value = line.decode().partition(':')
+                    headers[name.strip().lower()] = value.strip()
+                body = json.loads(await reader.readexactly(int(headers.get('content-length', 0))) or b'{}')
+                self.received.append(body.get('input'))
+                self.active += 1
+                self.max_active = max(self.max_active, self.active)
+                try:
+                    await asyncio.sleep(self.delay)
+                finally:
+                    self.active -= 1
+                status, extra = self.script.pop(0) if self.script else (200, {})
+                payload = json.dumps(_response(body.get('input')) if status == 200 else {'error': {'message': 'slow down', 'type': 'rate_limit'}}).encode()
+                head = [f"HTTP/1.1 {status} {'OK' if status == 200 else 'Error'}", 'content-type: application/json', f"content-length: {len(payload)}"]
+                head += [f"{name}: {value}" for name, value in extra.items()]
+                writer.write(("\r\n".join(head) + "\r\n\r\n").encode() + payload)
+                await writer.drain()
+        except (ConnectionError, asyncio.IncompleteReadError):
+            pass
+        finally:
+            self.connections.discard(writer)
+            writer.close()
+
+class RequestSchedulerTest(unittest.IsolatedAsyncioTestCase):
+    def _scheduler(self: Self, **limits: Any) -> RequestScheduler:
+        scheduler = RequestScheduler(SchedulerConfig(base_backoff=0.01, max_backoff=0.1, models={MODEL: ModelLimits(**limits)}))
+        self.addAsyncCleanup(scheduler.http_client.aclose)
+        return scheduler
+
+    def _submit(self: Self, scheduler: RequestScheduler, provider: FakeProvider, input: str, priority: Priority = Priority.BACKGROUND):
+        client = scheduler.openai_client(api_key='test', base_url=provider.base_url)
+        return scheduler.submit(
+            MODEL,
+            lambda: client.responses.create(model=MODEL, input=input),
+            priority=priority,
+            estimated_tokens=10,
+            used_tokens=lambda response: response.usage.total_tokens
+        )
+
+    async def test_retries_rate_limits_after_retry_after(self):
+        scheduler = self._scheduler()
+        async with FakeProvider(script=[(429, {'retry-after-ms': '200'}), (503, {})]) as provider:
+            started = time.perf_counter()
+            response = await self._submit(scheduler, provider, 'hello')
+        self.assertEqual(response.output_text, 'hello')
+        self.assertEqual(provider.received, ['hello'] * 3)
+        self.assertGreaterEqual(time.perf_counter() - started, 0.2)
+        self.assertEqual(scheduler.models[MODEL].in_flight, 0)
+
+    async def test_gives_up_on_errors_that_are_not_retryable(self):
+        scheduler = self._scheduler()
+        async with FakeProvider(script=[(400, {})]) as provider:
+            with self.assertRaises(Exception):
+                await self._submit(scheduler, provider, 'bad')
+        self.assertEqual(provider.received, ['bad'])
+        self.assertEqual(scheduler.models[MODEL].in_flight, 0)
+
+    async def test_waiting_requests_are_admitted_by_priority(self):
+        scheduler = self._scheduler(max_concurrency=1)
+        async with FakeProvider(delay=0.1) as provider:
+            first = asyncio.create_task(self._submit(scheduler, provider, 'first'))
+            await asyncio.sleep(0.05)
+            # queued behind first, in this order
+            waiting = [
+                asyncio.create_task(self._submit(scheduler, provider, 'background 1')),
+                asyncio.create_task(self._submit(scheduler, provider, 'background 2')),
+                asyncio.create_task(self._submit(scheduler, provider, 'interactive', Priority.INTERACTIVE)),
+            ]
+            await asyncio.gather(first, *waiting)
+        self.assertEqual(provider.received, ['first', 'interactive', 'background 1', 'background 2'])
+
+    async def test_concurrency_limit_holds(self):
+        scheduler = self._scheduler(max_concurrency=2)
+        async with FakeProvider(delay=0.05) as provider:
+            await asyncio.gather(*(self._submit(scheduler, provider, str(i)) for i in range(8)))
+        self.assertEqual(len(provider.received), 8)
+        self.assertEqual(provider.max_active, 2)
+        self.assertEqual(scheduler.models[MODEL].in_flight, 0)
+
+    async def test_cancelled_requests_give_their_slot_back(self):
+        scheduler = self._scheduler(max_concurrency=1)
+        async with FakeProvider(delay=0.5) as provider:
+            for i in range(3):
+                task = asyncio.create_task(self._submit(scheduler, provider, f"cancelled {i}"))
+                # cancelled once the provider has it, however slow the run, and well before it answers
+                while len(provider.received) <= i:
+                    await asyncio.sleep(0.005)
+                task.cancel()
+                with self.assertRaises(asyncio.CancelledError):
+                    await task
+            self.assertEqual(scheduler.models[MODEL].in_flight, 0)
+            response = await asyncio.wait_for(self._submit(scheduler, provider, 'after'), timeout=5)
+        self.assertEqual(response.output_text, 'after')
+
+    async def test_failing_usage_gives_the_slot_back(self):
+        scheduler = self._scheduler(max_concurrency=1)
+        client_calls = 0
+
+        async def request():
+            nonlocal client_calls
+            client_calls += 1
+            return object()
+
+        with self.assertRaises(AttributeError):
+            await scheduler.submit(MODEL, request, used_tokens=lambda response: response.usage.total_tokens)
+        self.assertEqual(client_calls, 1)
+        self.assertEqual(scheduler.models[MODEL].in_flight, 0)
+
+    async def test_streams_hold_their_slot_until_drained_or_closed(self):
+        scheduler = self._scheduler(max_concurrency=1)
+        state = scheduler._state(MODEL)
+        # no refill, or a slow run would have the bucket back at capacity before the correction is taken
+        state.tokens.rate = state.tokens.max_rate = 0
+
+        async def events():
+            for tokens in (None, 40, 20):
+                yield tokens
+
+        async def request():
+            return events()
+
+        seen_in_flight = []
+        stream = await scheduler.submit(MODEL, request, estimated_tokens=10, used_tokens=lambda event: event, stream=True)
+        level = state.tokens.level
+        async with aclosing(stream):
+            async for _ in stream:
+                seen_in_flight.append(state.in_flight)
+        self.assertEqual(seen_in_flight, [1, 1, 1])
+        self.assertEqual(state.in_flight, 0)
+        # corrected for the 60 tokens the events reported instead of the 10 estimated
+        self.assertEqual(state.tokens.level, level - 50)
+
+        # a stream that is closed before it is read gives the slot back too, and the next request gets it
+        stream = await scheduler.submit(MODEL, request, stream=True)
+        self.assertEqual(state.in_flight, 1)
+        await stream.aclose()
+        self.assertEqual(state.in_flight, 0)
+        stream = await asyncio.wait_for(scheduler.submit(MODEL, request, stream=True), timeout=5)
+        await stream.aclose()
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,68 @@
+"""
+ResponseCache, on its own and under a write pass whose turns repeat themselves.
+
+    python -m unittest discover -s tests
+"""
+import os
+import unittest
+from typing import Self
+from dendrite.db.io import DatabaseType
+from dendrite.models.response_cache import ResponseCache
+from dendrite.utils.config import build_write_pass, get_config
+from support import FakeOpenAI, response, synthetic_database, temporary_folder, use_config
+
+class ResponseCacheTest(unittest.IsolatedAsyncioTestCase):
+    def _cache(self: Self) -> ResponseCache:
+        cache = ResponseCache(os.path.join(temporary_folder(self), 'responses.sqlite'))
+        self.addCleanup(cache.close)
+        return cache
+
+    async def test_entries_are_never_replaced(self):
+        cache = self._cache()
+        key = ResponseCache.key('model', 'instructions', [], 'input')
+        await cache.put(key, 'model', 'first')
+        await cache.put(key, 'model', 'second')
+        self.assertEqual(await cache.get(key), 'first')
+        self.assertEqual(cache.stats.writes, 1)
+
+    def test_occurrences_have_keys_of_their_own(self):
+        keys = [ResponseCache.key('model', 'instructions', [], 'input', occurrence) for occurrence in range(3)]
+        self.assertEqual(len(set(keys)), 3)
+        self.assertEqual(keys[0], ResponseCache.key('model', 'instructions', [], 'input'))
+
+    async def test_a_pass_with_a_repeated_turn_replays_the_same(self):
+        use_config(self)
+        database, _ = synthetic_database(self)
+        cache = self._cache()
+        # the first two turns call a tool that doesn't exist, and every turn is sent the same input
+        script = ['missing', 'also missing', None]
+
+        async def run() -> tuple[list[str], FakeOpenAI]:
+            with database.active():
+                client = build_write_pass(get_config(), database)[DatabaseType.CONCEPTUAL]
+            client.response_cache = cache
+            client._build_messages = lambda conversation: list(conversation)
+            replies = iter(script)
+            provider = client.clients[0] = FakeOpenAI(lambda request: response(f"r{len(provider.requests)}", [(name, {})] if (name := next(replies)) else []))
+            applied = []
+            apply = client._apply_response
+            async def record(response, *args, **kwargs):
+                applied.append(response.id)
+                return await apply(response, *args, **kwargs)
+            client._apply_response = record
+            with database.active():
+                await client.process_convo([{'role': 'user', 'content': 'hello'}])
+            return applied, provider
+
+        applied, provider = await run()
+        self.assertEqual(applied, ['r1', 'r2', 'r3'])
+        self.assertEqual(len(provider.requests), 3)
+        self.assertEqual(len({str(request['input']) for request in provider.requests}), 1)
+
+        replayed, provider = await run()
+        self.assertEqual(replayed, applied)
+        self.assertEqual(provider.requests, [])
+        self.assertEqual(cache.stats.writes, 3)
+
+if __name__ == '__main__':
+    unittest.main()
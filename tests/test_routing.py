@@ -0,0 +1,75 @@
+"""
+Model routing: a turn whose tool calls don't validate on the cheap tier is dropped and asked of the next one.
+
+    python -m unittest discover -s tests
+"""
+import unittest
+from typing import Self
+from dendrite.db.io import DatabaseType
+from dendrite.models.routing import get_router
+from dendrite.utils.config import build_write_pass, get_config
+from support import FakeOpenAI, Turns, response, synthetic_database, use_config
+
+ROUTING = {
+    'tiers': {
+        'fast': {'model': 'fast-model', 'api_key': 'test', 'input_cost': 1.0, 'output_cost': 10.0},
+        'full': {'model': 'full-model', 'api_key': 'test', 'input_cost': 5.0, 'output_cost': 50.0},
+    },
+    'routes': {'conceptual': ['fast', 'full']},
+}
+
+class RoutingTest(unittest.IsolatedAsyncioTestCase):
+    async def asyncSetUp(self: Self):
+        use_config(self, routing=ROUTING)
+        self.database, store = synthetic_database(self)
+        context = self.database.active()
+        context.__enter__()
+        self.addCleanup(context.__exit__, None, None, None)
+        self.node = store.node_paths['conceptual'][0]
+        self.client = build_write_pass(get_config(), self.database)[DatabaseType.CONCEPTUAL]
+        self.assertEqual([name for name, _ in self.client.tiers], ['fast', 'full'])
+
+    def _script(self: Self, tiers: dict[str, Turns]) -> dict[str, FakeOpenAI]:
+        """Every tier answers with its own turns, then with no calls at all."""
+        fakes = {}
+        for i, (name, _) in enumerate(self.client.tiers):
+            turns = iter(tiers.get(name, []))
+            fakes[name] = self.client.clients[i] = FakeOpenAI(lambda request, name=name, turns=turns: response(name, next(turns, [])))
+        return fakes
+
+    def _create(self: Self, name: str) -> tuple[str, dict]:
+        return ('create_note', {'name': name, 'content': f"written as {name}", 'references': [self.node]})
+
+    def _names(self: Self) -> list[str]:
+        return sorted(note.name for note in self.database.node(self.node).notes if note.name.startswith("by "))
+
+    async def test_invalid_calls_are_asked_of_the_next_tier(self):
+        fakes = self._script({
+            # a tool that doesn't exist, then arguments that don't parse, and only then a valid turn
+            'fast': [[('nope', {})], [('create_note', '{bad')], [self._create("by fast")]],
+            'full': [[self._create("by full")], [self._create("by full again")]],
+        })
+        await self.client.process_convo([{'role': 'user', 'content': "remember this"}])
+
+        # the invalid turns ran nothing, the full tier's answers to them did
+        self.assertEqual(self._names(), ["by fast", "by full", "by full again"])
+        self.assertEqual([request['model'] for request in fakes['fast'].requests], ['fast-model'] * 4)
+        self.assertEqual([request['model'] for request in fakes['full'].requests], ['full-model'] * 2)
+        # the full tier is asked what the fast one was, the dropped response isn't part of it
+        self.assertEqual(fakes['full'].requests[0]['input'], fakes['fast'].requests[0]['input'])
+
+        report = get_router().report()
+        self.assertEqual((report.tiers['fast'].requests, report.tiers['fast'].escalated, report.tiers['fast'].invalid_calls), (4, 2, 2))
+        self.assertEqual((report.tiers['full'].requests, report.tiers['full'].escalated), (2, 0))
+        self.assertAlmostEqual(report.tiers['fast'].cost, 4 * (1000 * 1.0 + 100 * 10.0) / 1_000_000)
+        self.assertAlmostEqual(report.cost, report.tiers['fast'].cost + 2 * (1000 * 5.0 + 100 * 50.0) / 1_000_000)
+
+    async def test_valid_calls_never_reach_the_next_tier(self):
+        fakes = self._script({'fast': [[self._create("by fast")]]})
+        await self.client.process_convo([{'role': 'user', 'content': "remember this"}])
+        self.assertEqual(self._names(), ["by fast"])
+        self.assertEqual(fakes['full'].requests, [])
+        self.assertEqual(get_router().report().tiers['fast'].escalated, 0)
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,121 @@
+"""
+Near duplicate notes: MinHash signatures of word shingles, the band keys candidates are found by, and the dedupe
+report's clusters.
+
+    python -m unittest discover -s tests
+"""
+import os
+import random
+import unittest
+from typing import Self
+from dendrite.db.nodes import NodeIndex
+from dendrite.db.similarity import BANDS, ROWS, SHINGLE_WORDS, SimilarityIndex, bands, dedupe_report, jaccard, note_text, shingles, signature
+from dendrite.interface.types import Content, ContentStatus, GitStatus, Node, Note
+from dendrite.utils.file import WRITER
+from support import temporary_folder
+
+WORDS = [f"word{i}" for i in range(500)]
+
+def text(seed: int, length: int = 60) -> str:
+    return " ".join(random.Random(seed).choices(WORDS, k=length))
+
+def note(id: int, content: str, node_id: int = 2, name: str = "note", read_only: bool = False) -> Note:
+    return Note(id=id, read_only=read_only, name=name, content=[Content(text=content, status=ContentStatus.STAGED)], node_ids=[node_id], note_references=[], status=GitStatus.STAGED)
+
+class SignatureTest(unittest.TestCase):
+    def test_shingles(self):
+        self.assertEqual(shingles("The quick, brown FOX jumps"), shingles("the quick brown fox... jumps!"))
+        self.assertEqual(len(shingles("one two three four five")), 5 - SHINGLE_WORDS + 1)
+        # shorter than a shingle, still a shingle of its own
+        self.assertEqual(len(shingles("just two")), 1)
+        self.assertEqual(shingles(" ... "), set())
+
+    def test_signature_and_bands(self):
+        hashes = shingles(text(1))
+        self.assertEqual(len(signature(hashes)), BANDS * ROWS)
+        self.assertEqual(signature(hashes), signature(set(hashes)))
+        self.assertEqual(len(bands(signature(hashes))), BANDS)
+        self.assertEqual((signature(set()), bands([])), ([], []))
+        # a single shingle leaves every bin but one to borrow, each band still gets its own key
+        single = bands(signature(shingles("alone")))
+        self.assertEqual(len(set(single)), BANDS)
+        # the same rows in another band aren't the same key
+        rows = list(range(ROWS)) * BANDS
+        self.assertEqual(len(set(bands(rows))), BANDS)
+
+    def test_alike_notes_share_more_bands(self):
+        base = shingles(text(1))
+        near = shingles(text(1) + " and a few more words")
+        other = shingles(text(2))
+        self.assertGreater(jaccard(base, near), 0.8)
+        self.assertLess(jaccard(base, other), 0.1)
+        shared = lambda a, b: len(set(bands(signature(a))) & set(bands(signature(b))))
+        self.assertEqual(shared(base, base), BANDS)
+        self.assertGreater(shared(base, near), shared(base, other))
+        self.assertEqual(jaccard(set(), set()), 0.0)
+
+class SimilarityIndexTest(unittest.TestCase):
+    def setUp(self: Self):
+        self.folder = os.path.join(temporary_folder(self), 'similarity')
+        self.index = SimilarityIndex(self.folder)
+        self.notes = [note(1, text(1)), note(2, text(1) + " and a few more words"), note(3, text(2))]
+        self.index.rebuild([Node(1, 'conceptual', 'conceptual', self.notes, [])])
+
+    def test_candidates(self):
+        hashes = shingles(note_text(self.notes[0]))
+        found = [entry.note_id for entry in self.index.candidates(hashes)]
+        # the note itself shares every band, so it comes first
+        self.assertEqual(found, [1, 2])
+        self.assertEqual([entry.note_id for entry in self.index.candidates(hashes, exclude=1)], [2])
+        self.assertEqual(self.index.get(1).nodes, [2])
+
+    def test_kept_up_to_date_and_read_back(self):
+        self.index.remove(2)
+        self.index.add(note(4, text(2)))
+        self.index.add(note(5, text(2), read_only=True))
+        self.assertIsNone(self.index.get(2))
+        self.assertIsNone(self.index.get(5))
+        self.assertEqual([entry.note_id for entry in self.index.candidates(shingles(note_text(self.notes[2])))], [3, 4])
+
+        WRITER.flush_sync()
+        index = SimilarityIndex(self.folder)
+        self.assertTrue(index.exists())
+        self.assertEqual(len(index), 3)
+        self.assertEqual(index.buckets, self.index.buckets)
+
+class DedupeReportTest(unittest.TestCase):
+    def test_alike_notes_are_linked_into_clusters(self):
+        base = text(1, 100)
+        notes = [
+            note(1, base, name="first"),
+            # each alike to the one before it, the last less so to the first
+            note(2, base + " " + text(10, 8), name="second"),
+            note(3, base + " " + text(10, 8) + " " + text(11, 8), name="third"),
+            note(4, text(2), name="other"),
+            note(5, text(2) + " " + text(12, 3), node_id=3, name="other again"),
+            note(6, base, name="summary", read_only=True),
+            note(7, text(3), name="alone"),
+        ]
+        nodes = NodeIndex(places={1: (None, 'conceptual'), 2: (1, 'work'), 3: (1, 'school')})
+        texts = {note.id: shingles(note_text(note)) for note in notes}
+        self.assertLess(jaccard(texts[1], texts[3]), 0.86)
+        self.assertGreaterEqual(min(jaccard(texts[1], texts[2]), jaccard(texts[2], texts[3])), 0.86)
+
+        report = dedupe_report([Node(1, 'conceptual', 'conceptual', notes, [])], nodes, threshold=0.86)
+        self.assertEqual(report.notes, 6)
+        self.assertGreaterEqual(report.candidates, 3)
+        clusters = sorted(report.clusters, key=lambda cluster: cluster.paths)
+        self.assertEqual([cluster.paths for cluster in clusters], [
+            ['conceptual/work/1', 'conceptual/work/2', 'conceptual/work/3'],
+            ['conceptual/work/4', 'conceptual/school/5'],
+        ])
+        self.assertEqual(clusters[0].names, ["first", "second", "third"])
+        self.assertAlmostEqual(clusters[0].similarity, min(jaccard(texts[1], texts[2]), jaccard(texts[2], texts[3])))
+        self.assertEqual(clusters[1].bytes, len(note_text(notes[4]).encode('utf-8')))
+
+        # nothing is that alike
+        strict = dedupe_report([Node(1, 'conceptual', 'conceptual', notes, [])], nodes, threshold=0.99)
+        self.assertEqual(strict.clusters, [])
+
+if __name__ == '__main__':
+    unittest.main()
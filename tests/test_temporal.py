@@ -0,0 +1,99 @@
+"""
+TemporalIndex: notes filed under day nodes, by date, a month per partition.
+
+    python -m unittest discover -s tests
+"""
+import os
+import unittest
+from datetime import date
+from typing import Self
+import dendrite.db.temporal as temporal
+from dendrite.db.io import DatabaseType
+from dendrite.db.temporal import DAY_SUMMARY, TemporalIndex, day_path, parse_bound, parse_day_path
+from dendrite.interface.types import Content, ContentStatus, GitStatus, Note
+from dendrite.utils.file import WRITER
+from support import synthetic_database, temporary_folder
+
+def note(id: int, name: str = "Session", read_only: bool = False) -> Note:
+    return Note(id=id, read_only=read_only, name=name, content=[Content(text=name, status=ContentStatus.STAGED)], node_ids=[], note_references=[], status=GitStatus.STAGED)
+
+# two sessions a day on the 1st, 15th and last of each month, from December to March
+DAYS = [date(2024, 12, 31)] + [date(2025, month, day) for month, days in ((1, (1, 15, 31)), (2, (1, 15, 28)), (3, (1, 15, 31))) for day in days]
+
+class TemporalIndexTest(unittest.TestCase):
+    def setUp(self: Self):
+        self.folder = os.path.join(temporary_folder(self), 'temporal')
+        self.index = TemporalIndex(self.folder)
+        # added out of order, the index sorts them
+        for i, day in reversed(list(enumerate(DAYS))):
+            self.index.add(note(2 * i + 2, f"{day} second"), day)
+            self.index.add(note(2 * i + 1, f"{day} first"), day)
+
+    def _days(self: Self, entries) -> list[date]:
+        return [entry.day for entry in entries]
+
+    def test_range_across_months(self):
+        entries = self.index.range(date(2025, 1, 15), date(2025, 3, 1))
+        self.assertEqual(self._days(entries), [day for day in DAYS if date(2025, 1, 15) <= day <= date(2025, 3, 1) for _ in range(2)])
+        # entries of a day are ordered by note id
+        self.assertEqual([entry.name for entry in entries[:2]], ["2025-01-15 first", "2025-01-15 second"])
+        self.assertEqual(entries[0].path, f"{day_path(date(2025, 1, 15))}/{entries[0].note_id}")
+
+        self.assertEqual(len(self.index.range()), 2 * len(DAYS))
+        self.assertEqual(self._days(self.index.range(end=date(2025, 1, 1))), [date(2024, 12, 31)] * 2 + [date(2025, 1, 1)] * 2)
+        self.assertEqual(self._days(self.index.range(start=date(2025, 3, 31))), [date(2025, 3, 31)] * 2)
+        self.assertEqual(self.index.range(parse_bound('2025-02-02'), parse_bound('2025-02-14', end=True)), [])
+        self.assertEqual(len(self.index.range(parse_bound('2025-02'), parse_bound('2025-02', end=True))), 6)
+        self.assertEqual(len(self.index.range(parse_bound('2024'), parse_bound('2024', end=True))), 2)
+
+    def test_last_n_across_months(self):
+        entries = self.index.recent(5)
+        self.assertEqual(self._days(entries), [date(2025, 3, 1), date(2025, 3, 15), date(2025, 3, 15), date(2025, 3, 31), date(2025, 3, 31)])
+        self.assertEqual(entries[0].name, "2025-03-01 second")
+        # reaching back over the start of a month, and of a year
+        self.assertEqual(self._days(self.index.recent(3, end=date(2025, 1, 14))), [date(2024, 12, 31), date(2025, 1, 1), date(2025, 1, 1)])
+        self.assertEqual(self._days(self.index.recent(3, end=date(2025, 2, 1))), [date(2025, 1, 31), date(2025, 2, 1), date(2025, 2, 1)])
+        self.assertEqual(len(self.index.recent(100)), 2 * len(DAYS))
+
+    def test_refiling_a_note_moves_its_entry(self):
+        day, other = date(2025, 2, 15), date(2025, 3, 15)
+        moved = note(3 * 100, "moved")
+        self.index.file(moved, [day_path(day), 'conceptual/work'])
+        self.assertIn(moved.id, [entry.note_id for entry in self.index.range(day, day)])
+        self.index.file(moved, [day_path(other)], old_references=[day_path(day)])
+        self.assertNotIn(moved.id, [entry.note_id for entry in self.index.range(day, day)])
+        self.assertIn(moved.id, [entry.note_id for entry in self.index.range(other, other)])
+        # rollup summaries aren't sessions
+        self.index.file(note(3 * 100 + 1, DAY_SUMMARY, read_only=True), [day_path(day)])
+        self.assertEqual(len(self.index.range(day, day)), 2)
+
+    def test_months_are_read_back_as_queries_reach_them(self):
+        previous = temporal.MAX_PARTITIONS
+        temporal.MAX_PARTITIONS = 2
+        self.addCleanup(setattr, temporal, 'MAX_PARTITIONS', previous)
+        WRITER.flush_sync()
+        index = TemporalIndex(self.folder)
+        self.assertEqual(index.months, ['2024-12', '2025-01', '2025-02', '2025-03'])
+        self.assertEqual(len(index.partitions), 0)
+        self.assertEqual(self._days(index.range()), self._days(self.index.range()))
+        self.assertEqual(list(index.partitions), ['2025-02', '2025-03'])
+        self.assertEqual(self._days(index.recent(2, end=date(2024, 12, 31))), [date(2024, 12, 31)] * 2)
+        self.assertEqual(list(index.partitions), ['2025-03', '2024-12'])
+
+    def test_rebuilt_from_the_temporal_tree(self):
+        database, _ = synthetic_database(self, days=40)
+        root = database.dbs[DatabaseType.TEMPORAL]
+        index = TemporalIndex(os.path.join(temporary_folder(self), 'temporal'))
+        index.rebuild(root)
+        # notes filed under year and month nodes aren't sessions
+        sessions = [
+            (day, note.id)
+            for year in root.children for month in year.children for node in month.children
+            if (day := parse_day_path(f"temporal/{year.name}/{month.name}/{node.name}")) is not None
+            for note in node.notes
+        ]
+        self.assertEqual(index.months, ['2024-12', '2025-01'])
+        self.assertEqual([(entry.day, entry.note_id) for entry in index.range()], sorted(sessions))
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,70 @@
+"""
+TreeVersion: copy-on-write versions of the databases, invisible to them until published.
+
+    python -m unittest discover -s tests
+"""
+import unittest
+from typing import Self
+from dendrite.db.io import DatabaseType, TreeVersion, publish
+from dendrite.interface.interface import ContentUpdate, Interface, NoteEdit
+from support import synthetic_database
+
+class TreeVersionTest(unittest.TestCase):
+    def setUp(self: Self):
+        self.database, self.store = synthetic_database(self)
+        context = self.database.active()
+        context.__enter__()
+        self.addCleanup(context.__exit__, None, None, None)
+        self.note_path = self.store.note_paths['conceptual'][0]
+        self.node_path = self.note_path.rsplit('/', 1)[0]
+
+    def _content(self: Self) -> str:
+        """The note as the running task sees it: in its version, if it works on one."""
+        return Interface(DatabaseType.CONCEPTUAL, database=self.database).find_note(self.note_path).to_storage_string()
+
+    def _edit(self: Self, version: TreeVersion, text: str):
+        with version.active():
+            interface = Interface(DatabaseType.CONCEPTUAL, database=self.database)
+            interface.edit_note(NoteEdit(path_to_note=self.note_path, content_update=ContentUpdate(content=text, append=True)))
+            interface.generate_scaffolding(self.node_path, {text.replace(' ', '_'): {}})
+
+    def test_edits_are_invisible_until_published(self):
+        before = self._content()
+        version, other = TreeVersion(self.database), TreeVersion(self.database)
+        self._edit(version, "only in the version")
+
+        self.assertEqual(self._content(), before)
+        self.assertIsNone(self.database.node(f"{self.node_path}/only_in_the_version"))
+        with version.active():
+            self.assertIn("only in the version", self._content())
+            self.assertIsNotNone(self.database.node(f"{self.node_path}/only_in_the_version"))
+        with other.active():
+            self.assertEqual(self._content(), before)
+
+        publish(version)
+        self.assertIn("only in the version", self._content())
+        self.assertIsNotNone(self.database.node(f"{self.node_path}/only_in_the_version"))
+        # versions taken before keep what they were taken from
+        with other.active():
+            self.assertEqual(self._content(), before)
+            self.assertIsNone(self.database.node(f"{self.node_path}/only_in_the_version"))
+
+    def test_only_what_changed_is_copied(self):
+        roots = dict(self.database.dbs)
+        version = TreeVersion(self.database)
+        self._edit(version, "changed")
+        self.assertIs(version.roots[DatabaseType.CONCRETE], roots[DatabaseType.CONCRETE])
+        self.assertIs(version.roots[DatabaseType.TEMPORAL], roots[DatabaseType.TEMPORAL])
+        self.assertIsNot(version.roots[DatabaseType.CONCEPTUAL], roots[DatabaseType.CONCEPTUAL])
+        # siblings of the edited node are shared, the edited one and its parents are copies
+        original = self.database.node(self.node_path)
+        with version.active():
+            copied = self.database.node(self.node_path)
+        self.assertIsNot(copied, original)
+        unchanged = [child for child in roots[DatabaseType.CONCEPTUAL].children if not self.node_path.startswith(f"conceptual/{child.name}")]
+        self.assertTrue(unchanged)
+        for child in unchanged:
+            self.assertIn(child, version.roots[DatabaseType.CONCEPTUAL].children)
+
+if __name__ == '__main__':
+    unittest.main()
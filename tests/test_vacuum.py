@@ -0,0 +1,111 @@
+"""
+vacuum: duplicate sibling nodes merged, dangling references dropped, orphans removed, and nothing touched on a dry run.
+
+    python -m unittest discover -s tests
+"""
+import json
+import os
+import unittest
+from typing import Self
+from dendrite.db.io import Database
+from dendrite.db.vacuum import vacuum
+from dendrite.utils.file import WRITER
+from support import temporary_folder
+
+# written out by hand: json.dumps can't write the second 'work'
+NODES = """{
+    "conceptual": {"id": 1, "children": {
+        "work": {"id": 2, "children": {"coding": {"id": 3, "children": {}}}},
+        "work": {"id": 4, "children": {"goals": {"id": 5, "children": {}}}}
+    }},
+    "concrete": {"id": 6, "children": {}},
+    "temporal": {"id": 7, "children": {}}
+}"""
+
+NOTES = [
+    # filed under the work merged away, and under a node that is gone
+    {'id': 11, 'name': 'python', 'read_only': False, 'node_references': [4, 99], 'note_references': []},
+    # a repeated node reference, and a repeated and a dangling note reference
+    {'id': 12, 'name': 'goals', 'read_only': False, 'node_references': [5, 5], 'note_references': ['11', '11', '40']},
+    # its content file is gone
+    {'id': 13, 'name': 'gone', 'read_only': False, 'node_references': [3], 'note_references': []},
+    # filed by a path that no longer exists
+    {'id': 14, 'name': 'lost', 'read_only': False, 'node_references': ['conceptual/lost/found'], 'note_references': []},
+]
+
+def write_store(root: str):
+    content = os.path.join(root, 'notes', 'content')
+    os.makedirs(content)
+    with open(os.path.join(root, 'nodes.json'), 'w', encoding='utf-8') as file:
+        file.write(NODES)
+    with open(os.path.join(root, 'notes', 'notes.json'), 'w', encoding='utf-8') as file:
+        json.dump(NOTES, file, indent=4)
+    # 20 belongs to no note
+    for id in (11, 12, 14, 20):
+        with open(os.path.join(content, f"{id}.md"), 'w', encoding='utf-8') as file:
+            file.write(f"content of {id}")
+
+def snapshot(root: str) -> dict[str, str]:
+    files = {}
+    for folder, _, names in os.walk(root):
+        for name in names:
+            with open(os.path.join(folder, name), 'r', encoding='utf-8') as file:
+                files[os.path.relpath(os.path.join(folder, name), root)] = file.read()
+    return files
+
+class VacuumTest(unittest.TestCase):
+    def setUp(self: Self):
+        self.root = os.path.join(temporary_folder(self), 'store')
+        write_store(self.root)
+
+    def _counts(self: Self, report) -> dict[str, int]:
+        return report.model_dump(include={
+            'duplicate_nodes', 'dangling_node_references', 'dangling_note_references', 'repeated_references',
+            'refiled_notes', 'scaffolded_nodes', 'missing_content', 'orphaned_content', 'unreachable_notes'
+        })
+
+    def _expected(self: Self) -> dict[str, int]:
+        return {
+            'duplicate_nodes': 1, 'dangling_node_references': 1, 'dangling_note_references': 1, 'repeated_references': 2,
+            'refiled_notes': 1, 'scaffolded_nodes': 2, 'missing_content': 1, 'orphaned_content': 1, 'unreachable_notes': 0
+        }
+
+    def test_a_dry_run_changes_nothing(self):
+        before = snapshot(self.root)
+        report = vacuum(self.root, dry_run=True, indent=0, repeat=1)
+        self.assertEqual(self._counts(report), self._expected())
+        # the note without content keeps the store from loading
+        self.assertIsNone(report.load_before)
+        self.assertIsNone(report.load_after)
+        self.assertGreater(report.bytes_saved, 0)
+        self.assertEqual(snapshot(self.root), before)
+
+    def test_the_store_is_fixed(self):
+        report = vacuum(self.root, indent=0, repeat=1)
+        WRITER.flush_sync()
+        self.assertEqual(self._counts(report), self._expected())
+        self.assertIsNotNone(report.load_after)
+        self.assertEqual(sorted(os.listdir(os.path.join(self.root, 'notes', 'content'))), ['11.md', '12.md', '14.md'])
+
+        notes = {note['id']: note for note in json.loads(snapshot(self.root)[os.path.join('notes', 'notes.json')])}
+        self.assertEqual(sorted(notes), [11, 12, 14])
+        self.assertEqual(notes[11]['node_references'], [2])
+        self.assertEqual(notes[12]['node_references'], [5])
+        self.assertEqual(notes[12]['note_references'], ['11'])
+
+        database = Database('vacuumed', self.root)
+        with database.active():
+            work = database.node('conceptual/work')
+            self.assertEqual(work.id, 2)
+            self.assertEqual(sorted(child.name for child in work.children), ['coding', 'goals'])
+            self.assertEqual([note.id for note in work.notes], [11])
+            self.assertEqual([note.id for note in database.node('conceptual/work/goals').notes], [12])
+            self.assertEqual([note.id for note in database.node('conceptual/lost/found').notes], [14])
+
+        # and a second run has nothing left to fix
+        again = vacuum(self.root, indent=0, repeat=1)
+        self.assertEqual(set(self._counts(again).values()), {0})
+        self.assertEqual(again.bytes_saved, 0)
+
+if __name__ == '__main__':
+    unittest.main()